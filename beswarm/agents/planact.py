@@ -11,6 +11,8 @@ from typing import List, Dict, Union
 from ..broker import MessageBroker
 from ..aient.aient.models import chatgpt
 from ..aient.aient.plugins import get_function_call_list, registry
+from ..aient.aient.plugins.command_runner import progress_listener
+from ..aient.aient.plugins.command_session import get_session_manager, session_owner
 from ..prompt import worker_system_prompt, instruction_system_prompt, Goal
 from ..utils import extract_xml_content, get_current_screen_image_message, register_mcp_tools, setup_logger
 from ..aient.aient.models.chatgpt import ModelNotFoundError, TaskComplete, RetryFailedError, InputTokenCountExceededError, BadRequestError
@@ -174,6 +176,9 @@ class WorkerAgent(BaseAgent):
 
         self.agent = chatgpt(**self.config)
 
+    def _publish_command_progress(self, event: Dict):
+        self.broker.publish({"status": "command_progress", **event}, self.status_topic)
+
     async def handle_message(self, message: Dict):
         """Receives an instruction, executes it, and publishes the response."""
 
@@ -188,7 +193,9 @@ class WorkerAgent(BaseAgent):
             instruction = await get_current_screen_image_message(instruction)
 
         try:
-            response = await self.agent.ask_async(UserMessage(instruction, Texts("\n\nYour message **must** end with [done] to signify the end of your output.", name="done")))
+            # excute_command 运行期间的输出进度转发到任务状态主题，start_command 启动的后台命令归属于这个 agent
+            with progress_listener(self._publish_command_progress), session_owner(self):
+                response = await self.agent.ask_async(UserMessage(instruction, Texts("\n\nYour message **must** end with [done] to signify the end of your output.", name="done")))
         except TaskComplete as e:
             self.broker.publish({"status": "finished", "result": e.completion_message}, self.status_topic)
             return
@@ -325,12 +332,15 @@ class BrokerWorker:
         self.broker.publish({"instruction": "Initial kickoff"}, self.INSTRUCTION_TOPIC)
 
         self._status_subscription = self.broker.subscribe(self._task_status_subscriber, self.TASK_STATUS_TOPIC)
-        await self.task_completion_event.wait()
-
-        instruction_agent.dispose()
-        worker_agent.dispose()
-        self._status_subscription.dispose()
-        await self.mcp_manager.cleanup()
+        try:
+            await self.task_completion_event.wait()
+        finally:
+            instruction_agent.dispose()
+            worker_agent.dispose()
+            self._status_subscription.dispose()
+            # 任务结束后不再有人查看 worker 启动的后台命令
+            await get_session_manager().release(worker_agent)
+            await self.mcp_manager.cleanup()
         return self.final_result
 
     async def stream_run(self):
@@ -357,4 +367,5 @@ class BrokerWorker:
         finally:
             instruction_agent.dispose()
             worker_agent.dispose()
+            await get_session_manager().release(worker_agent)
             await self.mcp_manager.cleanup()
\ No newline at end of file
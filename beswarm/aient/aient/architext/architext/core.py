@@ -1,3 +1,5 @@
+import re
+import json
 import pickle
 import base64
 import asyncio
@@ -5,7 +7,8 @@ import logging
 import hashlib
 import mimetypes
 import uuid
-import threading
+import time
+import weakref
 import copy
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
@@ -35,21 +38,49 @@ class ProviderGroup:
         for p in self._providers:
             p.visible = value
 
-# Global, thread-safe registry for providers created within f-strings
-_fstring_provider_registry = {}
-_registry_lock = threading.Lock()
+# Matches the placeholder that ContextProvider.__str__ leaves inside f-strings.
+_PLACEHOLDER_PATTERN = re.compile(r'(__provider_placeholder_[a-f0-9]{32}__)')
+
+# Registry for providers created within f-strings.
+# Each running event loop owns its own dict, so concurrent agents never share a lock,
+# and placeholders that were never absorbed into a Message are released together
+# with their loop. Code running outside of any loop (e.g. module-level prompts) uses
+# the global fallback dict. Single dict operations are atomic, so no lock is needed.
+_fstring_provider_registry: Dict[str, 'ContextProvider'] = {}
+_loop_provider_registries: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, ContextProvider]]' = weakref.WeakKeyDictionary()
+
+def _current_registry() -> Dict[str, 'ContextProvider']:
+    """Returns the provider registry of the running event loop, or the global one."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _fstring_provider_registry
+    registry = _loop_provider_registries.get(loop)
+    if registry is None:
+        registry = _loop_provider_registries.setdefault(loop, {})
+    return registry
 
 def _register_provider(provider: 'ContextProvider') -> str:
     """Registers a provider and returns a unique placeholder."""
-    with _registry_lock:
-        provider_id = f"__provider_placeholder_{uuid.uuid4().hex}__"
-        _fstring_provider_registry[provider_id] = provider
-        return provider_id
+    provider_id = f"__provider_placeholder_{uuid.uuid4().hex}__"
+    _current_registry()[provider_id] = provider
+    return provider_id
 
 def _retrieve_provider(placeholder: str) -> Optional['ContextProvider']:
     """Retrieves a provider from the registry."""
-    with _registry_lock:
-        return _fstring_provider_registry.pop(placeholder, None)
+    provider = _current_registry().pop(placeholder, None)
+    if provider is not None:
+        return provider
+    # The placeholder may have been created in another scope (e.g. at import time
+    # or in a different loop); fall back to the other registries.
+    provider = _fstring_provider_registry.pop(placeholder, None)
+    if provider is not None:
+        return provider
+    for registry in list(_loop_provider_registries.values()):
+        provider = registry.pop(placeholder, None)
+        if provider is not None:
+            return provider
+    return None
 
 # 1. 核心数据结构: ContentBlock
 @dataclass
@@ -57,8 +88,36 @@ class ContentBlock:
     name: str
     content: str
 
+# 刷新策略，决定 Messages.refresh 在一个周期中是否调用 provider 的 refresh():
+#   static    内容只在 update()/mark_stale() 之后才重新渲染，没有过期时跳过
+#   per_turn  每个刷新周期都重新渲染，可用 ttl 限制最短间隔，ttl 内跳过
+#   on_change 每个周期检查数据源，只有数据源变化时才重新渲染
+REFRESH_STATIC = "static"
+REFRESH_PER_TURN = "per_turn"
+REFRESH_ON_CHANGE = "on_change"
+
+@dataclass
+class RefreshStats:
+    """一次 Messages.refresh 周期的统计信息。"""
+    duration: float = 0.0
+    providers: int = 0
+    refreshed: int = 0
+    skipped: int = 0
+    rendered: int = 0
+    deduplicated: int = 0
+    slowest: Optional[str] = None
+    slowest_duration: float = 0.0
+
 # 2. 上下文提供者 (带缓存)
 class ContextProvider(ABC):
+    refresh_policy: str = REFRESH_ON_CHANGE
+    # Expensive providers (disk or network IO) are throttled by Messages.refresh_concurrency.
+    expensive: bool = False
+    ttl: Optional[float] = None
+    _last_rendered_at: float = 0.0
+    # (tokenizer name, rendered content, token count) of the last token_count() call.
+    _token_cache: Optional[tuple] = None
+
     def __init__(self, name: str, visible: bool = True):
         self.name = name
         self._cached_content: Optional[str] = None
@@ -85,9 +144,43 @@ class ContextProvider(ABC):
             # so just marking it stale is enough for the renderer to reconsider it.
             self.mark_stale()
     async def refresh(self):
+        if self.refresh_policy == REFRESH_PER_TURN and self._ttl_expired():
+            self._is_stale = True
         if self._is_stale:
             self._cached_content = await self.render()
             self._is_stale = False
+            self._last_rendered_at = time.monotonic()
+
+    def _ttl_expired(self) -> bool:
+        return self.ttl is None or time.monotonic() - self._last_rendered_at >= self.ttl
+
+    def needs_refresh(self) -> bool:
+        """Whether refresh() can change the content in this cycle, according to refresh_policy."""
+        if self.refresh_policy == REFRESH_STATIC:
+            return self._is_stale
+        if self.refresh_policy == REFRESH_PER_TURN:
+            return self._is_stale or self._ttl_expired()
+        # on_change providers compare their data source inside refresh().
+        return True
+
+    def refresh_key(self) -> Any:
+        """Providers sharing a refresh key are refreshed once per cycle and share the result."""
+        return id(self)
+
+    def _adopt(self, other: 'ContextProvider'):
+        """
+        Takes over the rendered content of a provider with the same refresh key.
+        Only the rendered content and its freshness are shared; the name under which the content is
+        emitted stays the provider's own. Everything else that affects the output must be part of the key.
+        """
+        if other is self:
+            return
+        if type(other) is not type(self) or other.refresh_key() != self.refresh_key():
+            raise ValueError(f"Provider '{self.name}' cannot adopt content from '{other.name}': refresh keys differ.")
+        self._cached_content = other._cached_content
+        self._is_stale = other._is_stale
+        self._last_rendered_at = other._last_rendered_at
+
     @abstractmethod
     async def render(self) -> Optional[str]: raise NotImplementedError
     @abstractmethod
@@ -97,6 +190,21 @@ class ContextProvider(ABC):
             return ContentBlock(self.name, self._cached_content)
         return None
 
+    def token_count(self, tokenizer) -> int:
+        """
+        Counts the tokens of the rendered content with `tokenizer` (any object with `name` and `count(text)`).
+        The result is memoised until the rendered content or the tokenizer changes.
+        """
+        block = self.get_content_block()
+        if block is None or not block.content:
+            return 0
+        cache = self._token_cache
+        if cache is not None and cache[0] == tokenizer.name and cache[1] is block.content:
+            return cache[2]
+        tokens = tokenizer.count(block.content)
+        self._token_cache = (tokenizer.name, block.content, tokens)
+        return tokens
+
     def __add__(self, other):
         if isinstance(other, Message):
             # Create a new message of the same type as `other`, with `self` prepended.
@@ -104,11 +212,34 @@ class ContextProvider(ABC):
             return type(other)(*new_items)
         return NotImplemented
 
+def _callable_identity(func: Callable) -> Any:
+    """
+    Identifies the data source behind a callable. Functions with the same code object, globals, closure cells,
+    bound instance and defaults compute the same value, so a lambda expression evaluated repeatedly (for example
+    in a loop, or a bound method fetched twice) shares one identity. Lambdas written at different places in the
+    source have different code objects and stay separate. Other callables (builtins, functools.partial,
+    objects with __call__) are only identified with themselves.
+    """
+    function = getattr(func, "__func__", func)
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return id(func)
+    bound = getattr(func, "__self__", None)
+    return (
+        code,
+        id(function.__globals__),
+        tuple(id(cell) for cell in function.__closure__ or ()),
+        id(bound) if bound is not None else None,
+        tuple(id(value) for value in function.__defaults__ or ()),
+        tuple((key, id(value)) for key, value in (function.__kwdefaults__ or {}).items()),
+    )
+
 class Texts(ContextProvider):
-    def __init__(self, text: Optional[Union[str, Callable[[], str]]] = None, name: Optional[str] = None, visible: bool = True, newline: bool = False):
+    def __init__(self, text: Optional[Union[str, Callable[[], str]]] = None, name: Optional[str] = None, visible: bool = True, newline: bool = False, ttl: Optional[float] = None):
         if text is None and name is None:
             raise ValueError("Either 'text' or 'name' must be provided.")
         self.newline = newline
+        self.ttl = ttl
 
         # Ensure that non-callable inputs are treated as strings
         if not callable(text):
@@ -135,10 +266,16 @@ class Texts(ContextProvider):
             # of the async refresh cycle. Let the first refresh formalize it.
             self._is_stale = True
 
-    async def refresh(self):
+    @property
+    def refresh_policy(self) -> str:
+        return REFRESH_PER_TURN if self._is_dynamic else REFRESH_STATIC
+
+    def refresh_key(self) -> Any:
+        # Dynamic texts backed by the same data source render the same value within a turn.
+        # newline and ttl change how the shared value is placed and refreshed, so they are part of the key.
         if self._is_dynamic:
-            self._is_stale = True
-        await super().refresh()
+            return (Texts, _callable_identity(self._text), self.newline, self.ttl)
+        return id(self)
 
     def update(self, text: Union[str, Callable[[], str]]):
         self._text = text
@@ -219,6 +356,8 @@ class Texts(ContextProvider):
         return NotImplemented
 
 class Tools(ContextProvider):
+    refresh_policy = REFRESH_STATIC
+
     def __init__(self, tools_json: Optional[List[Dict]] = None, name: str = "tools", visible: bool = True):
         super().__init__(name, visible=visible)
         self._tools_json = tools_json or []
@@ -240,6 +379,8 @@ class Tools(ContextProvider):
         return self._tools_json == other._tools_json
 
 class Files(ContextProvider):
+    expensive = True
+
     def __init__(self, *paths: Union[str, List[str]], name: str = "files", visible: bool = True):
         super().__init__(name, visible=visible)
         self._files: Dict[str, str] = {}
@@ -281,6 +422,12 @@ class Files(ContextProvider):
         Synchronizes content for files sourced from disk.
         Content set manually is overwritten if the file exists, but preserved if it does not.
         """
+        # Disk reads run in a worker thread so large files do not block the event loop.
+        if await asyncio.to_thread(self._sync_from_disk):
+            self.mark_stale()
+        await super().refresh()
+
+    def _sync_from_disk(self) -> bool:
         is_changed = False
         for path, spec in list(self._file_sources.items()):
             if spec.get('source') == 'disk':
@@ -310,10 +457,7 @@ class Files(ContextProvider):
                 except FileNotFoundError:
                     # File does not exist, so we keep the manual content. No change.
                     pass
-
-        if is_changed:
-            self.mark_stale()
-        await super().refresh()
+        return is_changed
 
     def update(self, path: str, content: Optional[str] = None, head: Optional[Union[int, str]] = None):
         """
@@ -364,6 +508,11 @@ class Files(ContextProvider):
         return self._files == other._files
 
 class Images(ContextProvider):
+    refresh_policy = REFRESH_STATIC
+    expensive = True
+    # Images are billed per tile rather than by the length of their data URL.
+    image_tokens: int = 765
+
     def __init__(self, url: str, name: Optional[str] = None, visible: bool = True):
         super().__init__(name or url, visible=visible)
         self.url = url
@@ -386,11 +535,31 @@ class Images(ContextProvider):
             logging.warning(f"Image file not found: {self.url}. Skipping.")
             return None # Or handle error appropriately
 
+    def token_count(self, tokenizer) -> int:
+        return self.image_tokens if self.get_content_block() else 0
+
     def __eq__(self, other):
         if not isinstance(other, Images):
             return NotImplemented
         return self.url == other.url
 
+class CacheBreakpoint(ContextProvider):
+    """
+    标记提示词缓存断点。断点之前的内容跨轮次保持不变，构成可被服务端缓存的前缀；
+    断点之后是每轮都会变化的内容。包含断点的消息会渲染为带 cache_control 的文本块列表。
+    relocate: 发送请求时是否把断点之后的内容移到最后一条 user 消息的末尾，使历史对话也能命中缓存。
+    断点之后的内容必须紧挨着后面的对话时（例如以对话起始标签结尾），设为 False 留在原处。
+    """
+    refresh_policy = REFRESH_STATIC
+
+    def __init__(self, name: str = "cache_breakpoint", relocate: bool = True):
+        super().__init__(name, visible=True)
+        self.relocate = relocate
+    def update(self, *args, **kwargs):
+        pass
+    async def render(self) -> Optional[str]:
+        return ""
+
 # 3. 消息类 (已合并 MessageContent)
 class Message(ABC):
     def __init__(self, role: str, *initial_items: Union[ContextProvider, str, list, 'Message']):
@@ -404,13 +573,12 @@ class Message(ABC):
             if isinstance(item, Message):
                 processed_items.extend(item.provider())
             elif isinstance(item, str):
-                import re
-                placeholder_pattern = re.compile(r'(__provider_placeholder_[a-f0-9]{32}__)')
-                parts = placeholder_pattern.split(item)
-                if len(parts) > 1:
+                # Fast path: plain strings without any placeholder skip the regex split.
+                parts = _PLACEHOLDER_PATTERN.split(item) if "__provider_placeholder_" in item else None
+                if parts and len(parts) > 1:
                     for part in parts:
                         if not part: continue
-                        if placeholder_pattern.match(part):
+                        if _PLACEHOLDER_PATTERN.match(part):
                             provider = _retrieve_provider(part)
                             if provider:
                                 processed_items.append(provider)
@@ -594,6 +762,13 @@ class Message(ABC):
         """提供类似字典的 .get() 方法来访问属性。"""
         return getattr(self, key, default)
 
+    # Tokens the chat format adds around every message (role, separators).
+    token_overhead: int = 4
+
+    def token_count(self, tokenizer) -> int:
+        """Tokens of the rendered message. Only providers whose content changed are counted again."""
+        return self.token_overhead + sum(item.token_count(tokenizer) for item in self._items)
+
     async def refresh(self):
         """刷新此消息中的所有 provider。"""
         tasks = [provider.refresh() for provider in self._items]
@@ -617,7 +792,40 @@ class Message(ABC):
         await self.refresh()
         return self.to_dict()
 
+    def _render_blocks(self) -> List[Dict[str, Any]]:
+        """Renders the items as content blocks, marking the block before each CacheBreakpoint."""
+        content_list = []
+        text_parts = []
+        def flush_text():
+            if text_parts:
+                content_list.append({"type": "text", "text": "".join(text_parts)})
+                text_parts.clear()
+        for item in self._items:
+            if isinstance(item, CacheBreakpoint):
+                flush_text()
+                if content_list:
+                    content_list[-1]["cache_control"] = {"type": "ephemeral"}
+                    if not getattr(item, "relocate", True):
+                        content_list[-1]["relocate"] = False
+                continue
+            block = item.get_content_block()
+            if not block or not block.content: continue
+            if isinstance(item, Images):
+                flush_text()
+                content_list.append({"type": "image_url", "image_url": {"url": block.content}})
+            else:
+                if isinstance(item, Texts) and item.newline and (text_parts or content_list):
+                    text_parts.append("\n\n")
+                text_parts.append(block.content)
+        flush_text()
+        return content_list
+
     def to_dict(self) -> Optional[Dict[str, Any]]:
+        if any(isinstance(p, CacheBreakpoint) for p in self._items):
+            content_list = self._render_blocks()
+            if not content_list: return None
+            return {"role": self.role, "content": content_list}
+
         is_multimodal = any(isinstance(p, Images) for p in self._items)
 
         if not is_multimodal:
@@ -657,6 +865,8 @@ class RoleMessage:
 
 class ToolCalls(Message):
     """Represents an assistant message that requests tool calls."""
+    _token_cache: Optional[tuple] = None
+
     def __init__(self, tool_calls: List[Any]):
         super().__init__("assistant")
         self.tool_calls = tool_calls
@@ -685,8 +895,17 @@ class ToolCalls(Message):
             "content": None
         }
 
+    def token_count(self, tokenizer) -> int:
+        cache = self._token_cache
+        if cache is None or cache[0] != tokenizer.name:
+            text = json.dumps(self.to_dict()["tool_calls"], ensure_ascii=False)
+            cache = self._token_cache = (tokenizer.name, self.token_overhead + tokenizer.count(text))
+        return cache[1]
+
 class ToolResults(Message):
     """Represents a tool message with the result of a single tool call."""
+    _token_cache: Optional[tuple] = None
+
     def __init__(self, tool_call_id: str, content: Union[str, Message]):
         # The base Message class now handles the absorption of a Message object.
         # We just need to pass the content to the parent __init__.
@@ -709,8 +928,18 @@ class ToolResults(Message):
             "content": self._content
         }
 
+    def token_count(self, tokenizer) -> int:
+        cache = self._token_cache
+        if cache is None or cache[0] != tokenizer.name:
+            cache = self._token_cache = (tokenizer.name, self.token_overhead + tokenizer.count(self._content or ""))
+        return cache[1]
+
 # 4. 顶层容器: Messages
 class Messages:
+    # Maximum number of expensive providers refreshed at the same time.
+    refresh_concurrency: int = 4
+    last_refresh_stats: Optional[RefreshStats] = None
+
     def __init__(self, *initial_messages: Message):
         from typing import Tuple
         self._messages: List[Message] = []
@@ -780,11 +1009,52 @@ class Messages:
         return None
 
     async def refresh(self):
-        tasks = []
+        """
+        刷新所有 provider。同一实例或同一数据源在一个周期内只刷新一次，按 refresh_policy 不需要刷新的直接跳过，
+        昂贵的 provider 受 refresh_concurrency 限制，周期耗时记录在 last_refresh_stats 中。
+        """
+        start = time.perf_counter()
+        groups: Dict[Any, List[ContextProvider]] = {}
+        seen_ids = set()
         for provider_list in self._providers_index.values():
             for provider, _ in provider_list:
-                tasks.append(provider.refresh())
-        await asyncio.gather(*tasks)
+                if id(provider) in seen_ids:
+                    continue
+                seen_ids.add(id(provider))
+                groups.setdefault(provider.refresh_key(), []).append(provider)
+
+        stale_groups = [members for members in groups.values() if any(member.needs_refresh() for member in members)]
+        stats = RefreshStats(
+            providers=len(seen_ids), refreshed=len(stale_groups), skipped=len(groups) - len(stale_groups),
+            deduplicated=len(seen_ids) - len(groups),
+        )
+        semaphore = asyncio.Semaphore(max(1, self.refresh_concurrency))
+
+        async def refresh_group(members: List[ContextProvider]):
+            leader = members[0]
+            rendered_at = leader._last_rendered_at
+            provider_start = time.perf_counter()
+            if leader.expensive:
+                async with semaphore:
+                    await leader.refresh()
+            else:
+                await leader.refresh()
+            elapsed = time.perf_counter() - provider_start
+            if leader._last_rendered_at != rendered_at:
+                stats.rendered += 1
+            if elapsed > stats.slowest_duration:
+                stats.slowest, stats.slowest_duration = leader.name, elapsed
+            for follower in members[1:]:
+                follower._adopt(leader)
+
+        await asyncio.gather(*(refresh_group(members) for members in stale_groups))
+        stats.duration = time.perf_counter() - start
+        self.last_refresh_stats = stats
+        logging.debug(
+            f"Messages.refresh: {stats.providers} providers, {stats.refreshed} refreshed, "
+            f"{stats.skipped} skipped, {stats.rendered} rendered, {stats.deduplicated} deduplicated in {stats.duration * 1000:.2f}ms "
+            f"(slowest: {stats.slowest} {stats.slowest_duration * 1000:.2f}ms)"
+        )
 
     def render(self) -> List[Dict[str, Any]]:
         results = [msg.to_dict() for msg in self._messages]
@@ -814,6 +1084,10 @@ class Messages:
         await self.refresh()
         return self.render()
 
+    def token_count(self, tokenizer) -> int:
+        """Total tokens of all messages, reusing each provider's memoised count."""
+        return sum(message.token_count(tokenizer) for message in self._messages)
+
     def append(self, message: Message):
         if self._messages and self._messages[-1].role == message.role:
             last_message = self._messages[-1]
@@ -1931,6 +1931,204 @@ Files: {Files(visible=True, name="files")}
         await messages_copied.render_latest()
         self.assertEqual(counter, 3, "Dynamic function should be re-evaluated on each render_latest call")
 
+    async def test_zze_fstring_registry_scoped_per_loop(self):
+        """测试 f-string provider 注册表按事件循环隔离，未被消费的 provider 随循环一起释放"""
+        import gc
+        import weakref
+        from architext.core import _current_registry, _fstring_provider_registry
+
+        # 在运行中的事件循环内，占位符进入该循环自己的注册表，而不是全局注册表
+        placeholder = str(Texts("loop scoped", name="loop_scoped"))
+        self.assertIn(placeholder, _current_registry())
+        self.assertNotIn(placeholder, _fstring_provider_registry)
+        message = UserMessage(f"before {placeholder} after")
+        self.assertNotIn(placeholder, _current_registry())
+        self.assertEqual(message.provider("loop_scoped").content, "loop scoped")
+
+        # 在另一个事件循环中创建但从未消费的 provider，应在循环结束后被回收
+        async def leak_placeholder():
+            provider = Texts("orphan", name="orphan")
+            str(provider)
+            return weakref.ref(provider)
+
+        orphan_ref = await asyncio.to_thread(asyncio.run, leak_placeholder())
+        gc.collect()
+        self.assertIsNone(orphan_ref())
+
+    async def test_zzf_refresh_deduplicates_shared_sources(self):
+        """测试同一实例或同一数据源的 provider 在一个刷新周期内只计算一次"""
+        calls = 0
+        def current_time():
+            nonlocal calls
+            calls += 1
+            return f"t{calls}"
+
+        shared = Texts("shared", name="shared")
+        messages = Messages(
+            SystemMessage(Texts(current_time, name="time_a"), shared),
+            UserMessage("hi"),
+            AssistantMessage(shared),
+            UserMessage(Texts(current_time, name="time_b")),
+        )
+        await messages.refresh()
+        self.assertEqual(calls, 1)
+        self.assertEqual(messages.provider("time_b")._cached_content, "t1")
+        self.assertEqual(messages.provider("time_a")._cached_content, "t1")
+        stats = messages.last_refresh_stats
+        self.assertEqual(stats.deduplicated, 1)
+        self.assertEqual(stats.refreshed, stats.providers - 1)
+        self.assertGreaterEqual(stats.duration, 0)
+
+        # per_turn 策略：下一个周期重新计算
+        await messages.refresh()
+        self.assertEqual(calls, 2)
+        self.assertEqual(messages.provider("time_b")._cached_content, "t2")
+
+    async def test_zzf_refresh_key_identifies_data_source(self):
+        """测试动态文本按数据源（代码、闭包、绑定对象）去重，而不是按可调用对象的 id"""
+        calls = []
+        def current_time():
+            calls.append(1)
+            return "now"
+
+        class Clock:
+            def read(self):
+                calls.append(1)
+                return "clock"
+
+        def make_reader(value):
+            return lambda: calls.append(1) or value
+
+        clock = Clock()
+        # 每次新建的 lambda、每次取出的绑定方法都是不同的对象，但数据源相同
+        same_lambda = [Texts(lambda: current_time(), name=f"lambda_{i}") for i in range(3)]
+        same_method = [Texts(clock.read, name=f"method_{i}") for i in range(2)]
+        # 同一段代码捕获不同的变量、绑定不同的对象，不能合并
+        different = [Texts(make_reader("a"), name="reader_a"), Texts(make_reader("b"), name="reader_b"), Texts(Clock().read, name="other_clock")]
+        # newline 不同的 provider 不合并
+        with_newline = Texts(lambda: current_time(), name="lambda_newline", newline=True)
+
+        messages = Messages(SystemMessage(*same_lambda, *same_method), UserMessage(*different, with_newline))
+        await messages.refresh()
+        stats = messages.last_refresh_stats
+        self.assertEqual(stats.deduplicated, 3)
+        self.assertEqual(len(calls), 6)
+        self.assertEqual(messages.provider("reader_b")._cached_content, "b")
+        self.assertEqual(messages.provider("lambda_2")._cached_content, "now")
+
+        with self.assertRaises(ValueError):
+            same_lambda[0]._adopt(with_newline)
+
+        # 同一个代码对象绑定到不同的全局命名空间（例如重新加载的模块），读取的是不同的数据
+        source = compile("lambda: value", "<reloaded>", "eval")
+        first, second = eval(source, {"value": "first"}), eval(source, {"value": "second"})
+        self.assertIs(first.__code__, second.__code__)
+        reloaded = Messages(UserMessage(Texts(first, name="reloaded_a"), Texts(second, name="reloaded_b")))
+        await reloaded.refresh()
+        self.assertEqual(reloaded.last_refresh_stats.deduplicated, 0)
+        self.assertEqual(reloaded.provider("reloaded_b")._cached_content, "second")
+
+    async def test_zzg_refresh_policies_and_ttl(self):
+        """测试 static / per_turn / ttl 刷新策略"""
+        calls = 0
+        def counter():
+            nonlocal calls
+            calls += 1
+            return str(calls)
+
+        static = Texts("static", name="static")
+        cached = Texts(counter, name="cached", ttl=3600)
+        self.assertEqual(static.refresh_policy, "static")
+        self.assertEqual(cached.refresh_policy, "per_turn")
+        self.assertEqual(Files().refresh_policy, "on_change")
+
+        static.render = AsyncMock(wraps=static.render)
+        messages = Messages(UserMessage(static, cached))
+        for _ in range(3):
+            await messages.refresh()
+        static.render.assert_awaited_once()
+        self.assertEqual(calls, 1, "ttl 内动态内容不应重新计算")
+        self.assertEqual(messages.last_refresh_stats.rendered, 0)
+        # 没有过期的 static 和 ttl 内的 per_turn provider 不进入刷新
+        self.assertEqual(messages.last_refresh_stats.skipped, 2)
+        self.assertEqual(messages.last_refresh_stats.refreshed, 0)
+
+        cached.ttl = 0
+        await messages.refresh()
+        self.assertEqual(calls, 2)
+
+    async def test_zzh_refresh_limits_expensive_providers(self):
+        """测试昂贵 provider 的并发刷新受 refresh_concurrency 限制"""
+        active = 0
+        peak = 0
+
+        class SlowProvider(Texts):
+            expensive = True
+            async def render(self):
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+                return self.name
+
+        messages = Messages(UserMessage(*[SlowProvider(name=f"slow_{i}") for i in range(6)]))
+        messages.refresh_concurrency = 2
+        await messages.refresh()
+        self.assertEqual(peak, 2)
+        self.assertEqual(messages.last_refresh_stats.rendered, 6)
+        self.assertTrue(messages.last_refresh_stats.slowest.startswith("slow_"))
+
+    async def test_zzi_cache_breakpoint_renders_blocks(self):
+        """测试 CacheBreakpoint 将消息拆分为稳定前缀与易变后缀两个文本块"""
+        message = SystemMessage(f"stable {Texts('tools', name='tools_doc')}{CacheBreakpoint()} now: {Texts(lambda: 'volatile')}")
+        rendered = await message.render_latest()
+        self.assertEqual(rendered["content"], [
+            {"type": "text", "text": "stable tools", "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": " now: volatile"},
+        ])
+
+        # 不含断点的消息仍然渲染为字符串
+        plain = await SystemMessage("stable", Texts(lambda: " volatile")).render_latest()
+        self.assertEqual(plain["content"], "stable volatile")
+
+    async def test_zzj_token_count_is_memoised_per_provider(self):
+        """测试 token 计数按 provider 缓存，只有内容变化的 provider 会被重新计数"""
+        class CharTokenizer:
+            name = "chars"
+            def __init__(self): self.calls = []
+            def count(self, text):
+                self.calls.append(text)
+                return len(text)
+
+        tokenizer = CharTokenizer()
+        counter = {"value": 0}
+        def dynamic():
+            counter["value"] += 1
+            return f"v{counter['value']}"
+
+        messages = Messages(
+            SystemMessage(Texts("system"), Texts(dynamic)),
+            UserMessage("hello"),
+            AssistantMessage("world"),
+        )
+        await messages.render_latest()
+        self.assertEqual(messages.token_count(tokenizer), 3 * Message.token_overhead + len("system") + len("v1") + len("hello") + len("world"))
+        self.assertEqual(len(tokenizer.calls), 4)
+
+        # 内容未变化时不再调用 tokenizer
+        messages.token_count(tokenizer)
+        self.assertEqual(len(tokenizer.calls), 4)
+
+        # 动态 provider 刷新后只重新计数它自己
+        await messages.render_latest()
+        messages.token_count(tokenizer)
+        self.assertEqual(tokenizer.calls[4:], ["v2"])
+
+        # 图片按固定值计数，不计算 data URL 的长度
+        image_message = UserMessage(Images("data:image/png;base64," + "A" * 10000))
+        self.assertEqual(image_message.token_count(tokenizer), Message.token_overhead + Images.image_tokens)
+
 
 # ==============================================================================
 # 6. 演示
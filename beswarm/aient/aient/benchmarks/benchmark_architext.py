@@ -0,0 +1,38 @@
+import time
+import asyncio
+
+from ..architext.architext import UserMessage, Texts
+
+"""
+基准测试: 构造 10 万条纯字符串消息和内嵌 provider 的 f-string 消息，并渲染全部消息。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_architext
+"""
+
+N = 100_000
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s  ({elapsed / N * 1e6:6.2f} us/msg)")
+    return result
+
+async def main():
+    # 纯字符串消息：走不含占位符的快速路径
+    plain = bench("construct plain messages", lambda: [UserMessage(f"hello {i}") for i in range(N)])
+    # f-string 中内嵌 provider：走占位符拆分与注册表查找
+    mixed = bench("construct f-string messages", lambda: [UserMessage(f"hi {Texts(str(i))} there") for i in range(N)])
+
+    async def render_all(messages):
+        for message in messages:
+            await message.render_latest()
+
+    start = time.perf_counter()
+    await render_all(plain)
+    await render_all(mixed)
+    elapsed = time.perf_counter() - start
+    print(f"{'render 2 x messages':<40} {elapsed:8.3f}s  ({elapsed / (2 * N) * 1e6:6.2f} us/msg)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
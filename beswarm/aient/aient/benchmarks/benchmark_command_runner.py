@@ -0,0 +1,78 @@
+import os
+import re
+import pty
+import time
+import select
+import asyncio
+import tracemalloc
+import subprocess
+
+from ..plugins.command_runner import run_command
+
+"""
+基准测试: 运行一个输出约 16MB 的命令，对比原来的 excute_command 读取方式和新的异步执行器
+的耗时和峰值内存；再运行一个挂起的命令，验证无输出超时能按时结束它。
+
+原实现用 1024 字节的 select 循环读取 pty，把全部输出保存在列表里，结束后再截取首尾各 250 行，
+这里在 legacy_run 中复现它作为基线。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_command_runner
+"""
+
+LARGE_COMMAND = "seq 1 2000000"
+HUNG_COMMAND = "echo start; sleep 3600"
+
+def legacy_run(command):
+    output_lines = []
+    master_fd, slave_fd = pty.openpty()
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=slave_fd, stderr=slave_fd, close_fds=True)
+    os.close(slave_fd)
+    while True:
+        try:
+            r, _, _ = select.select([master_fd], [], [], 0.1)
+            if r:
+                data_bytes = os.read(master_fd, 1024)
+                if not data_bytes:
+                    break
+                output_lines.append(data_bytes.decode(errors='replace'))
+            if process.poll() is not None and not r:
+                break
+        except OSError:
+            break
+    os.close(master_fd)
+    process.wait()
+    new_output_lines = []
+    output_lines = "".join(output_lines).strip().replace("\\r", "\r").replace("\\\\", "").replace("\\n", "\n").replace("\r", "+++").replace("\n", "+++")
+    output_lines = re.sub(r'\\u001b\[[0-9;]*[a-zA-Z]', '', output_lines)
+    for line in output_lines.split("+++"):
+        if line.strip() == "":
+            continue
+        new_output_lines.append(line)
+    if len(new_output_lines) > 500:
+        new_output_lines = new_output_lines[:250] + new_output_lines[-250:]
+    return "\n".join(new_output_lines)
+
+def measure(label, func):
+    started = time.perf_counter()
+    output = func()
+    elapsed = time.perf_counter() - started
+    # tracemalloc 会明显拖慢执行，峰值内存单独再跑一次
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:16s} total {elapsed:6.2f}s  peak memory {peak / 2 ** 20:7.1f}MB  returned {len(output):6d} chars")
+
+def main():
+    print(f"large output: {LARGE_COMMAND}")
+    measure("legacy select", lambda: legacy_run(LARGE_COMMAND))
+    measure("async runner", lambda: asyncio.run(run_command(LARGE_COMMAND)).output)
+
+    print(f"hung command: {HUNG_COMMAND} (legacy implementation never returns)")
+    started = time.perf_counter()
+    result = asyncio.run(run_command(HUNG_COMMAND, idle_timeout=1.0, kill_grace=0.5))
+    print(f"async runner     idle timeout 1.0s, returned after {time.perf_counter() - started:.2f}s "
+          f"({result.timed_out}, exit {result.returncode}, output {result.output!r})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import time
+import asyncio
+import threading
+import httpx
+from http.server import ThreadingHTTPServer
+
+from ..core.connection import ConnectionManager, PoolConfig
+from ..core.test.test_connection import KeepAliveHandler
+
+"""
+基准测试: 模拟 run_paper_job 的调用方式（每个任务一次 asyncio.run，每个任务创建多个 agent），
+对比每个实例各自创建 httpx.AsyncClient 与使用共享连接管理器时的新建连接数和耗时。
+
+本地服务器没有 TLS，真实环境中每个新连接还要多一次 TLS 握手。没有安装 h2 时，
+并发请求仍然需要多个 HTTP/1.1 连接。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_connection
+"""
+
+JOBS = 5
+AGENTS = 8
+REQUESTS = 3
+
+class CountingHandler(KeepAliveHandler):
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+def run_jobs(url, make_client, concurrent):
+    async def job():
+        clients = [make_client() for _ in range(AGENTS)]
+        for _ in range(REQUESTS):
+            if concurrent:
+                await asyncio.gather(*(client.get(url) for client in clients))
+            else:
+                for client in clients:
+                    await client.get(url)
+
+    started = time.perf_counter()
+    for _ in range(JOBS):
+        asyncio.run(job())
+    return time.perf_counter() - started
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://localhost:{server.server_port}/v1/chat/completions"
+    total = JOBS * AGENTS * REQUESTS
+    print(f"{JOBS} jobs x {AGENTS} agents x {REQUESTS} requests = {total} requests")
+    try:
+        for concurrent in (False, True):
+            print("concurrent agents:" if concurrent else "sequential agents:")
+            CountingHandler.connections = 0
+            elapsed = run_jobs(url, lambda: httpx.AsyncClient(follow_redirects=True, timeout=600), concurrent)
+            print(f"  client per instance: {CountingHandler.connections:3d} connections, {elapsed:.2f}s")
+
+            CountingHandler.connections = 0
+            manager = ConnectionManager(PoolConfig())
+            elapsed = run_jobs(url, lambda: manager.get_client(url), concurrent)
+            stats = manager.connection_stats()[f"http://localhost:{server.server_port}"]
+            print(f"  shared manager:      {CountingHandler.connections:3d} connections, {elapsed:.2f}s "
+                  f"(reuse {stats.reuse_ratio:.0%}, dns {stats.dns_lookups} lookups / {stats.dns_hits} hits)")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import io
+import time
+import base64
+import random
+import asyncio
+
+from PIL import Image
+
+from ..core.models import RequestModel
+from ..core.utils import get_image_message, image_part_cache, prepare_image_messages
+
+"""
+基准测试: 一段包含 20 张图片的对话（每轮新增一张，PNG/JPEG/WebP 混合），
+对比原来逐张、每轮重新编码的图片准备与并发、按内容缓存的实现。
+
+legacy_image_message 复现了原来的 get_image_message。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_image_cache
+"""
+
+IMAGES = 20
+ENGINES = ["gpt", "claude", "gemini"]
+
+def make_images():
+    rng = random.Random(0)
+    urls = []
+    for index in range(IMAGES):
+        image = Image.frombytes("RGB", (384, 384), bytes(rng.getrandbits(8) for _ in range(384 * 384 * 3)))
+        image_format, mime_type = [("PNG", "image/png"), ("JPEG", "image/jpeg"), ("WEBP", "image/webp")][index % 3]
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format)
+        urls.append(f"data:{mime_type};base64," + base64.b64encode(buffer.getvalue()).decode("utf-8"))
+    return urls
+
+async def legacy_image_message(base64_image, engine):
+    colon_index = base64_image.index(":")
+    semicolon_index = base64_image.index(";")
+    image_type = base64_image[colon_index + 1:semicolon_index]
+    if image_type == "image/webp":
+        image = Image.open(io.BytesIO(base64.b64decode(base64_image.split(",")[1])))
+        png_buffer = io.BytesIO()
+        image.save(png_buffer, format="PNG")
+        base64_image = "data:image/png;base64," + base64.b64encode(png_buffer.getvalue()).decode('utf-8')
+        image_type = "image/png"
+    if engine == "gpt":
+        return {"type": "image_url", "image_url": {"url": base64_image}}
+    if engine == "claude":
+        return {"type": "image", "source": {"type": "base64", "media_type": image_type, "data": base64_image.split(",")[1]}}
+    return {"inlineData": {"mimeType": image_type, "data": base64_image.split(",")[1]}}
+
+def conversation(urls, turns):
+    messages = []
+    for url in urls[:turns]:
+        messages.append({"role": "user", "content": [{"type": "text", "text": "看这张图"}, {"type": "image_url", "image_url": {"url": url}}]})
+        messages.append({"role": "assistant", "content": "好的"})
+    return RequestModel(model="test", messages=messages).messages
+
+async def legacy_turn(messages, engine):
+    for message in messages:
+        if isinstance(message.content, list):
+            for item in message.content:
+                if item.type == "image_url":
+                    await legacy_image_message(item.image_url.url, engine)
+
+async def cached_turn(messages, engine):
+    await prepare_image_messages(messages, engine)
+    for message in messages:
+        if isinstance(message.content, list):
+            for item in message.content:
+                if item.type == "image_url":
+                    await get_image_message(item.image_url.url, engine)
+
+async def run_conversation(urls, engine, prepare):
+    per_turn = []
+    for turns in range(1, IMAGES + 1):
+        messages = conversation(urls, turns)
+        started = time.perf_counter()
+        await prepare(messages, engine)
+        per_turn.append(time.perf_counter() - started)
+    return per_turn
+
+def main():
+    urls = make_images()
+    size = sum(len(url) for url in urls) / 1024 / 1024
+    print(f"{IMAGES} images ({size:.1f} MB base64), {IMAGES} turns, image preparation time")
+    for engine in ENGINES:
+        image_part_cache.clear()
+        legacy = asyncio.run(run_conversation(urls, engine, legacy_turn))
+        cached = asyncio.run(run_conversation(urls, engine, cached_turn))
+        print(f"{engine:7s} legacy total {sum(legacy) * 1000:7.1f}ms last turn {legacy[-1] * 1000:6.1f}ms | "
+              f"cached total {sum(cached) * 1000:6.1f}ms last turn {cached[-1] * 1000:5.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import time
+import random
+import fnmatch
+
+from ..utils.path_policy import PathPolicy
+
+"""
+基准测试: 对 100 万次路径检查，对比原沙箱逐条 fnmatch 的匹配和编译后的 PathPolicy。
+
+规则为 24 条（16 条目录 / 文件规则和 8 条 glob 规则），路径从 20000 个不同的绝对路径中随机抽取，
+分别测试缓存命中（重复路径）和缓存全部未命中（cache_size=0）两种情况。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_path_policy
+"""
+
+CHECKS = 1_000_000
+DISTINCT_PATHS = 20_000
+
+def legacy_match(patterns, target_path):
+    abs_target_path = os.path.abspath(target_path)
+    for pattern in patterns:
+        if '*' in pattern or '?' in pattern or '[' in pattern:
+            if fnmatch.fnmatch(abs_target_path, pattern):
+                return True
+        elif abs_target_path == pattern or abs_target_path.startswith(pattern + os.sep):
+            return True
+    return False
+
+def build_rules():
+    patterns = [f"/srv/project{i}/secrets" for i in range(12)]
+    patterns += ["/etc/shadow", "/root/.ssh", "/var/lib/db", "/home/user/.aws/credentials"]
+    patterns += [
+        "/**/*beswarm*/**", "/home/*/.ssh/*", "/**/.env", "/**/*.pem",
+        "/srv/*/private/**", "/tmp/cache-??/*", "/**/id_[rd]sa*", "/**/node_modules/.cache/**",
+    ]
+    return [os.path.abspath(p) for p in patterns]
+
+def build_paths(rng):
+    dirs = ["srv", "project3", "project17", "src", "lib", "home", "user", "tmp", "data", "beswarm", "private", "docs", "tests"]
+    files = ["main.py", "README.md", ".env", "key.pem", "id_rsa", "notes.txt", "model.bin", "config.json"]
+    paths = []
+    for _ in range(DISTINCT_PATHS):
+        depth = rng.randint(1, 7)
+        paths.append("/" + "/".join(rng.choice(dirs) for _ in range(depth)) + "/" + rng.choice(files))
+    return paths
+
+def run(check, sequence):
+    started = time.perf_counter()
+    hits = 0
+    for path in sequence:
+        if check(path):
+            hits += 1
+    return time.perf_counter() - started, hits
+
+def main():
+    rng = random.Random(0)
+    patterns = build_rules()
+    paths = build_paths(rng)
+    sequence = [rng.choice(paths) for _ in range(CHECKS)]
+
+    cached = PathPolicy(patterns, cache_size=DISTINCT_PATHS)
+    uncached = PathPolicy(patterns, cache_size=0)
+    assert all(cached.matches(p) == legacy_match(patterns, p) for p in paths)
+
+    print(f"{CHECKS} 次检查，{len(patterns)} 条规则，{DISTINCT_PATHS} 个不同路径")
+    legacy_time, legacy_hits = run(lambda p: legacy_match(patterns, p), sequence)
+    uncached_time, uncached_hits = run(uncached.matches, sequence)
+    cached_time, cached_hits = run(cached.matches, sequence)
+    assert legacy_hits == uncached_hits == cached_hits
+    for name, elapsed in (("逐条 fnmatch", legacy_time), ("PathPolicy 无缓存", uncached_time), ("PathPolicy 缓存", cached_time)):
+        print(f"{name:<18} {elapsed:7.2f}s  {elapsed / CHECKS * 1e6:6.2f} µs/次  {legacy_time / elapsed:5.1f}x")
+    print(f"命中规则的路径: {cached_hits}，缓存: {cached.cache_info()}")
+
+if __name__ == "__main__":
+    main()
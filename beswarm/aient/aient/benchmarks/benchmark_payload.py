@@ -0,0 +1,58 @@
+import time
+import asyncio
+import statistics
+
+from ..core.request import prepare_request_payload, message_model_cache
+
+"""
+基准测试: 500 条消息的对话，每个供应商构造请求体的耗时。
+
+"cold" 每次调用前清空已校验消息的缓存，相当于每轮都重新校验全部消息；
+"warm" 模拟连续对话，只有新增的消息需要校验和转换。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_payload
+"""
+
+MESSAGES = 500
+ROUNDS = 100
+
+PROVIDERS = {
+    "gpt": {"base_url": "https://api.openai.com/v1/chat/completions", "model": "gpt-4o"},
+    "claude": {"base_url": "https://api.anthropic.com/v1/messages", "model": "claude-3-5-sonnet"},
+    "gemini": {"base_url": "https://generativelanguage.googleapis.com/v1beta", "model": "gemini-2.5-pro"},
+    "openrouter": {"base_url": "https://openrouter.ai/api/v1/chat/completions", "model": "openai/gpt-4o"},
+}
+
+def conversation(turns):
+    messages = [{"role": "system", "content": "你是一个科研写作助手。" * 50}]
+    for index in range(turns):
+        messages.append({"role": "user", "content": f"第 {index} 个问题：" + "请分析这段实验数据。" * 20})
+        messages.append({"role": "assistant", "content": f"第 {index} 个回答：" + "根据数据可以看出趋势。" * 40})
+    return messages
+
+async def measure(name, cold):
+    config = PROVIDERS[name]
+    provider = {"provider": name, "base_url": config["base_url"], "api": "key", "model": [config["model"]], "tools": True, "image": True}
+    base = conversation(MESSAGES // 2)
+    message_model_cache.clear()
+    samples = []
+    for round_index in range(ROUNDS):
+        # 每轮在末尾追加一问一答
+        messages = base + conversation(round_index + 1)[-2:]
+        request_data = {"model": config["model"], "messages": messages, "stream": True}
+        if cold:
+            message_model_cache.clear()
+        started = time.perf_counter()
+        await prepare_request_payload(provider, request_data)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+def main():
+    print(f"{MESSAGES} messages, median of {ROUNDS} turns")
+    for name in PROVIDERS:
+        cold = asyncio.run(measure(name, cold=True))
+        warm = asyncio.run(measure(name, cold=False))
+        print(f"{name:11s} cold {cold * 1000:6.2f}ms  warm {warm * 1000:6.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+"""
+基准测试: 对比启动时导入全部插件（OCEANS_EAGER_PLUGINS=1）与按插件清单延迟导入的耗时。
+
+每轮在新的子进程中先预先导入两种方式都会用到的第三方模块，只计时 import beswarm.aient.aient.plugins，
+并统计启动后加载了多少个插件子模块。延迟模式下第一次运行会生成索引文件，不计入结果。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_plugin_import
+"""
+
+ROUNDS = 15
+PACKAGE = "beswarm.aient.aient.plugins"
+
+PROBE = """
+import sys, json, time
+for name in json.loads(sys.argv[1]):
+    try:
+        __import__(name)
+    except Exception:
+        pass
+started = time.perf_counter()
+import {package} as plugins
+elapsed = time.perf_counter() - started
+loaded = [m for m in sys.modules if m.startswith("{package}.") and m.rsplit(".", 1)[1] not in plugins.excluded_modules]
+print(json.dumps({{"elapsed": elapsed, "plugins": len(loaded), "modules": sorted(sys.modules)}}))
+""".format(package=PACKAGE)
+
+def run(eager, preload, index_path):
+    env = dict(os.environ, OCEANS_EAGER_PLUGINS="1" if eager else "0", OCEANS_PLUGIN_INDEX=index_path)
+    env.pop("OCEANS_MINIMAL_PLUGINS", None)
+    output = subprocess.run([sys.executable, "-c", PROBE, json.dumps(preload)], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    index_path = os.path.join(tempfile.mkdtemp(), "plugin_index.json")
+    # 两种方式共同依赖的第三方模块预先导入，避免被 beswarm 其它部分的导入时间淹没
+    lazy_modules = run(False, [], index_path)["modules"]
+    preload = [name for name in lazy_modules if not name.startswith("beswarm") and name != "__main__"]
+    for eager in (True, False):
+        results = [run(eager, preload, index_path) for _ in range(ROUNDS)]
+        elapsed = statistics.median(result["elapsed"] for result in results) * 1000
+        label = "eager" if eager else "lazy "
+        print(f"{label}  import {elapsed:7.1f}ms  plugin submodules loaded {results[0]['plugins']:2d}  modules {len(results[0]['modules'])}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import time
+import asyncio
+import tempfile
+
+from ..core.process_pool import ProcessPoolService
+from ..core.test.test_process_pool import write_text_pdf
+
+"""
+基准测试: 同时读取 10 个 PDF（pdfminer 纯 Python 解析），对比在线程中直接解析与提交到常驻进程池。
+
+同时运行一个 10ms 心跳的协程，记录事件循环被 GIL 阻塞的最大延迟。
+进程池在计时前预热（子进程启动并预先导入 pdfminer）。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_process_pool
+"""
+
+PDFS = 10
+PAGES = 12
+LINES_PER_PAGE = 45
+INTERVAL = 0.01
+
+async def heartbeat(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    last = loop.time()
+    while not stop.is_set():
+        await asyncio.sleep(INTERVAL)
+        now = loop.time()
+        worst = max(worst, now - last - INTERVAL)
+        last = now
+    return worst
+
+async def measure(read):
+    stop = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(stop))
+    started = time.perf_counter()
+    texts = await asyncio.gather(*[read(path) for path in PATHS])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return elapsed, await beat, sum(len(text) for text in texts)
+
+PATHS = []
+
+def main():
+    from pdfminer.high_level import extract_text
+
+    directory = tempfile.mkdtemp()
+    for index in range(PDFS):
+        path = os.path.join(directory, f"doc{index}.pdf")
+        write_text_pdf(path, PAGES, LINES_PER_PAGE)
+        PATHS.append(path)
+
+    pool = ProcessPoolService(max_workers=min(PDFS, os.cpu_count() or 1))
+    pool.warm()
+    print(f"{PDFS} PDFs x {PAGES} pages, {os.cpu_count()} CPU(s), {pool.max_workers} worker(s)")
+    for label, read in [
+        ("thread pool ", lambda path: asyncio.to_thread(extract_text, path)),
+        ("process pool", lambda path: pool.run_async(extract_text, path)),
+    ]:
+        elapsed, worst, chars = asyncio.run(measure(read))
+        print(f"{label}  total {elapsed:5.2f}s  max heartbeat lag {worst * 1000:7.1f}ms  chars {chars}")
+    pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import importlib.util
+
+from ..core.python_pool import PythonWorkerPool, DEFAULT_PRELOAD
+
+"""
+基准测试: 连续执行同一个导入了常用库的代码片段，对比每次启动新解释器（原 run_python_script 的做法）
+和预热解释器池的延迟。
+
+优先使用 numpy / pandas / matplotlib；当前环境没有安装时，改用已经安装的较重的库代替，
+结果中会列出实际预导入的模块。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_python_pool
+"""
+
+RUNS = 20
+FALLBACK_MODULES = ("httpx", "pdfminer.high_level", "email.mime.multipart", "decimal", "asyncio")
+
+def heavy_modules():
+    modules = [m for m in DEFAULT_PRELOAD if importlib.util.find_spec(m.split(".")[0]) is not None]
+    return modules or [m for m in FALLBACK_MODULES if importlib.util.find_spec(m.split(".")[0]) is not None]
+
+async def cold_run(code):
+    """原实现：写临时文件，启动新的解释器执行，等待输出。"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_file:
+        temp_file.write(code)
+        temp_file_name = temp_file.name
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, temp_file_name,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        return stdout.decode()
+    finally:
+        os.unlink(temp_file_name)
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def report(label, samples):
+    print(f"{label:24s} mean {sum(samples) / len(samples) * 1000:8.1f}ms  p50 {percentile(samples, 0.5) * 1000:8.1f}ms  p95 {percentile(samples, 0.95) * 1000:8.1f}ms")
+
+async def main():
+    modules = heavy_modules()
+    code = "".join(f"import {m}\n" for m in modules) + "print(sum(range(1000)))\n"
+    print(f"{RUNS} runs, snippet imports: {', '.join(modules)}")
+
+    cold = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        await cold_run(code)
+        cold.append(time.perf_counter() - started)
+    report("new interpreter per run", cold)
+
+    pool = PythonWorkerPool(size=1, preload=modules, python=sys.executable)
+    started = time.perf_counter()
+    first = await pool.run_async(code)
+    report("pool, first run (cold)", [time.perf_counter() - started])
+    warm = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        result = await pool.run_async(code)
+        warm.append(time.perf_counter() - started)
+    assert result.warm and result.stdout == first.stdout
+    report("pool, warm runs", warm)
+    pool.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
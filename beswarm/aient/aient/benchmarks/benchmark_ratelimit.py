@@ -0,0 +1,51 @@
+import time
+import asyncio
+from collections import defaultdict
+
+from ..core.utils import ThreadSafeCircularList
+
+"""
+基准测试: 在 "100000/min" 的限额下连续取 key，对比令牌桶与原来按时间戳列表扫描的实现。
+
+原实现每次取 key 都要扫描窗口内全部请求时间戳并重建列表，窗口内请求越多越慢，
+这里在 legacy_is_rate_limited 中复现它作为基线。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_ratelimit
+"""
+
+ACQUISITIONS = 10_000
+LIMIT = (100_000, 60)
+
+def legacy_is_rate_limited(requests, item, model_key="default"):
+    now = time.time()
+    limit_count, limit_period = LIMIT
+    recent_requests = sum(1 for req in requests[item][model_key] if req > now - limit_period)
+    if recent_requests >= limit_count:
+        return True
+    requests[item][model_key] = [req for req in requests[item][model_key] if req > now - limit_period]
+    requests[item][model_key].append(now)
+    return False
+
+def measure_legacy():
+    requests = defaultdict(lambda: defaultdict(list))
+    started = time.perf_counter()
+    for _ in range(ACQUISITIONS):
+        legacy_is_rate_limited(requests, "key")
+    return time.perf_counter() - started
+
+async def measure_bucket():
+    circular = ThreadSafeCircularList(["key"], rate_limit=f"{LIMIT[0]}/min")
+    started = time.perf_counter()
+    for _ in range(ACQUISITIONS):
+        await circular.next()
+    return time.perf_counter() - started
+
+def main():
+    print(f"{ACQUISITIONS} acquisitions, limit {LIMIT[0]}/{LIMIT[1]}s")
+    legacy = measure_legacy()
+    bucket = asyncio.run(measure_bucket())
+    print(f"timestamp list  total {legacy:6.2f}s  per acquisition {legacy / ACQUISITIONS * 1e6:8.1f}us")
+    print(f"token bucket    total {bucket:6.2f}s  per acquisition {bucket / ACQUISITIONS * 1e6:8.1f}us")
+
+if __name__ == "__main__":
+    main()
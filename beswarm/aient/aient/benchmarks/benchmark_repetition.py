@@ -0,0 +1,69 @@
+import time
+import random
+
+from ..utils.scripts import find_most_frequent_phrase, RepetitionDetector
+
+"""
+基准测试: 一个 8000 字符的正常响应之后进入重复循环，每个流式片段 20 个字符。
+
+对比两种做法：每个片段之后对累积的全文调用 find_most_frequent_phrase（最常见的长短语出现 4 次即判定为重复），
+和 RepetitionDetector 只处理新增片段。输出总耗时、每个片段的平均耗时，以及进入循环后多少个字符才发现。
+另外测量 RepetitionDetector 处理 1 MB 不重复文本的吞吐量。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_repetition
+"""
+
+CHUNK = 20
+# 按最常见短语判定重复：至少 4 次、至少 40 个字符
+LEGACY_MIN_REPEATS = 4
+LEGACY_MIN_PHRASE = 40
+
+def normal_text(size, seed=0):
+    rng = random.Random(seed)
+    words = ["parser", "returns", "the", "value", "after", "checking", "each", "token", "in", "order",
+             "then", "writes", "result", "file", "test", "passes", "because", "input", "is", "valid"]
+    parts, length = [], 0
+    while length < size:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(5, 15))) + f" ({rng.randint(0, 9999)}).\n"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+def run_legacy(text, loop_start):
+    started = time.perf_counter()
+    chunks = 0
+    for end in range(CHUNK, len(text) + CHUNK, CHUNK):
+        chunks += 1
+        phrase, count = find_most_frequent_phrase(text[:end])
+        if count >= LEGACY_MIN_REPEATS and len(phrase) >= LEGACY_MIN_PHRASE:
+            return time.perf_counter() - started, chunks, end - loop_start
+    return time.perf_counter() - started, chunks, None
+
+def run_streaming(text, loop_start):
+    started = time.perf_counter()
+    detector = RepetitionDetector()
+    chunks = 0
+    for index in range(0, len(text), CHUNK):
+        chunks += 1
+        if detector.feed(text[index:index + CHUNK]):
+            return time.perf_counter() - started, chunks, index + CHUNK - loop_start
+    return time.perf_counter() - started, chunks, None
+
+def main():
+    prefix = normal_text(8000)
+    text = prefix + "I will check the output file once more before continuing.\n" * 200
+    for name, run in (("find_most_frequent_phrase", run_legacy), ("RepetitionDetector", run_streaming)):
+        elapsed, chunks, latency = run(text, len(prefix))
+        found = f"进入循环后 {latency} 字符发现" if latency is not None else "响应结束仍未发现"
+        print(f"{name:<26} {elapsed * 1000:9.1f} ms  {elapsed / chunks * 1e6:9.1f} µs/片段  {found}")
+
+    text = normal_text(1 << 20)
+    detector = RepetitionDetector()
+    started = time.perf_counter()
+    for index in range(0, len(text), CHUNK):
+        detector.feed(text[index:index + CHUNK])
+    elapsed = time.perf_counter() - started
+    print(f"RepetitionDetector 1 MB 正常文本: {elapsed:.2f}s ({len(text) / elapsed / 1e6:.1f} MB/s)，误报: {detector.result}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import time
+import random
+import asyncio
+import statistics
+
+from ..core.utils import ThreadSafeCircularList
+
+"""
+基准测试: 模拟一组性能不一的端点，对比各调度算法下端到端请求延迟的 p50 / p99。
+
+每个端点有基础延迟和容量，进行中的请求超过容量后延迟按比例增长；flaky 端点有一定概率很快返回错误，
+失败的请求换一个端点重试。所有请求以固定并发发出。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_scheduler
+"""
+
+REQUESTS = 2000
+CONCURRENCY = 64
+MAX_ATTEMPTS = 3
+
+# 名称: (基础延迟秒数, 容量, 错误率)
+ENDPOINTS = {
+    "fast-a": (0.02, 16, 0.0),
+    "fast-b": (0.02, 16, 0.0),
+    "medium": (0.06, 8, 0.0),
+    "slow": (0.25, 4, 0.0),
+    "flaky": (0.02, 16, 0.3),
+}
+
+class SimulatedEndpoint:
+    def __init__(self, name, latency, capacity, error_rate, rng):
+        self.name = name
+        self.latency = latency
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rng = rng
+        self.in_flight = 0
+
+    async def call(self):
+        self.in_flight += 1
+        try:
+            if self.rng.random() < self.error_rate:
+                await asyncio.sleep(0.005)
+                raise RuntimeError(f"{self.name} failed")
+            load = max(self.in_flight / self.capacity, 1.0)
+            await asyncio.sleep(self.latency * load * self.rng.lognormvariate(0, 0.3))
+        finally:
+            self.in_flight -= 1
+
+async def simulate(algorithm):
+    rng = random.Random(0)
+    endpoints = {name: SimulatedEndpoint(name, *config, rng) for name, config in ENDPOINTS.items()}
+    scheduler = ThreadSafeCircularList(list(endpoints), schedule_algorithm=algorithm, seed=0)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+    failures = 0
+
+    async def one_request():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            for _ in range(MAX_ATTEMPTS):
+                try:
+                    async with scheduler.track() as name:
+                        await endpoints[name].call()
+                    break
+                except RuntimeError:
+                    continue
+            else:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return p50, p99, elapsed, failures, scheduler.stats()
+
+def main():
+    print(f"{REQUESTS} requests, concurrency {CONCURRENCY}, endpoints: {', '.join(ENDPOINTS)}")
+    for algorithm in ["round_robin", "random", "least_outstanding", "p2c"]:
+        p50, p99, elapsed, failures, stats = asyncio.run(simulate(algorithm))
+        share = " ".join(f"{name}={item['requests']}" for name, item in stats.items())
+        print(f"{algorithm:18s} p50 {p50 * 1000:6.1f}ms  p99 {p99 * 1000:7.1f}ms  total {elapsed:5.2f}s  failed {failures}  [{share}]")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer
+
+from ..models.chatgpt import chatgpt
+from ..core.test.test_speculative_tools import ScriptedStreamHandler, speculative_lookup, tool_events, TOOL_CALL
+
+"""
+基准测试: 对比开启和关闭投机执行时，从发出请求到拿到第一个工具结果的时间。
+
+模拟服务器输出约 2000 个 token 的长回复，只读工具调用出现在回复开头。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_speculative_tools
+"""
+
+def time_to_first_tool_result(api_url, speculative_tools):
+    tool_events.clear()
+    ScriptedStreamHandler.requests = 0
+    bot = chatgpt(api_key="test", engine="gpt-4o", api_url=api_url, tools=[speculative_lookup], speculative_tools=speculative_tools)
+
+    async def run():
+        started = time.monotonic()
+        async for _ in bot.ask_stream_async("hi"):
+            pass
+        finished = [event[2] for event in tool_events if event[0] == "finish"]
+        return finished[0] - started
+    return asyncio.run(run())
+
+def main():
+    # 每个分片约 5 个 token，400 个分片约 2000 个 token
+    ScriptedStreamHandler.script = [
+        ["我来查询。\n", TOOL_CALL] + ["继续分析这个问题，"] * 400,
+        ["完成"],
+    ]
+    ScriptedStreamHandler.chunk_delay = 0.002
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedStreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    try:
+        for speculative_tools in (False, True):
+            samples = sorted(time_to_first_tool_result(api_url, speculative_tools) for _ in range(5))
+            label = "speculative" if speculative_tools else "sequential"
+            print(f"{label:>12}: time to first tool result median {samples[2] * 1000:.1f} ms, min {samples[0] * 1000:.1f} ms")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import json
+import time
+import random
+import string
+import asyncio
+import httpx
+
+from ..core.response import fetch_gpt_response_stream
+from ..core.utils import end_of_line, encode_sse
+
+"""
+基准测试: 回放一段约 10 万 token 的 SSE 流，对比字节级增量解码与原来逐行切换线程解析的实现。
+
+原实现按文本切分行，每一行都通过 asyncio.to_thread 调用 json.loads 和 json.dumps，
+并在每次生成响应时重新设置随机种子，这里在 legacy_fetch 中复现它作为基线。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_sse
+"""
+
+TOKENS = 100_000
+NETWORK_CHUNK = 1400
+
+def recorded_stream(tokens=TOKENS):
+    rng = random.Random(0)
+    words = ["数据", "分析", " the", " model", " token", "，", "。", " stream", "结果", "\n"]
+    lines = [": keepalive\n\n"]
+    for index in range(tokens):
+        chunk = {
+            "id": "chatcmpl-recorded", "object": "chat.completion.chunk", "created": 1700000000, "model": "gpt-4o",
+            "choices": [{"index": 0, "delta": {"content": rng.choice(words)}, "logprobs": None, "finish_reason": None}],
+        }
+        lines.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+def make_client(payload: bytes):
+    async def body():
+        for start in range(0, len(payload), NETWORK_CHUNK):
+            yield payload[start:start + NETWORK_CHUNK]
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body())
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+async def legacy_fetch(client, url, headers, payload, timeout):
+    timestamp = int(time.time())
+    async with client.stream('POST', url, headers=headers, content=json.dumps(payload), timeout=timeout) as response:
+        buffer = ""
+        async for chunk in response.aiter_text():
+            buffer += chunk
+            while "\n" in buffer:
+                line, buffer = buffer.split("\n", 1)
+                if line.startswith(": keepalive"):
+                    yield line + end_of_line
+                    continue
+                if line and not line.startswith(":") and (result := line.lstrip("data: ").strip()):
+                    if result == "[DONE]":
+                        break
+                    line = await asyncio.to_thread(json.loads, result)
+                    random.seed(timestamp)
+                    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=29))
+                    line['id'] = f"chatcmpl-{random_str}"
+                    json_line = await asyncio.to_thread(json.dumps, line)
+                    yield "data: " + json_line.strip() + end_of_line
+
+async def measure(fetch, payload):
+    async with make_client(payload) as client:
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        events = 0
+        async for chunk in fetch(client, "http://mock/v1/chat/completions", {}, {"model": "gpt-4o"}, 30):
+            # 与原实现一样输出 SSE 文本
+            encode_sse(chunk)
+            events += 1
+        return events, time.perf_counter() - started_wall, time.process_time() - started_cpu
+
+def main():
+    payload = recorded_stream()
+    print(f"stream: {TOKENS} tokens, {len(payload) / 1024 / 1024:.1f} MB, {NETWORK_CHUNK} byte chunks")
+    for name, fetch in [("legacy (aiter_text + to_thread)", legacy_fetch), ("incremental decoder", fetch_gpt_response_stream)]:
+        events, wall, cpu = asyncio.run(measure(fetch, payload))
+        print(f"{name:34s} events={events} wall={wall:.2f}s cpu={cpu:.2f}s cpu/token={cpu / TOKENS * 1e6:.1f}us")
+
+if __name__ == "__main__":
+    main()
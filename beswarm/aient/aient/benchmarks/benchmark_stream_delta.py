@@ -0,0 +1,54 @@
+import json
+import time
+import asyncio
+
+from ..core.response import fetch_claude_response_stream, fetch_gpt_response_stream
+from ..core.utils import encode_sse
+from ..models.chatgpt import chatgpt
+from .benchmark_sse import recorded_stream, make_client, NETWORK_CHUNK
+
+"""
+基准测试: 对比 fetcher 直接产出 ChatDelta 与先编码成 SSE 文本再由 chatgpt 解析两种方式，
+从网络字节到 chatgpt 输出文本的每 token CPU 时间。
+
+"SSE 文本" 一列在 fetcher 和 chatgpt 之间插入 encode_sse，复现原来每个 token 编码、解析两次的路径。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_stream_delta
+"""
+
+TOKENS = 100_000
+
+def recorded_claude_stream(tokens=TOKENS):
+    words = ["数据", "分析", " the", " model", " token", "，", "。", " stream", "结果", "\n"]
+    events = [{"type": "message_start", "message": {"usage": {"input_tokens": 100, "output_tokens": 0}}}]
+    events.append({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+    for index in range(tokens):
+        events.append({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": words[index % len(words)]}})
+    events.append({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": tokens}})
+    return "".join(f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events).encode("utf-8")
+
+async def measure(fetch, payload, encode):
+    bot = chatgpt(api_key="test", engine="gpt-4o", use_plugins=False)
+    async with make_client(payload) as client:
+        async def generator():
+            async for chunk in fetch(client):
+                yield encode_sse(chunk) if encode else chunk
+
+        started = time.process_time()
+        async for _ in bot._process_stream_response(generator(), is_async=True):
+            pass
+        return time.process_time() - started
+
+def main():
+    streams = [
+        ("claude", recorded_claude_stream(), lambda client: fetch_claude_response_stream(client, "http://mock/v1/messages", {}, {}, "claude", 30)),
+        ("gpt", recorded_stream(TOKENS), lambda client: fetch_gpt_response_stream(client, "http://mock/v1/chat/completions", {}, {"model": "gpt-4o"}, 30)),
+    ]
+    print(f"{TOKENS} tokens per stream, {NETWORK_CHUNK} byte chunks, CPU per token")
+    for name, payload, fetch in streams:
+        encoded = asyncio.run(measure(fetch, payload, encode=True))
+        typed = asyncio.run(measure(fetch, payload, encode=False))
+        print(f"{name:7s} SSE text {encoded / TOKENS * 1e6:5.1f}us  ChatDelta {typed / TOKENS * 1e6:5.1f}us  ({encoded / typed:.1f}x)")
+
+if __name__ == "__main__":
+    main()
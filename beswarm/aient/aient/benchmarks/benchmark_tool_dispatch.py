@@ -0,0 +1,62 @@
+import copy
+import time
+import inspect
+
+from ..plugins import config
+from ..plugins.registry import registry
+
+"""
+基准测试: 每次工具调用的参数检查开销，以及每个智能体初始化工具配置的开销。
+
+旧实现每次调用都对函数做 inspect.signature 并在参数名列表中线性查找；
+每个智能体构造时深拷贝 PLUGINS 和 function_call_list，再重新生成全部工具 schema。
+这里在 legacy_* 中复现它们作为基线。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_tool_dispatch
+"""
+
+CALLS = 20000
+AGENTS = 200
+TOOL = "read_file" if "read_file" in registry.tools else "list_directory"
+ARGUMENTS = {"file_path": "README.md", "head": "20"} if TOOL == "read_file" else {"path": "."}
+
+def legacy_check(func, info, arguments):
+    invalid = [name for name in arguments.keys() if name not in info.args]
+    missing = [
+        param.name
+        for param in inspect.signature(func).parameters.values()
+        if param.default is inspect.Parameter.empty and param.name not in arguments
+    ]
+    return invalid, missing, arguments
+
+def binder_check(binder, arguments):
+    return binder.invalid(arguments), binder.missing(arguments), binder.bind(arguments)
+
+def legacy_agent_setup():
+    plugins = copy.deepcopy(config.PLUGINS)
+    function_call_list = copy.deepcopy(config.function_call_list)
+    plugins = config.get_plugins()
+    function_call_list = {name: copy.deepcopy(config.function_to_json(func)) for name, func in registry.tools.items()}
+    claude_tools_list = {name: config.gpt2claude_tools_json(schema) for name, schema in function_call_list.items()}
+    return plugins, function_call_list, claude_tools_list
+
+def timed(label, count, fn):
+    started = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:28s} {elapsed / count * 1e6:9.2f}us")
+
+def main():
+    func = registry.resolve(TOOL)
+    info = registry.tools_info[TOOL]
+    binder = registry.binder(TOOL)
+    config.update_tools_config()
+    print(f"tool {TOOL}, {len(registry.tools)} registered tools")
+    timed("per call: signature scan", CALLS, lambda: legacy_check(func, info, ARGUMENTS))
+    timed("per call: binder", CALLS, lambda: binder_check(binder, ARGUMENTS))
+    timed("per agent: deepcopy setup", AGENTS, legacy_agent_setup)
+    timed("per agent: shared setup", AGENTS, config.update_tools_config)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import time
+import asyncio
+
+from ..plugins.executor import BlockingToolRunner
+
+"""
+基准测试: 8 个智能体同时调用耗时 200ms 的同步工具，同时有一个 10ms 心跳的流在运行。
+
+对比在事件循环上直接调用（原实现）与放进线程池执行的总耗时和心跳最大延迟。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_tool_runner
+"""
+
+AGENTS = 8
+CALLS_PER_AGENT = 3
+TOOL_SECONDS = 0.2
+INTERVAL = 0.01
+
+def blocking_tool(seconds: float):
+    time.sleep(seconds)
+    return "ok"
+
+async def heartbeat(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    gaps = []
+    last = loop.time()
+    while not stop.is_set():
+        await asyncio.sleep(INTERVAL)
+        now = loop.time()
+        gaps.append(now - last - INTERVAL)
+        last = now
+    return gaps
+
+async def measure(call):
+    stop = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(stop))
+
+    async def agent():
+        for _ in range(CALLS_PER_AGENT):
+            await call()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[agent() for _ in range(AGENTS)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    gaps = sorted(await beat)
+    return elapsed, gaps[int(len(gaps) * 0.99) - 1] if gaps else 0.0, gaps[-1] if gaps else 0.0
+
+async def inline_call():
+    return blocking_tool(TOOL_SECONDS)
+
+def main():
+    runner = BlockingToolRunner(io_workers=AGENTS, monitor_loop_lag=False)
+    print(f"{AGENTS} agents x {CALLS_PER_AGENT} calls of a {TOOL_SECONDS * 1000:.0f}ms sync tool")
+    for label, call in [
+        ("on event loop", inline_call),
+        ("thread pool  ", lambda: runner.call("blocking_tool", blocking_tool, {"seconds": TOOL_SECONDS})),
+    ]:
+        elapsed, p99, worst = asyncio.run(measure(call))
+        print(f"{label}  total {elapsed:5.2f}s  heartbeat lag p99 {p99 * 1000:7.1f}ms  max {worst * 1000:7.1f}ms")
+    runner.shutdown()
+
+if __name__ == "__main__":
+    main()
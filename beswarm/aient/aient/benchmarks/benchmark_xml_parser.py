@@ -0,0 +1,60 @@
+import json
+import time
+
+from ..utils.scripts import XmlMatcher, XmlMatcherResult, StreamingToolCallParser, parse_function_xml, parse_continuous_json
+from ..core.test.test_xml_parser import (
+    LegacyXmlMatcher,
+    LegacyStreamingToolCallParser,
+    legacy_parse_function_xml,
+    legacy_parse_continuous_json,
+    tool_call_payload,
+)
+
+"""
+基准测试: 1 MB 的 write_to_file 工具调用，对比改写前后的解析耗时。
+
+- XmlMatcher: 一次性输入整个响应；
+- StreamingToolCallParser: 按 50 个字符的片段流式输入；
+- parse_function_xml: 解析完整响应，以及 20000 行未闭合的 <br> 之后的一个工具调用；
+- parse_continuous_json: 两个连续的 1 MB JSON 参数对象。
+
+python -m beswarm.aient.aient.benchmarks.benchmark_xml_parser
+"""
+
+CHUNK = 50
+
+def stream(parser_class, text):
+    parser = parser_class(["write_to_file"])
+    calls = []
+    for pos in range(0, len(text), CHUNK):
+        calls.extend(parser.feed(text[pos:pos + CHUNK]))
+    return calls
+
+def as_plain(results):
+    return [(r.matched, r.data) if isinstance(r, XmlMatcherResult) else r for r in results]
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+def main():
+    text, body = tool_call_payload(1 << 20)
+    arguments = json.dumps({"path": "paper.tex", "content": body})
+    unclosed = "<br>\n" * 20000 + "x" * 200000 + "\n<read_file>\n<path>a.py</path>\n</read_file>\n"
+    cases = [
+        ("XmlMatcher", lambda matcher: matcher("write_to_file").final(text), XmlMatcher, LegacyXmlMatcher),
+        ("StreamingToolCallParser", lambda parser: stream(parser, text), StreamingToolCallParser, LegacyStreamingToolCallParser),
+        ("parse_function_xml", lambda parse: parse(text), parse_function_xml, legacy_parse_function_xml),
+        ("parse_function_xml (未闭合标签)", lambda parse: parse(unclosed), parse_function_xml, legacy_parse_function_xml),
+        ("parse_continuous_json", lambda parse: parse(arguments + arguments, "write_to_file"), parse_continuous_json, legacy_parse_continuous_json),
+    ]
+    print(f"响应 {len(text)} 字符，流式片段 {CHUNK} 字符")
+    for name, run, new, old in cases:
+        old_time, old_result = timed(run, old)
+        new_time, new_result = timed(run, new)
+        assert as_plain(new_result) == as_plain(old_result), name
+        print(f"{name:<32} 原实现 {old_time * 1000:9.1f} ms  新实现 {new_time * 1000:8.1f} ms  {old_time / new_time:7.1f}x")
+
+if __name__ == "__main__":
+    main()
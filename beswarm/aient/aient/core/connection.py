@@ -0,0 +1,289 @@
+import os
+import ssl
+import socket
+import asyncio
+import ipaddress
+import threading
+import importlib.util
+import urllib.request
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+import httpcore
+
+from .log_config import logger
+
+"""
+进程级 HTTP 连接管理。
+
+同一个事件循环里，所有 BaseLLM 实例和工具按 (源站, 代理) 共享一个 httpx.AsyncClient，
+连接池和 keepalive 上限可配置，安装了 h2 时启用 HTTP/2 多路复用。
+httpx 的连接绑定在创建它的事件循环上，run_paper_job 每个任务一次 asyncio.run，
+所以连接池按事件循环划分；跨事件循环共享的是 SSL 上下文（加载证书链本身就要十几毫秒）、
+DNS 缓存和统计数据。
+
+配置来自环境变量：
+    OCEANS_HTTP_MAX_CONNECTIONS     每个源站的最大连接数，默认 100
+    OCEANS_HTTP_MAX_KEEPALIVE       保持的空闲连接数，默认 20
+    OCEANS_HTTP_KEEPALIVE_EXPIRY    空闲连接保持的秒数，默认 60
+    OCEANS_HTTP_CONNECT_TIMEOUT     建立连接的超时秒数，默认 10
+    OCEANS_HTTP2                    设为 0 关闭 HTTP/2
+    OCEANS_DNS_TTL                  DNS 缓存秒数，默认 300，设为 0 关闭
+"""
+
+def _env_number(name: str, default, cast=float):
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Invalid value for {name}: {value!r}, using {default}")
+        return default
+
+@dataclass
+class PoolConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    connect_timeout: float = 10.0
+    http2: bool = True
+    dns_ttl: float = 300.0
+
+    @classmethod
+    def from_env(cls) -> "PoolConfig":
+        return cls(
+            max_connections=_env_number("OCEANS_HTTP_MAX_CONNECTIONS", cls.max_connections, int),
+            max_keepalive_connections=_env_number("OCEANS_HTTP_MAX_KEEPALIVE", cls.max_keepalive_connections, int),
+            keepalive_expiry=_env_number("OCEANS_HTTP_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            connect_timeout=_env_number("OCEANS_HTTP_CONNECT_TIMEOUT", cls.connect_timeout),
+            http2=os.environ.get("OCEANS_HTTP2", "1").strip().lower() not in ("0", "false", "no", "off"),
+            dns_ttl=_env_number("OCEANS_DNS_TTL", cls.dns_ttl),
+        )
+
+@dataclass
+class ConnectionStats:
+    requests: int = 0
+    # 新建的 TCP 连接数，每个连接对应一次 TCP（以及 TLS）握手
+    connections: int = 0
+    http2_responses: int = 0
+    dns_lookups: int = 0
+    dns_hits: int = 0
+
+    @property
+    def reused(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.reused / self.requests if self.requests else 0.0
+
+class DNSCache:
+    """按 (主机, 端口) 缓存解析结果。多个地址轮流使用，连接失败的地址会被移除。"""
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_ip(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
+
+    async def resolve(self, host: str, port: int, stats: Optional[ConnectionStats] = None) -> str:
+        if self.ttl <= 0 or self._is_ip(host):
+            return host
+        loop = asyncio.get_running_loop()
+        key = (host, port)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > loop.time() and entry[1]:
+                addresses = entry[1]
+                addresses.append(addresses.pop(0))
+                if stats:
+                    stats.dns_hits += 1
+                return addresses[-1]
+
+        if stats:
+            stats.dns_lookups += 1
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        if not addresses:
+            return host
+        with self._lock:
+            self._entries[key] = (loop.time() + self.ttl, addresses)
+        return addresses[0]
+
+    def invalidate(self, host: str, port: int, address: Optional[str] = None):
+        with self._lock:
+            if address is None:
+                self._entries.pop((host, port), None)
+                return
+            entry = self._entries.get((host, port))
+            if entry and address in entry[1]:
+                entry[1].remove(address)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class _CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """在建立 TCP 连接前查询 DNS 缓存，并统计新建连接数。TLS 的 SNI 和证书校验仍然使用原始主机名。"""
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, dns: DNSCache, stats: ConnectionStats):
+        self._backend = backend
+        self._dns = dns
+        self._stats = stats
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self._stats.connections += 1
+        try:
+            address = await self._dns.resolve(host, port, self._stats)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+        try:
+            return await self._backend.connect_tcp(address, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+        except (httpcore.ConnectError, httpcore.ConnectTimeout):
+            if address == host:
+                raise
+            # 缓存的地址不可用，移除后直接用主机名再试一次
+            self._dns.invalidate(host, port, address)
+            return await self._backend.connect_tcp(host, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: ConnectionStats, dns: DNSCache, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+        pool = getattr(self, "_pool", None)
+        backend = getattr(pool, "_network_backend", None)
+        if backend is not None:
+            pool._network_backend = _CachingNetworkBackend(backend, dns, stats)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.requests += 1
+        response = await super().handle_async_request(request)
+        if response.extensions.get("http_version") == b"HTTP/2":
+            self._stats.http2_responses += 1
+        return response
+
+def _origin(url: str) -> str:
+    parsed = urlparse(str(url))
+    if not parsed.scheme or not parsed.netloc:
+        raise ValueError(f"Invalid URL: {url}")
+    return f"{parsed.scheme}://{parsed.netloc}".lower()
+
+def _environment_proxy(origin: str) -> Optional[str]:
+    parsed = urlparse(origin)
+    if urllib.request.proxy_bypass(parsed.hostname or ""):
+        return None
+    proxies = urllib.request.getproxies()
+    return proxies.get(parsed.scheme) or proxies.get("all")
+
+class ConnectionManager:
+    """
+    按 (事件循环, 源站, 代理) 缓存 httpx.AsyncClient。
+
+    共享的客户端不要在调用方关闭；不同调用方的超时通过请求参数传入（fetch_* 都是这样做的），
+    客户端上的 timeout 只是默认值。
+    """
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig.from_env()
+        self.dns = DNSCache(self.config.dns_ttl)
+        self.stats: Dict[str, ConnectionStats] = {}
+        self._clients: Dict[asyncio.AbstractEventLoop, Dict[Tuple[str, Optional[str]], httpx.AsyncClient]] = {}
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._lock = threading.Lock()
+        self.http2 = self.config.http2 and importlib.util.find_spec("h2") is not None
+        if self.config.http2 and not self.http2:
+            logger.debug("h2 is not installed, HTTP/2 is disabled. Install httpx[http2] to enable it.")
+
+    def ssl_context(self) -> ssl.SSLContext:
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = httpx.create_ssl_context()
+            return self._ssl_context
+
+    def get_client(
+        self,
+        url: str,
+        proxy: Optional[str] = None,
+        timeout: Optional[float] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> httpx.AsyncClient:
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        origin = _origin(url)
+        key = (origin, proxy)
+        with self._lock:
+            clients = self._clients.get(loop)
+            if clients is None:
+                # 事件循环结束后，绑定在上面的连接已经不可用
+                for closed in [other for other in self._clients if other.is_closed()]:
+                    del self._clients[closed]
+                clients = self._clients[loop] = {}
+            client = clients.get(key)
+        if client is not None and not client.is_closed:
+            return client
+
+        client = self._create_client(origin, proxy, timeout)
+        with self._lock:
+            clients[key] = client
+        return client
+
+    def _create_client(self, origin: str, proxy: Optional[str], timeout: Optional[float]) -> httpx.AsyncClient:
+        config = self.config
+        with self._lock:
+            stats = self.stats.setdefault(origin, ConnectionStats())
+        transport = _CountingTransport(
+            stats,
+            self.dns,
+            verify=self.ssl_context(),
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            proxy=proxy or _environment_proxy(origin),
+        )
+        return httpx.AsyncClient(
+            transport=transport,
+            follow_redirects=True,
+            timeout=httpx.Timeout(timeout or 600, connect=config.connect_timeout),
+        )
+
+    def connection_stats(self) -> Dict[str, ConnectionStats]:
+        with self._lock:
+            return {origin: ConnectionStats(**vars(stats)) for origin, stats in self.stats.items()}
+
+    def log_stats(self):
+        for origin, stats in self.connection_stats().items():
+            logger.info(
+                f"{origin}: {stats.requests} requests over {stats.connections} connections "
+                f"(reuse {stats.reuse_ratio:.0%}, http/2 {stats.http2_responses}, "
+                f"dns {stats.dns_lookups} lookups / {stats.dns_hits} hits)"
+            )
+
+_manager: Optional[ConnectionManager] = None
+_manager_lock = threading.Lock()
+
+def get_connection_manager() -> ConnectionManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ConnectionManager()
+        return _manager
+
+def get_async_client(url: str, proxy: Optional[str] = None, timeout: Optional[float] = None, loop=None) -> httpx.AsyncClient:
+    """返回当前事件循环中 url 所在源站的共享客户端。"""
+    return get_connection_manager().get_client(url, proxy=proxy, timeout=timeout, loop=loop)
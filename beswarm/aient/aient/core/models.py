@@ -41,6 +41,7 @@ class ContentItem(BaseModel):
     type: str
     text: Optional[str] = None
     image_url: Optional[ImageUrl] = None
+    cache_control: Optional[Dict[str, Any]] = None
 
 class Message(BaseModel):
     role: str
@@ -0,0 +1,264 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+"""
+进程内共享的常驻进程池，用于 pdfminer 解析 PDF、tree-sitter 提取符号、difflib 模糊匹配这类
+长时间持有 GIL 的纯 Python 计算。
+
+- 使用 forkserver 启动子进程，子进程启动时预先导入 preload 中的模块，第一次调用不必再付导入开销；
+- 每个子进程执行 max_tasks_per_child 个任务后由新进程替换，避免解析器的内存碎片和缓存无限增长；
+- 可选的地址空间上限（RLIMIT_AS），超出时任务在子进程里得到 MemoryError，不会拖垮主进程；
+- 子进程报告的常驻内存超过 recycle_rss_mb 时，整个进程池在当前任务完成后被替换。
+
+提交的函数和参数必须可以 pickle（模块级函数）。在子进程内再次提交、进程池被禁用
+（OCEANS_PROCESS_POOL=0 或打包后的应用）或进程池崩溃时，任务直接在当前进程执行。
+与 multiprocessing 的要求相同，子进程会重新导入主脚本，脚本入口需要放在 if __name__ == "__main__" 下；
+主脚本来自标准输入等无法重新导入的来源时，同样在当前进程执行。
+"""
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRELOAD = ("pdfminer.high_level", "difflib")
+
+_in_worker = False
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+def _current_rss() -> int:
+    """当前进程的常驻内存（字节），无法获取时返回 0。"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # macOS 上 ru_maxrss 的单位是字节，Linux 上是 KB；这里拿到的是峰值
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except (ImportError, OSError):
+        return 0
+
+def _main_importable() -> bool:
+    """子进程需要能重新导入主模块：-c、-m 和交互模式没有问题，从标准输入读取的脚本不行。"""
+    main = sys.modules.get("__main__")
+    path = getattr(main, "__file__", None)
+    if path is None or getattr(getattr(main, "__spec__", None), "name", None):
+        return True
+    return os.path.isfile(path)
+
+def _init_worker(preload: Sequence[str], memory_limit_mb: Optional[int]):
+    global _in_worker
+    _in_worker = True
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+def _run_task(fn: Callable, args: tuple, kwargs: dict):
+    """子进程中执行任务，同时返回执行后的常驻内存，供主进程决定是否回收进程池。"""
+    return fn(*args, **kwargs), _current_rss()
+
+def _ping():
+    return os.getpid()
+
+class ProcessPoolService:
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_tasks_per_child: Optional[int] = 100,
+        memory_limit_mb: Optional[int] = None,
+        recycle_rss_mb: Optional[int] = 1024,
+        preload: Iterable[str] = DEFAULT_PRELOAD,
+        enabled: bool = True,
+    ):
+        self.max_workers = max_workers or max(1, min(4, os.cpu_count() or 1))
+        self.max_tasks_per_child = max_tasks_per_child
+        self.memory_limit_mb = memory_limit_mb
+        self.recycle_rss_mb = recycle_rss_mb
+        self.preload = tuple(preload)
+        self.enabled = enabled and not getattr(sys, "frozen", False)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0
+        self.recycled = 0
+        self.peak_worker_rss = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        methods = multiprocessing.get_all_start_methods()
+        # fork 会复制父进程的线程和锁；max_tasks_per_child 也要求非 fork 的启动方式
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.preload, self.memory_limit_mb),
+            max_tasks_per_child=self.max_tasks_per_child,
+        )
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            return self._executor
+
+    def warm(self) -> List[int]:
+        """提前启动全部子进程并完成预导入，返回子进程的 pid。"""
+        if not self.available:
+            return []
+        executor = self.executor()
+        return sorted({future.result() for future in [executor.submit(_ping) for _ in range(self.max_workers)]})
+
+    @property
+    def available(self) -> bool:
+        return self.enabled and not _in_worker and _main_importable()
+
+    def _retire(self, executor: ProcessPoolExecutor):
+        """替换进程池。旧进程池中已提交的任务会继续完成。"""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        self.recycled += 1
+        executor.shutdown(wait=False)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """提交任务，返回 concurrent.futures.Future。进程池不可用时在当前线程执行。"""
+        result = Future()
+        if not self.available:
+            self.inline += 1
+            try:
+                result.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                result.set_exception(e)
+            return result
+
+        executor = self.executor()
+        self.submitted += 1
+        started = time.monotonic()
+        try:
+            inner = executor.submit(_run_task, fn, args, kwargs)
+        except (BrokenProcessPool, RuntimeError):
+            # 进程池已损坏或正在关闭，换一个新的再提交
+            self._retire(executor)
+            executor = self.executor()
+            inner = executor.submit(_run_task, fn, args, kwargs)
+
+        def done(inner: Future):
+            if inner.cancelled():
+                result.cancel()
+                return
+            error = inner.exception()
+            if error is None:
+                value, rss = inner.result()
+                self.completed += 1
+                self.peak_worker_rss = max(self.peak_worker_rss, rss)
+                if self.recycle_rss_mb and rss > self.recycle_rss_mb * 1024 * 1024:
+                    logger.info(f"Recycling process pool, worker RSS {rss / 2 ** 20:.0f}MB after {time.monotonic() - started:.1f}s task")
+                    self._retire(executor)
+                result.set_result(value)
+                return
+            self.failed += 1
+            if isinstance(error, BrokenProcessPool):
+                # 子进程异常退出（例如被 OOM killer 杀死），之后的任务使用新的进程池
+                self._retire(executor)
+            result.set_exception(error)
+
+        result.set_running_or_notify_cancel()
+        inner.add_done_callback(done)
+        return result
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """同步执行任务并等待结果。供线程池中的同步工具调用，等待期间不持有 GIL。"""
+        try:
+            return self.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool:
+            logger.warning(f"Process pool broke while running {getattr(fn, '__qualname__', fn)}, running it in-process")
+            self.inline += 1
+            return fn(*args, **kwargs)
+
+    async def run_async(self, fn: Callable, *args, **kwargs) -> Any:
+        if not self.available:
+            self.inline += 1
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+        except BrokenProcessPool:
+            logger.warning(f"Process pool broke while running {getattr(fn, '__qualname__', fn)}, running it in a thread")
+            self.inline += 1
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    def map(self, fn: Callable, *iterables: Iterable) -> List[Any]:
+        """并行执行 fn，结果按输入顺序返回。"""
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.available,
+            "max_workers": self.max_workers,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "memory_limit_mb": self.memory_limit_mb,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "inline": self.inline,
+            "recycled": self.recycled,
+            "peak_worker_rss": self.peak_worker_rss,
+        }
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+_process_pool: Optional[ProcessPoolService] = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolService:
+    """
+    返回进程内共享的进程池。
+
+    环境变量：OCEANS_PROCESS_POOL=0 关闭进程池；OCEANS_PROCESS_WORKERS 子进程数量；
+    OCEANS_WORKER_MAX_TASKS 每个子进程执行多少个任务后替换；
+    OCEANS_WORKER_MEMORY_MB 子进程地址空间上限；OCEANS_WORKER_RECYCLE_MB 触发回收的常驻内存。
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolService(
+                max_workers=_env_int("OCEANS_PROCESS_WORKERS", None),
+                max_tasks_per_child=_env_int("OCEANS_WORKER_MAX_TASKS", 100) or None,
+                memory_limit_mb=_env_int("OCEANS_WORKER_MEMORY_MB", None),
+                recycle_rss_mb=_env_int("OCEANS_WORKER_RECYCLE_MB", 1024) or None,
+                enabled=os.environ.get("OCEANS_PROCESS_POOL", "1").strip().lower() not in {"0", "false", "no", "off"},
+            )
+        return _process_pool
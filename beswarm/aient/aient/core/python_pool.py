@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import select
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from ..utils.scripts import sandbox
+
+"""
+run_python_script 的预热解释器池。
+
+原来每次执行代码片段都要启动一个新的 Python 进程，numpy / pandas / matplotlib 这类库每次都要重新导入。
+这里维护若干常驻的解释器进程（python_worker.py），启动时预先导入 preload 中的模块，
+每个片段在新的命名空间中执行，片段之间不共享变量。
+
+- 解释器通过 sandbox.Popen 启动，沙箱启用时同样注入文件访问限制；每个解释器在自己的进程组中运行；
+- 解释器执行 max_runs 个片段后，或执行后常驻内存超过 recycle_rss_mb 时被替换，
+  替换用的新解释器在后台线程中启动并完成预导入，下一次调用不必等待；
+- 片段超时时结束整个进程组，解释器随之丢弃。
+
+模块级状态（已导入模块中的全局变量、片段启动的线程）仍然会留在解释器中，直到它被替换。
+"""
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+DEFAULT_PRELOAD = ("numpy", "pandas", "matplotlib", "matplotlib.pyplot")
+# 单个片段最多返回的 stdout / stderr 字节数
+MAX_OUTPUT = 1 << 20
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+@dataclass
+class ExecutionResult:
+    stdout: str
+    stderr: str
+    returncode: int
+    duration: float
+    worker_pid: int
+    # 是否由已经执行过片段或预先启动的解释器执行
+    warm: bool
+
+class PythonWorker:
+    """一个常驻解释器。方法都是阻塞的，由 PythonWorkerPool 在线程中调用。"""
+    def __init__(self, python: str = "python", preload: Sequence[str] = DEFAULT_PRELOAD, startup_timeout: float = 60):
+        env = dict(os.environ)
+        # 没有显示器的环境中 matplotlib 默认后端可能无法导入
+        env.setdefault("MPLBACKEND", "Agg")
+        self.process = sandbox.Popen(
+            [python, "-u", WORKER_SCRIPT, *preload],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=hasattr(os, "killpg"),
+            env=env,
+        )
+        self.runs = 0
+        self.rss = 0
+        self.started = time.monotonic()
+        try:
+            ready = self._read(startup_timeout)
+        except BaseException:
+            self.kill()
+            raise
+        self.pid = ready.get("pid", self.process.pid)
+        self.preloaded: List[str] = ready.get("preloaded", [])
+        self.rss = ready.get("rss", 0)
+
+    def _read(self, timeout: Optional[float]) -> Dict[str, Any]:
+        stdout = self.process.stdout
+        if timeout is not None and hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(stdout, select.POLLIN | select.POLLHUP)
+            if not poller.poll(max(0.0, timeout) * 1000):
+                raise TimeoutError
+        line = stdout.readline()
+        if not line:
+            raise RuntimeError(f"Python worker exited with code {self.process.wait()}")
+        return json.loads(line)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def execute(self, code: str, cwd: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """执行一个片段。超时抛出 TimeoutError，解释器被结束。"""
+        request = json.dumps({"code": code, "cwd": cwd or os.getcwd(), "max_output": MAX_OUTPUT})
+        try:
+            self.process.stdin.write(request.encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+            reply = self._read(timeout)
+        except BaseException:
+            self.kill()
+            raise
+        self.runs += 1
+        self.rss = reply.get("rss", 0)
+        return reply
+
+    def close(self):
+        """关闭标准输入，解释器读到 EOF 后自行退出；短时间内没有退出则结束进程组。"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+            self.process.stdout.close()
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except (ProcessLookupError, PermissionError, OSError):
+            pass
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+class PythonWorkerPool:
+    """
+    size: 解释器数量上限，也是同时执行的片段数上限；max_runs: 每个解释器执行多少个片段后替换；
+    recycle_rss_mb: 执行后常驻内存超过该值时替换；enabled 为 False 时每个片段使用新的解释器，执行后立即关闭。
+    """
+    def __init__(
+        self,
+        size: int = 2,
+        max_runs: int = 50,
+        recycle_rss_mb: Optional[int] = 1024,
+        preload: Sequence[str] = DEFAULT_PRELOAD,
+        python: str = "python",
+        enabled: bool = True,
+    ):
+        self.size = max(1, size)
+        self.max_runs = max_runs if enabled else 1
+        self.recycle_rss_mb = recycle_rss_mb
+        self.preload = tuple(preload)
+        self.python = python
+        self.enabled = enabled
+        self._idle: List[PythonWorker] = []
+        self._workers = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+        self.runs = 0
+        self.cold_starts = 0
+        self.recycled = 0
+        self.timeouts = 0
+
+    def _spawn(self) -> PythonWorker:
+        worker = PythonWorker(self.python, self.preload)
+        with self._lock:
+            self._workers += 1
+            self.cold_starts += 1
+        return worker
+
+    def _discard(self, worker: PythonWorker, close: bool = True):
+        with self._lock:
+            self._workers -= 1
+        if close:
+            worker.close()
+
+    def _replenish(self) -> bool:
+        """启动一个解释器放入空闲列表，失败时等下一次调用再启动。"""
+        try:
+            worker = self._spawn()
+        except Exception as e:
+            logger.warning(f"Failed to prestart Python worker: {e}")
+            return False
+        with self._lock:
+            if not self._closed and self._workers <= self.size:
+                self._idle.append(worker)
+                return True
+        self._discard(worker)
+        return False
+
+    def warm(self, count: Optional[int] = None):
+        """启动解释器直到空闲解释器达到 count 个（默认 size 个），阻塞到它们完成预导入。"""
+        if not self.enabled:
+            return
+        count = self.size if count is None else min(count, self.size)
+        while True:
+            with self._lock:
+                if len(self._idle) >= count or self._workers >= self.size:
+                    return
+            if not self._replenish():
+                return
+
+    def _needs_recycle(self, worker: PythonWorker) -> bool:
+        if worker.runs >= self.max_runs:
+            return True
+        return bool(self.recycle_rss_mb) and worker.rss > self.recycle_rss_mb * 1024 * 1024
+
+    def run(self, code: str, cwd: Optional[str] = None, timeout: Optional[float] = None) -> ExecutionResult:
+        """执行一个片段并等待结果。超时抛出 TimeoutError。"""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            warm = worker is not None
+            if worker is not None and not worker.alive():
+                self._discard(worker, close=False)
+                worker.kill()
+                worker, warm = None, False
+            if worker is None:
+                worker = self._spawn()
+            try:
+                reply = worker.execute(code, cwd=cwd, timeout=timeout)
+            except TimeoutError:
+                self.timeouts += 1
+                self._discard(worker, close=False)
+                if self.enabled:
+                    threading.Thread(target=self._replenish, daemon=True).start()
+                raise
+            except BaseException:
+                self._discard(worker, close=False)
+                raise
+            self.runs += 1
+            if self._needs_recycle(worker):
+                self._discard(worker)
+                if self.enabled:
+                    self.recycled += 1
+                    threading.Thread(target=self._replenish, daemon=True).start()
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+            return ExecutionResult(
+                stdout=reply["stdout"],
+                stderr=reply["stderr"],
+                returncode=reply["returncode"],
+                duration=reply["duration"],
+                worker_pid=worker.pid,
+                warm=warm,
+            )
+        finally:
+            self._slots.release()
+
+    async def run_async(self, code: str, cwd: Optional[str] = None, timeout: Optional[float] = None) -> ExecutionResult:
+        return await asyncio.to_thread(self.run, code, cwd, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            idle = len(self._idle)
+            workers = self._workers
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "workers": workers,
+            "idle": idle,
+            "runs": self.runs,
+            "cold_starts": self.cold_starts,
+            "recycled": self.recycled,
+            "timeouts": self.timeouts,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            self._discard(worker)
+
+_python_pool: Optional[PythonWorkerPool] = None
+_python_pool_lock = threading.Lock()
+
+def get_python_pool() -> PythonWorkerPool:
+    """
+    返回进程内共享的解释器池。
+
+    环境变量：OCEANS_PYTHON_POOL=0 关闭预热，每个片段使用新的解释器；OCEANS_PYTHON_WORKERS 解释器数量（默认 2）；
+    OCEANS_PYTHON_WORKER_MAX_RUNS 每个解释器执行的片段数（默认 50）；OCEANS_PYTHON_WORKER_RECYCLE_MB 触发替换的常驻内存（默认 1024）；
+    OCEANS_PYTHON_PRELOAD 逗号分隔的预导入模块。
+    """
+    global _python_pool
+    with _python_pool_lock:
+        if _python_pool is None:
+            preload = os.environ.get("OCEANS_PYTHON_PRELOAD")
+            _python_pool = PythonWorkerPool(
+                size=_env_int("OCEANS_PYTHON_WORKERS", 2),
+                max_runs=max(1, _env_int("OCEANS_PYTHON_WORKER_MAX_RUNS", 50)),
+                recycle_rss_mb=_env_int("OCEANS_PYTHON_WORKER_RECYCLE_MB", 1024) or None,
+                preload=DEFAULT_PRELOAD if preload is None else [m.strip() for m in preload.split(",") if m.strip()],
+                enabled=os.environ.get("OCEANS_PYTHON_POOL", "1").strip().lower() not in {"0", "false", "no", "off"},
+            )
+        return _python_pool
@@ -0,0 +1,133 @@
+import os
+import io
+import sys
+import ast
+import json
+import time
+import builtins
+import tempfile
+import traceback
+import importlib
+
+"""
+run_python_script 使用的常驻 Python 解释器，由 python_pool.PythonWorker 以脚本方式启动，只依赖标准库。
+
+启动时导入命令行参数中列出的模块（不存在的模块跳过），之后每个代码片段在全新的命名空间中执行，
+已导入的模块留在 sys.modules 中，后续片段不必重复导入。
+
+协议：原标准输入每行一个 JSON 请求 {"code": ..., "cwd": ..., "max_output": ...}；
+回复写到原标准输出，每行一个 JSON。执行期间文件描述符 1、2 被重定向到临时文件，
+C 扩展直接写入的输出也会被收集；标准输入替换为空，代码中的 input() 不会读到协议数据。
+"""
+
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except (ImportError, OSError):
+        return 0
+
+def _execute(code: str):
+    """执行代码；最后一条语句是表达式且值不为 None 时输出它的 repr。"""
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    tree = ast.parse(code, "<code>")
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(tree.body.pop().value)
+    exec(compile(tree, "<code>", "exec"), namespace)
+    if last is not None:
+        result = eval(compile(last, "<code>", "eval"), namespace)
+        if result is not None:
+            print("\nResult:", repr(result))
+
+def _read_output(f, limit: int) -> str:
+    """读取临时文件中的输出，超过 limit 字节时保留开头和结尾。"""
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    if size <= limit:
+        return f.read().decode(errors="replace")
+    head = f.read(limit // 2).decode(errors="replace")
+    f.seek(size - limit // 2)
+    tail = f.read().decode(errors="replace")
+    return f"{head}\n... (省略 {size - limit} 字节输出) ...\n{tail}"
+
+def _reset_state(path, argv):
+    sys.path[:] = path
+    sys.argv[:] = argv
+    pyplot = sys.modules.get("matplotlib.pyplot")
+    if pyplot is not None:
+        try:
+            pyplot.close("all")
+        except Exception:
+            pass
+
+def serve(preload):
+    replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    sys.stdin = io.TextIOWrapper(io.BytesIO())
+
+    preloaded = []
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            preloaded.append(name)
+        except Exception:
+            pass
+    replies.write(json.dumps({"ready": True, "pid": os.getpid(), "preloaded": preloaded, "rss": _rss()}) + "\n")
+    replies.flush()
+
+    base_path, base_argv = list(sys.path), list(sys.argv)
+    for line in requests:
+        request = json.loads(line)
+        out, err = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        started = time.perf_counter()
+        returncode = 0
+        try:
+            if request.get("cwd"):
+                os.chdir(request["cwd"])
+            _execute(request["code"])
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                returncode = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            # 只显示片段自身的调用栈，去掉解释器循环的帧
+            etype, value, tb = sys.exc_info()
+            while tb is not None and tb.tb_frame.f_code.co_filename != "<code>":
+                tb = tb.tb_next
+            traceback.print_exception(etype, value, tb)
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            _reset_state(base_path, base_argv)
+        limit = int(request.get("max_output", 1 << 20))
+        reply = {
+            "stdout": _read_output(out, limit),
+            "stderr": _read_output(err, limit),
+            "returncode": returncode,
+            "duration": time.perf_counter() - started,
+            "rss": _rss(),
+        }
+        out.close()
+        err.close()
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+
+if __name__ == "__main__":
+    serve(sys.argv[1:])
@@ -0,0 +1,326 @@
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+from .log_config import logger
+from .retry import _parse_duration, _parse_timestamp, parse_retry_after
+
+"""
+令牌桶限流：同时限制请求数和 token 数，取令牌是 O(1) 的，额度不足时可以等待而不是直接失败。
+
+限额有两个来源：配置的限流字符串（parse_rate_limit），以及服务商在响应头里返回的
+x-ratelimit-* / anthropic-ratelimit-*，后者会覆盖桶的容量和剩余额度。
+服务商的限额按 API key 和模型计算，get_rate_limiter 按 (scheme + host, API key, 模型) 返回进程内共享的限流器：
+使用同一个 key 和模型的所有 agent 共用同一份额度，同一个 host 上的其他 key 或模型（例如压缩摘要用的小模型）互不影响。
+"""
+
+# 单次请求的 token 上限（tpr）没有时间窗口，用这个周期值表示
+TOKENS_PER_REQUEST = -1
+
+class RateLimit(NamedTuple):
+    count: int
+    # 时间窗口的秒数；tpr 为 TOKENS_PER_REQUEST
+    period: float
+    # "requests" 或 "tokens"
+    kind: str = "requests"
+
+_TIME_UNITS = {
+    's': 1, 'sec': 1, 'secs': 1, 'second': 1, 'seconds': 1,
+    'm': 60, 'min': 60, 'mins': 60, 'minute': 60, 'minutes': 60,
+    'h': 3600, 'hr': 3600, 'hrs': 3600, 'hour': 3600, 'hours': 3600,
+    'd': 86400, 'day': 86400, 'days': 86400,
+    'mo': 2592000, 'month': 2592000, 'months': 2592000,
+    'y': 31536000, 'year': 31536000, 'years': 31536000,
+}
+# 缩写同时给出类型和周期，例如 "500/rpm"、"200k/tpm"
+_SHORTHAND_UNITS = {
+    'rps': ("requests", 1), 'rpm': ("requests", 60), 'rph': ("requests", 3600), 'rpd': ("requests", 86400),
+    'tps': ("tokens", 1), 'tpm': ("tokens", 60), 'tph': ("tokens", 3600), 'tpd': ("tokens", 86400),
+    'tpr': ("tokens", TOKENS_PER_REQUEST),
+}
+_COUNT_SUFFIX = {'': 1, 'k': 1_000, 'm': 1_000_000}
+_LIMIT_PATTERN = re.compile(
+    r'^(\d+(?:\.\d+)?)\s*([km]?)\s*(requests?|reqs?|tokens?)?\s*/\s*(\d+(?:\.\d+)?)?\s*([a-z]+)$',
+    re.IGNORECASE,
+)
+
+def parse_rate_limit(limit_string: str) -> List[RateLimit]:
+    """
+    解析逗号分隔的限流规则，例如 "10/min, 1000/day"、"200k tokens/min"、"60/5min"、"4000/tpr"。
+
+    单位按完整单词匹配（"m" 是分钟，"mo" 是月），周期前可以带倍数，数量可以带 k / m 后缀；
+    写明 tokens 或使用 tpm 等缩写的规则限制 token 数，其余限制请求数。
+    """
+    limits = []
+    for limit in limit_string.split(','):
+        limit = limit.strip()
+        match = _LIMIT_PATTERN.match(limit)
+        if not match:
+            raise ValueError(f"Invalid rate limit format: {limit}")
+
+        count, suffix, kind, multiplier, unit = match.groups()
+        count = int(float(count) * _COUNT_SUFFIX[suffix.lower()])
+        unit = unit.lower()
+        if unit in _SHORTHAND_UNITS:
+            if kind or multiplier:
+                raise ValueError(f"Invalid rate limit format: {limit}")
+            kind, seconds = _SHORTHAND_UNITS[unit]
+        elif unit in _TIME_UNITS:
+            kind = "tokens" if kind and kind.lower().startswith("token") else "requests"
+            seconds = _TIME_UNITS[unit] * (float(multiplier) if multiplier else 1)
+            if seconds <= 0:
+                raise ValueError(f"Invalid rate limit period: {limit}")
+        else:
+            raise ValueError(f"Unknown time unit: {unit}")
+        limits.append(RateLimit(count, seconds, kind))
+
+    return limits
+
+
+class TokenBucket:
+    """容量为 capacity、每秒补充 rate 个令牌的桶。时间按需结算，没有后台任务。"""
+    def __init__(self, capacity: float, period: float, now: Optional[float] = None):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """返回取出 amount 个令牌需要等待的秒数。超过容量的请求在桶满时放行，避免永远等待。"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def update(self, limit: Optional[float], remaining: Optional[float], reset_after: Optional[float], now: float):
+        """
+        用服务端返回的限额校准桶。OpenAI 和 Anthropic 的 reset 都是额度完全恢复的时间，
+        据此估计补充速率。
+        """
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(float(remaining), self.capacity)
+        if reset_after and reset_after > 0 and self.capacity > self.level:
+            self.rate = (self.capacity - self.level) / reset_after
+        self.updated = now
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# OpenAI 的 reset 是时长（"6m0s"），Anthropic 的 reset 是 RFC 3339 时间戳
+_HEADER_FORMATS = [
+    ("x-ratelimit-{field}-{kind}", _parse_duration),
+    ("anthropic-ratelimit-{kind}-{field}", _parse_timestamp),
+]
+
+class RateLimiter:
+    """
+    一组请求数和 token 数的令牌桶。acquire 在所有桶都有余量时一次性扣除，否则等待最长的那个桶。
+
+    配置的限额以 ("requests" / "tokens", 周期) 为键；从响应头学到的限额以 (类型, "server") 为键，
+    周期按分钟计（OpenAI 和 Anthropic 的限额都是每分钟）。
+    """
+    server_period = 60.0
+
+    def __init__(self, limits: Optional[List[RateLimit]] = None, name: str = ""):
+        self.name = name
+        self.tokens_per_request: Optional[int] = None
+        self._buckets: Dict[Tuple[str, object], TokenBucket] = {}
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.waited = 0.0
+        self.configure(limits or [])
+
+    def configure(self, limits: List[RateLimit]):
+        """
+        替换配置的限额，保留从响应头学到的限额。
+        限额没有变化的桶保留当前余量，多个 agent 用相同配置创建时不会重置共享的额度。
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = {key: bucket for key, bucket in self._buckets.items() if key[1] == "server"}
+            self.tokens_per_request = None
+            for limit in limits:
+                if limit.period == TOKENS_PER_REQUEST:
+                    self.tokens_per_request = limit.count
+                    continue
+                key = (limit.kind, limit.period)
+                # 同一周期配置多次时取更严格的限额
+                if key in buckets and buckets[key].capacity <= limit.count:
+                    continue
+                existing = self._buckets.get(key)
+                if existing is not None and existing.capacity == limit.count:
+                    buckets[key] = existing
+                else:
+                    buckets[key] = TokenBucket(limit.count, limit.period, now)
+            self._buckets = buckets
+
+    def exceeds_tokens_per_request(self, tokens: int) -> bool:
+        return self.tokens_per_request is not None and tokens > self.tokens_per_request
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        wait = self._blocked_until - now
+        for (kind, _), bucket in self._buckets.items():
+            wait = max(wait, bucket.wait_time(tokens if kind == "tokens" else 1, now))
+        return max(wait, 0.0)
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """返回取得额度需要等待的秒数，不扣除额度。"""
+        with self._lock:
+            return self._wait_time(tokens, time.monotonic())
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        """额度足够时扣除并返回 0，否则不扣除，返回需要等待的秒数。"""
+        now = time.monotonic()
+        with self._lock:
+            wait = self._wait_time(tokens, now)
+            if wait > 0:
+                return wait
+            for (kind, _), bucket in self._buckets.items():
+                bucket.consume(tokens if kind == "tokens" else 1)
+            return 0.0
+
+    async def acquire(self, tokens: int = 0, timeout: Optional[float] = None) -> float:
+        """等待直到取得额度，返回等待的秒数。超过 timeout 仍没有额度时抛出 RateLimitExceeded。"""
+        started = time.monotonic()
+        wait = self.try_acquire(tokens)
+        while wait > 0:
+            waited = time.monotonic() - started
+            if timeout is not None and waited + wait > timeout:
+                raise RateLimitExceeded(f"Rate limit of {self.name or 'endpoint'} exceeded", retry_after=wait)
+            await asyncio.sleep(wait)
+            wait = self.try_acquire(tokens)
+        waited = time.monotonic() - started
+        if waited > 0:
+            self.waits += 1
+            self.waited += waited
+        return waited
+
+    def block(self, seconds: float):
+        """服务端要求等待（429 + Retry-After）时，在这段时间内不放行任何请求。"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def observe(self, headers, status_code: Optional[int] = None):
+        """从响应头学习限额；429 响应按 Retry-After 暂停放行。"""
+        if not headers:
+            return
+        lowered = {key.lower(): str(value).strip() for key, value in headers.items()}
+        now = time.monotonic()
+        learned = []
+        for kind in ("requests", "tokens"):
+            for header_format, parse_reset in _HEADER_FORMATS:
+                values = {field: lowered.get(header_format.format(field=field, kind=kind)) for field in ("limit", "remaining", "reset")}
+                if values["limit"] is None and values["remaining"] is None:
+                    continue
+                try:
+                    limit = float(values["limit"]) if values["limit"] is not None else None
+                    remaining = float(values["remaining"]) if values["remaining"] is not None else None
+                except ValueError:
+                    continue
+                reset = values["reset"]
+                reset_after = None
+                if reset:
+                    reset_after = parse_reset(reset)
+                    if reset_after is None:
+                        try:
+                            reset_after = float(reset)
+                        except ValueError:
+                            reset_after = None
+                learned.append((kind, limit, remaining, reset_after))
+                break
+
+        with self._lock:
+            for kind, limit, remaining, reset_after in learned:
+                key = (kind, "server")
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    if not limit:
+                        continue
+                    bucket = self._buckets[key] = TokenBucket(limit, self.server_period, now)
+                bucket.update(limit, remaining, reset_after, now)
+
+        if status_code == 429:
+            retry_after = parse_retry_after(headers)
+            if retry_after:
+                self.block(retry_after)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            buckets = {}
+            for (kind, period), bucket in self._buckets.items():
+                bucket._refill(now)
+                buckets[f"{kind}/{period}"] = {"capacity": bucket.capacity, "available": bucket.level, "rate": bucket.rate}
+            return {"buckets": buckets, "waits": self.waits, "waited": self.waited, "blocked_for": max(self._blocked_until - now, 0.0)}
+
+_rate_limiters: Dict[Tuple[str, Optional[str], Optional[str]], RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+# 各服务商携带 API key 的请求头
+_API_KEY_HEADERS = ("x-api-key", "api-key", "x-goog-api-key")
+
+def request_api_key(headers, url: str = "") -> Optional[str]:
+    """从请求头（Authorization: Bearer、x-api-key 等）或 URL 的 key 参数中取出 API key，没有时返回 None。"""
+    if headers:
+        lowered = {str(key).lower(): value for key, value in headers.items()}
+        authorization = lowered.get("authorization")
+        if authorization:
+            return str(authorization).split(" ", 1)[-1]
+        for name in _API_KEY_HEADERS:
+            if lowered.get(name):
+                return str(lowered[name])
+    keys = parse_qs(urlparse(str(url)).query).get("key")
+    return keys[0] if keys else None
+
+def get_rate_limiter(url: str, limits: Optional[List[RateLimit]] = None, api_key: Optional[str] = None, model: Optional[str] = None) -> RateLimiter:
+    """
+    返回进程内按 (scheme + host, API key, 模型) 共享的限流器。传入 limits 时更新它的配置。
+    API key 只以摘要的形式出现在键和限流器名字中。
+    """
+    parsed = urlparse(str(url))
+    origin = f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else str(url)
+    key_digest = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else None
+    key = (origin, key_digest, model or None)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            name = "/".join(part for part in (origin, model, f"key-{key_digest}" if key_digest else None) if part)
+            limiter = _rate_limiters[key] = RateLimiter(name=name)
+    if limits is not None:
+        limiter.configure(limits)
+    return limiter
+
+def observe_rate_limit_headers(response, model: Optional[str] = None):
+    """把响应的限流头交给发出请求的 (base URL, API key, 模型) 对应的限流器。API key 从请求中取出。"""
+    try:
+        request = response.request
+        url = request.url
+    except (AttributeError, RuntimeError):
+        return
+    try:
+        api_key = request_api_key(request.headers, str(url))
+        get_rate_limiter(str(url), api_key=api_key, model=model).observe(response.headers, response.status_code)
+    except Exception as e:
+        logger.debug(f"Failed to learn rate limits from {url}: {e}")
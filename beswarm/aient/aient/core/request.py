@@ -8,9 +8,11 @@ import base64
 import asyncio
 import hashlib
 import datetime
+import threading
 import urllib.parse
 from io import IOBase
-from typing import Tuple
+from typing import Dict, Tuple
+from collections import OrderedDict
 from datetime import timezone
 from urllib.parse import urlparse
 
@@ -20,6 +22,7 @@ from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 
 from .models import RequestModel, Message
+from .sse import json_dumpb
 from .utils import (
     c3s,
     c3o,
@@ -35,6 +38,7 @@ from .utils import (
     get_model_dict,
     get_text_message,
     get_image_message,
+    prepare_image_messages,
 )
 
 gemini_max_token_65k_models = ["gemini-2.5-pro", "gemini-2.0-pro", "gemini-2.0-flash-thinking", "gemini-2.5-flash"]
@@ -69,10 +73,12 @@ async def get_gemini_payload(request, engine, provider, api_key=None):
     try:
         request_messages = [Message(role="user", content=request.prompt)]
     except Exception:
-        request_messages = copy.deepcopy(request.messages)
+        request_messages = request.messages
+    if provider.get("image", True):
+        await prepare_image_messages(request_messages, engine)
     for msg in request_messages:
-        if msg.role == "assistant":
-            msg.role = "model"
+        # gemini 中 assistant 的角色名是 model。不修改 msg，请求中的消息对象会在多次请求之间复用
+        role = "model" if msg.role == "assistant" else msg.role
         tool_calls = None
         if isinstance(msg.content, list):
             content = []
@@ -121,7 +127,7 @@ async def get_gemini_payload(request, engine, provider, api_key=None):
                 }
             )
         elif msg.role != "system" and content:
-            messages.append({"role": msg.role, "parts": content})
+            messages.append({"role": role, "parts": content})
         elif msg.role == "system":
             content[0]["text"] = re.sub(r"_+", "_", content[0]["text"])
             system_prompt = system_prompt + "\n\n" + content[0]["text"]
@@ -205,7 +211,7 @@ async def get_gemini_payload(request, engine, provider, api_key=None):
             for item in data:
                 process_tool_parameters(item)
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             if field == "tools" and ("gemini-2.0-flash-thinking" in original_model or "gemini-2.5-flash-image" in original_model):
                 continue
@@ -410,10 +416,12 @@ async def get_vertex_gemini_payload(request, engine, provider, api_key=None):
     systemInstruction = None
     system_prompt = ""
     function_arguments = None
-    request_messages = copy.deepcopy(request.messages)
+    request_messages = request.messages
+    if provider.get("image", True):
+        await prepare_image_messages(request_messages, engine)
     for msg in request_messages:
-        if msg.role == "assistant":
-            msg.role = "model"
+        # gemini 中 assistant 的角色名是 model。不修改 msg，请求中的消息对象会在多次请求之间复用
+        role = "model" if msg.role == "assistant" else msg.role
         tool_calls = None
         if isinstance(msg.content, list):
             content = []
@@ -462,7 +470,7 @@ async def get_vertex_gemini_payload(request, engine, provider, api_key=None):
                 }
             )
         elif msg.role != "system" and content:
-            messages.append({"role": msg.role, "parts": content})
+            messages.append({"role": role, "parts": content})
         elif msg.role == "system":
             system_prompt = system_prompt + "\n\n" + content[0]["text"]
     if system_prompt.strip():
@@ -519,7 +527,7 @@ async def get_vertex_gemini_payload(request, engine, provider, api_key=None):
     ]
     generation_config = {}
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             if field == "tools":
                 payload.update({
@@ -638,6 +646,8 @@ async def get_vertex_claude_payload(request, engine, provider, api_key=None):
     messages = []
     system_prompt = None
     tool_id = None
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
     for msg in request.messages:
         tool_call_id = None
         tool_calls = None
@@ -646,9 +656,13 @@ async def get_vertex_claude_payload(request, engine, provider, api_key=None):
             for item in msg.content:
                 if item.type == "text":
                     text_message = await get_text_message(item.text, engine)
+                    if item.cache_control:
+                        text_message["cache_control"] = item.cache_control
                     content.append(text_message)
                 elif item.type == "image_url" and provider.get("image", True):
                     image_message = await get_image_message(item.image_url.url, engine)
+                    if item.cache_control:
+                        image_message["cache_control"] = item.cache_control
                     content.append(image_message)
         else:
             content = msg.content
@@ -735,7 +749,7 @@ async def get_vertex_claude_payload(request, engine, provider, api_key=None):
         'stream_options',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             payload[field] = value
 
@@ -841,6 +855,8 @@ async def get_aws_payload(request, engine, provider, api_key=None):
     messages = []
     # system_prompt = None
     tool_id = None
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
     for msg in request.messages:
         tool_call_id = None
         tool_calls = None
@@ -849,9 +865,13 @@ async def get_aws_payload(request, engine, provider, api_key=None):
             for item in msg.content:
                 if item.type == "text":
                     text_message = await get_text_message(item.text, engine)
+                    if item.cache_control:
+                        text_message["cache_control"] = item.cache_control
                     content.append(text_message)
                 elif item.type == "image_url" and provider.get("image", True):
                     image_message = await get_image_message(item.image_url.url, engine)
+                    if item.cache_control:
+                        image_message["cache_control"] = item.cache_control
                     content.append(image_message)
         else:
             content = msg.content
@@ -946,7 +966,7 @@ async def get_aws_payload(request, engine, provider, api_key=None):
         'stream',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             payload[field] = value
 
@@ -994,6 +1014,54 @@ async def get_aws_payload(request, engine, provider, api_key=None):
 
     return url, headers, payload
 
+async def get_gpt_message(msg, engine, provider, url, original_model):
+    """把一条消息转换为 OpenAI 格式，返回零条或多条消息。"""
+    messages = []
+    tool_calls = None
+    tool_call_id = None
+    if isinstance(msg.content, list):
+        content = []
+        for item in msg.content:
+            if item.type == "text":
+                text_message = await get_text_message(item.text, engine)
+                if "v1/responses" in url:
+                    text_message["type"] = "input_text"
+                content.append(text_message)
+            elif item.type == "image_url" and provider.get("image", True) and "o1-mini" not in original_model:
+                image_message = await get_image_message(item.image_url.url, engine)
+                if "v1/responses" in url:
+                    image_message = {
+                        "type": "input_image",
+                        "image_url": image_message["image_url"]["url"]
+                    }
+                content.append(image_message)
+    else:
+        content = msg.content
+        if msg.role == "system" and "o3-mini" in original_model and not content.startswith("Formatting re-enabled"):
+            content = "Formatting re-enabled. " + content
+        tool_calls = msg.tool_calls
+        tool_call_id = msg.tool_call_id
+
+    if tool_calls:
+        tool_calls_list = []
+        for tool_call in tool_calls:
+            tool_calls_list.append({
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {
+                    "name": tool_call.function.name,
+                    "arguments": tool_call.function.arguments
+                }
+            })
+            if provider.get("tools"):
+                messages.append({"role": msg.role, "tool_calls": tool_calls_list})
+    elif tool_call_id:
+        if provider.get("tools"):
+            messages.append({"role": msg.role, "tool_call_id": tool_call_id, "content": content})
+    else:
+        messages.append({"role": msg.role, "content": content})
+    return messages
+
 async def get_gpt_payload(request, engine, provider, api_key=None):
     headers = {
         'Content-Type': 'application/json',
@@ -1009,54 +1077,19 @@ async def get_gpt_payload(request, engine, provider, api_key=None):
         headers['X-Title'] = "Uni API"
 
     messages = []
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
+    # 只有新增或变化的消息需要转换，之前转换过的消息直接复用
+    convert_key = ("gpt", engine, "v1/responses" in url, provider.get("tools"), provider.get("image", True), "o1-mini" in original_model, "o3-mini" in original_model)
     for msg in request.messages:
-        tool_calls = None
-        tool_call_id = None
-        if isinstance(msg.content, list):
-            content = []
-            for item in msg.content:
-                if item.type == "text":
-                    text_message = await get_text_message(item.text, engine)
-                    if "v1/responses" in url:
-                        text_message["type"] = "input_text"
-                    content.append(text_message)
-                elif item.type == "image_url" and provider.get("image", True) and "o1-mini" not in original_model:
-                    image_message = await get_image_message(item.image_url.url, engine)
-                    if "v1/responses" in url:
-                        image_message = {
-                            "type": "input_image",
-                            "image_url": image_message["image_url"]["url"]
-                        }
-                    content.append(image_message)
-        else:
-            content = msg.content
-            if msg.role == "system" and "o3-mini" in original_model and not content.startswith("Formatting re-enabled"):
-                content = "Formatting re-enabled. " + content
-            tool_calls = msg.tool_calls
-            tool_call_id = msg.tool_call_id
-
-        if tool_calls:
-            tool_calls_list = []
-            for tool_call in tool_calls:
-                tool_calls_list.append({
-                    "id": tool_call.id,
-                    "type": tool_call.type,
-                    "function": {
-                        "name": tool_call.function.name,
-                        "arguments": tool_call.function.arguments
-                    }
-                })
-                if provider.get("tools"):
-                    messages.append({"role": msg.role, "tool_calls": tool_calls_list})
-        elif tool_call_id:
-            if provider.get("tools"):
-                messages.append({"role": msg.role, "tool_call_id": tool_call_id, "content": content})
-        else:
-            messages.append({"role": msg.role, "content": content})
+        messages.extend(await message_model_cache.convert(
+            msg, convert_key, lambda msg=msg: get_gpt_message(msg, engine, provider, url, original_model)
+        ))
 
     if ("o1-mini" in original_model or "o1-preview" in original_model) and len(messages) > 1 and messages[0]["role"] == "system":
         system_msg = messages.pop(0)
-        messages[0]["content"] = system_msg["content"] + messages[0]["content"]
+        # 转换结果会被缓存复用，这里不能原地修改
+        messages[0] = {**messages[0], "content": system_msg["content"] + messages[0]["content"]}
 
     if "v1/responses" in url:
         payload = {
@@ -1074,7 +1107,7 @@ async def get_gpt_payload(request, engine, provider, api_key=None):
         'messages',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             if field == "max_tokens" and ("o1" in original_model or "o3" in original_model or "o4" in original_model or "gpt-5" in original_model):
                 payload["max_completion_tokens"] = value
@@ -1190,6 +1223,8 @@ async def get_azure_payload(request, engine, provider, api_key=None):
     )
 
     messages = []
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
     for msg in request.messages:
         tool_calls = None
         tool_call_id = None
@@ -1236,7 +1271,7 @@ async def get_azure_payload(request, engine, provider, api_key=None):
         'messages',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             if field == "max_tokens" and "o1" in original_model:
                 payload["max_completion_tokens"] = value
@@ -1270,6 +1305,8 @@ async def get_azure_databricks_payload(request, engine, provider, api_key=None):
     url = urllib.parse.urljoin(base_url, f"/serving-endpoints/{original_model}/invocations")
 
     messages = []
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
     for msg in request.messages:
         tool_calls = None
         tool_call_id = None
@@ -1331,7 +1368,7 @@ async def get_azure_databricks_payload(request, engine, provider, api_key=None):
         'messages',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             if field == "max_tokens" and "o1" in original_model:
                 payload["max_completion_tokens"] = value
@@ -1392,6 +1429,8 @@ async def get_openrouter_payload(request, engine, provider, api_key=None):
         headers['X-Title'] = "Uni API"
 
     messages = []
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
     for msg in request.messages:
         tool_calls = None
         tool_call_id = None
@@ -1450,7 +1489,7 @@ async def get_openrouter_payload(request, engine, provider, api_key=None):
         'stream_options',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             payload[field] = value
 
@@ -1527,7 +1566,7 @@ async def get_cohere_payload(request, engine, provider, api_key=None):
         'stream_options',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             payload[field] = value
 
@@ -1575,7 +1614,7 @@ async def get_cloudflare_payload(request, engine, provider, api_key=None):
         'stream_options',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             payload[field] = value
 
@@ -1660,6 +1699,8 @@ async def get_claude_payload(request, engine, provider, api_key=None):
     messages = []
     system_prompt = None
     tool_id = None
+    if provider.get("image", True):
+        await prepare_image_messages(request.messages, engine)
     for msg in request.messages:
         tool_call_id = None
         tool_calls = None
@@ -1668,9 +1709,13 @@ async def get_claude_payload(request, engine, provider, api_key=None):
             for item in msg.content:
                 if item.type == "text":
                     text_message = await get_text_message(item.text, engine)
+                    if item.cache_control:
+                        text_message["cache_control"] = item.cache_control
                     content.append(text_message)
                 elif item.type == "image_url" and provider.get("image", True):
                     image_message = await get_image_message(item.image_url.url, engine)
+                    if item.cache_control:
+                        image_message["cache_control"] = item.cache_control
                     content.append(image_message)
         else:
             content = msg.content
@@ -1762,7 +1807,7 @@ async def get_claude_payload(request, engine, provider, api_key=None):
         'stream_options',
     ]
 
-    for field, value in request.model_dump(exclude_unset=True).items():
+    for field, value in request.model_dump(exclude_unset=True, exclude={"messages"}).items():
         if field not in miss_fields and value is not None:
             payload[field] = value
 
@@ -2072,14 +2117,155 @@ async def get_payload(request: RequestModel, engine, provider, api_key=None):
     else:
         raise ValueError("Unknown payload")
 
+# 使用 Anthropic 消息格式、支持 cache_control 的引擎
+CLAUDE_FORMAT_ENGINES = ("claude", "vertex-claude", "aws")
+
+def order_messages_for_prompt_cache(messages, engine):
+    """
+    将 system 消息中最后一个 cache_control 断点之后的易变内容（时间、目录、文件内容等）
+    移到最后一条 user 消息的末尾，使 system 与历史对话构成跨轮次字节一致的前缀。
+    断点块带有 relocate=False 时，易变内容留在 system 原处，只缓存断点之前的部分。
+
+    Claude 格式的引擎保留 cache_control 断点，并在最后一条 user 消息的易变内容之前再加一个断点，
+    用于缓存历史对话；其它引擎的 system 被还原为字符串，依赖服务端的自动前缀缓存。
+    """
+    system_index = next((
+        i for i, msg in enumerate(messages)
+        if isinstance(msg, dict) and msg.get("role") == "system" and isinstance(msg.get("content"), list)
+        and any(isinstance(part, dict) and part.get("cache_control") for part in msg["content"])
+    ), None)
+    if system_index is None:
+        return messages
+    parts = messages[system_index]["content"]
+    if any(part.get("type") != "text" for part in parts):
+        return messages
+
+    breakpoint_index = max(i for i, part in enumerate(parts) if part.get("cache_control"))
+    stable_text = "".join(part.get("text") or "" for part in parts[:breakpoint_index + 1])
+    raw_volatile_text = "".join(part.get("text") or "" for part in parts[breakpoint_index + 1:])
+    volatile_text = raw_volatile_text.strip()
+    cache_control = parts[breakpoint_index]["cache_control"]
+    relocate = parts[breakpoint_index].get("relocate", True)
+    use_cache_control = engine in CLAUDE_FORMAT_ENGINES
+
+    messages = list(messages)
+    last_message = messages[-1]
+    # 没有可以承载易变内容的 user 消息时，易变内容只能留在 system 末尾
+    volatile_in_system = bool(volatile_text)
+    if relocate and isinstance(last_message, dict) and last_message.get("role") == "user" and not last_message.get("tool_call_id") and last_message.get("content"):
+        volatile_in_system = False
+        last_content = last_message["content"]
+        if use_cache_control:
+            last_content = [{"type": "text", "text": last_content}] if isinstance(last_content, str) else [dict(part) for part in last_content]
+            last_content[-1]["cache_control"] = cache_control
+            if volatile_text:
+                last_content.append({"type": "text", "text": volatile_text})
+        elif volatile_text:
+            if isinstance(last_content, str):
+                last_content = last_content + "\n\n" + volatile_text
+            else:
+                last_content = list(last_content) + [{"type": "text", "text": volatile_text}]
+        messages[-1] = {**last_message, "content": last_content}
+
+    if use_cache_control:
+        system_content = [{"type": "text", "text": stable_text, "cache_control": cache_control}]
+        if volatile_in_system:
+            system_content.append({"type": "text", "text": raw_volatile_text})
+    else:
+        system_content = stable_text + raw_volatile_text if volatile_in_system else stable_text
+    messages[system_index] = {**messages[system_index], "content": system_content}
+    return messages
+
+class MessageModelCache:
+    """
+    缓存已经校验过的 Message 对象。对话每轮只新增少量消息，之前的消息原样出现在下一次请求中，
+    不需要再经过 pydantic 校验。
+
+    渲染出的消息是普通字典，没有稳定的 id，这里以消息的 JSON 序列化结果作为键，内容不变即命中。
+    缓存的 Message 对象会被多次请求共享，payload 构造函数不能修改它们。
+
+    缓存在进程内共享，多个线程中的事件循环会同时使用，读写都在锁内进行；
+    校验和转换本身在锁外执行，并发时同一条消息可能被重复处理，但只保留先写入的结果。
+    """
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Message]" = OrderedDict()
+        # id(Message) -> (Message, {转换键: 转换结果})，只记录仍在缓存中的对象
+        self._converted: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+
+    def validate(self, messages) -> list:
+        result = []
+        for message in messages:
+            if not isinstance(message, dict):
+                result.append(message if isinstance(message, Message) else Message.model_validate(message))
+                continue
+            try:
+                key = json_dumpb(message)
+            except (TypeError, ValueError):
+                result.append(Message.model_validate(message))
+                continue
+            with self._lock:
+                model = self._entries.get(key)
+                if model is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+            if model is None:
+                validated = Message.model_validate(message)
+                with self._lock:
+                    model = self._entries.get(key)
+                    if model is None:
+                        self.misses += 1
+                        model = self._entries[key] = validated
+                        self._converted[id(model)] = (model, {})
+                        if len(self._entries) > self.maxsize:
+                            _, evicted = self._entries.popitem(last=False)
+                            self._converted.pop(id(evicted), None)
+                    else:
+                        self.hits += 1
+            result.append(model)
+        return result
+
+    async def convert(self, message, key: tuple, factory):
+        """
+        返回 message 转换后的供应商格式。key 描述影响转换结果的全部条件。
+        结果在多次请求之间共享，调用方不能修改。不在缓存中的消息每次都调用 factory。
+        """
+        with self._lock:
+            entry = self._converted.get(id(message))
+            if entry is None or entry[0] is not message:
+                entry = None
+            elif key in entry[1]:
+                return entry[1][key]
+        converted = await factory()
+        if entry is None:
+            return converted
+        with self._lock:
+            return entry[1].setdefault(key, converted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._converted.clear()
+            self.hits = self.misses = 0
+
+message_model_cache = MessageModelCache()
+
 async def prepare_request_payload(provider, request_data):
 
     model_dict = get_model_dict(provider)
-    request = RequestModel(**request_data)
-
-    original_model = model_dict[request.model]
+    original_model = model_dict[request_data["model"]]
     engine, _ = get_engine(provider, endpoint=None, original_model=original_model)
 
+    if request_data.get("messages"):
+        messages = message_model_cache.validate(order_messages_for_prompt_cache(request_data["messages"], engine))
+        request = RequestModel(**{**request_data, "messages": []})
+        request.messages = messages
+    else:
+        request = RequestModel(**request_data)
+
     url, headers, payload = await get_payload(request, engine, provider, api_key=provider['api'])
 
     return url, headers, payload, engine
@@ -0,0 +1,216 @@
+import re
+import time
+import random
+import threading
+import contextvars
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+"""
+请求重试策略：指数退避 + full jitter、Retry-After / 限流头解析、任务级重试预算，
+以及按 base URL 在所有 agent 之间共享的熔断器。
+"""
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+def _parse_duration(value: str) -> Optional[float]:
+    """解析 OpenAI 风格的时长，例如 "1s"、"6m0s"、"20ms"。"""
+    matches = _DURATION_PATTERN.findall(value)
+    if not matches or "".join(number + unit for number, unit in matches) != value.replace(" ", ""):
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in matches)
+
+def _parse_timestamp(value: str) -> Optional[float]:
+    """解析 HTTP 日期或 RFC 3339 时间戳，返回距离现在的秒数。"""
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    从响应头中解析建议的等待秒数。
+
+    依次识别 retry-after-ms、Retry-After（秒数或 HTTP 日期）、
+    OpenAI 的 x-ratelimit-reset-* 以及 Anthropic 的 anthropic-ratelimit-*-reset。
+    """
+    if not headers:
+        return None
+    headers = {key.lower(): str(value).strip() for key, value in headers.items()}
+
+    if headers.get("retry-after-ms"):
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        value = headers["retry-after"]
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            parsed = _parse_timestamp(value)
+            if parsed is not None:
+                return parsed
+
+    resets = []
+    for key, value in headers.items():
+        if key.startswith("x-ratelimit-reset"):
+            parsed = _parse_duration(value)
+            if parsed is None:
+                try:
+                    parsed = float(value)
+                except ValueError:
+                    parsed = None
+        elif key.startswith("anthropic-ratelimit-") and key.endswith("-reset"):
+            parsed = _parse_timestamp(value)
+        else:
+            continue
+        if parsed is not None:
+            resets.append(parsed)
+    return max(resets) if resets else None
+
+
+class RetryBudget:
+    """
+    一个任务（job）内所有 agent 共享的重试预算，按令牌桶计算。
+    最多连续重试 max_retries 次，之后每 refill_interval 秒恢复一次重试机会（None 表示不恢复）。
+    服务商故障期间重试被限制在恢复速度以内，避免无限重试；故障过去后，长时间运行的任务仍然可以重试。
+    """
+    def __init__(self, max_retries: int = 100, refill_interval: Optional[float] = 6.0):
+        self.max_retries = max_retries
+        self.refill_interval = refill_interval
+        self.used = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.refill_interval:
+            self.used = max(0.0, self.used - (now - self._updated) / self.refill_interval)
+        self._updated = now
+
+    def consume(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.used + 1 > self.max_retries:
+                return False
+            self.used += 1
+            return True
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            self._refill()
+            return max(0, int(self.max_retries - self.used))
+
+# 当前任务的重试预算。任务入口设置后，同一上下文中创建的所有 agent 都共享它。
+current_retry_budget: contextvars.ContextVar[Optional[RetryBudget]] = contextvars.ContextVar('current_retry_budget', default=None)
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，冷却期内所有请求等待；
+    冷却期结束后只放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def acquire(self) -> float:
+        """返回发送请求前需要等待的秒数，0 表示可以立即发送。"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            now = time.monotonic()
+            remaining = self._opened_at + self.reset_timeout - now
+            if remaining > 0:
+                return remaining
+            # 试探请求长时间没有结果时视为丢失，允许新的试探。
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                return min(1.0, self.reset_timeout)
+            self._probe_started = now
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe_started is not None or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(url: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> CircuitBreaker:
+    """返回进程内按 base URL（scheme + host）共享的熔断器。"""
+    parsed = urlparse(str(url))
+    key = f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else str(url)
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(key)
+        if breaker is None:
+            breaker = _circuit_breakers[key] = CircuitBreaker(failure_threshold, reset_timeout)
+        return breaker
+
+
+class RetryPolicy:
+    """
+    指数退避 + full jitter 的重试策略。
+
+    第 n 次重试的等待时间在 [0, min(max_delay, base_delay * 2 ** (n - 1))] 内均匀随机，
+    如果服务端给出了 Retry-After，至少等待该时长。
+    """
+    def __init__(
+        self,
+        base_delay: float = 0.5,
+        max_delay: float = 60.0,
+        budget: Optional[RetryBudget] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        ceiling = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def consume_budget(self) -> bool:
+        budget = current_retry_budget.get() or self.budget
+        return budget.consume() if budget is not None else True
+
+    def circuit_breaker(self, url: str) -> CircuitBreaker:
+        return get_circuit_breaker(url, self.failure_threshold, self.reset_timeout)
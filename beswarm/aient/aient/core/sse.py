@@ -0,0 +1,319 @@
+import re
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+字节级的增量 SSE 解码器与 JSON 编解码。
+
+解码器直接处理网络层的字节块：按行切分时只解码完整的行，不会切断多字节字符；
+多行 data: 按规范用换行拼接成一个事件；空行分发事件。为了兼容不规范的服务端，
+没有 "data:" 前缀的 JSON 行（NDJSON）会立即作为一个事件分发，两个事件之间缺少空行时，
+如果已缓存的数据已经是完整的 JSON，也会先把它分发出去。
+
+Gemini 的 JSON 数组流和 AWS Bedrock 的二进制 event stream 不是 SSE，分别由 JSONStreamDecoder
+和 EventStreamDecoder 以同样的方式在字节上增量解码。
+
+安装了 orjson 时使用它编解码 JSON，否则使用标准库。单个 token 的 JSON 很小，直接在事件循环中解析，
+比每行都切换到线程池快得多。
+"""
+
+def json_loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj: Any) -> str:
+    """与 json.dumps(obj, ensure_ascii=False) 等价的紧凑输出。"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            # orjson 不支持的类型（例如超过 64 位的整数）交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def json_dumpb(obj: Any) -> bytes:
+    """紧凑的 JSON 字节串，用于缓存键等不需要解码成字符串的场合。"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+_UNPARSED = object()
+
+@dataclass
+class SSEEvent:
+    data: str
+    event: str = "message"
+    id: Optional[str] = None
+    retry: Optional[int] = None
+    _json: Any = field(default=_UNPARSED, repr=False, compare=False)
+
+    def json(self) -> Any:
+        """解析 data 中的 JSON，结果会被缓存。"""
+        if self._json is _UNPARSED:
+            self._json = json_loads(self.data)
+        return self._json
+
+class SSEDecoder:
+    """
+    增量 SSE 解码器。feed() 接收任意切分的字节块，返回其中完整的事件。
+
+    comments=True 时以 ":" 开头的注释行（例如 ": keepalive"）作为 event == "comment" 的事件返回。
+    """
+    def __init__(self, comments: bool = False):
+        self.comments = comments
+        self._buffer = bytearray()
+        # 上一个字节块末尾的 "\r"，它和下一个块开头的 "\n" 可能组成一个 "\r\n"
+        self._pending_cr = False
+        # _buffer 中已经确认没有换行符的前缀长度，长行跨越多个字节块时不重复查找
+        self._scanned = 0
+        self._data: List[str] = []
+        self._event = ""
+        self._id: Optional[str] = None
+        self._retry: Optional[int] = None
+        self._parsed: Any = _UNPARSED
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        # 只规范化新到的字节：上一块留下的 "\r" 放回开头，本块末尾的 "\r" 留到下一次处理
+        if self._pending_cr:
+            chunk = b"\r" + chunk
+            self._pending_cr = False
+        if chunk.endswith(b"\r"):
+            chunk = chunk[:-1]
+            self._pending_cr = True
+        if b"\r" in chunk:
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        buffer = self._buffer
+        buffer += chunk
+
+        events: List[SSEEvent] = []
+        start = 0
+        search = self._scanned
+        while True:
+            newline = buffer.find(b"\n", search)
+            if newline == -1:
+                break
+            self._process_line(buffer[start:newline].decode("utf-8", errors="replace"), events)
+            start = search = newline + 1
+        if start:
+            del buffer[:start]
+        self._scanned = len(buffer)
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束时调用，处理最后一行以及没有以空行结束的事件。"""
+        events: List[SSEEvent] = []
+        if self._buffer or self._pending_cr:
+            self._process_line(self._buffer.decode("utf-8", errors="replace"), events)
+            self._buffer.clear()
+        self._pending_cr = False
+        self._scanned = 0
+        self._dispatch(events)
+        return events
+
+    def _dispatch(self, events: List[SSEEvent]):
+        if self._data:
+            events.append(SSEEvent("\n".join(self._data), self._event or "message", self._id, self._retry, self._parsed))
+        self._data = []
+        self._event = ""
+        self._parsed = _UNPARSED
+
+    def _pending_is_complete(self) -> bool:
+        if len(self._data) != 1:
+            return False
+        pending = self._data[0]
+        if pending == "[DONE]":
+            return True
+        if not pending.endswith(("}", "]")):
+            return False
+        try:
+            self._parsed = json_loads(pending)
+        except ValueError:
+            return False
+        return True
+
+    def _process_line(self, line: str, events: List[SSEEvent]):
+        if not line:
+            self._dispatch(events)
+            return
+        if line[0] == ":":
+            if self.comments:
+                events.append(SSEEvent(line[1:].strip(), "comment"))
+            return
+
+        if line[0] in "{[":
+            # 没有 data: 前缀的 JSON 行，立即分发
+            self._dispatch(events)
+            self._data.append(line)
+            self._dispatch(events)
+            return
+        name, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+
+        if name == "data":
+            if self._data and self._pending_is_complete():
+                self._dispatch(events)
+            self._data.append(value)
+        elif name == "event":
+            self._event = value
+        elif name == "id":
+            if "\0" not in value:
+                self._id = value
+        elif name == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+
+async def aiter_sse(response, comments: bool = False) -> AsyncIterator[SSEEvent]:
+    """从 httpx 的流式响应中逐个读取 SSE 事件。"""
+    decoder = SSEDecoder(comments=comments)
+    async for chunk in response.aiter_bytes():
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.flush():
+        yield event
+
+_JSON_STRUCTURE = re.compile(rb'[{}"\\]')
+
+class JSONStreamDecoder:
+    """
+    从字节流中逐个取出顶层 JSON 对象。
+
+    Gemini 的 streamGenerateContent 默认返回一个逐步输出、带缩进的 JSON 数组，指定 alt=sse 时返回 SSE。
+    两种格式中对象之外的字符（"[", ",", "]", "data:" 和空白）都被忽略：只跟踪花括号深度和字符串状态，
+    对象完整时立即解析，不需要按行拼接后反复尝试解析。
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+        self._start: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        buffer = self._buffer
+        buffer += chunk
+        objects: List[Any] = []
+        position = self._scanned
+        while True:
+            match = _JSON_STRUCTURE.search(buffer, position)
+            if match is None:
+                position = len(buffer)
+                break
+            char = buffer[match.start()]
+            position = match.end()
+            if self._in_string:
+                if char == 0x5C:
+                    if position == len(buffer):
+                        # 被转义的字符在下一个字节块中，从反斜杠处重新扫描
+                        position = match.start()
+                        break
+                    position += 1
+                elif char == 0x22:
+                    self._in_string = False
+            elif char == 0x22:
+                self._in_string = self._depth > 0
+            elif char == 0x7B:
+                if self._depth == 0:
+                    self._start = match.start()
+                self._depth += 1
+            elif char == 0x7D and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        objects.append(json_loads(bytes(buffer[self._start:position])))
+                    except ValueError:
+                        pass
+                    self._start = None
+        # 丢弃已经处理完的字节，未完成的对象从缓冲区开头继续
+        keep = position if self._start is None else self._start
+        del buffer[:keep]
+        self._scanned = position - keep
+        if self._start is not None:
+            self._start = 0
+        return objects
+
+async def aiter_json_objects(response) -> AsyncIterator[Any]:
+    """从 httpx 的流式响应中逐个读取顶层 JSON 对象。"""
+    decoder = JSONStreamDecoder()
+    async for chunk in response.aiter_bytes():
+        for obj in decoder.feed(chunk):
+            yield obj
+
+@dataclass
+class EventStreamMessage:
+    headers: dict
+    payload: bytes
+
+    def json(self) -> Any:
+        return json_loads(self.payload)
+
+# 头部值类型 -> 固定长度，None 表示带 2 字节长度前缀
+_HEADER_SIZES = {0: 0, 1: 0, 2: 1, 3: 2, 4: 4, 5: 8, 6: None, 7: None, 8: 8, 9: 16}
+
+class EventStreamDecoder:
+    """
+    AWS event stream（application/vnd.amazon.eventstream）的增量解码器。
+
+    每条消息是 12 字节的前导（总长度、头部长度、CRC）、头部、载荷和 4 字节 CRC。
+    字符串头部（:event-type、:message-type 等）解码为 str，其余类型保留原始字节。
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[EventStreamMessage]:
+        buffer = self._buffer
+        buffer += chunk
+        messages: List[EventStreamMessage] = []
+        start = 0
+        while len(buffer) - start >= 12:
+            total_length, headers_length = struct.unpack_from(">II", buffer, start)
+            if len(buffer) - start < total_length:
+                break
+            headers_end = start + 12 + headers_length
+            headers = self._parse_headers(buffer, start + 12, headers_end)
+            payload = bytes(buffer[headers_end:start + total_length - 4])
+            messages.append(EventStreamMessage(headers, payload))
+            start += total_length
+        if start:
+            del buffer[:start]
+        return messages
+
+    @staticmethod
+    def _parse_headers(buffer, position, end) -> dict:
+        headers = {}
+        while position < end:
+            name_length = buffer[position]
+            name = buffer[position + 1:position + 1 + name_length].decode("utf-8")
+            position += 1 + name_length
+            value_type = buffer[position]
+            position += 1
+            size = _HEADER_SIZES[value_type]
+            if size is None:
+                size = struct.unpack_from(">H", buffer, position)[0]
+                position += 2
+            value = bytes(buffer[position:position + size])
+            position += size
+            if value_type == 7:
+                value = value.decode("utf-8")
+            elif value_type in (0, 1):
+                value = value_type == 0
+            headers[name] = value
+        return headers
+
+async def aiter_event_stream(response) -> AsyncIterator[EventStreamMessage]:
+    """从 httpx 的流式响应中逐条读取 AWS event stream 消息。"""
+    decoder = EventStreamDecoder()
+    async for chunk in response.aiter_bytes():
+        for message in decoder.feed(chunk):
+            yield message
@@ -0,0 +1,133 @@
+import os
+import time
+import signal
+import asyncio
+import unittest
+
+from ...plugins.command_runner import OutputBuffer, run_command, noise_filter, progress_listener, IS_UNIX
+from ...plugins.excute_command import excute_command, format_command_result
+
+"""
+测试脚本: 验证命令输出的首尾缓冲、超时终止进程组和进度事件。
+
+python -m beswarm.aient.aient.core.test.test_command_runner
+"""
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 已退出但尚未被回收的进程
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().split()[2] != "Z"
+    except OSError:
+        return True
+
+class TestOutputBuffer(unittest.TestCase):
+
+    def test_keeps_head_and_tail(self):
+        buffer = OutputBuffer(head_lines=3, tail_lines=2)
+        for i in range(10):
+            buffer.feed(f"line {i}\n")
+        self.assertEqual(buffer.total_lines, 10)
+        self.assertEqual(buffer.dropped, 5)
+        self.assertEqual(buffer.lines(), ["line 0", "line 1", "line 2", "... (省略 5 行输出) ...", "line 8", "line 9"])
+
+    def test_split_chunks_carriage_returns_and_escapes(self):
+        buffer = OutputBuffer()
+        self.assertEqual(buffer.feed("par"), [])
+        self.assertEqual(buffer.feed("tial\r 10%\r 20%\n\n\x1b[32mok\x1b[0m\n"), ["partial", " 10%", " 20%", "ok"])
+        buffer.feed("literal\\nescape")
+        buffer.close()
+        self.assertEqual(buffer.render(), "partial\n 10%\n 20%\nok\nliteral\nescape")
+
+    def test_long_line_is_split(self):
+        buffer = OutputBuffer(max_line_chars=100)
+        buffer.feed("x" * 1050)
+        self.assertEqual(buffer.total_lines, 10)
+        self.assertEqual(len(buffer._partial), 50)
+
+    def test_noise_filter(self):
+        keep = noise_filter("pip install requests && git clone https://example.com/repo.git repo")
+        self.assertFalse(keep("   ━━━━━━━━━━ 1.2/3.4 MB"))
+        self.assertFalse(keep("Receiving objects:  45% (450/1000)"))
+        self.assertTrue(keep("Successfully installed requests"))
+        self.assertIsNone(noise_filter("ls"))
+
+@unittest.skipUnless(IS_UNIX, "需要 pty 和进程组")
+class TestRunCommand(unittest.TestCase):
+
+    def test_large_output_is_bounded(self):
+        result = asyncio.run(run_command("seq 1 100000", head_lines=5, tail_lines=5))
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.total_lines, 100000)
+        self.assertEqual(result.dropped_lines, 99990)
+        self.assertTrue(result.output.startswith("1\n2\n3\n4\n5\n"))
+        self.assertTrue(result.output.endswith("99999\n100000"))
+
+    def test_idle_timeout_kills_process_group(self):
+        started = time.monotonic()
+        result = asyncio.run(run_command("sleep 30 & echo $!; sleep 30", idle_timeout=0.5, kill_grace=0.5))
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(result.timed_out, "idle")
+        self.assertEqual(result.returncode, -signal.SIGTERM)
+        background = int(result.output.strip())
+        time.sleep(0.1)
+        self.assertFalse(_alive(background))
+
+    def test_wall_clock_timeout_and_sigkill(self):
+        # 忽略 SIGTERM 且一直有输出的命令：只受总时间限制，宽限期后被 SIGKILL
+        command = "trap '' TERM; while true; do echo tick; sleep 0.05; done"
+        result = asyncio.run(run_command(command, timeout=0.5, idle_timeout=0, kill_grace=0.3))
+        self.assertEqual(result.timed_out, "timeout")
+        self.assertEqual(result.returncode, -signal.SIGKILL)
+        self.assertGreater(result.total_lines, 3)
+
+    def test_progress_events(self):
+        events = []
+
+        async def run():
+            with progress_listener(events.append):
+                return await run_command("for i in 1 2 3 4 5; do echo step $i; sleep 0.1; done", progress_interval=0.15)
+
+        result = asyncio.run(run())
+        self.assertEqual(result.returncode, 0)
+        kinds = [event["event"] for event in events]
+        self.assertEqual(kinds[0], "started")
+        self.assertEqual(kinds[-1], "finished")
+        self.assertIn("output", kinds)
+        self.assertEqual(events[-1]["lines"], 5)
+        reported = [line for event in events for line in event.get("recent", [])]
+        self.assertEqual(reported, [f"step {i}" for i in range(1, 6)])
+
+    def test_cancel_kills_command(self):
+        output = []
+
+        async def run():
+            task = asyncio.create_task(run_command("sleep 30 & echo $!; sleep 30", on_output=output.append))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        time.sleep(0.1)
+        self.assertFalse(_alive(int(b"".join(output).decode().strip())))
+
+    def test_excute_command_messages(self):
+        self.assertEqual(asyncio.run(excute_command("echo hi &amp;&amp; echo there")), "执行命令成功:\nhi\nthere")
+        self.assertEqual(asyncio.run(excute_command("true")), "执行命令成功")
+        failed = asyncio.run(excute_command("echo boom; exit 3"))
+        self.assertIn("退出码 3", failed)
+        self.assertIn("boom", failed)
+
+    def test_timeout_message(self):
+        result = asyncio.run(run_command("echo partial; sleep 30", idle_timeout=0.3))
+        message = format_command_result(result)
+        self.assertTrue(message.startswith("<tool_error>执行命令超时"))
+        self.assertIn("partial", message)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import time
+import asyncio
+import tempfile
+import unittest
+
+from ...plugins.command_runner import IS_UNIX
+from ...plugins.command_session import SpoolFile, CommandSessionManager, get_session_manager, session_owner, start_command, poll_command, read_command_output, kill_command
+
+"""
+测试脚本: 验证后台命令会话的 spool 文件上限、状态查询、输出读取、资源统计和终止。
+
+python -m beswarm.aient.aient.core.test.test_command_session
+"""
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 已退出但尚未被回收的进程
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().split()[2] != "Z"
+    except OSError:
+        return True
+
+class TestSpoolFile(unittest.TestCase):
+
+    def test_compacts_and_keeps_logical_offsets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spool = SpoolFile(os.path.join(directory, "out.log"), limit=100)
+            for i in range(30):
+                spool.write(f"{i:09d}\n".encode())
+            self.assertEqual(spool.total, 300)
+            self.assertLessEqual(spool.total - spool.start, 100)
+            self.assertLessEqual(os.path.getsize(spool.path), 100)
+            # 已丢弃的部分从 start 开始读
+            offset, data = spool.read(0, 10)
+            self.assertEqual(offset, spool.start)
+            self.assertEqual(data, f"{offset // 10:09d}\n".encode())
+            offset, data = spool.read(290, 100)
+            self.assertEqual((offset, data), (290, b"000000029\n"))
+            spool.write(b"more\n")
+            self.assertEqual(spool.read(300, 10), (300, b"more\n"))
+            spool.close()
+
+@unittest.skipUnless(IS_UNIX, "需要 pty 和进程组")
+class TestCommandSessions(unittest.TestCase):
+
+    def test_background_command_lifecycle(self):
+        manager = CommandSessionManager(sample_interval=0.2)
+
+        async def run():
+            session = await manager.start("for i in 1 2 3; do echo step $i; sleep 0.2; done")
+            self.assertTrue(session.running)
+            # 命令运行期间事件循环没有被占用
+            started = time.monotonic()
+            await asyncio.sleep(0.1)
+            self.assertLess(time.monotonic() - started, 0.3)
+            self.assertTrue(await manager.wait(session, 5))
+            self.assertEqual(session.status, "exited")
+            self.assertEqual(session.result.returncode, 0)
+            self.assertEqual(session.tail(), ["step 1", "step 2", "step 3"])
+            await manager.shutdown()
+
+        asyncio.run(run())
+
+    def test_kill_terminates_process_group(self):
+        manager = CommandSessionManager()
+
+        async def run():
+            session = await manager.start("sleep 30 & echo $!; sleep 30")
+            await asyncio.sleep(0.3)
+            background = int(session.tail()[0])
+            await manager.kill(session, kill_grace=0.5)
+            self.assertEqual(session.status, "killed")
+            await asyncio.sleep(0.1)
+            self.assertFalse(_alive(background))
+            await manager.shutdown()
+
+        asyncio.run(run())
+
+    def test_running_limit(self):
+        manager = CommandSessionManager(max_running=1)
+
+        async def run():
+            await manager.start("sleep 30")
+            with self.assertRaises(RuntimeError):
+                await manager.start("sleep 30")
+            await manager.shutdown()
+            self.assertEqual(manager.sessions, {})
+
+        asyncio.run(run())
+
+    def test_release_kills_only_owned_sessions(self):
+        manager = CommandSessionManager()
+        owner = object()
+
+        async def run():
+            with session_owner(owner):
+                owned = await manager.start("sleep 30")
+            other = await manager.start("sleep 30")
+            await manager.release(owner)
+            self.assertEqual(owned.status, "killed")
+            self.assertFalse(os.path.exists(owned.spool.path))
+            self.assertEqual(list(manager.sessions), [other.id])
+            self.assertTrue(other.running)
+            await manager.shutdown()
+
+        asyncio.run(run())
+
+    def test_exit_cleanup_kills_commands_and_removes_spool_dir(self):
+        manager = CommandSessionManager()
+
+        async def run():
+            session = await manager.start("sleep 30")
+            spool_dir = manager.spool_dir
+            manager._cleanup_at_exit()
+            self.assertFalse(os.path.exists(spool_dir))
+            self.assertTrue(await manager.wait(session, 5))
+            await manager.shutdown()
+
+        asyncio.run(run())
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "需要 /proc")
+    def test_resource_usage(self):
+        manager = CommandSessionManager(sample_interval=0.2)
+        command = "python -c 'x = bytearray(64 * 2 ** 20); [sum(range(10 ** 6)) for _ in range(20)]; import time; time.sleep(30)'"
+
+        async def run():
+            session = await manager.start(command)
+            for _ in range(50):
+                await asyncio.sleep(0.2)
+                session.sample()
+                if session.cpu_time > 0.2:
+                    break
+            self.assertGreater(session.cpu_time, 0.2)
+            self.assertGreater(session.peak_rss, 64 * 2 ** 20)
+            await manager.shutdown()
+
+        asyncio.run(run())
+
+    def test_tools(self):
+        async def run():
+            started = await start_command("echo first; sleep 0.2; echo second")
+            session_id = started.split("会话 ID: ")[1].split("，")[0]
+            summary = await poll_command(session_id, wait=5)
+            self.assertIn("exited，退出码 0", summary)
+            self.assertIn("second", summary)
+            output = await read_command_output(session_id, offset=0, max_chars=7)
+            self.assertIn("继续读取请使用 offset=7", output)
+            self.assertTrue(output.endswith("\nfirst"))
+            self.assertIn("没有找到会话", await kill_command("cmd-unknown"))
+            await get_session_manager().shutdown()
+
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import json
+import time
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..tokenizer import Tokenizer, register_tokenizer
+from ...models.chatgpt import chatgpt, ToolResult
+from ...models.compaction import SUMMARY_NAME, is_summary, default_compaction_model
+from ...architext.architext import UserMessage, AssistantMessage, Texts
+
+"""
+测试脚本: 验证对话接近 token 上限时的后台摘要压缩。
+
+本地模拟服务器对摘要请求延迟返回摘要文本，对普通请求立即返回。
+
+python -m beswarm.aient.aient.core.test.test_compaction
+"""
+
+class CharTokenizer(Tokenizer):
+    name = "chars"
+
+    def count(self, text):
+        return len(text)
+
+register_tokenizer("compaction-test", CharTokenizer)
+
+class MockSummaryHandler(BaseHTTPRequestHandler):
+    summary_delay = 0.3
+    summary_requests = []
+    summary_models = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if body["model"] == "missing-model":
+            type(self).summary_models.append(body["model"])
+            payload = json.dumps({"error": {"message": "model not found"}}).encode("utf-8")
+            self.send_response(404)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if "压缩" in body["messages"][0]["content"]:
+            type(self).summary_models.append(body["model"])
+            type(self).summary_requests.append(body["messages"][-1]["content"])
+            time.sleep(self.summary_delay)
+            content = "摘要：任务是分析数据。"
+        else:
+            content = "好的"
+        chunk = {"choices": [{"index": 0, "delta": {"role": "assistant", "content": content}}]}
+        payload = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except BrokenPipeError:
+            # 测试结束时仍在进行的摘要请求会被取消
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class TestCompaction(unittest.TestCase):
+
+    def setUp(self):
+        MockSummaryHandler.summary_requests = []
+        MockSummaryHandler.summary_models = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockSummaryHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_bot(self, truncate_limit, **kwargs):
+        bot = chatgpt(
+            api_key="test", engine="compaction-test", system_prompt="system",
+            api_url=f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions",
+            use_plugins=False, truncate_limit=truncate_limit, **kwargs,
+        )
+        conversation = bot.conversation["default"]
+        conversation.append(UserMessage(ToolResult("read_csv", json.dumps({"file_path": "/tmp/data.csv"}), "a,b\n1,2")))
+        conversation.append(AssistantMessage("早期分析" * 20))
+        conversation.append(UserMessage(ToolResult("search_web", json.dumps({"query": "unrelated query"}), "结果" * 20)))
+        conversation.append(AssistantMessage("继续分析" * 20))
+        conversation.append(UserMessage("请再看一下 /tmp/data.csv 的第二列"))
+        conversation.append(AssistantMessage("好的"))
+        return bot
+
+    def test_summary_runs_in_background_and_replaces_oldest_messages(self):
+        bot = self.make_bot(truncate_limit=400)
+
+        async def run():
+            started = time.monotonic()
+            await bot.ask_async("第一个问题")
+            first_latency = time.monotonic() - started
+            self.assertTrue(bot.compactor.pending("default"))
+            await asyncio.sleep(MockSummaryHandler.summary_delay + 0.2)
+            await bot.ask_async("第二个问题")
+            return first_latency
+
+        first_latency = asyncio.run(run())
+        # 摘要请求与主请求并行，不阻塞对话
+        self.assertLess(first_latency, MockSummaryHandler.summary_delay)
+        self.assertEqual(len(MockSummaryHandler.summary_requests), 1)
+
+        conversation = bot.conversation["default"]
+        self.assertTrue(is_summary(conversation[1]))
+        summary_text = conversation[1].provider(SUMMARY_NAME).content
+        self.assertIn("摘要：任务是分析数据。", summary_text)
+        # 被后续消息引用的工具结果原样保留，未被引用的被总结掉
+        kept = [provider.tool_name for provider in conversation[1].provider() if isinstance(provider, ToolResult)]
+        self.assertEqual(kept, ["read_csv"])
+
+        stats = bot.compactor.stats[0]
+        self.assertGreater(stats.tokens_saved, 0)
+        self.assertEqual(stats.kept_tool_results, 1)
+        self.assertGreaterEqual(stats.duration, MockSummaryHandler.summary_delay)
+
+    def test_evicted_messages_are_summarised(self):
+        bot = self.make_bot(truncate_limit=150)
+
+        async def run():
+            await bot.ask_async("第一个问题")
+            await asyncio.sleep(MockSummaryHandler.summary_delay + 0.2)
+            await bot.ask_async("第二个问题")
+        asyncio.run(run())
+
+        # 超过上限的消息被立即移除，但内容进入了摘要请求
+        self.assertIn("早期分析", MockSummaryHandler.summary_requests[0])
+        self.assertTrue(any(is_summary(message) for message in bot.conversation["default"]))
+
+    def compact(self, bot):
+        async def run():
+            await bot.ask_async("第一个问题")
+            await asyncio.sleep(MockSummaryHandler.summary_delay + 0.2)
+            await bot.ask_async("第二个问题")
+        asyncio.run(run())
+
+    def test_goal_survives_compaction(self):
+        bot = self.make_bot(truncate_limit=400)
+        goal = Texts("分析 /tmp/data.csv 并给出结论", name="goal")
+        bot.conversation["default"][1].insert(0, goal)
+        self.compact(bot)
+
+        conversation = bot.conversation["default"]
+        self.assertTrue(is_summary(conversation[1]))
+        self.assertIs(conversation.provider("goal"), goal)
+        # 目标仍在摘要消息的开头，不会被总结掉
+        self.assertIs(conversation[1].provider()[0], goal)
+
+    def test_default_compaction_model_is_a_cheap_one(self):
+        self.assertEqual(default_compaction_model("gpt-4.1"), "gpt-4o-mini")
+        self.assertEqual(default_compaction_model("openrouter/anthropic/claude-sonnet-4"), "openrouter/anthropic/claude-3-5-haiku-latest")
+        self.assertEqual(default_compaction_model("gemini-2.5-pro"), "gemini-2.0-flash")
+        self.assertEqual(default_compaction_model("deepseek-chat"), "deepseek-chat")
+
+    def test_unavailable_compaction_model_falls_back_to_main_engine(self):
+        bot = self.make_bot(truncate_limit=400, compaction_model="missing-model")
+        self.compact(bot)
+        self.assertEqual(MockSummaryHandler.summary_models, ["missing-model", "compaction-test"])
+        self.assertEqual(bot.compaction_model, "compaction-test")
+        self.assertTrue(is_summary(bot.conversation["default"][1]))
+
+    def test_compaction_can_be_disabled(self):
+        bot = chatgpt(api_key="test", engine="compaction-test", use_plugins=False, compaction=False)
+        self.assertIsNone(bot.compactor)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import socket
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..connection import ConnectionManager, DNSCache, PoolConfig, ConnectionStats, get_connection_manager
+from ...models.chatgpt import chatgpt
+
+"""
+测试脚本: 验证进程级共享连接池、DNS 缓存和连接复用统计。
+
+python -m beswarm.aient.aient.core.test.test_connection
+"""
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # 头和正文分两次写出，关闭 Nagle 算法避免 keep-alive 连接上的延迟确认
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://localhost:{self.server.server_port}/v1/chat/completions"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_clients_are_shared_per_origin_and_loop(self):
+        async def clients():
+            first = chatgpt(api_key="test", api_url=self.url, use_plugins=False)
+            second = chatgpt(api_key="test", api_url=self.url.replace("chat/completions", "responses"), use_plugins=False)
+            other = chatgpt(api_key="test", api_url="https://api.example.com/v1/chat/completions", use_plugins=False)
+            return first.aclient, second.aclient, other.aclient
+
+        first, second, other = asyncio.run(clients())
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        # 新的事件循环使用新的客户端，但共享 SSL 上下文
+        again, _, _ = asyncio.run(clients())
+        self.assertIsNot(first, again)
+        manager = get_connection_manager()
+        self.assertIs(first._transport._pool._ssl_context, again._transport._pool._ssl_context)
+        self.assertIs(first._transport._pool._ssl_context, manager.ssl_context())
+
+    def test_connections_are_reused_and_counted(self):
+        manager = ConnectionManager(PoolConfig(http2=False))
+
+        async def run():
+            for _ in range(5):
+                response = await manager.get_client(self.url).get(self.url)
+                self.assertEqual(response.text, "ok")
+
+        asyncio.run(run())
+        stats = manager.connection_stats()[f"http://localhost:{self.server.server_port}"]
+        self.assertEqual(stats.requests, 5)
+        self.assertEqual(stats.connections, 1)
+        self.assertEqual(stats.reused, 4)
+        self.assertEqual(stats.dns_lookups, 1)
+
+    def test_dns_cache(self):
+        cache = DNSCache(ttl=60)
+        stats = ConnectionStats()
+
+        async def run():
+            first = await cache.resolve("localhost", 80, stats)
+            await cache.resolve("localhost", 80, stats)
+            self.assertEqual(await cache.resolve("127.0.0.1", 80, stats), "127.0.0.1")
+            cache.invalidate("localhost", 80)
+            await cache.resolve("localhost", 80, stats)
+            return first
+
+        self.assertIn(asyncio.run(run()), ("127.0.0.1", "::1"))
+        self.assertEqual((stats.dns_lookups, stats.dns_hits), (2, 1))
+        self.assertEqual(asyncio.run(DNSCache(ttl=0).resolve("localhost", 80)), "localhost")
+
+    def test_pool_config_from_env(self):
+        import os
+        from unittest import mock
+        with mock.patch.dict(os.environ, {"OCEANS_HTTP_MAX_CONNECTIONS": "8", "OCEANS_HTTP2": "0", "OCEANS_DNS_TTL": "bad"}):
+            config = PoolConfig.from_env()
+        self.assertEqual(config.max_connections, 8)
+        self.assertFalse(config.http2)
+        self.assertEqual(config.dns_ttl, 300.0)
+        self.assertFalse(ConnectionManager(config).http2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import io
+import time
+import base64
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+from ..utils import ImagePartCache, get_image_from_url, get_image_message, image_part_cache, prepare_image_messages, remote_image_cache
+from ..request import prepare_request_payload
+
+"""
+测试脚本: 验证图片消息片段的并发准备和按内容缓存，以及远程图片每轮都向服务端确认是否变化。
+
+python -m beswarm.aient.aient.core.test.test_image_cache
+"""
+
+def make_image(color, image_format="PNG", size=(64, 64)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+def data_url(content, mime_type="image/png"):
+    return f"data:{mime_type};base64," + base64.b64encode(content).decode("utf-8")
+
+class SlowImageHandler(BaseHTTPRequestHandler):
+    delay = 0.2
+    requests = 0
+    not_modified = 0
+    # 每个路径当前的版本，版本变化表示同一个 URL 的图片内容变了
+    versions = {}
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests += 1
+        time.sleep(self.delay)
+        index = int(self.path.strip("/"))
+        version = cls.versions.get(index, 0)
+        etag = f'"{index}-{version}"'
+        if self.headers.get("If-None-Match") == etag:
+            cls.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = make_image(((index * 10 + version * 100) % 255, 0, 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ImageServer(ThreadingHTTPServer):
+    # 默认的 listen backlog 只有 5，并发连接会被丢弃并在 1 秒后重试
+    request_queue_size = 64
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        image_part_cache.clear()
+        remote_image_cache.clear()
+        SlowImageHandler.requests = 0
+        SlowImageHandler.not_modified = 0
+        SlowImageHandler.versions = {}
+
+    def start_server(self):
+        server = ImageServer(("127.0.0.1", 0), SlowImageHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    def test_identical_images_are_encoded_once(self):
+        url = data_url(make_image((255, 0, 0)))
+        hits = image_part_cache.hits
+        first = asyncio.run(get_image_message(url, "claude"))
+        # 内容相同的另一个字符串对象也会命中
+        second = asyncio.run(get_image_message("".join([url[:10], url[10:]]), "vertex-claude"))
+        self.assertEqual(first, second)
+        self.assertEqual(image_part_cache.hits - hits, 1)
+        # 返回值可以安全修改
+        first["cache_control"] = {"type": "ephemeral"}
+        first["source"]["data"] = ""
+        self.assertNotIn("cache_control", asyncio.run(get_image_message(url, "claude")))
+        self.assertTrue(asyncio.run(get_image_message(url, "claude"))["source"]["data"])
+
+        gemini = asyncio.run(get_image_message(url, "gemini"))
+        self.assertEqual(gemini["inlineData"]["data"], second["source"]["data"])
+        with self.assertRaises(ValueError):
+            asyncio.run(get_image_message(url, "cohere"))
+
+    def test_webp_is_converted_to_png(self):
+        url = data_url(make_image((0, 255, 0), "WEBP"), "image/webp")
+        message = asyncio.run(get_image_message(url, "gpt"))
+        self.assertTrue(message["image_url"]["url"].startswith("data:image/png;base64,"))
+        self.assertEqual(asyncio.run(get_image_message(url, "gpt")), message)
+
+    def test_lru_is_bounded_by_bytes(self):
+        cache = ImagePartCache(max_bytes=10)
+
+        async def run():
+            for index in range(5):
+                await cache.get(("k", index), lambda index=index: asyncio.sleep(0, result="abcd"))
+        asyncio.run(run())
+        self.assertEqual(len(cache._entries), 2)
+        self.assertLessEqual(cache._bytes, 10)
+
+    def test_inflight_is_per_event_loop(self):
+        cache = ImagePartCache()
+        started = threading.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(0.2)
+            return "slow"
+
+        async def quick():
+            return "quick"
+
+        # 另一个线程的事件循环正在计算同一个键，这里不能等待属于那个循环的 future
+        worker = threading.Thread(target=lambda: asyncio.run(cache.get(("k",), slow)))
+        worker.start()
+        started.wait()
+        self.assertEqual(asyncio.run(cache.get(("k",), quick)), "quick")
+        worker.join()
+        self.assertEqual(len(cache._inflight), 0)
+
+    def test_remote_images_are_fetched_concurrently_and_revalidated(self):
+        base_url = self.start_server()
+        provider = {"provider": "test", "base_url": "https://api.anthropic.com/v1/messages", "api": "key", "model": ["claude-3-5-sonnet"]}
+        content = [{"type": "text", "text": "比较这些图片"}]
+        content += [{"type": "image_url", "image_url": {"url": f"{base_url}/{index}"}} for index in range(10)]
+        request_data = {"model": "claude-3-5-sonnet", "messages": [{"role": "user", "content": content}], "stream": True}
+        # 预热服务端和客户端，避免首次导入的耗时计入
+        asyncio.run(get_image_from_url(f"{base_url}/99"))
+        SlowImageHandler.requests = 0
+        started = time.monotonic()
+        _, _, payload, _ = asyncio.run(prepare_request_payload(provider, request_data))
+        elapsed = time.monotonic() - started
+        # 同一个请求中每个 URL 只请求一次
+        self.assertEqual(SlowImageHandler.requests, 10)
+        _, _, second, _ = asyncio.run(prepare_request_payload(provider, request_data))
+
+        images = [part for part in payload["messages"][0]["content"] if part["type"] == "image"]
+        self.assertEqual(len(images), 10)
+        self.assertLess(elapsed, 10 * SlowImageHandler.delay / 2)
+        # 第二轮对话只发条件请求，内容没变时沿用上次的结果
+        self.assertEqual(SlowImageHandler.requests, 20)
+        self.assertEqual(SlowImageHandler.not_modified, 10)
+        self.assertEqual(second["messages"][0]["content"], payload["messages"][0]["content"])
+
+    def test_changed_remote_image_is_not_stale(self):
+        url = self.start_server() + "/3"
+        first = asyncio.run(get_image_message(url, "gpt"))
+        self.assertEqual(asyncio.run(get_image_message(url, "gpt")), first)
+        SlowImageHandler.versions[3] = 1
+        changed = asyncio.run(get_image_message(url, "gpt"))
+        self.assertNotEqual(changed, first)
+        self.assertEqual(SlowImageHandler.not_modified, 1)
+
+    def test_prepare_ignores_unknown_engines(self):
+        asyncio.run(prepare_image_messages([], "cohere"))
+
+if __name__ == "__main__":
+    unittest.main()
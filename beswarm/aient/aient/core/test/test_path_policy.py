@@ -0,0 +1,114 @@
+import os
+import sys
+import random
+import fnmatch
+import tempfile
+import unittest
+import subprocess
+
+from ...utils.path_policy import PathPolicy
+from ...utils.scripts import Sandbox, INJECTION_CODE
+
+"""
+测试脚本: 验证编译后的路径规则与原来逐条 fnmatch 的判断一致，以及注入子进程的沙箱使用同一个匹配器。
+
+python -m beswarm.aient.aient.core.test.test_path_policy
+"""
+
+def legacy_match(patterns, target_path):
+    """原 Sandbox._is_path_protected 的逐条匹配。"""
+    abs_target_path = os.path.abspath(target_path)
+    for pattern in patterns:
+        if '*' in pattern or '?' in pattern or '[' in pattern:
+            if fnmatch.fnmatch(abs_target_path, pattern):
+                return True
+        elif abs_target_path == pattern or abs_target_path.startswith(pattern + os.sep):
+            return True
+    return False
+
+PATTERNS = [
+    "/srv/data",
+    "/srv/data.bak/readme.txt",
+    "/",
+    "/etc/pass[wd]d",
+    "/**/*beswarm*/**",
+    "/home/*/.ssh/*",
+    "/tmp/a?c",
+    "/opt/app (1)/cfg+.json",
+]
+
+class TestPathPolicy(unittest.TestCase):
+
+    def test_matches_legacy_loop_on_random_paths(self):
+        rng = random.Random(0)
+        parts = ["srv", "data", "data.bak", "readme.txt", "etc", "passwd", "passdd", "home", "alice", ".ssh",
+                 "id_rsa", "tmp", "abc", "a/c", "beswarm", "my-beswarm-x", "opt", "app (1)", "cfg+.json", ".."]
+        abs_patterns = [os.path.abspath(p) for p in PATTERNS]
+        for size in range(len(PATTERNS) + 1):
+            patterns = abs_patterns[:size]
+            policy = PathPolicy(patterns)
+            for _ in range(400):
+                path = "/" + "/".join(rng.choice(parts) for _ in range(rng.randint(0, 5)))
+                self.assertEqual(policy.matches(path), legacy_match(patterns, path), (patterns, path))
+
+    def test_relative_paths_use_current_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            policy = PathPolicy([os.path.join(tmp, "secret")])
+            cwd = os.getcwd()
+            try:
+                os.chdir(tmp)
+                self.assertTrue(policy.matches("secret/key.pem"))
+                self.assertTrue(policy.matches(b"./secret"))
+                self.assertFalse(policy.matches("secretive"))
+            finally:
+                os.chdir(cwd)
+            self.assertFalse(policy.matches("secret/key.pem"))
+
+    def test_cache_and_non_path_arguments(self):
+        policy = PathPolicy(["/srv/data"], cache_size=2)
+        for _ in range(3):
+            self.assertTrue(policy.matches("/srv/data/x"))
+        self.assertEqual(policy.cache_info().hits, 2)
+        self.assertFalse(policy.matches(3))
+        self.assertFalse(PathPolicy([]).matches("/srv/data"))
+
+    def test_sandbox_recompiles_on_new_rule(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            target = os.path.join(tmp, "notes.txt")
+            box = Sandbox(readonly_paths=[], no_read_paths=[])
+            saved = os.environ.get("SANDBOX_READONLY_PATHS")
+            try:
+                self.assertFalse(box._is_path_protected(target))
+                box.add_readonly_path(tmp)
+                self.assertTrue(box._is_path_protected(target))
+                with self.assertRaises(PermissionError):
+                    box._sandboxed_open(target, "w")
+            finally:
+                box.disable()
+                if saved is None:
+                    os.environ.pop("SANDBOX_READONLY_PATHS", None)
+                else:
+                    os.environ["SANDBOX_READONLY_PATHS"] = saved
+
+    def test_injected_subprocess_uses_policy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            secret = os.path.join(tmp, "secret.txt")
+            with open(secret, "w") as f:
+                f.write("x")
+            env = dict(os.environ, SANDBOX_READONLY_PATHS=os.path.join(tmp, "*.log"), SANDBOX_EXEC_NO_READ_PATHS=os.path.join(tmp, "*.txt"))
+            code = (
+                "import sys\n"
+                "for path, mode in ((sys.argv[1], 'r'), (sys.argv[1] + '.log', 'w'), (sys.argv[1] + '.out', 'w')):\n"
+                "    try:\n"
+                "        open(path, mode).close(); print('ok')\n"
+                "    except PermissionError:\n"
+                "        print('denied')\n"
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", INJECTION_CODE, "-c", code, secret],
+                env=env, capture_output=True, text=True, timeout=30,
+            )
+            self.assertEqual(result.stdout.split(), ["denied", "denied", "ok"], result.stderr)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import copy
+import asyncio
+import unittest
+import threading
+
+from ..models import RequestModel
+from ..request import MessageModelCache, prepare_request_payload, get_payload, message_model_cache
+
+"""
+测试脚本: 验证构造请求体时对已校验消息和转换结果的缓存。
+
+python -m beswarm.aient.aient.core.test.test_payload_cache
+"""
+
+def provider_for(name, model, base_url):
+    return {"provider": name, "base_url": base_url, "api": "key", "model": [model], "tools": True, "image": True}
+
+PROVIDERS = {
+    "gpt": provider_for("gpt", "gpt-4o", "https://api.openai.com/v1/chat/completions"),
+    "o1": provider_for("gpt", "o1-mini", "https://api.openai.com/v1/chat/completions"),
+    "claude": provider_for("claude", "claude-3-5-sonnet", "https://api.anthropic.com/v1/messages"),
+    "gemini": provider_for("gemini", "gemini-2.5-pro", "https://generativelanguage.googleapis.com/v1beta"),
+}
+
+def conversation():
+    return [
+        {"role": "system", "content": "你是一个科研写作助手。"},
+        {"role": "user", "content": "读取文件"},
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "call_1", "type": "function", "function": {"name": "read_file", "arguments": '{"file_path": "a.txt"}'}},
+        ]},
+        {"role": "tool", "tool_call_id": "call_1", "name": "read_file", "content": "文件内容"},
+        {"role": "assistant", "content": "已读取"},
+        {"role": "user", "content": [{"type": "text", "text": "继续"}]},
+    ]
+
+def build(name, messages):
+    provider = PROVIDERS[name]
+    request_data = {"model": provider["model"][0], "messages": messages, "stream": True}
+    return asyncio.run(prepare_request_payload(provider, request_data))
+
+def build_uncached(name, messages):
+    provider = PROVIDERS[name]
+    request = RequestModel(model=provider["model"][0], messages=copy.deepcopy(messages), stream=True)
+    engine = "gpt" if name == "o1" else name
+    return asyncio.run(get_payload(request, engine, provider, api_key=provider["api"]))
+
+class TestPayloadCache(unittest.TestCase):
+
+    def setUp(self):
+        message_model_cache.clear()
+
+    def test_unchanged_messages_hit_the_cache(self):
+        messages = conversation()
+        build("gpt", messages)
+        self.assertEqual(message_model_cache.misses, len(messages))
+        hits = message_model_cache.hits
+        build("gpt", messages + [{"role": "user", "content": "新问题"}])
+        self.assertEqual(message_model_cache.hits - hits, len(messages))
+        self.assertEqual(message_model_cache.misses, len(messages) + 1)
+
+    def test_payloads_match_uncached_build(self):
+        messages = conversation()
+        for name in PROVIDERS:
+            with self.subTest(provider=name):
+                expected = build_uncached(name, messages)[2]
+                # 第二次构造走缓存，结果应与第一次以及不经过缓存的结果一致
+                first = build(name, messages)[2]
+                second = build(name, messages)[2]
+                self.assertEqual(first, expected)
+                self.assertEqual(second, expected)
+
+    def test_gemini_does_not_mutate_cached_messages(self):
+        messages = conversation()
+        payload = build("gemini", messages)[2]
+        self.assertIn("model", [content["role"] for content in payload["contents"]])
+        validated = message_model_cache.validate(messages)
+        self.assertIn("assistant", [msg.role for msg in validated])
+        # gemini 之后再构造 gpt 请求，assistant 角色保持不变
+        gpt_roles = [msg["role"] for msg in build("gpt", messages)[2]["messages"]]
+        self.assertNotIn("model", gpt_roles)
+
+    def test_o1_system_merge_does_not_mutate_cached_forms(self):
+        messages = [{"role": "system", "content": "系统提示。"}, {"role": "user", "content": "问题"}]
+        first = build("o1", messages)[2]["messages"]
+        second = build("o1", messages)[2]["messages"]
+        self.assertEqual(first, [{"role": "user", "content": "系统提示。问题"}])
+        self.assertEqual(second, first)
+
+    def test_eviction_drops_converted_forms(self):
+        cache = MessageModelCache(maxsize=2)
+        first, second, third = cache.validate([{"role": "user", "content": f"消息{index}"} for index in range(3)])
+        self.assertEqual(len(cache._entries), 2)
+        self.assertEqual(set(cache._converted), {id(second), id(third)})
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            return ["converted"]
+
+        async def convert_twice(message):
+            return [await cache.convert(message, ("gpt",), factory) for _ in range(2)]
+        # 被淘汰的消息每次都重新转换，仍在缓存中的只转换一次
+        asyncio.run(convert_twice(first))
+        self.assertEqual(len(calls), 2)
+        asyncio.run(convert_twice(third))
+        self.assertEqual(len(calls), 3)
+        # 再次出现的被淘汰消息重新校验，淘汰最久未使用的一条
+        self.assertIsNot(cache.validate([{"role": "user", "content": "消息0"}])[0], first)
+        self.assertEqual(cache.misses, 4)
+        self.assertNotIn(id(second), cache._converted)
+
+    def test_concurrent_threads_keep_entries_consistent(self):
+        cache = MessageModelCache(maxsize=16)
+        errors = []
+
+        def worker(seed):
+            try:
+                for turn in range(200):
+                    messages = [{"role": "user", "content": f"消息{(seed + turn + index) % 40}"} for index in range(8)]
+                    for message, model in zip(messages, cache.validate(messages)):
+                        assert model.content == message["content"]
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache._entries), 16)
+        self.assertEqual(set(cache._converted), {id(model) for model in cache._entries.values()})
+        self.assertEqual(cache.hits + cache.misses, 8 * 200 * 8)
+
+if __name__ == "__main__":
+    unittest.main()
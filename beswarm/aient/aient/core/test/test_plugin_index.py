@@ -0,0 +1,135 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+from ...plugins import manifest
+from ...plugins.manifest import scan_source, load_plugin_index
+from ...plugins.config import function_to_json, tool_schema
+from ...plugins.registry import registry
+
+"""
+测试脚本: 验证插件清单（静态分析出的 schema 与 function_to_json 一致、按 mtime 失效）和工具的延迟导入。
+
+python -m beswarm.aient.aient.core.test.test_plugin_index
+"""
+
+SAMPLE = '''
+from ..plugins.registry import register_tool
+
+@register_tool()
+def search(query: str, limit: int = 10, exact: bool = False, ratio: float = 0.5, *tags, scope=None, **extra) -> str:
+    """
+    搜索。
+
+    Args:
+        query: 关键词
+    """
+    return query
+
+@register_tool("renamed")
+async def stream(path, chunk_size: int = 1024):
+    """读取文件"""
+    yield path
+
+def helper():
+    return 1
+'''
+
+def exec_functions(source):
+    namespace = {}
+    exec(compile(source.replace("from ..plugins.registry import register_tool", "register_tool = lambda *a, **k: (lambda f: f)"), "<sample>", "exec"), namespace)
+    return namespace
+
+class TestScanSource(unittest.TestCase):
+
+    def test_schema_matches_function_to_json(self):
+        entries = scan_source(SAMPLE)
+        namespace = exec_functions(SAMPLE)
+        self.assertEqual([entry["name"] for entry in entries], ["search", "renamed"])
+        for entry in entries:
+            func = namespace[entry["function"]]
+            self.assertEqual(entry["schema"], function_to_json(func))
+        self.assertEqual(entries[0]["kind"], "function")
+        self.assertEqual(entries[0]["return_type"], "<class 'str'>")
+        self.assertEqual(entries[1]["kind"], "async_generator")
+
+    def test_future_annotations(self):
+        source = "from __future__ import annotations\n" + SAMPLE
+        namespace = exec_functions(source)
+        for entry in scan_source(source):
+            self.assertEqual(entry["schema"], function_to_json(namespace[entry["function"]]))
+
+    def test_dynamic_registration_is_not_static(self):
+        for source in [
+            "from x import register_tool\nNAME = 'a'\n@register_tool(NAME)\ndef f(): pass\n",
+            "from x import register_tool\ndef f(): pass\nregister_tool()(f)\n",
+            "from x import register_tool\n@register_tool\ndef f(): pass\n",
+            "from x import register_tool\n@cache\n@register_tool()\ndef f(): pass\n",
+            "def f(:\n",
+        ]:
+            with self.subTest(source=source):
+                self.assertIsNone(scan_source(source))
+
+class TestPluginIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.index_path = os.path.join(self.tmp.name, "cache", "index.json")
+        with open(os.path.join(self.tmp.name, "sample.py"), "w", encoding="utf-8") as f:
+            f.write(SAMPLE)
+
+    def test_cached_until_source_changes(self):
+        with mock.patch.object(manifest, "scan_source", wraps=scan_source) as scan:
+            first = load_plugin_index(self.tmp.name, ["sample", "missing"], self.index_path)
+            second = load_plugin_index(self.tmp.name, ["sample", "missing"], self.index_path)
+            self.assertEqual(scan.call_count, 1)
+            self.assertEqual(first, second)
+            self.assertIsNone(first["missing"])
+
+            path = os.path.join(self.tmp.name, "sample.py")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n@register_tool()\ndef extra(): pass\n")
+            third = load_plugin_index(self.tmp.name, ["sample"], self.index_path)
+            self.assertEqual(scan.call_count, 2)
+            self.assertEqual([entry["name"] for entry in third["sample"]], ["search", "renamed", "extra"])
+
+        with open(self.index_path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["version"], manifest.INDEX_VERSION)
+
+class TestLazyPlugins(unittest.TestCase):
+
+    def test_import_does_not_load_plugin_modules(self):
+        code = (
+            "import sys\n"
+            "import beswarm.aient.aient.plugins as plugins\n"
+            "loaded = [m for m in sys.modules if m.startswith('beswarm.aient.aient.plugins.') and m.rsplit('.', 1)[1] not in plugins.excluded_modules]\n"
+            "print(len(loaded), len(plugins.registry.tools))\n"
+        )
+        env = dict(os.environ, OCEANS_PLUGIN_INDEX=os.path.join(tempfile.mkdtemp(), "index.json"))
+        env.pop("OCEANS_EAGER_PLUGINS", None)
+        env.pop("OCEANS_MINIMAL_PLUGINS", None)
+        output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout.split()
+        self.assertEqual(output[0], "0")
+        self.assertGreater(int(output[1]), 0)
+
+    def test_lazy_tool_resolves_on_first_use(self):
+        from ... import plugins
+        self.assertIn("get_time", registry.tools)
+        schema = tool_schema("get_time")
+        func = plugins.get_time
+        self.assertFalse(registry.is_lazy("get_time"))
+        self.assertIs(registry.tools["get_time"], func)
+        self.assertEqual(schema, function_to_json(func))
+        self.assertTrue(func().strip())
+        # 导入同名子模块后，包上导出的仍是工具函数
+        import importlib
+        importlib.import_module(f"{plugins.__name__}.excute_command")
+        self.assertTrue(callable(plugins.excute_command))
+
+if __name__ == "__main__":
+    unittest.main()
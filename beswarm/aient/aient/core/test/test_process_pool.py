@@ -0,0 +1,134 @@
+import os
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+from ..process_pool import ProcessPoolService
+
+"""
+测试脚本: 验证共享进程池的任务接口、子进程回收、内存上限，以及 read_file / edit_file 使用进程池后的结果不变。
+
+python -m beswarm.aient.aient.core.test.test_process_pool
+"""
+
+def write_text_pdf(path: str, pages: int, lines_per_page: int):
+    """写一个只包含 Helvetica 文本的 PDF。"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        text = [b"BT /F1 10 Tf 12 TL 50 780 Td"]
+        for line in range(lines_per_page):
+            text.append(f"(Page {page} line {line}: the quick brown fox jumps over the lazy dog {page * line}) '".encode())
+        text.append(b"ET")
+        stream = b"\n".join(text)
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+
+def worker_pid(_=None):
+    return os.getpid()
+
+def fail(message):
+    raise ValueError(message)
+
+def allocate(megabytes):
+    return len(bytearray(megabytes * 1024 * 1024))
+
+class TestProcessPoolService(unittest.TestCase):
+
+    def make_pool(self, **kwargs):
+        pool = ProcessPoolService(**kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_run_in_worker_and_propagate_errors(self):
+        pool = self.make_pool(max_workers=1)
+        self.assertNotEqual(pool.run(worker_pid), os.getpid())
+        self.assertNotEqual(asyncio.run(pool.run_async(worker_pid)), os.getpid())
+        with self.assertRaises(ValueError):
+            pool.run(fail, "boom")
+        self.assertEqual(pool.map(pow, [2, 3], [3, 2]), [8, 9])
+        self.assertEqual(pool.stats()["failed"], 1)
+
+    def test_disabled_pool_runs_inline(self):
+        pool = self.make_pool(enabled=False)
+        self.assertEqual(pool.run(worker_pid), os.getpid())
+        self.assertEqual(asyncio.run(pool.run_async(pow, 2, 5)), 32)
+        self.assertEqual(pool.stats()["inline"], 2)
+
+    def test_workers_recycled_after_max_tasks(self):
+        pool = self.make_pool(max_workers=1, max_tasks_per_child=2)
+        pids = [pool.run(worker_pid) for _ in range(6)]
+        self.assertGreaterEqual(len(set(pids)), 3)
+
+    def test_pool_replaced_when_worker_rss_too_high(self):
+        pool = self.make_pool(max_workers=1, recycle_rss_mb=1)
+        first = pool.run(worker_pid)
+        second = pool.run(worker_pid)
+        self.assertNotEqual(first, second)
+        self.assertGreaterEqual(pool.stats()["recycled"], 1)
+        self.assertGreater(pool.stats()["peak_worker_rss"], 1024 * 1024)
+
+    @unittest.skipUnless(hasattr(os, "sysconf") and os.path.exists("/proc/self/statm"), "RLIMIT_AS 只在 Linux 上验证")
+    def test_memory_limit_raises_in_worker(self):
+        pool = self.make_pool(max_workers=1, memory_limit_mb=1024)
+        with self.assertRaises(MemoryError):
+            pool.run(allocate, 2048)
+        # 子进程仍然可用
+        self.assertEqual(pool.run(allocate, 16), 16 * 1024 * 1024)
+
+class TestCallSites(unittest.TestCase):
+
+    def test_read_file_pdf_through_pool(self):
+        from .....tools.read_file import read_file
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "doc.pdf")
+        write_text_pdf(path, 2, 3)
+        text = read_file(path)
+        self.assertIn("Page 1 line 2", text)
+
+    def test_document_extract_relative_path_after_chdir(self):
+        from ...utils.scripts import Document_extract
+        from ..process_pool import get_process_pool
+        # 子进程在切换目录之前启动
+        self.assertIsNotNone(get_process_pool().run(worker_pid))
+        directory = tempfile.mkdtemp()
+        write_text_pdf(os.path.join(directory, "paper.pdf"), 2, 3)
+        cwd = os.getcwd()
+        try:
+            os.chdir(directory)
+            prompt = asyncio.run(Document_extract(None, "paper.pdf"))
+        finally:
+            os.chdir(cwd)
+        self.assertIn("Page 1 line 2", prompt)
+
+    def test_chunked_fuzzy_match_matches_sequential(self):
+        from .....tools.edit_file import find_best_match, _score_positions
+        content_lines = [f"    value_{i % 37} = compute(alpha, beta_{i % 11})" for i in range(600)]
+        search_lines = ["    value_5 = compute(alpha, beta_9)", "    value_6 = compute(alpha, beta_10)"]
+        positions = len(content_lines) - len(search_lines) + 1
+        # 阈值设为 0，强制分块提交到进程池
+        with mock.patch(f"{find_best_match.__module__}.FUZZY_MATCH_POOL_THRESHOLD", 0):
+            for precision in (0.9, 0.99):
+                with self.subTest(precision=precision):
+                    expected = _score_positions(search_lines, content_lines, 0, positions, precision)
+                    self.assertEqual(find_best_match(search_lines, content_lines, precision), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import json
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..request import prepare_request_payload, order_messages_for_prompt_cache
+from ...models.chatgpt import chatgpt
+from ...architext.architext import SystemMessage, Texts, CacheBreakpoint
+
+"""
+测试脚本: 验证提示词前缀在多轮对话之间保持字节一致，以便命中服务端的提示词缓存。
+
+本地启动一个模拟的 OpenAI 兼容服务器，记录每次请求的原始字节，并在 usage 中返回 cached_tokens。
+
+python -m beswarm.aient.aient.core.test.test_prompt_cache
+"""
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    bodies = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        type(self).bodies.append(body)
+        cached_tokens = 100 if len(type(self).bodies) > 1 else 0
+        chunks = [
+            {"choices": [{"index": 0, "delta": {"role": "assistant", "content": "收到"}}]},
+            {"choices": [], "usage": {"prompt_tokens": 120, "completion_tokens": 2, "total_tokens": 122, "prompt_tokens_details": {"cached_tokens": cached_tokens}}},
+        ]
+        payload = "".join(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.write(payload.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+class TestPromptCache(unittest.TestCase):
+
+    def setUp(self):
+        MockOpenAIHandler.bodies = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAIHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.turn = 0
+
+        def current_turn():
+            self.turn += 1
+            return f"turn-{self.turn}"
+
+        self.system_prompt = SystemMessage(f"""
+你是一个有用的AI助手。
+{Texts("稳定的工具说明", name="tools_doc")}
+{CacheBreakpoint()}
+当前时间：{Texts(current_turn)}
+""")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_prefix_bytes_identical_across_turns(self):
+        bot = chatgpt(
+            api_key="test",
+            engine="gpt-4o",
+            api_url=f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions",
+            system_prompt=self.system_prompt,
+            use_plugins=False,
+        )
+
+        async def run():
+            for question in ["第一个问题", "第二个问题"]:
+                async for _ in bot.ask_stream_async(question):
+                    pass
+        asyncio.run(run())
+
+        first, second = MockOpenAIHandler.bodies
+        # 第一轮请求中截至第一个问题为止的字节，必须原样出现在第二轮请求的开头
+        def encoded(text):
+            return json.dumps(text)[1:-1].encode("utf-8")
+        prefix_end = first.index(encoded("第一个问题")) + len(encoded("第一个问题"))
+        self.assertEqual(first[:prefix_end], second[:prefix_end])
+        self.assertIn(encoded("稳定的工具说明"), first[:prefix_end])
+
+        # 易变内容被移到最后一条 user 消息末尾，且每轮都不同
+        first_messages = json.loads(first)["messages"]
+        second_messages = json.loads(second)["messages"]
+        self.assertIsInstance(first_messages[0]["content"], str)
+        self.assertNotIn("turn-", first_messages[0]["content"])
+        self.assertIn("turn-1", first_messages[-1]["content"])
+        self.assertIn("turn-2", second_messages[-1]["content"])
+        self.assertEqual(second_messages[1]["content"], "第一个问题")
+
+        # usage 中的缓存命中 token 被记录下来
+        self.assertEqual(bot.cached_tokens["default"], 100)
+
+    def test_claude_payload_emits_cache_breakpoints(self):
+        provider = {
+            "provider": "anthropic",
+            "base_url": "https://api.anthropic.com/v1/messages",
+            "api": "test",
+            "model": ["claude-sonnet-4-20250514"],
+            "tools": True,
+        }
+
+        async def build(turn_messages):
+            messages = [await self.system_prompt.render_latest()] + turn_messages
+            _, _, payload, engine = await prepare_request_payload(provider, {"model": "claude-sonnet-4-20250514", "messages": messages})
+            self.assertEqual(engine, "claude")
+            return payload
+
+        first = asyncio.run(build([{"role": "user", "content": "第一个问题"}]))
+        second = asyncio.run(build([
+            {"role": "user", "content": "第一个问题"},
+            {"role": "assistant", "content": "收到"},
+            {"role": "user", "content": "第二个问题"},
+        ]))
+
+        self.assertEqual(first["system"], second["system"])
+        self.assertEqual(first["system"][0]["cache_control"], {"type": "ephemeral"})
+        self.assertNotIn("turn-", first["system"][0]["text"])
+
+        # 断点位于最后一条 user 消息的易变内容之前，下一轮可以命中历史对话缓存
+        last_blocks = first["messages"][-1]["content"]
+        self.assertEqual(last_blocks[0], {"type": "text", "text": "第一个问题", "cache_control": {"type": "ephemeral"}})
+        self.assertIn("turn-1", last_blocks[1]["text"])
+        self.assertNotIn("cache_control", last_blocks[1])
+        self.assertEqual(second["messages"][0]["content"], "第一个问题")
+
+    def test_all_claude_format_engines_keep_breakpoints(self):
+        async def build():
+            return [await self.system_prompt.render_latest(), {"role": "user", "content": "第一个问题"}]
+        messages = asyncio.run(build())
+        for engine in ("claude", "vertex-claude", "aws"):
+            ordered = order_messages_for_prompt_cache(messages, engine)
+            self.assertEqual(ordered[0]["content"][0]["cache_control"], {"type": "ephemeral"}, engine)
+            self.assertEqual(ordered[-1]["content"][0]["cache_control"], {"type": "ephemeral"}, engine)
+        ordered = order_messages_for_prompt_cache(messages, "gpt")
+        self.assertIsInstance(ordered[0]["content"], str)
+
+    def test_breakpoint_without_relocation_keeps_volatile_text_in_place(self):
+        system_prompt = SystemMessage(f"""
+工具说明
+{CacheBreakpoint(relocate=False)}
+当前时间：{Texts(lambda: "turn-1")}
+<conversation_start>""")
+
+        async def build():
+            return [await system_prompt.render_latest(), {"role": "user", "content": "第一个问题"}]
+        messages = asyncio.run(build())
+
+        ordered = order_messages_for_prompt_cache(messages, "gpt")
+        self.assertEqual(ordered[0]["content"], "\n工具说明\n\n当前时间：turn-1\n<conversation_start>")
+        self.assertEqual(ordered[1], {"role": "user", "content": "第一个问题"})
+
+        ordered = order_messages_for_prompt_cache(messages, "claude")
+        stable, volatile = ordered[0]["content"]
+        self.assertEqual(stable, {"type": "text", "text": "\n工具说明\n", "cache_control": {"type": "ephemeral"}})
+        self.assertEqual(volatile, {"type": "text", "text": "\n当前时间：turn-1\n<conversation_start>"})
+        self.assertEqual(ordered[1], {"role": "user", "content": "第一个问题"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import sys
+import time
+import asyncio
+import unittest
+
+from ..python_pool import PythonWorkerPool
+from ...plugins.run_python import run_python_script
+
+"""
+测试脚本: 验证预热解释器池的命名空间隔离、输出收集、预导入、回收和超时处理。
+
+python -m beswarm.aient.aient.core.test.test_python_pool
+"""
+
+class TestPythonWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = PythonWorkerPool(size=1, max_runs=3, preload=("json", "email.mime.text", "no_such_module"), python=sys.executable)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_isolated_namespaces_and_last_expression(self):
+        first = self.pool.run("x = 21\nx * 2")
+        self.assertEqual(first.stdout, "\nResult: 42\n")
+        self.assertFalse(first.warm)
+        second = self.pool.run("x")
+        self.assertTrue(second.warm)
+        self.assertEqual(second.worker_pid, first.worker_pid)
+        self.assertEqual(second.returncode, 1)
+        self.assertIn("NameError", second.stderr)
+        # 调用栈只包含片段自身
+        self.assertNotIn("python_worker.py", second.stderr)
+
+    def test_output_streams_and_exit_codes(self):
+        result = self.pool.run("import os, sys\nprint('out')\nos.write(1, b'raw\\n')\nprint('err', file=sys.stderr)\nsys.exit(4)")
+        self.assertEqual(result.stdout, "out\nraw\n")
+        self.assertEqual(result.stderr, "err\n")
+        self.assertEqual(result.returncode, 4)
+        self.assertIn("EOFError", self.pool.run("input()").stderr)
+
+    def test_preloaded_modules_are_reused(self):
+        self.pool.warm()
+        result = self.pool.run("import sys\nsorted(m for m in ('json', 'email.mime.text', 'no_such_module') if m in sys.modules)")
+        self.assertTrue(result.warm)
+        self.assertEqual(result.stdout, "\nResult: ['email.mime.text', 'json']\n")
+
+    def test_recycle_after_max_runs(self):
+        pids = [self.pool.run("1").worker_pid for _ in range(4)]
+        self.assertEqual(len(set(pids[:3])), 1)
+        self.assertNotEqual(pids[3], pids[0])
+        self.assertEqual(self.pool.stats()["recycled"], 1)
+
+    def test_recycle_on_memory_growth(self):
+        pool = PythonWorkerPool(size=1, recycle_rss_mb=40, preload=(), python=sys.executable)
+        try:
+            first = pool.run("x = 1")
+            # 挂在模块上的对象不会随命名空间释放
+            second = pool.run("import json\njson.cache = bytearray(64 * 2 ** 20)\njson.cache[::4096] = b'x' * len(json.cache[::4096])")
+            third = pool.run("x = 1")
+            self.assertEqual(first.worker_pid, second.worker_pid)
+            self.assertNotEqual(second.worker_pid, third.worker_pid)
+        finally:
+            pool.shutdown()
+
+    def test_timeout_discards_worker(self):
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            self.pool.run("while True: pass", timeout=0.5)
+        self.assertLess(time.monotonic() - started, 3)
+        self.assertEqual(self.pool.run("'alive'").stdout, "\nResult: 'alive'\n")
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+
+    def test_tool_output_format(self):
+        result = asyncio.run(run_python_script("def add(a, b):\n    return a + b\n\nresult = add(5, 3)\nprint(result)"))
+        self.assertEqual(result, "Execution result:\n8\n\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import time
+import asyncio
+import unittest
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+
+from ..ratelimit import RateLimit, RateLimiter, TokenBucket, RateLimitExceeded, TOKENS_PER_REQUEST, parse_rate_limit, get_rate_limiter, observe_rate_limit_headers, request_api_key
+from ..utils import ThreadSafeCircularList, HTTPException
+
+"""
+测试脚本: 验证令牌桶限流、限流字符串解析和从响应头学习限额。
+
+python -m beswarm.aient.aient.core.test.test_ratelimit
+"""
+
+class TestParseRateLimit(unittest.TestCase):
+
+    def test_units_and_kinds(self):
+        self.assertEqual(parse_rate_limit("10/min, 1000/day"), [RateLimit(10, 60), RateLimit(1000, 86400)])
+        self.assertEqual(parse_rate_limit("2/m,1/mo"), [RateLimit(2, 60), RateLimit(1, 2592000)])
+        self.assertEqual(parse_rate_limit("60/5min"), [RateLimit(60, 300)])
+        self.assertEqual(parse_rate_limit("3/minutes"), [RateLimit(3, 60)])
+        self.assertEqual(parse_rate_limit("200k tokens/min"), [RateLimit(200_000, 60, "tokens")])
+        self.assertEqual(parse_rate_limit("1.5M/tpd"), [RateLimit(1_500_000, 86400, "tokens")])
+        self.assertEqual(parse_rate_limit("500/RPM"), [RateLimit(500, 60, "requests")])
+        self.assertEqual(parse_rate_limit("4000/tpr"), [RateLimit(4000, TOKENS_PER_REQUEST, "tokens")])
+
+    def test_invalid_formats(self):
+        for value in ["10", "10/fortnight", "ten/min", "10/0min", "10 tokens/tpm", "10/5rpm"]:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_rate_limit(value)
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_refill_and_wait_time(self):
+        bucket = TokenBucket(10, 10, now=0.0)
+        self.assertEqual(bucket.wait_time(10, 0.0), 0.0)
+        bucket.consume(10)
+        self.assertAlmostEqual(bucket.wait_time(3, 1.0), 2.0)
+        self.assertEqual(bucket.wait_time(3, 3.0), 0.0)
+        # 超过容量的请求在桶满时放行
+        self.assertAlmostEqual(bucket.wait_time(100, 3.0), 7.0)
+
+    def test_limiter_checks_requests_and_tokens_together(self):
+        limiter = RateLimiter(parse_rate_limit("100/min, 1000 tokens/min"))
+        self.assertEqual(limiter.try_acquire(tokens=600), 0.0)
+        wait = limiter.try_acquire(tokens=600)
+        self.assertAlmostEqual(wait, 200 / (1000 / 60), places=1)
+        # 失败的尝试不扣除任何桶
+        self.assertEqual(limiter.try_acquire(tokens=400), 0.0)
+        self.assertAlmostEqual(limiter.stats()["buckets"]["requests/60"]["available"], 98, places=1)
+
+    def test_acquire_waits_for_capacity(self):
+        limiter = RateLimiter(parse_rate_limit("20/s"))
+
+        async def run():
+            started = time.monotonic()
+            for _ in range(25):
+                await limiter.acquire()
+            return time.monotonic() - started
+
+        elapsed = asyncio.run(run())
+        self.assertGreater(elapsed, 0.2)
+        self.assertLess(elapsed, 1.0)
+        self.assertGreater(limiter.waits, 0)
+
+    def test_acquire_timeout(self):
+        limiter = RateLimiter(parse_rate_limit("1/min"))
+
+        async def run():
+            await limiter.acquire()
+            await limiter.acquire(timeout=0.1)
+
+        with self.assertRaises(RateLimitExceeded) as context:
+            asyncio.run(run())
+        self.assertGreater(context.exception.retry_after, 50)
+
+    def test_shared_limiter_keeps_state_across_agents(self):
+        first = get_rate_limiter("https://shared.example.com/v1/chat/completions", parse_rate_limit("2/min"), api_key="sk-a", model="gpt-4o")
+        first.try_acquire()
+        second = get_rate_limiter("https://shared.example.com/v1/responses", parse_rate_limit("2/min"), api_key="sk-a", model="gpt-4o")
+        self.assertIs(first, second)
+        self.assertEqual(second.try_acquire(), 0.0)
+        self.assertGreater(second.try_acquire(), 0.0)
+
+    def test_limiters_are_separate_per_key_and_model(self):
+        url = "https://keyed.example.com/v1/chat/completions"
+        main = get_rate_limiter(url, api_key="sk-a", model="gpt-4o")
+        self.assertIsNot(main, get_rate_limiter(url, api_key="sk-b", model="gpt-4o"))
+        self.assertIsNot(main, get_rate_limiter(url, api_key="sk-a", model="gpt-4o-mini"))
+        self.assertNotIn("sk-a", main.name)
+
+    def test_headers_are_learned_by_the_matching_limiter(self):
+        url = "https://learned.example.com/v1/chat/completions"
+        main = get_rate_limiter(url, api_key="sk-a", model="gpt-4o")
+        compaction = get_rate_limiter(url, api_key="sk-a", model="gpt-4o-mini")
+        response = SimpleNamespace(
+            request=SimpleNamespace(url=url, headers={"Authorization": "Bearer sk-a"}),
+            headers={"x-ratelimit-limit-requests": "1", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "30s"},
+            status_code=200,
+        )
+        observe_rate_limit_headers(response, "gpt-4o-mini")
+        self.assertGreater(compaction.try_acquire(), 0.0)
+        self.assertEqual(main.try_acquire(), 0.0)
+
+    def test_request_api_key(self):
+        self.assertEqual(request_api_key({"Authorization": "Bearer sk-a"}), "sk-a")
+        self.assertEqual(request_api_key({"x-api-key": "sk-ant"}), "sk-ant")
+        self.assertEqual(request_api_key({}, "https://generativelanguage.googleapis.com/v1beta/models/x:generate?key=AIza"), "AIza")
+        self.assertIsNone(request_api_key({}, "https://example.com/v1"))
+
+class TestLearnFromHeaders(unittest.TestCase):
+
+    def test_openai_headers(self):
+        limiter = RateLimiter()
+        limiter.observe({
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "2s",
+            "x-ratelimit-limit-tokens": "150000",
+            "x-ratelimit-remaining-tokens": "149000",
+            "x-ratelimit-reset-tokens": "400ms",
+        })
+        # 2 秒内恢复 60 个请求
+        self.assertAlmostEqual(limiter.wait_time(), 1 / 30, delta=0.01)
+        buckets = limiter.stats()["buckets"]
+        self.assertEqual(buckets["tokens/server"]["capacity"], 150000)
+        self.assertAlmostEqual(buckets["requests/server"]["rate"], 30.0)
+
+    def test_anthropic_headers_and_retry_after(self):
+        reset = (datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat()
+        limiter = RateLimiter()
+        limiter.observe({
+            "anthropic-ratelimit-tokens-limit": "80000",
+            "anthropic-ratelimit-tokens-remaining": "1000",
+            "anthropic-ratelimit-tokens-reset": reset,
+        })
+        self.assertEqual(limiter.wait_time(tokens=500), 0.0)
+        self.assertGreater(limiter.wait_time(tokens=5000), 1.0)
+
+        limiter.observe({"retry-after": "5"}, status_code=429)
+        self.assertGreater(limiter.wait_time(), 4.0)
+
+class TestCircularListLimits(unittest.TestCase):
+
+    def test_next_can_wait_instead_of_failing(self):
+        async def run():
+            circular = ThreadSafeCircularList(["a"], rate_limit="10/s")
+            for _ in range(10):
+                await circular.next()
+            with self.assertRaises(HTTPException):
+                await circular.next()
+            started = time.monotonic()
+            await circular.next(timeout=1)
+            return time.monotonic() - started
+
+        self.assertLess(asyncio.run(run()), 0.5)
+
+    def test_model_specific_limits_and_tpr(self):
+        async def run():
+            circular = ThreadSafeCircularList(["a"], rate_limit={"default": "100/min", "gpt-4": "1/min, 1000/tpr"})
+            await circular.next("gpt-4o")
+            self.assertTrue(await circular.is_all_rate_limited("gpt-4o"))
+            self.assertFalse(await circular.is_all_rate_limited("claude"))
+            self.assertTrue(await circular.is_tpr_exceeded("gpt-4o", 2000))
+            self.assertFalse(await circular.is_tpr_exceeded("claude", 2000))
+
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
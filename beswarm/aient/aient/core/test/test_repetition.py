@@ -0,0 +1,158 @@
+import json
+import time
+import glob
+import asyncio
+import threading
+import unittest
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ...core.retry import RetryBudget, RetryPolicy
+from ...models.chatgpt import chatgpt, append_output, DiscardOutput
+from ...utils.scripts import RepetitionDetector
+
+"""
+测试脚本: 验证流式重复检测器能尽早发现重复循环、结果与分片方式无关、不误报正常文本，
+以及检测到重复时中断流式响应并重试。
+
+python -m beswarm.aient.aient.core.test.test_repetition
+"""
+
+def feed_all(detector, text, size):
+    for index in range(0, len(text), size):
+        result = detector.feed(text[index:index + size])
+        if result:
+            return index + size, result
+    return None, None
+
+class TestRepetitionDetector(unittest.TestCase):
+
+    def test_detects_line_loop_soon_after_threshold(self):
+        intro = "Let me look at the failing test first, then the parser.\n"
+        loop = "I will read the file again to check the output.\n"
+        text = intro + loop * 500
+        position, (phrase, count) = feed_all(RepetitionDetector(min_chars=2000), text, 7)
+        self.assertIsNotNone(position)
+        # 重复区域达到 2000 个字符后一个片段之内就能发现
+        self.assertLess(position, len(intro) + 2000 + len(loop) + 7)
+        self.assertIn("read the file again", phrase)
+        self.assertGreaterEqual(count, 4)
+
+    def test_detects_cjk_loop_without_spaces(self):
+        text = "好的，我明白了。" * 1000
+        position, (phrase, count) = feed_all(RepetitionDetector(min_chars=500), text, 3)
+        self.assertLess(position, 600)
+        self.assertEqual(len(phrase), len("好的，我明白了。"))
+
+    def test_result_does_not_depend_on_chunking(self):
+        text = "def f():\n    return 1\n" + "x = compute(y, z) + 1\n" * 300
+        results = set()
+        for size in (1, 5, 64, len(text)):
+            detector = RepetitionDetector(min_chars=1000)
+            feed_all(detector, text, size)
+            results.add((detector.result[1], detector.count))
+        self.assertEqual(len(results), 1, results)
+
+    def test_no_false_positive_on_repository_sources(self):
+        root = Path(__file__).resolve().parents[2]
+        files = sorted(glob.glob(str(root / "**" / "*.py"), recursive=True))
+        self.assertTrue(files)
+        for name in files:
+            text = Path(name).read_text(encoding="utf-8", errors="replace")
+            position, result = feed_all(RepetitionDetector(), text, 40)
+            self.assertIsNone(result, f"{name}: {result}")
+
+    def test_long_period_and_stops_after_detection(self):
+        paragraph = " ".join(f"word{i}" for i in range(120)) + ".\n"
+        detector = RepetitionDetector(min_repeats=3, min_chars=1000)
+        position, (phrase, count) = feed_all(detector, paragraph * 5, 50)
+        self.assertEqual(count, 3)
+        self.assertEqual(phrase.split(), paragraph.split())
+        self.assertEqual(detector.feed("anything"), (phrase, count))
+
+class LoopingStreamHandler(BaseHTTPRequestHandler):
+    requests = 0
+    sent = []
+    chunk_delay = 0.01
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        cls = type(self)
+        cls.requests += 1
+        pieces = ["我先检查一下文件。\n"] + ["检查文件内容，然后再检查一次输出结果。\n"] * 400 if cls.requests == 1 else ["完成"]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        sent = 0
+        try:
+            for piece in pieces:
+                chunk = {"choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                sent += 1
+                time.sleep(cls.chunk_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        cls.sent.append(sent)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestStreamAbort(unittest.TestCase):
+
+    def setUp(self):
+        LoopingStreamHandler.requests = 0
+        LoopingStreamHandler.sent = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LoopingStreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def bot(self, **kwargs):
+        return chatgpt(
+            api_key="test", engine="gpt-4o", use_plugins=False,
+            api_url=f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions", **kwargs,
+        )
+
+    def ask(self, **kwargs):
+        bot = self.bot(**kwargs)
+        async def run():
+            return [chunk async for chunk in bot.ask_stream_async("hi")]
+        return asyncio.run(run())
+
+    def test_loop_aborts_stream_and_retries(self):
+        budget = RetryBudget(max_retries=10)
+        chunks = self.ask(retry_policy=RetryPolicy(base_delay=0.01, budget=budget))
+        self.assertEqual(LoopingStreamHandler.requests, 2)
+        self.assertEqual(chunks[-1], "完成")
+        # 正文立即流式产出，重试前由 DiscardOutput 撤回第一次响应已经产出的全部内容
+        discard = next(index for index, chunk in enumerate(chunks) if isinstance(chunk, DiscardOutput))
+        self.assertTrue(any("检查文件内容" in chunk for chunk in chunks[:discard]), chunks)
+        self.assertEqual(chunks[discard].length, sum(len(chunk) for chunk in chunks[:discard]))
+        output = []
+        for chunk in chunks:
+            append_output(output, chunk)
+        self.assertEqual("".join(output), "完成")
+        # 重试经过退避和重试预算
+        self.assertEqual(budget.remaining, 9)
+        # 第一次响应在重复区域达到阈值后就被中断，服务端没有发完 401 个分片
+        deadline = time.monotonic() + 2
+        while len(LoopingStreamHandler.sent) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertLess(LoopingStreamHandler.sent[0], 200)
+
+    def test_ask_async_returns_only_the_retried_response(self):
+        bot = self.bot(retry_policy=RetryPolicy(base_delay=0.01))
+        self.assertEqual(asyncio.run(bot.ask_async("hi")), "完成")
+        self.assertEqual(LoopingStreamHandler.requests, 2)
+
+    def test_check_can_be_disabled(self):
+        chunks = self.ask(repetition_check=False)
+        self.assertEqual(LoopingStreamHandler.requests, 1)
+        self.assertEqual(len(chunks), 401)
+
+if __name__ == "__main__":
+    unittest.main()
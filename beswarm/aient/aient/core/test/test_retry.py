@@ -0,0 +1,171 @@
+import json
+import time
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ..retry import RetryPolicy, RetryBudget, CircuitBreaker, current_retry_budget, parse_retry_after, get_circuit_breaker
+from ...models.chatgpt import chatgpt, RetryFailedError
+
+"""
+测试脚本: 在本地故障注入服务器上验证 chatgpt 的重试策略。
+
+服务器按预设脚本依次返回错误码或正常的 SSE 响应，并记录每次请求的到达时间。
+
+python -m beswarm.aient.aient.core.test.test_retry
+"""
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    # 每个元素是 (status_code, headers)，脚本用完后一直返回最后一个元素。
+    # status_code 为 "stream_error" 时返回 200，但 SSE 数据中是错误对象
+    script = []
+    arrivals = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        cls = type(self)
+        cls.arrivals.append(time.monotonic())
+        status, headers = cls.script[min(len(cls.arrivals), len(cls.script)) - 1]
+        if status == "stream_error":
+            status = 200
+            body = f"data: {json.dumps({'error': {'message': 'injected stream fault'}})}\n\n".encode("utf-8")
+            content_type = "text/event-stream"
+        elif status == 200:
+            chunk = {"choices": [{"index": 0, "delta": {"role": "assistant", "content": "ok"}}]}
+            body = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8")
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps({"error": {"message": "injected fault"}}).encode("utf-8")
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        FaultInjectingHandler.arrivals = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FaultInjectingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_bot(self, **policy_kwargs):
+        policy_kwargs.setdefault("base_delay", 0.01)
+        return chatgpt(api_key="test", engine="gpt-4o", api_url=self.api_url, use_plugins=False, retry_policy=RetryPolicy(**policy_kwargs))
+
+    def ask(self, bot, budget=None):
+        async def run():
+            if budget is not None:
+                current_retry_budget.set(budget)
+            return await bot.ask_async("hi")
+        return asyncio.run(run())
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after({"Retry-After": "3"}), 3.0)
+        self.assertEqual(parse_retry_after({"retry-after-ms": "250"}), 0.25)
+        self.assertEqual(parse_retry_after({"x-ratelimit-reset-requests": "1m30s", "x-ratelimit-reset-tokens": "20ms"}), 90.0)
+        self.assertIsNone(parse_retry_after({"content-type": "application/json"}))
+
+    def test_backoff_uses_full_jitter_and_honours_retry_after(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+        for attempt in range(1, 8):
+            delay = policy.backoff(attempt)
+            self.assertTrue(0 <= delay <= min(8.0, 2 ** (attempt - 1)))
+        self.assertGreaterEqual(policy.backoff(1, retry_after=5.0), 5.0)
+
+    def test_retries_server_errors_until_success(self):
+        FaultInjectingHandler.script = [(503, {}), (502, {}), (200, {})]
+        self.assertEqual(self.ask(self.make_bot()), "ok")
+        self.assertEqual(len(FaultInjectingHandler.arrivals), 3)
+
+    def test_rate_limit_waits_for_retry_after(self):
+        FaultInjectingHandler.script = [(429, {"Retry-After": "0.3"}), (200, {})]
+        self.assertEqual(self.ask(self.make_bot()), "ok")
+        first, second = FaultInjectingHandler.arrivals
+        self.assertGreaterEqual(second - first, 0.3)
+
+    def test_retry_budget_is_shared_per_job(self):
+        FaultInjectingHandler.script = [(500, {})]
+        with self.assertRaises(RetryFailedError):
+            self.ask(self.make_bot(), budget=RetryBudget(2))
+        # 首次请求 + 预算内的两次重试
+        self.assertEqual(len(FaultInjectingHandler.arrivals), 3)
+
+    def test_unexpected_errors_back_off_and_use_the_budget(self):
+        FaultInjectingHandler.script = [("stream_error", {}), ("stream_error", {}), (200, {})]
+        budget = RetryBudget(5)
+        self.assertEqual(self.ask(self.make_bot(base_delay=0.2), budget=budget), "ok")
+        self.assertEqual(len(FaultInjectingHandler.arrivals), 3)
+        self.assertEqual(budget.remaining, 3)
+        first, second, third = FaultInjectingHandler.arrivals
+        # 第二次重试的退避上限是 0.4s，两次重试都没有等待的概率可以忽略
+        self.assertGreater(third - first, 0.01)
+
+        FaultInjectingHandler.arrivals = []
+        FaultInjectingHandler.script = [("stream_error", {})]
+        with self.assertRaises(RetryFailedError):
+            self.ask(self.make_bot(), budget=RetryBudget(1))
+        self.assertEqual(len(FaultInjectingHandler.arrivals), 2)
+
+    def test_retry_budget_refills_over_time(self):
+        budget = RetryBudget(2, refill_interval=0.05)
+        self.assertTrue(budget.consume())
+        self.assertTrue(budget.consume())
+        self.assertFalse(budget.consume())
+        time.sleep(0.06)
+        self.assertTrue(budget.consume())
+        self.assertFalse(budget.consume())
+        time.sleep(0.2)
+        self.assertEqual(budget.remaining, 2)
+        self.assertFalse(RetryBudget(0, refill_interval=None).consume())
+
+    def test_circuit_breaker_is_shared_across_agents(self):
+        FaultInjectingHandler.script = [(500, {}), (500, {}), (200, {})]
+        with self.assertRaises(RetryFailedError):
+            self.ask(self.make_bot(failure_threshold=2, reset_timeout=0.5), budget=RetryBudget(1))
+        opened_at = FaultInjectingHandler.arrivals[-1]
+
+        # 另一个 agent 使用同一个 base URL：熔断打开期间不会发出请求，冷却后试探成功
+        self.assertEqual(self.ask(self.make_bot(failure_threshold=2, reset_timeout=0.5)), "ok")
+        self.assertEqual(len(FaultInjectingHandler.arrivals), 3)
+        self.assertGreaterEqual(FaultInjectingHandler.arrivals[-1] - opened_at, 0.45)
+
+    def test_only_server_faults_open_the_circuit_breaker(self):
+        # 429 和响应内容的错误来自配额或模型行为，不代表服务端故障，不能替所有 agent 打开熔断器
+        FaultInjectingHandler.script = [(429, {}), ("stream_error", {}), (429, {}), ("stream_error", {}), (200, {})]
+        self.assertEqual(self.ask(self.make_bot(failure_threshold=1)), "ok")
+        self.assertEqual(get_circuit_breaker(self.api_url).state, "closed")
+        self.assertEqual(len(FaultInjectingHandler.arrivals), 5)
+
+        FaultInjectingHandler.arrivals = []
+        FaultInjectingHandler.script = [(503, {})]
+        with self.assertRaises(RetryFailedError):
+            self.ask(self.make_bot(failure_threshold=1, reset_timeout=30), budget=RetryBudget(0, refill_interval=None))
+        self.assertEqual(get_circuit_breaker(self.api_url).state, "open")
+
+    def test_half_open_admits_a_single_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertGreater(breaker.acquire(), 0)
+        time.sleep(0.06)
+        self.assertEqual(breaker.acquire(), 0.0)
+        self.assertGreater(breaker.acquire(), 0, "only one probe may run while half open")
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.acquire(), 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import asyncio
+import unittest
+
+from ..utils import ThreadSafeCircularList, HTTPException, circular_list_encoder
+
+"""
+测试脚本: 验证 ThreadSafeCircularList 的负载感知调度（least_outstanding、p2c）和统计数据。
+
+python -m beswarm.aient.aient.core.test.test_scheduler
+"""
+
+class TestLoadAwareScheduling(unittest.TestCase):
+
+    def test_release_updates_stats(self):
+        async def run():
+            circular = ThreadSafeCircularList(["a", "b"], schedule_algorithm="p2c", seed=0)
+            item = await circular.acquire()
+            self.assertEqual(circular.item_stats[item].in_flight, 1)
+            circular.release(item, 0.5)
+            circular.release(item, error=True)
+            return circular.stats()[item]
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual((stats["requests"], stats["errors"]), (2, 1))
+        # 失败的请求不计入延迟
+        self.assertEqual(stats["ewma_latency"], 0.5)
+        self.assertAlmostEqual(stats["error_rate"], ThreadSafeCircularList.ewma_alpha)
+
+    def test_p2c_avoids_slow_and_failing_items(self):
+        async def run():
+            circular = ThreadSafeCircularList(["fast", "slow", "flaky"], schedule_algorithm="p2c", seed=1)
+            for _ in range(5):
+                for item, latency, error in [("fast", 0.02, False), ("slow", 1.0, False), ("flaky", 0.02, True)]:
+                    circular.item_stats[item].in_flight += 1
+                    circular.release(item, latency, error)
+            return [await circular.next() for _ in range(300)]
+
+        picks = asyncio.run(run())
+        # 只有 slow 和 flaky 同时被抽中时才不会选 fast
+        self.assertGreater(picks.count("fast"), 150)
+        self.assertGreater(picks.count("slow"), picks.count("flaky"))
+
+    def test_least_outstanding_prefers_idle_items(self):
+        async def run():
+            circular = ThreadSafeCircularList(["a", "b", "c"], schedule_algorithm="least_outstanding", seed=0)
+            held = [await circular.acquire() for _ in range(3)]
+            self.assertEqual(sorted(held), ["a", "b", "c"])
+            circular.release("b", 0.1)
+            return await circular.next()
+
+        self.assertEqual(asyncio.run(run()), "b")
+
+    def test_track_records_failures(self):
+        async def run():
+            circular = ThreadSafeCircularList(["a"], schedule_algorithm="least_outstanding")
+            with self.assertRaises(ValueError):
+                async with circular.track() as item:
+                    self.assertEqual(circular.item_stats[item].in_flight, 1)
+                    raise ValueError
+            async with circular.track():
+                pass
+            return circular.stats()["a"]
+
+        stats = asyncio.run(run())
+        self.assertEqual((stats["in_flight"], stats["requests"], stats["errors"]), (0, 2, 1))
+        self.assertIsNotNone(stats["ewma_latency"])
+
+    def test_rate_limits_and_cooling_still_apply(self):
+        async def run():
+            circular = ThreadSafeCircularList(["a", "b"], rate_limit="2/min", schedule_algorithm="p2c", seed=0)
+            await circular.set_cooling("a", 60)
+            picks = [await circular.next() for _ in range(2)]
+            with self.assertRaises(HTTPException):
+                await circular.next()
+            return picks
+
+        self.assertEqual(asyncio.run(run()), ["b", "b"])
+
+    def test_stats_are_json_serializable(self):
+        circular = ThreadSafeCircularList(["a"], schedule_algorithm="p2c", provider_name="test")
+        circular.release("a", 0.2)
+        data = json.loads(json.dumps(circular, default=circular_list_encoder))
+        self.assertEqual(data["schedule_algorithm"], "p2c")
+        self.assertEqual(data["stats"]["a"]["ewma_latency"], 0.2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+import json
+import time
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ...models.chatgpt import chatgpt
+from ...plugins import register_tool
+from ...plugins.executor import register_tool_access, READ, WRITE
+from ...utils.scripts import StreamingToolCallParser, parse_function_xml
+
+"""
+测试脚本: 验证流式输出过程中只读工具的投机执行。
+
+本地模拟服务器按脚本依次返回分片的 SSE 响应，每个分片之间有固定延迟。
+
+python -m beswarm.aient.aient.core.test.test_speculative_tools
+"""
+
+tool_events = []
+
+@register_tool()
+async def speculative_lookup(query: str):
+    """测试用的只读查询工具"""
+    tool_events.append(("start", query, time.monotonic()))
+    try:
+        await asyncio.sleep(0.2)
+    except asyncio.CancelledError:
+        tool_events.append(("cancelled", query, time.monotonic()))
+        raise
+    tool_events.append(("finish", query, time.monotonic()))
+    return f"result of {query}"
+
+register_tool_access("speculative_lookup", READ, speculative=True)
+
+@register_tool()
+async def speculative_paid_search(query: str):
+    """测试用的只读工具，调用外部服务，不能投机执行"""
+    tool_events.append(("paid", query, time.monotonic()))
+    return f"paid result of {query}"
+
+register_tool_access("speculative_paid_search", READ)
+
+store = {}
+
+@register_tool()
+async def speculative_store_write(key: str, value: str):
+    """测试用的写入工具"""
+    await asyncio.sleep(0.1)
+    store[key] = value
+    tool_events.append(("write", key, time.monotonic()))
+    return "ok"
+
+@register_tool()
+async def speculative_store_read(key: str):
+    """测试用的读取工具"""
+    value = store.get(key)
+    tool_events.append(("read", value, time.monotonic()))
+    return value
+
+register_tool_access("speculative_store_write", WRITE, ["key"])
+register_tool_access("speculative_store_read", READ, ["key"], speculative=True)
+
+class ScriptedStreamHandler(BaseHTTPRequestHandler):
+    # 每个元素是一次响应的分片列表，脚本用完后一直返回最后一个元素
+    script = []
+    requests = 0
+    chunk_delay = 0.05
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        cls = type(self)
+        cls.requests += 1
+        pieces = cls.script[min(cls.requests, len(cls.script)) - 1]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for piece in pieces:
+            chunk = {"choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(cls.chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format, *args):
+        pass
+
+TOOL_CALL = "<speculative_lookup>\n<query>alpha</query>\n</speculative_lookup>\n"
+
+class TestSpeculativeTools(unittest.TestCase):
+
+    def setUp(self):
+        tool_events.clear()
+        ScriptedStreamHandler.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedStreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def ask(self, **kwargs):
+        bot = chatgpt(
+            api_key="test", engine="gpt-4o",
+            api_url=f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions",
+            tools=[speculative_lookup, speculative_paid_search, speculative_store_write, speculative_store_read], **kwargs,
+        )
+
+        async def run():
+            chunks = [chunk async for chunk in bot.ask_stream_async("hi")]
+            # 给被取消的任务留出处理 CancelledError 的时间
+            await asyncio.sleep(0.05)
+            return chunks
+        return asyncio.run(run())
+
+    def test_parser_matches_parse_function_xml_for_any_chunking(self):
+        text = (
+            "先查一下。\n" + TOOL_CALL +
+            "行内的 <speculative_lookup> 不是调用\n"
+            "<unknown_tool>\n<x>1</x>\n</unknown_tool>\n"
+            "<speculative_lookup>\n<query>a < b</query>\n</speculative_lookup>\n"
+        )
+        expected = [call for call in parse_function_xml(text) if call["function_name"] == "speculative_lookup"]
+        for size in (1, 3, 7, len(text)):
+            parser = StreamingToolCallParser(["speculative_lookup"])
+            calls = []
+            for index in range(0, len(text), size):
+                calls.extend(parser.feed(text[index:index + size]))
+            self.assertEqual(calls, expected, f"chunk size {size}")
+
+    def test_tool_starts_before_stream_ends_and_result_is_reused(self):
+        ScriptedStreamHandler.script = [
+            ["我来查询。\n", TOOL_CALL] + ["继续分析。"] * 8,
+            ["完成"],
+        ]
+        started = time.monotonic()
+        self.ask()
+        starts = [event for event in tool_events if event[0] == "start"]
+        self.assertEqual(len(starts), 1, "speculative result must be reused, not re-executed")
+        # 第一次响应共有 10 个分片，工具在第 2 个分片之后就开始执行
+        self.assertLess(starts[0][2] - started, 8 * ScriptedStreamHandler.chunk_delay)
+        self.assertEqual(ScriptedStreamHandler.requests, 2)
+
+    def test_malformed_response_cancels_speculative_tool(self):
+        ScriptedStreamHandler.script = [
+            # 缺少 [done]，校验失败后带纠正提示重试
+            ["我来查询。\n", TOOL_CALL, "继续分析。"],
+            ["没有工具调用。[done]"],
+        ]
+        self.ask(check_done=True)
+        self.assertEqual([event[0] for event in tool_events], ["start", "cancelled"])
+
+    def test_read_after_write_in_same_response_is_not_speculated(self):
+        store["x"] = "OLD"
+        ScriptedStreamHandler.script = [
+            [
+                "先写再读。\n",
+                "<speculative_store_write>\n<key>x</key>\n<value>NEW</value>\n</speculative_store_write>\n",
+                "<speculative_store_read>\n<key>x</key>\n</speculative_store_read>\n",
+                "继续分析。",
+            ],
+            ["完成"],
+        ]
+        self.ask()
+        self.assertEqual([event[:2] for event in tool_events], [("write", "x"), ("read", "NEW")])
+
+    def test_only_allowlisted_reads_are_speculated(self):
+        ScriptedStreamHandler.script = [
+            # 响应被判定为格式错误而重试，外部调用不应该已经发生
+            ["我来搜索。\n", "<speculative_paid_search>\n<query>beta</query>\n</speculative_paid_search>\n", "继续分析。"],
+            ["没有工具调用。[done]"],
+        ]
+        self.ask(check_done=True)
+        self.assertEqual(tool_events, [])
+        with self.assertRaises(ValueError):
+            register_tool_access("speculative_store_write", WRITE, ["key"], speculative=True)
+
+    def test_speculation_can_be_disabled(self):
+        ScriptedStreamHandler.script = [
+            ["我来查询。\n", TOOL_CALL, "继续分析。"],
+            ["完成"],
+        ]
+        ScriptedStreamHandler.chunk_delay = 0.3
+        try:
+            started = time.monotonic()
+            self.ask(speculative_tools=False)
+        finally:
+            ScriptedStreamHandler.chunk_delay = 0.05
+        # 关闭投机执行后，工具在整个响应结束之后才开始
+        self.assertGreaterEqual(tool_events[0][2] - started, 3 * 0.3)
+
+if __name__ == "__main__":
+    unittest.main()
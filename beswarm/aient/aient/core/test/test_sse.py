@@ -0,0 +1,230 @@
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from ..sse import SSEDecoder, JSONStreamDecoder, EventStreamDecoder, json_dumps, json_loads
+from ..response import fetch_response_stream
+from ..utils import completion_id_suffix
+from ...models.chatgpt import chatgpt
+
+"""
+测试脚本: 验证字节级增量 SSE 解码器，以及 Gemini 的 JSON 数组流和 AWS event stream 的解码。
+
+python -m beswarm.aient.aient.core.test.test_sse
+"""
+
+def decode_all(payload: bytes, splits, comments=False):
+    decoder = SSEDecoder(comments=comments)
+    events = []
+    start = 0
+    for end in list(splits) + [len(payload)]:
+        events.extend(decoder.feed(payload[start:end]))
+        start = end
+    events.extend(decoder.flush())
+    return events
+
+def random_splits(payload, rng):
+    return sorted(rng.sample(range(1, len(payload)), rng.randint(1, 20)))
+
+def event_stream_message(headers, payload: bytes) -> bytes:
+    encoded = b""
+    for name, value in headers.items():
+        value = value.encode("utf-8")
+        encoded += bytes([len(name)]) + name.encode("utf-8") + b"\x07" + struct.pack(">H", len(value)) + value
+    prelude = struct.pack(">II", 16 + len(encoded) + len(payload), len(encoded))
+    message = prelude + struct.pack(">I", zlib.crc32(prelude)) + encoded + payload
+    return message + struct.pack(">I", zlib.crc32(message))
+
+def bedrock_chunk(body):
+    payload = json.dumps({"bytes": base64.b64encode(json.dumps(body).encode("utf-8")).decode("ascii"), "p": "abcd"}).encode("utf-8")
+    return event_stream_message({":event-type": "chunk", ":content-type": "application/json", ":message-type": "event"}, payload)
+
+GEMINI_CHUNKS = [
+    {"candidates": [{"content": {"parts": [{"text": "大括号 } 和 \"引号\" {"}], "role": "model"}}]},
+    {"candidates": [{"content": {"parts": [{"text": "反斜杠 \\"}], "role": "model"}}]},
+    {"candidates": [{"content": {"parts": [{"text": "结束"}], "role": "model"}, "finishReason": "STOP"}],
+     "usageMetadata": {"promptTokenCount": 3, "candidatesTokenCount": 5, "totalTokenCount": 8}},
+]
+
+class StreamHandler(BaseHTTPRequestHandler):
+    payload = b""
+    chunk_size = 7
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        payload = type(self).payload
+        for start in range(0, len(payload), self.chunk_size):
+            self.wfile.write(payload[start:start + self.chunk_size])
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class TestSSEDecoder(unittest.TestCase):
+
+    def test_arbitrary_byte_splits(self):
+        chunks = [{"choices": [{"delta": {"content": text}}]} for text in ["你好", "，世界", "🙂", " done"]]
+        payload = "".join(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n" for chunk in chunks).encode("utf-8")
+        payload += b"data: [DONE]\r\n\r\n"
+        expected = [json.dumps(chunk, ensure_ascii=False) for chunk in chunks] + ["[DONE]"]
+
+        rng = random.Random(0)
+        for _ in range(200):
+            # 随机切分，包括多字节字符内部以及 "\r\n" 之间
+            splits = sorted(rng.sample(range(1, len(payload)), rng.randint(1, 20)))
+            events = decode_all(payload, splits)
+            self.assertEqual([event.data for event in events], expected)
+        # 逐字节输入
+        self.assertEqual([event.data for event in decode_all(payload, range(1, len(payload)))], expected)
+
+    def test_bare_carriage_returns(self):
+        payload = b"data: a\r\rdata: b\r\n\r\ndata: c\r\r"
+        for splits in ([], range(1, len(payload))):
+            self.assertEqual([event.data for event in decode_all(payload, splits)], ["a", "b", "c"])
+
+    def test_long_line_is_decoded_in_linear_time(self):
+        # 一行 4MB 的数据分成 64 字节的块输入，每块只处理新到的字节
+        data = "x" * (4 * 2 ** 20)
+        payload = f"data: {data}\r\n\r\n".encode()
+        started = time.perf_counter()
+        events = decode_all(payload, range(64, len(payload), 64))
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual([len(event.data) for event in events], [len(data)])
+
+    def test_multiline_data_and_fields(self):
+        payload = b"event: update\nid: 7\nretry: 1000\ndata: line one\ndata: line two\n\ndata:x\n\n"
+        events = decode_all(payload, [])
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0].data, "line one\nline two")
+        self.assertEqual((events[0].event, events[0].id, events[0].retry), ("update", "7", 1000))
+        self.assertEqual(events[1].data, "x")
+        self.assertEqual(events[1].event, "message")
+
+    def test_bare_json_lines(self):
+        payload = b'{"a": 1}\n{"a": 2}\r\n{"a": 3}'
+        self.assertEqual([event.json()["a"] for event in decode_all(payload, [3, 9])], [1, 2, 3])
+
+    def test_missing_blank_lines(self):
+        payload = b'data: {"a": 1}\ndata: {"a": 2}\ndata: [DONE]\n'
+        self.assertEqual([event.data for event in decode_all(payload, [])], ['{"a": 1}', '{"a": 2}', "[DONE]"])
+        # 已经解析过的 JSON 会被复用
+        self.assertEqual(decode_all(payload, [])[0].json(), {"a": 1})
+
+    def test_comments(self):
+        payload = b": keepalive\n\ndata: ok\n\n"
+        self.assertEqual([event.data for event in decode_all(payload, [])], ["ok"])
+        events = decode_all(payload, [], comments=True)
+        self.assertEqual([(event.event, event.data) for event in events], [("comment", "keepalive"), ("message", "ok")])
+
+    def test_json_helpers(self):
+        data = {"text": "中文", "list": [1, 2.5, None, True]}
+        self.assertEqual(json_loads(json_dumps(data)), data)
+        self.assertIn("中文", json_dumps(data))
+        self.assertEqual(json_dumps({"big": 2 ** 70}), '{"big":1180591620717411303424}')
+
+    def test_completion_id_is_stable(self):
+        self.assertEqual(completion_id_suffix(1700000000), completion_id_suffix(1700000000))
+        self.assertEqual(len(completion_id_suffix(1700000000)), 29)
+
+class TestJSONStreamDecoder(unittest.TestCase):
+
+    def decode_all(self, payload, splits):
+        decoder = JSONStreamDecoder()
+        objects = []
+        start = 0
+        for end in list(splits) + [len(payload)]:
+            objects.extend(decoder.feed(payload[start:end]))
+            start = end
+        return objects
+
+    def test_gemini_array_and_sse_formats(self):
+        array = ("[" + ",\r\n".join(json.dumps(chunk, ensure_ascii=False, indent=2) for chunk in GEMINI_CHUNKS) + "]").encode("utf-8")
+        sse = "".join(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n" for chunk in GEMINI_CHUNKS).encode("utf-8")
+        rng = random.Random(0)
+        for payload in (array, sse):
+            self.assertEqual(self.decode_all(payload, []), GEMINI_CHUNKS)
+            self.assertEqual(self.decode_all(payload, range(1, len(payload))), GEMINI_CHUNKS)
+            for _ in range(100):
+                self.assertEqual(self.decode_all(payload, random_splits(payload, rng)), GEMINI_CHUNKS)
+        self.assertEqual(self.decode_all(b"[]", []), [])
+
+class TestEventStreamDecoder(unittest.TestCase):
+
+    def test_arbitrary_byte_splits(self):
+        bodies = [{"delta": {"text": "你好"}}, {"delta": {"text": "世界"}}]
+        payload = b"".join(bedrock_chunk(body) for body in bodies)
+        rng = random.Random(0)
+        for _ in range(100):
+            decoder = EventStreamDecoder()
+            messages = []
+            start = 0
+            for end in random_splits(payload, rng) + [len(payload)]:
+                messages.extend(decoder.feed(payload[start:end]))
+                start = end
+            self.assertEqual([message.headers[":event-type"] for message in messages], ["chunk", "chunk"])
+            self.assertEqual([json_loads(base64.b64decode(message.json()["bytes"])) for message in messages], bodies)
+
+class TestSSEEndToEnd(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StreamHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_chatgpt_stream_with_small_chunks(self):
+        pieces = ["流式", "输出", "在多字节", "字符中间被切开"]
+        payload = ": keepalive\n\n"
+        for piece in pieces:
+            payload += f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': piece}}]}, ensure_ascii=False)}\r\n\r\n"
+        payload += "data: [DONE]\r\n\r\n"
+        StreamHandler.payload = payload.encode("utf-8")
+
+        bot = chatgpt(
+            api_key="test", engine="gpt-4o",
+            api_url=f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions",
+            use_plugins=False,
+        )
+        self.assertEqual(asyncio.run(bot.ask_async("你好")), "".join(pieces))
+
+    def stream(self, engine):
+        async def run():
+            url = f"http://127.0.0.1:{self.server.server_port}/stream"
+            async with httpx.AsyncClient() as client:
+                return [chunk async for chunk in fetch_response_stream(client, url, {}, {}, engine, "test-model")]
+        return asyncio.run(run())
+
+    def test_gemini_stream(self):
+        StreamHandler.payload = ("[" + ",\r\n".join(json.dumps(chunk, ensure_ascii=False, indent=2) for chunk in GEMINI_CHUNKS) + "]").encode("utf-8")
+        chunks = self.stream("gemini")
+        self.assertEqual("".join(chunk.content for chunk in chunks if getattr(chunk, "content", None)), "大括号 } 和 \"引号\" {反斜杠 \\结束")
+        self.assertIn("stop", [getattr(chunk, "stop", None) for chunk in chunks])
+        self.assertIn(8, [getattr(chunk, "total_tokens", None) for chunk in chunks])
+
+    def test_gemini_empty_array_is_blocked(self):
+        StreamHandler.payload = b"[]"
+        self.assertIn("PROHIBITED_CONTENT", [getattr(chunk, "stop", None) for chunk in self.stream("gemini")])
+
+    def test_aws_stream(self):
+        StreamHandler.payload = bedrock_chunk({"delta": {"text": "你好"}}) + bedrock_chunk({"delta": {"text": "，世界"}}) + bedrock_chunk(
+            {"amazon-bedrock-invocationMetrics": {"inputTokenCount": 4, "outputTokenCount": 6}})
+        chunks = self.stream("aws")
+        self.assertEqual("".join(chunk.content for chunk in chunks if getattr(chunk, "content", None)), "你好，世界")
+        self.assertIn(10, [getattr(chunk, "total_tokens", None) for chunk in chunks])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import json
+import asyncio
+import unittest
+
+from ..utils import ChatDelta, STREAM_DONE, KEEPALIVE, generate_delta, generate_sse_response, encode_sse
+from ...models.chatgpt import chatgpt
+
+"""
+测试脚本: 验证 fetcher 与 chatgpt 之间的类型化增量流，以及对外输出时的 SSE 编码。
+
+python -m beswarm.aient.aient.core.test.test_stream_delta
+"""
+
+TIMESTAMP = 1700000000
+
+def claude_like_deltas():
+    return [
+        generate_delta(TIMESTAMP, "test-model", reasoning_content="先想一想"),
+        generate_delta(TIMESTAMP, "test-model", "你好"),
+        generate_delta(TIMESTAMP, "test-model", "，世界"),
+        generate_delta(TIMESTAMP, "test-model", None, "toolu_1", "read_file", None),
+        generate_delta(TIMESTAMP, "test-model", None, None, None, '{"file_path": '),
+        generate_delta(TIMESTAMP, "test-model", None, None, None, '"/tmp/a.txt"}'),
+        ChatDelta(raw={"choices": [{"index": 0, "delta": {"content": "!"}}]}),
+        KEEPALIVE,
+        generate_delta(TIMESTAMP, "test-model", None, None, None, None, None, 30, 20, 10, cached_tokens=5),
+        STREAM_DONE,
+    ]
+
+class TestStreamDelta(unittest.TestCase):
+
+    def test_sse_encoding_matches_legacy_format(self):
+        sse = asyncio.run(generate_sse_response(TIMESTAMP, "test-model", "hi"))
+        self.assertTrue(sse.startswith("data: ") and sse.endswith("\n\n"))
+        chunk = json.loads(sse[len("data: "):])
+        self.assertEqual(chunk["choices"][0]["delta"], {"role": "assistant", "content": "hi"})
+        self.assertEqual(chunk["id"], generate_delta(TIMESTAMP, "test-model").to_dict()["id"])
+
+        usage = generate_delta(TIMESTAMP, "m", None, None, None, None, None, 30, 20, 10, cached_tokens=5).to_dict()
+        self.assertEqual(usage["choices"], [])
+        self.assertEqual(usage["usage"]["prompt_tokens_details"], {"cached_tokens": 5})
+        tool = generate_delta(TIMESTAMP, "m", None, "call_1", "search", None).to_dict()
+        self.assertEqual(tool["choices"][0]["delta"]["tool_calls"][0]["function"], {"name": "search", "arguments": ""})
+
+        self.assertEqual(encode_sse(STREAM_DONE), "data: [DONE]\n\n")
+        self.assertEqual(encode_sse(KEEPALIVE), ": keepalive\n\n")
+        self.assertEqual(encode_sse({"error": "x"}), {"error": "x"})
+
+    def test_typed_and_encoded_streams_are_equivalent(self):
+        async def consume(encode):
+            bot = chatgpt(api_key="test", engine="gpt-4o", use_plugins=False)
+
+            async def generator():
+                for delta in claude_like_deltas():
+                    yield encode_sse(delta) if encode else delta
+            chunks = [chunk async for chunk in bot._process_stream_response(generator(), is_async=True)]
+            return chunks, bot.conversation["default"][-1].to_dict(), bot.tokens_usage["default"]
+
+        typed = asyncio.run(consume(encode=False))
+        encoded = asyncio.run(consume(encode=True))
+        self.assertEqual(typed, encoded)
+        self.assertEqual("".join(typed[0]), "你好，世界!")
+
+if __name__ == "__main__":
+    unittest.main()
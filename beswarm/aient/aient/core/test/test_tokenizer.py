@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+
+from ..tokenizer import HeuristicTokenizer, Tokenizer, get_tokenizer, register_tokenizer
+from ...models.chatgpt import chatgpt
+
+"""
+测试脚本: 验证可插拔的 token 计数器，以及基于缓存计数的对话截断。
+
+python -m beswarm.aient.aient.core.test.test_tokenizer
+"""
+
+class CountingTokenizer(Tokenizer):
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text):
+        self.calls += 1
+        return len(text)
+
+class TestTokenizer(unittest.TestCase):
+
+    def test_heuristic_counts_cjk_per_character(self):
+        tokenizer = HeuristicTokenizer(cjk_weight=1.0)
+        text = "本文提出了一种新的方法"
+        self.assertEqual(tokenizer.count(text), len(text))
+        # len / 4 会把中文低估 4 倍
+        self.assertGreater(tokenizer.count(text), 2 * len(text) / 4)
+
+    def test_heuristic_counts_english_and_code(self):
+        tokenizer = HeuristicTokenizer()
+        self.assertEqual(tokenizer.count("the cat sat"), 3)
+        self.assertEqual(tokenizer.count("x = 12345"), 4)
+        self.assertEqual(tokenizer.count(""), 0)
+
+    def test_model_selection_is_cached(self):
+        self.assertIs(get_tokenizer("gpt-4o"), get_tokenizer("gpt-4o"))
+        self.assertNotEqual(get_tokenizer("gpt-4o").name, get_tokenizer("claude-sonnet-4-20250514").name)
+        self.assertEqual(get_tokenizer("openai/gpt-4o").name, get_tokenizer("gpt-4o").name)
+
+    def test_register_custom_tokenizer(self):
+        custom = CountingTokenizer()
+        register_tokenizer("custom-model", lambda: custom)
+        self.assertIs(get_tokenizer("custom-model-v2"), custom)
+
+    def test_truncation_reuses_memoised_counts(self):
+        tokenizer = CountingTokenizer()
+        register_tokenizer("truncation-test", lambda: tokenizer)
+        bot = chatgpt(api_key="test", engine="truncation-test", system_prompt="system", use_plugins=False, truncate_limit=200)
+        for index in range(5):
+            bot.add_to_conversation("问" * 30, "user")
+            bot.add_to_conversation("答" * 30, "assistant")
+        asyncio.run(bot.conversation["default"].render_latest())
+
+        bot.truncate_conversation()
+        self.assertLessEqual(bot.current_tokens["default"], 200)
+        self.assertEqual(bot.current_tokens["default"], bot.conversation["default"].token_count(tokenizer))
+        self.assertEqual(bot.conversation["default"][0].role, "system")
+
+        # 追加一条消息后再次截断，只有新消息需要计数
+        calls = tokenizer.calls
+        bot.add_to_conversation("问" * 30, "user")
+        asyncio.run(bot.conversation["default"].render_latest())
+        bot.truncate_conversation()
+        self.assertEqual(tokenizer.calls - calls, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import asyncio
+import inspect
+import unittest
+
+from ...models.chatgpt import chatgpt
+from ...plugins import register_tool, update_tools_config
+from ...plugins.config import get_tools_result_async
+from ...plugins.registry import registry, ToolBinder
+
+"""
+测试脚本: 验证注册时生成的参数绑定器，以及工具配置在智能体之间共享而不是深拷贝。
+
+python -m beswarm.aient.aient.core.test.test_tool_binder
+"""
+
+@register_tool()
+def binder_add(a: int, b: int = 1, scale: float = 1.0, verbose: bool = False):
+    """测试用的加法工具"""
+    total = (a + b) * scale
+    return f"{total} {verbose}"
+
+class TestToolBinder(unittest.TestCase):
+
+    def test_binder_from_signature(self):
+        def tool(path: str, head: int = None, *args, strict: "bool" = True, **extra):
+            pass
+        binder = ToolBinder.from_signature(inspect.signature(tool))
+        self.assertEqual(binder.names, ("path", "head", "strict"))
+        self.assertEqual(binder.missing({"head": "3"}), ["path"])
+        # 接受 **kwargs 的工具不检查未知参数
+        self.assertEqual(binder.invalid({"path": "a", "other": 1}), [])
+        self.assertEqual(binder.bind({"path": "1", "head": "3", "strict": "false"}), {"path": "1", "head": 3, "strict": False})
+        # 无法转换时保持原样
+        self.assertEqual(binder.bind({"head": "all"}), {"head": "all"})
+
+    def test_lazy_binder_matches_real_binder(self):
+        for name in list(registry.tools):
+            if not registry.is_lazy(name):
+                continue
+            lazy = registry.binder(name)
+            registry.resolve(name)
+            real = registry.binder(name)
+            with self.subTest(tool=name):
+                self.assertEqual((lazy.names, lazy.required, lazy.var_keyword), (real.names, real.required, real.var_keyword))
+                self.assertEqual(sorted(lazy.coercers), sorted(real.coercers))
+
+    def test_dispatch_coerces_and_rejects_arguments(self):
+        async def call(arguments):
+            return [chunk async for chunk in get_tools_result_async(
+                "binder_add", json.dumps(arguments), "gpt-4o", None, None, None, False, "gpt-4o", None, "default", "English"
+            )]
+
+        self.assertEqual(asyncio.run(call({"a": "2", "b": "3", "scale": "0.5", "verbose": "yes"})), ["function_response:2.5 True"])
+        error = asyncio.run(call({"a": 1, "c": 2}))[0]
+        self.assertIn("<tool_error>", error)
+        self.assertIn("['c']", error)
+
+class TestSharedToolConfig(unittest.TestCase):
+
+    def test_function_call_list_shared_until_registry_changes(self):
+        plugins, function_call_list, claude_tools_list = update_tools_config()
+        again = update_tools_config()
+        self.assertIs(again[1], function_call_list)
+        self.assertIs(again[2], claude_tools_list)
+        self.assertIsNot(again[0], plugins)
+
+        @register_tool()
+        def binder_late_tool(x):
+            """后注册的工具"""
+            return x
+
+        refreshed = update_tools_config()
+        self.assertIsNot(refreshed[1], function_call_list)
+        self.assertIn("binder_late_tool", refreshed[1])
+        # 已有工具的 schema 对象沿用
+        self.assertIs(refreshed[1]["binder_add"], function_call_list["binder_add"])
+
+    def test_agents_share_schemas_but_not_switches(self):
+        first = chatgpt(api_key="test", engine="gpt-4o", tools=[binder_add])
+        second = chatgpt(api_key="test", engine="gpt-4o")
+        self.assertIs(first.function_call_list, second.function_call_list)
+        self.assertTrue(first.plugins["binder_add"])
+        self.assertFalse(second.plugins["binder_add"])
+
+if __name__ == "__main__":
+    unittest.main()
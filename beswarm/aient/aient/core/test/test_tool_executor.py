@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from ...plugins.executor import ToolExecutor
+from .test_process_pool import write_text_pdf
+
+"""
+测试脚本: 验证依赖感知的工具执行器的并发与顺序语义。
+
+python -m beswarm.aient.aient.core.test.test_tool_executor
+"""
+
+def call(name, **parameter):
+    return {"function_name": name, "parameter": parameter}
+
+class TestToolExecutor(unittest.TestCase):
+
+    def run_calls(self, tool_calls, max_concurrency=4, delay=0.05):
+        timeline = {}
+        active = 0
+        peak = 0
+
+        async def runner(tool_call):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            start = time.monotonic()
+            await asyncio.sleep(delay)
+            active -= 1
+            timeline[id(tool_call)] = (start, time.monotonic())
+            return tool_call["function_name"]
+
+        results = asyncio.run(ToolExecutor(max_concurrency).run(tool_calls, runner))
+        spans = [timeline[id(tool_call)] for tool_call in tool_calls]
+        return results, spans, peak
+
+    def test_read_only_tools_run_concurrently_in_original_order(self):
+        tool_calls = [call("read_file", file_path=f"/tmp/{i}.txt") for i in range(3)] + [call("search_web", query="x")]
+        results, spans, peak = self.run_calls(tool_calls)
+        self.assertEqual(results, ["read_file"] * 3 + ["search_web"])
+        self.assertEqual(peak, 4)
+
+    def test_concurrency_limit(self):
+        tool_calls = [call("search_arxiv", query=str(i)) for i in range(6)]
+        _, _, peak = self.run_calls(tool_calls, max_concurrency=2)
+        self.assertEqual(peak, 2)
+
+    def test_writers_on_same_path_are_serialised(self):
+        tool_calls = [
+            call("read_file", file_path="/tmp/a.txt"),
+            call("edit_file", file_path="/tmp/a.txt", diff_content=""),
+            call("write_to_file", path="/tmp/a.txt", content=""),
+            call("write_to_file", path="/tmp/b.txt", content=""),
+        ]
+        _, spans, _ = self.run_calls(tool_calls)
+        self.assertGreaterEqual(spans[1][0], spans[0][1])
+        self.assertGreaterEqual(spans[2][0], spans[1][1])
+        # 不同路径的写入不需要等待
+        self.assertLess(spans[3][0], spans[0][1])
+
+    def test_commands_and_unknown_tools_are_barriers(self):
+        executor = ToolExecutor()
+        dependencies = executor.plan([
+            call("read_file", file_path="/tmp/a.txt"),
+            call("excute_command", command="rm /tmp/a.txt"),
+            call("search_web", query="x"),
+            call("create_task", goal="x"),
+            call("read_file", file_path="/tmp/b.txt"),
+        ])
+        self.assertEqual(dependencies[1], [0])
+        # 命令可能影响任意路径，但不影响无路径的只读工具
+        self.assertEqual(dependencies[2], [])
+        self.assertEqual(dependencies[3], [0, 1, 2])
+        self.assertEqual(dependencies[4], [1, 3])
+
+    def test_directory_listing_waits_for_writes_inside_it(self):
+        dependencies = ToolExecutor().plan([
+            call("write_to_file", path="/tmp/project/a.py", content=""),
+            call("list_directory", path="/tmp/project"),
+            call("list_directory", path="/tmp/other"),
+        ])
+        self.assertEqual(dependencies, [[], [0], []])
+
+    def test_session_polls_wait_for_session_commands(self):
+        dependencies = ToolExecutor().plan([
+            call("kill_command", session_id="s1"),
+            call("poll_command", session_id="s1"),
+            call("read_command_output", session_id="s1"),
+        ])
+        self.assertEqual(dependencies, [[], [0], [0]])
+
+    def test_failure_cancels_remaining_calls(self):
+        finished = []
+
+        async def runner(tool_call):
+            if tool_call["parameter"]["query"] == "boom":
+                raise RuntimeError("boom")
+            await asyncio.sleep(0.5)
+            finished.append(tool_call)
+
+        tool_calls = [call("search_web", query="boom"), call("search_web", query="slow")]
+        with self.assertRaises(RuntimeError):
+            asyncio.run(ToolExecutor().run(tool_calls, runner))
+        self.assertEqual(finished, [])
+
+class TestArxivDownload(unittest.TestCase):
+
+    def test_concurrent_downloads_use_separate_files(self):
+        from ...plugins import arXiv
+        directory = tempfile.mkdtemp()
+        pdfs = {}
+        for arxiv_id, pages in (("1", 1), ("3", 3)):
+            path = os.path.join(directory, f"{arxiv_id}.pdf")
+            write_text_pdf(path, pages, 2)
+            with open(path, "rb") as f:
+                pdfs[arxiv_id] = f.read()
+
+        threads = []
+        def fake_get(url, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return mock.Mock(status_code=200, content=pdfs[url.rsplit("/", 1)[1][:-4]])
+
+        async def run():
+            return await asyncio.gather(*(arXiv.download_read_arxiv_pdf(arxiv_id) for arxiv_id in ("1", "3")))
+
+        cwd = os.getcwd()
+        try:
+            os.chdir(directory)
+            with mock.patch.object(arXiv.requests, "get", fake_get):
+                one_page, three_pages = asyncio.run(run())
+        finally:
+            os.chdir(cwd)
+        # 下载在线程中进行，不阻塞事件循环
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertNotIn("Page 2 line", one_page)
+        self.assertIn("Page 2 line 1", three_pages)
+        # 不在工作目录中留下文件
+        self.assertEqual(sorted(os.listdir(directory)), ["1.pdf", "3.pdf"])
+
+if __name__ == "__main__":
+    unittest.main()
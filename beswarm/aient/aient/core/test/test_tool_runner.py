@@ -0,0 +1,124 @@
+import json
+import time
+import asyncio
+import unittest
+import contextvars
+
+from ...plugins import register_tool
+from ...plugins.config import get_tools_result_async
+from ...plugins.executor import BlockingToolRunner, LoopLagMonitor, register_tool_kind, tool_kind, ASYNC, INLINE, IO
+
+"""
+测试脚本: 验证同步工具在线程池中执行、每类的并发上限，以及事件循环延迟监视。
+
+python -m beswarm.aient.aient.core.test.test_tool_runner
+"""
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+def blocking_io(seconds: float = 0.2):
+    time.sleep(seconds)
+    return request_id.get()
+
+@register_tool()
+def runner_blocking_tool(seconds: float):
+    """测试用的阻塞工具"""
+    time.sleep(float(seconds))
+    return "done"
+
+register_tool_kind("blocking_io", IO)
+register_tool_kind("runner_blocking_tool", IO)
+
+async def heartbeat(stop: asyncio.Event, interval: float = 0.01):
+    """返回心跳之间的最大间隔"""
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    last = loop.time()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = loop.time()
+        worst = max(worst, now - last - interval)
+        last = now
+    return worst
+
+class TestToolKinds(unittest.TestCase):
+
+    def test_classification(self):
+        async def coroutine():
+            pass
+        self.assertEqual(tool_kind("anything", coroutine), ASYNC)
+        # 未登记的同步工具不一定线程安全，留在事件循环上执行
+        self.assertEqual(tool_kind("unregistered_sync_tool", blocking_io), INLINE)
+        self.assertEqual(tool_kind("create_task", blocking_io), INLINE)
+        self.assertEqual(tool_kind("move_knowledge_node", blocking_io), INLINE)
+        self.assertEqual(tool_kind("read_file", blocking_io), IO)
+        with self.assertRaises(ValueError):
+            register_tool_kind("runner_cpu_tool", "cpu")
+
+class TestBlockingToolRunner(unittest.TestCase):
+
+    def test_sync_tool_does_not_block_loop(self):
+        runner = BlockingToolRunner(io_workers=4, monitor_loop_lag=False)
+        self.addCleanup(runner.shutdown)
+
+        async def run():
+            stop = asyncio.Event()
+            beat = asyncio.ensure_future(heartbeat(stop))
+            request_id.set("req-1")
+            result = await runner.call("blocking_io", blocking_io, {"seconds": 0.3})
+            stop.set()
+            return result, await beat
+
+        result, worst = asyncio.run(run())
+        # 上下文变量随调用进入线程
+        self.assertEqual(result, "req-1")
+        self.assertLess(worst, 0.1)
+
+    def test_per_kind_concurrency_limit(self):
+        runner = BlockingToolRunner(io_workers=2, monitor_loop_lag=False)
+        self.addCleanup(runner.shutdown)
+
+        async def run():
+            started = time.monotonic()
+            await asyncio.gather(*[runner.call("blocking_io", blocking_io, {"seconds": 0.2}) for _ in range(4)])
+            return time.monotonic() - started
+
+        elapsed = asyncio.run(run())
+        self.assertGreater(elapsed, 0.38)
+        self.assertLess(elapsed, 0.7)
+        self.assertEqual(runner.stats()["io"]["calls"], 4)
+        self.assertGreater(runner.stats()["io"]["max_queue_wait"], 0.15)
+        self.assertEqual(runner.stats()["io"]["queued"], 0)
+
+class TestLoopLagMonitor(unittest.TestCase):
+
+    def test_detects_blocking_call(self):
+        async def run():
+            monitor = LoopLagMonitor(interval=0.05, threshold=0.1)
+            monitor.start()
+            await asyncio.sleep(0.1)
+            time.sleep(0.3)
+            await asyncio.sleep(0.1)
+            monitor.stop()
+            return monitor.stats()
+
+        stats = asyncio.run(run())
+        self.assertGreaterEqual(stats["max_lag"], 0.2)
+        self.assertEqual(stats["stalls"], 1)
+
+    def test_get_tools_result_async_runs_sync_tool_off_loop(self):
+        async def run():
+            stop = asyncio.Event()
+            beat = asyncio.ensure_future(heartbeat(stop))
+            chunks = [chunk async for chunk in get_tools_result_async(
+                "runner_blocking_tool", json.dumps({"seconds": 0.3}), "gpt-4o", None, None, None, False, "gpt-4o", None, "default", "English"
+            )]
+            stop.set()
+            return chunks, await beat
+
+        chunks, worst = asyncio.run(run())
+        self.assertEqual(chunks, ["function_response:done"])
+        self.assertLess(worst, 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,418 @@
+import json
+import random
+import unittest
+
+from ...utils.scripts import (
+    XmlMatcher,
+    XmlMatcherResult,
+    StreamingToolCallParser,
+    parse_function_xml,
+    parse_continuous_json,
+)
+
+"""
+测试脚本: 用随机生成的输入对比扫描式的 XmlMatcher / parse_function_xml / StreamingToolCallParser /
+parse_continuous_json 与原来逐字符实现的结果，并覆盖 1 MB 的工具调用内容。
+
+下面的 Legacy* / legacy_* 是改写前的实现，仅作为对照。
+
+python -m beswarm.aient.aient.core.test.test_xml_parser
+"""
+
+class LegacyXmlMatcher:
+
+    def __init__(self, tag_name, transform=None, position=0):
+        self.tag_name = tag_name
+        self.transform = transform
+        self.position = position
+        self.index = 0
+        self.chunks = []
+        self.cached = []
+        self.matched = False
+        self.state = 'TEXT'
+        self.depth = 0
+        self.pointer = 0
+
+    def _collect(self):
+        if not self.cached:
+            return
+        data = ''.join(self.cached)
+        last = self.chunks[-1] if self.chunks else None
+        current_matched_state = self.matched if self.state == 'TEXT' else self.depth > 0
+        if last and last.matched == current_matched_state:
+            last.data += data
+        elif data:
+            self.chunks.append(XmlMatcherResult(data=data, matched=current_matched_state))
+        self.cached = []
+
+    def _pop(self):
+        chunks_to_return = self.chunks
+        self.chunks = []
+        if not self.transform:
+            return [chunk for chunk in chunks_to_return]
+        return [self.transform(chunk) for chunk in chunks_to_return]
+
+    def _update(self, chunk):
+        for char in chunk:
+            current_char_processed = False
+            if self.state == 'TEXT':
+                if char == '<' and (self.pointer >= self.position or self.matched):
+                    self._collect()
+                    self.state = 'TAG_OPEN'
+                    self.cached.append(char)
+                    self.index = 0
+                    current_char_processed = True
+            elif self.state == 'TAG_OPEN':
+                self.cached.append(char)
+                current_char_processed = True
+                tag_name_len = len(self.tag_name)
+                if self.index == 0:
+                    if char == '/':
+                        self.state = 'TAG_CLOSE'
+                    elif char.isspace():
+                        pass
+                    elif char == self.tag_name[0]:
+                        self.index = 1
+                    else:
+                        self.state = 'TEXT'
+                        current_char_processed = True
+                elif self.index < tag_name_len:
+                    if self.tag_name[self.index] == char:
+                        self.index += 1
+                    elif char.isspace():
+                        self.state = 'TEXT'
+                        current_char_processed = True
+                    else:
+                        self.state = 'TEXT'
+                        current_char_processed = True
+                elif char == '>':
+                    self.state = 'TEXT'
+                    self.depth += 1
+                    self.matched = True
+                    self.cached = []
+                elif char.isspace():
+                    pass
+                else:
+                    pass
+            elif self.state == 'TAG_CLOSE':
+                self.cached.append(char)
+                current_char_processed = True
+                tag_name_len = len(self.tag_name)
+                if self.index == 0:
+                    if char.isspace():
+                        pass
+                    elif char == self.tag_name[0]:
+                        self.index = 1
+                    else:
+                        self.state = 'TEXT'
+                        current_char_processed = True
+                elif self.index < tag_name_len:
+                    if self.tag_name[self.index] == char:
+                        self.index += 1
+                    else:
+                        self.state = 'TEXT'
+                        current_char_processed = True
+                elif char == '>':
+                    was_inside_tag = self.depth > 0
+                    self.state = 'TEXT'
+                    if was_inside_tag:
+                        self.depth -= 1
+                        self.matched = self.depth > 0
+                        self.cached = []
+                    else:
+                        current_char_processed = True
+                elif char.isspace():
+                    pass
+                else:
+                    self.state = 'TEXT'
+                    current_char_processed = True
+            if not current_char_processed:
+                if self.state != 'TEXT':
+                    self.state = 'TEXT'
+                self.cached.append(char)
+            self.pointer += 1
+        if self.state == 'TEXT':
+            self._collect()
+
+    def final(self, chunk=None):
+        if chunk:
+            self._update(chunk)
+        self._collect()
+        return self._pop()
+
+    def update(self, chunk):
+        self._update(chunk)
+        return self._pop()
+
+def legacy_parse_function_xml(xml_content, check_line_start=True):
+    result_functions = []
+    position = 0
+    while position < len(xml_content):
+        tag_start = xml_content.find('<', position)
+        if tag_start == -1:
+            break
+        if check_line_start:
+            is_start_of_line_or_only_spaces_before = True
+            if tag_start > 0:
+                check_pos = tag_start - 1
+                while check_pos >= 0 and xml_content[check_pos] != '\n':
+                    if not xml_content[check_pos].isspace():
+                        is_start_of_line_or_only_spaces_before = False
+                        break
+                    check_pos -= 1
+            if not is_start_of_line_or_only_spaces_before:
+                position = tag_start + 1
+                continue
+        if tag_start + 1 < len(xml_content) and xml_content[tag_start + 1] == '/':
+            position = tag_start + 1
+            continue
+        tag_end = xml_content.find('>', tag_start)
+        if tag_end == -1:
+            break
+        tag_content = xml_content[tag_start + 1:tag_end].strip()
+        tag_name = tag_content.split()[0] if ' ' in tag_content else tag_content
+        if not tag_name:
+            position = tag_end + 1
+            continue
+        full_start_tag = f'<{tag_name}'
+        full_end_tag = f'</{tag_name}>'
+        start_pos = xml_content.find(full_start_tag, position)
+        if start_pos == -1:
+            position = tag_end + 1
+            continue
+        end_pos = xml_content.find(full_end_tag, start_pos)
+        if end_pos == -1:
+            position = tag_end + 1
+            continue
+        tag_inner_content = xml_content[tag_end + 1:end_pos]
+        if tag_name in ['tool_call', 'function_call', 'tool', 'function', 'tools']:
+            nested_functions = legacy_parse_function_xml(tag_inner_content, check_line_start=False)
+            result_functions.extend(nested_functions)
+        else:
+            parameters = {}
+            param_position = 0
+            while param_position < len(tag_inner_content):
+                param_tag_start = tag_inner_content.find('<', param_position)
+                if param_tag_start == -1:
+                    break
+                if param_tag_start + 1 < len(tag_inner_content) and tag_inner_content[param_tag_start + 1] == '/':
+                    param_position = param_tag_start + 1
+                    continue
+                param_tag_end = tag_inner_content.find('>', param_tag_start)
+                if param_tag_end == -1:
+                    break
+                param_name = tag_inner_content[param_tag_start + 1:param_tag_end].strip()
+                if ' ' in param_name:
+                    param_name = param_name.split()[0]
+                if not param_name:
+                    param_position = param_tag_end + 1
+                    continue
+                param_end_tag = f'</{param_name}>'
+                param_end_pos = tag_inner_content.find(param_end_tag, param_tag_end)
+                if param_end_pos == -1:
+                    param_position = param_tag_end + 1
+                    continue
+                param_value = tag_inner_content[param_tag_end + 1:param_end_pos].strip()
+                parameters[param_name] = param_value
+                param_position = param_end_pos + len(param_end_tag)
+            result_functions.append({'function_name': tag_name, 'parameter': parameters})
+        position = end_pos + len(full_end_tag)
+    return result_functions
+
+def legacy_parse_continuous_json(json_str, function_name=''):
+    if not json_str or not json_str.strip():
+        return []
+    try:
+        json_obj = json.loads(json_str)
+        tool_id = function_name + '_single' if function_name else 'tool_single'
+        return [{'function_name': function_name or 'default_function', 'parameter': json_obj, 'function_call_id': tool_id}]
+    except json.JSONDecodeError:
+        pass
+    result = []
+    idx = 0
+    length = len(json_str)
+    while idx < length:
+        if json_str[idx] != '{':
+            idx += 1
+            continue
+        balance = 1
+        start = idx
+        idx += 1
+        while idx < length and balance > 0:
+            if json_str[idx] == '{':
+                balance += 1
+            elif json_str[idx] == '}':
+                balance -= 1
+            idx += 1
+        if balance == 0:
+            json_obj_str = json_str[start:idx]
+            try:
+                json_obj = json.loads(json_obj_str)
+                tool_id = function_name + '_' + str(len(result)) if function_name else 'tool_' + str(len(result))
+                result.append({'function_name': function_name or 'default_function', 'parameter': json_obj, 'function_call_id': tool_id})
+            except json.JSONDecodeError:
+                pass
+    return result
+
+class LegacyStreamingToolCallParser:
+
+    def __init__(self, tool_names):
+        self.tool_names = set(tool_names)
+        self.buffer = ''
+        self.scan_pos = 0
+        self.call_start = None
+        self.matcher = None
+        self.matcher_pos = 0
+        self.matcher_opened = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        completed = []
+        while True:
+            if self.matcher is None and (not self._find_call_start()):
+                break
+            tool_call = self._advance_matcher()
+            if tool_call is None:
+                break
+            completed.extend(tool_call)
+        return completed
+
+    def _find_call_start(self):
+        while True:
+            tag_start = self.buffer.find('<', self.scan_pos)
+            if tag_start == -1:
+                self.scan_pos = len(self.buffer)
+                return False
+            tag_end = self.buffer.find('>', tag_start)
+            if tag_end == -1:
+                self.scan_pos = tag_start
+                return False
+            line_start = self.buffer.rfind('\n', 0, tag_start) + 1
+            tag_content = self.buffer[tag_start + 1:tag_end].strip()
+            tag_name = tag_content.split()[0] if tag_content else ''
+            if self.buffer[line_start:tag_start].strip() == '' and tag_name in self.tool_names:
+                self.call_start = tag_start
+                self.matcher = LegacyXmlMatcher(tag_name)
+                self.matcher_pos = tag_start
+                self.matcher_opened = False
+                return True
+            self.scan_pos = tag_start + 1
+
+    def _advance_matcher(self):
+        while self.matcher_pos < len(self.buffer):
+            piece_end = self.buffer.find('>', self.matcher_pos)
+            piece_end = len(self.buffer) if piece_end == -1 else piece_end + 1
+            self.matcher.update(self.buffer[self.matcher_pos:piece_end])
+            self.matcher_pos = piece_end
+            if self.matcher.depth > 0:
+                self.matcher_opened = True
+            elif self.matcher_opened:
+                segment = self.buffer[self.call_start:piece_end]
+                self.matcher = None
+                self.scan_pos = piece_end
+                return legacy_parse_function_xml(segment)
+        return None
+
+
+TOOLS = ["write_to_file", "read_file", "think"]
+PIECES = [
+    "<", ">", "</", "/", " ", "  ", "\n", "\t", "\r", "x", "a < b", "c > d", "{", "}", "好",
+    "<write_to_file>", "</write_to_file>", "<read_file>", "</read_file>", "<think>", "</think>",
+    "<path>", "</path>", "<content>", "</content>", "<tool_call>", "</tool_call>",
+    "< think>", "</think >", "<think attr='1'>", "<br>", "<think", "think>", "path", "</th",
+]
+
+def random_text(rng, size):
+    return "".join(rng.choice(PIECES) for _ in range(size))
+
+def random_chunks(rng, text):
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.choice((1, 2, 3, 7, 16, 64))
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+def tool_call_payload(size):
+    line = "\\section{Intro} a < b and x > y, <b>bold</b> $\\{x\\}$ 文本。\n"
+    body = (line * (size // len(line) + 1))[:size]
+    return "我来写文件。\n<write_to_file>\n<path>paper.tex</path>\n<content>\n" + body + "\n</content>\n</write_to_file>\n", body
+
+def as_tuples(results):
+    return [(result.matched, result.data) for result in results]
+
+class TestXmlParserFuzz(unittest.TestCase):
+
+    def test_xml_matcher_matches_legacy(self):
+        rng = random.Random(1)
+        for _ in range(1500):
+            text = random_text(rng, rng.randint(0, 60))
+            tag, position = rng.choice(TOOLS), rng.randint(0, 20)
+            new, old = XmlMatcher(tag, position=position), LegacyXmlMatcher(tag, position=position)
+            for chunk in random_chunks(rng, text):
+                self.assertEqual(as_tuples(new.update(chunk)), as_tuples(old.update(chunk)), repr(text))
+            self.assertEqual(as_tuples(new.final()), as_tuples(old.final()), repr(text))
+            self.assertEqual((new.depth, new.state, new.matched), (old.depth, old.state, old.matched))
+
+    def test_parse_function_xml_matches_legacy(self):
+        rng = random.Random(2)
+        for _ in range(1500):
+            text = random_text(rng, rng.randint(0, 80))
+            for check_line_start in (True, False):
+                self.assertEqual(
+                    parse_function_xml(text, check_line_start),
+                    legacy_parse_function_xml(text, check_line_start),
+                    repr(text),
+                )
+
+    def test_streaming_parser_matches_legacy(self):
+        rng = random.Random(3)
+        for _ in range(2000):
+            text = random_text(rng, rng.randint(0, 80))
+            new, old = StreamingToolCallParser(TOOLS), LegacyStreamingToolCallParser(TOOLS)
+            for chunk in random_chunks(rng, text):
+                self.assertEqual(new.feed(chunk), old.feed(chunk), repr(text))
+
+    def test_parse_continuous_json_matches_legacy(self):
+        rng = random.Random(4)
+        values = [1, "s", [1, 2], {"k": None}, True]
+        for _ in range(300):
+            parts = []
+            for _ in range(rng.randint(0, 4)):
+                obj = {f"k{i}": rng.choice(values) for i in range(rng.randint(0, 3))}
+                parts.append(json.dumps(obj) if rng.random() < 0.8 else json.dumps(obj)[:-1])
+                parts.append(rng.choice(["", " ", "\n", "x", "}"]))
+            text = "".join(parts)
+            self.assertEqual(parse_continuous_json(text, "f"), legacy_parse_continuous_json(text, "f"), repr(text))
+
+    def test_parse_continuous_json_braces_inside_strings(self):
+        first, second = {"code": "if (x) { y(); "}, {"code": "}"}
+        calls = parse_continuous_json(json.dumps(first) + json.dumps(second), "write")
+        self.assertEqual([call["parameter"] for call in calls], [first, second])
+        self.assertEqual([call["function_call_id"] for call in calls], ["write_0", "write_1"])
+
+    def test_megabyte_payload(self):
+        text, body = tool_call_payload(1 << 20)
+        expected = [{"function_name": "write_to_file", "parameter": {"path": "paper.tex", "content": body.strip()}}]
+        self.assertEqual(parse_function_xml(text), expected)
+
+        parser = StreamingToolCallParser(TOOLS)
+        calls = []
+        for pos in range(0, len(text), 50):
+            calls.extend(parser.feed(text[pos:pos + 50]))
+        self.assertEqual(calls, expected)
+
+        matcher = XmlMatcher("content")
+        results = as_tuples(matcher.final(text))
+        self.assertIn((True, "\n" + body + "\n"), results)
+
+        arguments = json.dumps({"path": "paper.tex", "content": body})
+        calls = parse_continuous_json(arguments + arguments, "write_to_file")
+        self.assertEqual([call["parameter"]["content"] for call in calls], [body, body])
+
+    def test_many_unclosed_tags_stay_linear(self):
+        text = "<br>\n" * 20000 + "<read_file>\n<path>a.py</path>\n</read_file>\n"
+        self.assertEqual(parse_function_xml(text), [{"function_name": "read_file", "parameter": {"path": "a.py"}}])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+"""
+可插拔的 token 计数器。
+
+安装了 tiktoken 且本地有对应编码表时使用精确的 BPE 计数，否则退回到按文字类型估算的离线计数器：
+中日韩字符逐字计数、英文单词按长度计数、数字按三位一组计数，比 len(text) / 4 更接近真实值，
+对中文为主的论文草稿尤其明显。不同模型通过 get_tokenizer(model) 选择对应的计数器。
+"""
+
+_CJK_RANGES = "぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯"
+_CJK_PATTERN = re.compile(f"[{_CJK_RANGES}]")
+_ASCII_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+_OTHER_WORD_PATTERN = re.compile(f"[^\\W\\d_A-Za-z{_CJK_RANGES}]+")
+_DIGITS_PATTERN = re.compile(r"\d{1,3}")
+_SPACE_RUN_PATTERN = re.compile(r"\s{2,}")
+_SYMBOL_PATTERN = re.compile(f"[^\\w\\s{_CJK_RANGES}]|_")
+
+
+class Tokenizer:
+    """token 计数器接口。name 用于区分不同计数器的缓存结果。"""
+    name: str = "tokenizer"
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+
+class HeuristicTokenizer(Tokenizer):
+    """
+    不依赖词表的离线估算。
+
+    cjk_weight 是每个中日韩字符的 token 数，word_chars 是英文单词平均每个 token 的字符数。
+    """
+    def __init__(self, name: str = "heuristic", cjk_weight: float = 1.0, word_chars: float = 5.0, other_chars: float = 3.0):
+        self.name = name
+        self.cjk_weight = cjk_weight
+        self.word_chars = word_chars
+        self.other_chars = other_chars
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokens = len(_CJK_PATTERN.findall(text)) * self.cjk_weight
+        tokens += sum(-(-len(word) // self.word_chars) for word in _ASCII_WORD_PATTERN.findall(text))
+        tokens += sum(-(-len(word) // self.other_chars) for word in _OTHER_WORD_PATTERN.findall(text))
+        tokens += len(_DIGITS_PATTERN.findall(text))
+        tokens += len(_SYMBOL_PATTERN.findall(text))
+        # 单个空格会并入后面的单词，连续空白（缩进、空行）大致算一个 token
+        tokens += len(_SPACE_RUN_PATTERN.findall(text))
+        return max(1, int(round(tokens)))
+
+
+class TiktokenTokenizer(Tokenizer):
+    """使用 tiktoken 编码表的精确计数。"""
+    def __init__(self, encoding_name: str):
+        if tiktoken is None:
+            raise ImportError("tiktoken is not installed")
+        self.name = encoding_name
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+# 模型名前缀 -> (tiktoken 编码名, 离线估算参数)。按顺序匹配，第一个命中的生效。
+MODEL_TOKENIZERS: List[Tuple[str, Optional[str], Dict[str, float]]] = [
+    ("gpt-4o", "o200k_base", {"cjk_weight": 0.8}),
+    ("gpt-4.1", "o200k_base", {"cjk_weight": 0.8}),
+    ("gpt-4.5", "o200k_base", {"cjk_weight": 0.8}),
+    ("gpt-5", "o200k_base", {"cjk_weight": 0.8}),
+    ("o1", "o200k_base", {"cjk_weight": 0.8}),
+    ("o3", "o200k_base", {"cjk_weight": 0.8}),
+    ("o4", "o200k_base", {"cjk_weight": 0.8}),
+    ("gpt-4", "cl100k_base", {"cjk_weight": 1.3}),
+    ("gpt-3.5", "cl100k_base", {"cjk_weight": 1.3}),
+    ("claude", None, {"cjk_weight": 1.4, "word_chars": 4.5}),
+    ("gemini", None, {"cjk_weight": 0.9}),
+    ("deepseek", None, {"cjk_weight": 0.7}),
+    ("qwen", None, {"cjk_weight": 0.7}),
+]
+DEFAULT_TOKENIZER: Tuple[Optional[str], Dict[str, float]] = ("o200k_base", {"cjk_weight": 1.0})
+
+_custom_tokenizers: List[Tuple[str, Callable[[], Tokenizer]]] = []
+_tokenizers: Dict[str, Tokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+def register_tokenizer(model_prefix: str, factory: Callable[[], Tokenizer]):
+    """为某一类模型注册自定义计数器，优先于内置规则。"""
+    with _tokenizers_lock:
+        _custom_tokenizers.insert(0, (model_prefix, factory))
+        _tokenizers.clear()
+
+def _model_family(model: str) -> str:
+    # 去掉 "openai/gpt-4o"、"anthropic.claude-3" 一类的服务商前缀
+    return re.split(r"[/:]", model.lower())[-1].split("anthropic.")[-1]
+
+def _build_tokenizer(model: str) -> Tokenizer:
+    family = _model_family(model)
+    for prefix, factory in _custom_tokenizers:
+        if family.startswith(prefix):
+            return factory()
+    encoding_name, heuristic = DEFAULT_TOKENIZER
+    for prefix, candidate_encoding, candidate_heuristic in MODEL_TOKENIZERS:
+        if family.startswith(prefix):
+            encoding_name, heuristic = candidate_encoding, candidate_heuristic
+            break
+    if encoding_name and tiktoken is not None:
+        try:
+            return TiktokenTokenizer(encoding_name)
+        except Exception:
+            # 离线环境下编码表无法下载，退回到估算
+            pass
+    name = f"heuristic:{encoding_name or family.split('-')[0]}"
+    return HeuristicTokenizer(name=name, **heuristic)
+
+def get_tokenizer(model: str = "") -> Tokenizer:
+    """返回适用于 model 的计数器，同一进程内按模型缓存。"""
+    model = model or ""
+    tokenizer = _tokenizers.get(model)
+    if tokenizer is None:
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.get(model)
+            if tokenizer is None:
+                tokenizer = _tokenizers[model] = _build_tokenizer(model)
+    return tokenizer
+
+def count_tokens(text: str, model: str = "") -> int:
+    return get_tokenizer(model).count(text)
@@ -7,14 +7,24 @@ import base64
 import random
 import string
 import asyncio
+import weakref
+import threading
 import traceback
-from time import time
+import contextvars
+from time import time, perf_counter
 from PIL import Image
-from collections import defaultdict
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+from collections import defaultdict, OrderedDict
 from httpx_socks import AsyncProxyTransport
 from urllib.parse import urlparse, urlunparse
 
 from .log_config import logger
+from .sse import json_dumps
+from .connection import get_connection_manager
+from .ratelimit import parse_rate_limit, RateLimit, RateLimiter, TOKENS_PER_REQUEST
 
 
 class HTTPException(Exception):
@@ -250,44 +260,59 @@ def safe_get(data, *keys, default=None):
         return default
     return data
 
-def parse_rate_limit(limit_string):
-    # 定义时间单位到秒的映射
-    time_units = {
-        's': 1, 'sec': 1, 'second': 1,
-        'm': 60, 'min': 60, 'minute': 60,
-        'h': 3600, 'hr': 3600, 'hour': 3600,
-        'd': 86400, 'day': 86400,
-        'mo': 2592000, 'month': 2592000,
-        'y': 31536000, 'year': 31536000,
-        'tpr': -1,
-    }
-
-    # 处理多个限制条件
-    limits = []
-    for limit in limit_string.split(','):
-        limit = limit.strip()
-        # 使用正则表达式匹配数字和单位
-        match = re.match(r'^(\d+)/(\w+)$', limit)
-        if not match:
-            raise ValueError(f"Invalid rate limit format: {limit}")
-
-        count, unit = match.groups()
-        count = int(count)
+@dataclass
+class ItemStats:
+    """单个 key 或端点的运行统计。延迟只统计成功的请求，失败通常很快返回（例如 429），会拉低延迟。"""
+    ewma_latency: Optional[float] = None
+    error_rate: float = 0.0
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    last_update: float = 0.0
+
+    def record(self, latency: Optional[float], error: bool, alpha: float, now: float):
+        self.requests += 1
+        self.last_update = now
+        self.error_rate += alpha * ((1.0 if error else 0.0) - self.error_rate)
+        if error:
+            self.errors += 1
+        elif latency is not None:
+            self.ewma_latency = latency if self.ewma_latency is None else self.ewma_latency + alpha * (latency - self.ewma_latency)
+
+    def to_dict(self) -> dict:
+        return {
+            "ewma_latency": self.ewma_latency,
+            "error_rate": self.error_rate,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
 
-        # 转换单位到秒
-        if unit not in time_units:
-            raise ValueError(f"Unknown time unit: {unit}")
+class ThreadSafeCircularList:
+    """
+    按调度算法轮流取出 key 或端点，并执行速率限制和冷却。
 
-        seconds = time_units[unit]
-        limits.append((count, seconds))
+    round_robin、random、fixed_priority、smart_round_robin 只看顺序；
+    least_outstanding 选择进行中请求最少的 item；p2c（power of two choices）随机取两个 item，
+    选择 EWMA 延迟 × (进行中请求数 + 1) × 错误惩罚 更小的那个。
+    后两种算法依赖调用方上报结果：使用 track()，或者 acquire() 之后调用 release()。
 
-    return limits
+    acquire / release / track 是提供给自己掌握请求生命周期的调用方的库接口（例如按 key 调度的网关）。
+    本仓库中的列表只在 request.py 构造 Vertex AI 的 URL 时用 next() 轮询区域，请求在之后才发出，
+    这些列表使用 round_robin，不需要也不会收到上报。
+    """
+    # 负载感知调度的参数
+    ewma_alpha = 0.3
+    error_penalty = 10.0
+    # 超过这个秒数没有新结果的 item，延迟视为未知，重新参与探测
+    stale_after = 60.0
 
-class ThreadSafeCircularList:
-    def __init__(self, items = [], rate_limit={"default": "999999/min"}, schedule_algorithm="round_robin", provider_name=None):
+    def __init__(self, items = [], rate_limit={"default": "999999/min"}, schedule_algorithm="round_robin", provider_name=None, seed=None):
         self.provider_name = provider_name
         self.original_items = list(items)
         self.schedule_algorithm = schedule_algorithm
+        self._random = random.Random(seed)
+        self.item_stats: Dict[str, ItemStats] = defaultdict(ItemStats)
 
         if schedule_algorithm == "random":
             self.items = random.sample(items, len(items))
@@ -297,14 +322,17 @@ class ThreadSafeCircularList:
             self.items = items
         elif schedule_algorithm == "smart_round_robin":
             self.items = items
+        elif schedule_algorithm in ("least_outstanding", "p2c"):
+            self.items = items
         else:
             self.items = items
-            logger.warning(f"Unknown schedule algorithm: {schedule_algorithm}, use (round_robin, random, fixed_priority, smart_round_robin) instead")
+            logger.warning(f"Unknown schedule algorithm: {schedule_algorithm}, use (round_robin, random, fixed_priority, smart_round_robin, least_outstanding, p2c) instead")
             self.schedule_algorithm = "round_robin"
 
         self.index = 0
         self.lock = asyncio.Lock()
-        self.requests = defaultdict(lambda: defaultdict(list))
+        # (item, 模型) -> 令牌桶限流器
+        self.limiters: Dict[tuple, RateLimiter] = {}
         self.cooling_until = defaultdict(float)
         self.rate_limits = {}
         self.reordering_task = None
@@ -367,55 +395,95 @@ class ThreadSafeCircularList:
             # self.requests[item] = []
             logger.warning(f"API key {item} 已进入冷却状态，冷却时间 {cooling_time} 秒")
 
-    async def is_rate_limited(self, item, model: str = None, is_check: bool = False) -> bool:
-        now = time()
+    def _rate_limit_for(self, model: str = None):
+        # 先尝试精确匹配，再模糊匹配，都没匹配到时使用默认值
+        if model and model in self.rate_limits:
+            return self.rate_limits[model]
+        for limit_model in self.rate_limits:
+            if limit_model != "default" and model and limit_model in model:
+                return self.rate_limits[limit_model]
+        return self.rate_limits.get("default", [RateLimit(999999, 60)])
+
+    def _limiter(self, item, model: str = None) -> RateLimiter:
+        key = (item, model or "default")
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limiter = self.limiters[key] = RateLimiter(self._rate_limit_for(model), name=f"{item}:{key[1]}")
+        return limiter
+
+    def wait_time(self, item, model: str = None, tokens: int = 0) -> float:
+        """返回 item 恢复可用需要等待的秒数，包括冷却时间。"""
+        return max(self.cooling_until[item] - time(), self._limiter(item, model).wait_time(tokens), 0.0)
+
+    async def is_rate_limited(self, item, model: str = None, is_check: bool = False, tokens: int = 0) -> bool:
         # 检查是否在冷却中
-        if now < self.cooling_until[item]:
+        if time() < self.cooling_until[item]:
             return True
 
-        # 获取适用的速率限制
+        # 令牌桶按需结算，不需要保存和扫描请求时间戳；is_check 只检查，不扣除额度
+        limiter = self._limiter(item, model)
+        if is_check:
+            return limiter.wait_time(tokens) > 0
+        if limiter.try_acquire(tokens) > 0:
+            logger.warning(f"API key {item}: model: {model or 'default'} has been rate limited")
+            return True
+        return False
 
-        if model:
-            model_key = model
-        else:
-            model_key = "default"
+    def _cost(self, item, now: float, default_latency: float) -> float:
+        stats = self.item_stats[item]
+        latency = stats.ewma_latency
+        if latency is None or now - stats.last_update > self.stale_after:
+            latency = default_latency
+        return latency * (stats.in_flight + 1) * (1 + self.error_penalty * stats.error_rate)
 
-        rate_limit = None
-        # 先尝试精确匹配
-        if model and model in self.rate_limits:
-            rate_limit = self.rate_limits[model]
+    async def _next_by_load(self, model: str = None, tokens: int = 0):
+        available = [item for item in self.items if not await self.is_rate_limited(item, model, is_check=True, tokens=tokens)]
+        if not available:
+            logger.warning("All API keys are rate limited!")
+            raise HTTPException(status_code=429, detail="Too many requests")
+
+        now = time()
+        # 没有统计数据的 item 使用已知延迟的平均值，既参与探测，又不会在并发突发时独占流量
+        known = [
+            stats.ewma_latency for stats in (self.item_stats[item] for item in available)
+            if stats.ewma_latency is not None and now - stats.last_update <= self.stale_after
+        ]
+        default_latency = sum(known) / len(known) if known else 1.0
+
+        if self.schedule_algorithm == "p2c":
+            candidates = self._random.sample(available, min(2, len(available)))
+            item = min(candidates, key=lambda candidate: self._cost(candidate, now, default_latency))
         else:
-            # 如果没有精确匹配，尝试模糊匹配
-            for limit_model in self.rate_limits:
-                if limit_model != "default" and model and limit_model in model:
-                    rate_limit = self.rate_limits[limit_model]
-                    break
-
-        # 如果都没匹配到，使用默认值
-        if rate_limit is None:
-            rate_limit = self.rate_limits.get("default", [(999999, 60)])  # 默认限制
-
-        # 检查所有速率限制条件
-        for limit_count, limit_period in rate_limit:
-            # 使用特定模型的请求记录进行计算
-            recent_requests = sum(1 for req in self.requests[item][model_key] if req > now - limit_period)
-            if recent_requests >= limit_count:
-                if not is_check:
-                    logger.warning(f"API key {item}: model: {model_key} has been rate limited ({limit_count}/{limit_period} seconds)")
-                return True
-
-        # 清理太旧的请求记录
-        max_period = max(period for _, period in rate_limit)
-        self.requests[item][model_key] = [req for req in self.requests[item][model_key] if req > now - max_period]
-
-        # 记录新的请求
-        if not is_check:
-            self.requests[item][model_key].append(now)
+            # 打乱后取最小值，相同负载时随机选择
+            candidates = self._random.sample(available, len(available))
+            item = min(candidates, key=lambda candidate: (self.item_stats[candidate].in_flight, self._cost(candidate, now, default_latency)))
 
-        return False
+        # 扣除本次请求的额度
+        await self.is_rate_limited(item, model, tokens=tokens)
+        return item
 
-    async def next(self, model: str = None):
+    async def next(self, model: str = None, tokens: int = 0, timeout: float = 0):
+        """
+        取出下一个可用的 item。所有 item 都被限流时，timeout 为 0 直接抛出 429，
+        否则等待最早恢复的 item，最多等待 timeout 秒。
+        """
+        started = time()
+        while True:
+            try:
+                return await self._next(model, tokens)
+            except HTTPException:
+                if not timeout or not self.items:
+                    raise
+                wait = min(self.wait_time(item, model, tokens) for item in self.items)
+                if time() - started + wait > timeout:
+                    raise
+                await asyncio.sleep(max(wait, 0.001))
+
+    async def _next(self, model: str = None, tokens: int = 0):
         async with self.lock:
+            if self.schedule_algorithm in ("least_outstanding", "p2c") and self.items:
+                return await self._next_by_load(model, tokens)
+
             if self.schedule_algorithm == "fixed_priority":
                 self.index = 0
 
@@ -428,7 +496,7 @@ class ThreadSafeCircularList:
                 item = self.items[self.index]
                 self.index = (self.index + 1) % len(self.items)
 
-                if not await self.is_rate_limited(item, model):
+                if not await self.is_rate_limited(item, model, tokens=tokens):
                     return item
 
                 # 如果已经检查了所有的 API key 都被限制
@@ -442,24 +510,9 @@ class ThreadSafeCircularList:
             return False
 
         async with self.lock:
-            rate_limit = None
-            model_key = model or "default"
-            if model and model_key in self.rate_limits:
-                rate_limit = self.rate_limits[model_key]
-            else:
-                # fuzzy match
-                for limit_model in self.rate_limits:
-                    if limit_model != "default" and model and limit_model in model:
-                        rate_limit = self.rate_limits[limit_model]
-                        break
-            if rate_limit is None:
-                rate_limit = self.rate_limits.get("default", [])
-
-            for limit_count, limit_period in rate_limit:
-                if limit_period == -1:  # TPR limit
-                    if tokens > limit_count:
-                        # logger.warning(f"API provider for model {model_key} exceeds TPR limit ({tokens}/{limit_count}).")
-                        return True
+            for limit in self._rate_limit_for(model):
+                if limit.period == TOKENS_PER_REQUEST and tokens > limit.count:
+                    return True
         return False
 
     async def is_all_rate_limited(self, model: str = None) -> bool:
@@ -502,6 +555,47 @@ class ThreadSafeCircularList:
         """
         return len(self.items)
 
+    async def acquire(self, model: str = None):
+        """取出一个 item 并计入进行中的请求，请求结束后必须调用 release。"""
+        item = await self.next(model)
+        self.item_stats[item].in_flight += 1
+        return item
+
+    def release(self, item, latency: Optional[float] = None, error: bool = False):
+        """上报 acquire 取出的 item 的请求结果。latency 为请求耗时（秒）。"""
+        stats = self.item_stats[item]
+        stats.in_flight = max(stats.in_flight - 1, 0)
+        stats.record(latency, error, self.ewma_alpha, time())
+
+    @asynccontextmanager
+    async def track(self, model: str = None):
+        """
+        async with circular_list.track(model) as item:
+            ...
+
+        自动统计耗时，代码块抛出异常时记为失败。
+        """
+        item = await self.acquire(model)
+        started = perf_counter()
+        try:
+            yield item
+        except BaseException:
+            self.release(item, error=True)
+            raise
+        self.release(item, perf_counter() - started)
+
+    def stats(self) -> Dict[str, dict]:
+        """返回每个 item 的统计数据。"""
+        return {item: self.item_stats[item].to_dict() for item in self.items}
+
+    def to_dict(self) -> dict:
+        return {
+            "provider_name": self.provider_name,
+            "schedule_algorithm": self.schedule_algorithm,
+            "items": list(self.items),
+            "stats": self.stats(),
+        }
+
 def circular_list_encoder(obj):
     if isinstance(obj, ThreadSafeCircularList):
         return obj.to_dict()
@@ -564,55 +658,105 @@ end_of_line = "\n\n"
 # end_of_line = "\r"
 # end_of_line = "\n"
 
-async def generate_sse_response(timestamp, model, content=None, tools_id=None, function_call_name=None, function_call_content=None, role=None, total_tokens=0, prompt_tokens=0, completion_tokens=0, reasoning_content=None, stop=None):
-    random.seed(timestamp)
-    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=29))
+@lru_cache(maxsize=64)
+def completion_id_suffix(timestamp) -> str:
+    """同一时间戳的响应使用同一个随机 id。结果被缓存，流式响应中每个 token 不必重新生成。"""
+    return ''.join(random.Random(timestamp).choices(string.ascii_letters + string.digits, k=29))
 
-    delta_content = {"role": "assistant", "content": content} if content else {}
-    if reasoning_content:
-        delta_content = {"role": "assistant", "content": "", "reasoning_content": reasoning_content}
-
-    sample_data = {
-        "id": f"chatcmpl-{random_str}",
-        "object": "chat.completion.chunk",
-        "created": timestamp,
-        "model": model,
-        "choices": [
-            {
-                "index": 0,
-                "delta": delta_content,
-                "logprobs": None,
-                "finish_reason": None if content or reasoning_content else "stop"
-            }
-        ],
-        "usage": None,
-        "system_fingerprint": "fp_d576307f90",
-    }
-    if function_call_content:
-        sample_data["choices"][0]["delta"] = {"tool_calls":[{"index":0,"function":{"arguments": function_call_content}}]}
-    if tools_id and function_call_name:
-        sample_data["choices"][0]["delta"] = {"tool_calls":[{"index":0,"id": tools_id,"type":"function","function":{"name": function_call_name, "arguments":""}}]}
-        # sample_data["choices"][0]["delta"] = {"tool_calls":[{"index":0,"function":{"id": tools_id, "name": function_call_name}}]}
-    if role:
-        sample_data["choices"][0]["delta"] = {"role": role, "content": ""}
-    if total_tokens:
-        sample_data["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total_tokens}
-        sample_data["choices"] = []
-    if stop:
-        sample_data["choices"][0]["delta"] = {}
-        sample_data["choices"][0]["finish_reason"] = stop
+@dataclass
+class ChatDelta:
+    """
+    流式响应中的一个增量。各个供应商的 fetch_*_response_stream 产出 ChatDelta，
+    客户端直接读取字段，只有需要对外输出 SSE 时才调用 to_sse() 编码。
 
-    json_data = await asyncio.to_thread(json.dumps, sample_data, ensure_ascii=False)
-    # print("json_data", json.dumps(sample_data, indent=4, ensure_ascii=False))
+    raw 是原样转发的上游 OpenAI 格式 chunk，此时其余内容字段不使用。
+    """
+    timestamp: Optional[int] = None
+    model: Optional[str] = None
+    content: Optional[str] = None
+    tools_id: Optional[str] = None
+    function_call_name: Optional[str] = None
+    function_call_content: Optional[str] = None
+    role: Optional[str] = None
+    total_tokens: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_content: Optional[str] = None
+    stop: Optional[str] = None
+    cached_tokens: int = 0
+    raw: Optional[dict] = None
+    keepalive: bool = False
+    done: bool = False
+
+    def to_dict(self) -> Optional[dict]:
+        """OpenAI chat.completion.chunk 格式。keepalive 和结束标记没有对应的 chunk，返回 None。"""
+        if self.raw is not None:
+            return self.raw
+        if self.keepalive or self.done:
+            return None
 
-    # 构建SSE响应
-    sse_response = f"data: {json_data}" + end_of_line
+        content = self.content
+        reasoning_content = self.reasoning_content
+        delta_content = {"role": "assistant", "content": content} if content else {}
+        if reasoning_content:
+            delta_content = {"role": "assistant", "content": "", "reasoning_content": reasoning_content}
 
-    return sse_response
+        sample_data = {
+            "id": f"chatcmpl-{completion_id_suffix(self.timestamp)}",
+            "object": "chat.completion.chunk",
+            "created": self.timestamp,
+            "model": self.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": delta_content,
+                    "logprobs": None,
+                    "finish_reason": None if content or reasoning_content else "stop"
+                }
+            ],
+            "usage": None,
+            "system_fingerprint": "fp_d576307f90",
+        }
+        if self.function_call_content:
+            sample_data["choices"][0]["delta"] = {"tool_calls":[{"index":0,"function":{"arguments": self.function_call_content}}]}
+        if self.tools_id and self.function_call_name:
+            sample_data["choices"][0]["delta"] = {"tool_calls":[{"index":0,"id": self.tools_id,"type":"function","function":{"name": self.function_call_name, "arguments":""}}]}
+        if self.role:
+            sample_data["choices"][0]["delta"] = {"role": self.role, "content": ""}
+        if self.total_tokens:
+            sample_data["usage"] = {"prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens, "total_tokens": self.total_tokens}
+            if self.cached_tokens:
+                sample_data["usage"]["prompt_tokens_details"] = {"cached_tokens": self.cached_tokens}
+            sample_data["choices"] = []
+        if self.stop:
+            sample_data["choices"][0]["delta"] = {}
+            sample_data["choices"][0]["finish_reason"] = self.stop
+        return sample_data
+
+    def to_sse(self) -> str:
+        if self.keepalive:
+            return ": keepalive" + end_of_line
+        if self.done:
+            return "data: [DONE]" + end_of_line
+        return "data: " + json_dumps(self.to_dict()) + end_of_line
+
+STREAM_DONE = ChatDelta(done=True)
+KEEPALIVE = ChatDelta(keepalive=True)
+
+def generate_delta(timestamp, model, content=None, tools_id=None, function_call_name=None, function_call_content=None, role=None, total_tokens=0, prompt_tokens=0, completion_tokens=0, reasoning_content=None, stop=None, cached_tokens=0):
+    return ChatDelta(timestamp, model, content, tools_id, function_call_name, function_call_content, role, total_tokens, prompt_tokens, completion_tokens, reasoning_content, stop, cached_tokens)
+
+async def generate_sse_response(timestamp, model, content=None, tools_id=None, function_call_name=None, function_call_content=None, role=None, total_tokens=0, prompt_tokens=0, completion_tokens=0, reasoning_content=None, stop=None, cached_tokens=0):
+    return generate_delta(timestamp, model, content, tools_id, function_call_name, function_call_content, role, total_tokens, prompt_tokens, completion_tokens, reasoning_content, stop, cached_tokens).to_sse()
+
+def encode_sse(chunk):
+    """在对外输出的边界把 fetch_response_stream 产出的 ChatDelta 编码为 SSE 文本，其他内容原样返回。"""
+    if isinstance(chunk, ChatDelta):
+        return chunk.to_sse()
+    return chunk
 
 async def generate_no_stream_response(timestamp, model, content=None, tools_id=None, function_call_name=None, function_call_content=None, role=None, total_tokens=0, prompt_tokens=0, completion_tokens=0, reasoning_content=None, image_base64=None):
-    random.seed(timestamp)
-    random_str = ''.join(random.choices(string.ascii_letters + string.digits, k=29))
+    random_str = completion_id_suffix(timestamp)
     message = {
         "role": role,
         "content": content,
@@ -692,7 +836,7 @@ async def generate_no_stream_response(timestamp, model, content=None, tools_id=N
     if total_tokens:
         sample_data["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total_tokens}
 
-    json_data = await asyncio.to_thread(json.dumps, sample_data, ensure_ascii=False)
+    json_data = json_dumps(sample_data)
     # print("json_data", json.dumps(sample_data, indent=4, ensure_ascii=False))
 
     return json_data
@@ -717,9 +861,10 @@ def encode_image(file_content: bytes):
     else:
         raise ValueError(f"不支持的图片格式: {img_format}")
 
-async def get_image_from_url(url):
+async def _fetch_image(url, headers=None):
     transport = httpx.AsyncHTTPTransport(
-        http2=True,
+        # 没有安装 h2 时 http2=True 会直接报错
+        http2=get_connection_manager().http2,
         verify=False,
         retries=1
     )
@@ -727,10 +872,13 @@ async def get_image_from_url(url):
         try:
             response = await client.get(
                 url,
+                headers=headers,
                 timeout=30.0
             )
-            response.raise_for_status()
-            return response.content
+            # 条件请求返回的 304 表示内容没有变化，交给调用方处理
+            if response.status_code != 304:
+                response.raise_for_status()
+            return response
 
         except httpx.RequestError as e:
             logger.error(f"请求 URL 时出错 {e.request.url!r}: {e}")
@@ -739,11 +887,166 @@ async def get_image_from_url(url):
             logger.error(f"获取 URL 时发生 HTTP 错误 {e.request.url!r}: {e.response.status_code}")
             raise HTTPException(status_code=e.response.status_code, detail=f"获取 URL 时出错: {url}")
 
+async def get_image_from_url(url):
+    return (await _fetch_image(url)).content
+
 async def get_encode_image(image_url):
     file_content = await get_image_from_url(image_url)
-    base64_image = encode_image(file_content)
+    base64_image = await asyncio.to_thread(encode_image, file_content)
     return base64_image
 
+class ImagePartCache:
+    """
+    图片消息片段的 LRU 缓存，按总字节数限制大小。
+
+    键是 (格式, data URL) 本身：Python 字符串的哈希值计算一次后保存在对象上，
+    同一个 data URL 在后续轮次中再次出现时查找几乎不花时间，内容相同的不同字符串对象也能命中。
+    同一个事件循环中同一个键的并发请求共享一次计算。
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._bytes = 0
+        # future 属于创建它的事件循环，按循环分开记录，循环关闭后自动释放
+        self._inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, asyncio.Future]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    async def get(self, key: tuple, factory, size: Optional[int] = None):
+        """size 为 None 时按返回的字符串长度计算。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+            future = inflight.get(key)
+            if future is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(factory())
+        inflight[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            inflight.pop(key, None)
+        self._store(key, value, len(value) if size is None else size)
+        return value
+
+    def _store(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+image_part_cache = ImagePartCache()
+
+class RemoteImageCache:
+    """
+    远程图片的下载结果，按总字节数限制大小。
+
+    URL 指向的内容可能变化，不能只按 URL 复用：每次都带上次响应的 ETag / Last-Modified 发条件请求，
+    服务端返回 304 时沿用上次编码好的 data URL，否则重新下载。之后的转换按 data URL（即图片内容）缓存。
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.downloads = 0
+        self.revalidated = 0
+        # url -> (条件请求头, data URL)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    async def get(self, url: str) -> str:
+        with self._lock:
+            entry = self._entries.get(url)
+        response = await _fetch_image(url, entry[0] if entry else None)
+        if response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            return entry[1]
+        self.downloads += 1
+        data_url = await asyncio.to_thread(encode_image, response.content)
+        validators = {}
+        if response.headers.get("etag"):
+            validators["If-None-Match"] = response.headers["etag"]
+        if response.headers.get("last-modified"):
+            validators["If-Modified-Since"] = response.headers["last-modified"]
+        with self._lock:
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            # 没有校验信息的响应无法确认内容是否变化，不缓存
+            if validators and len(data_url) <= self.max_bytes:
+                self._entries[url] = (validators, data_url)
+                self._bytes += len(data_url)
+                while self._bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self._bytes -= len(evicted)
+        return data_url
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+remote_image_cache = RemoteImageCache()
+
+# 当前正在构造的请求中已经解析的远程图片：url -> Future[data URL]。
+# prepare_image_messages 为每个请求重新创建，同一请求中重复出现的 URL 只确认一次。
+_request_remote_images: contextvars.ContextVar[Optional[Dict[str, asyncio.Future]]] = contextvars.ContextVar("request_remote_images", default=None)
+
+async def _resolve_remote_image(url):
+    resolved = _request_remote_images.get()
+    if resolved is None:
+        return await remote_image_cache.get(url)
+    future = resolved.get(url)
+    if future is None:
+        future = resolved[url] = asyncio.ensure_future(remote_image_cache.get(url))
+    return await asyncio.shield(future)
+
+IMAGE_MESSAGE_FORMATS = {
+    "gpt": "gpt", "openrouter": "gpt", "azure": "gpt", "azure-databricks": "gpt",
+    "claude": "claude", "vertex-claude": "claude", "aws": "claude",
+    "gemini": "gemini", "vertex-gemini": "gemini",
+}
+
+def _webp_to_png(base64_image):
+    # 解码base64获取图片数据
+    image_data = base64.b64decode(base64_image.split(",")[1])
+
+    # 使用PIL打开webp图片
+    image = Image.open(io.BytesIO(image_data))
+
+    # 转换为PNG格式
+    png_buffer = io.BytesIO()
+    image.save(png_buffer, format="PNG")
+    png_base64 = base64.b64encode(png_buffer.getvalue()).decode('utf-8')
+
+    # 返回PNG格式的base64
+    return f"data:image/png;base64,{png_base64}"
+
+def _copy_image_message(message):
+    # 调用方会修改返回值（例如加上 cache_control），缓存中的对象不能直接返回
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in message.items()}
+
 # from PIL import Image
 # import io
 # def validate_image(image_data, image_type):
@@ -765,38 +1068,36 @@ async def get_encode_image(image_url):
 #         return False
 
 async def get_image_message(base64_image, engine = None):
+    image_format = IMAGE_MESSAGE_FORMATS.get(engine)
+    if image_format is None:
+        raise ValueError("Unknown engine")
     if base64_image.startswith("http"):
-        base64_image = await get_encode_image(base64_image)
+        base64_image = await _resolve_remote_image(base64_image)
+    message = await image_part_cache.get(
+        (image_format, base64_image),
+        lambda: _build_image_message(base64_image, image_format),
+        size=len(base64_image),
+    )
+    return _copy_image_message(message)
+
+async def _build_image_message(base64_image, image_format):
     colon_index = base64_image.index(":")
     semicolon_index = base64_image.index(";")
     image_type = base64_image[colon_index + 1:semicolon_index]
 
     if image_type == "image/webp":
-        # 将webp转换为png
-
-        # 解码base64获取图片数据
-        image_data = base64.b64decode(base64_image.split(",")[1])
-
-        # 使用PIL打开webp图片
-        image = Image.open(io.BytesIO(image_data))
-
-        # 转换为PNG格式
-        png_buffer = io.BytesIO()
-        image.save(png_buffer, format="PNG")
-        png_base64 = base64.b64encode(png_buffer.getvalue()).decode('utf-8')
-
-        # 返回PNG格式的base64
-        base64_image = f"data:image/png;base64,{png_base64}"
+        # 将webp转换为png，转换结果在各个格式之间共享
+        base64_image = await image_part_cache.get(("png", base64_image), lambda source=base64_image: asyncio.to_thread(_webp_to_png, source))
         image_type = "image/png"
 
-    if "gpt" == engine or "openrouter" == engine or "azure" == engine or "azure-databricks" == engine:
+    if image_format == "gpt":
         return {
             "type": "image_url",
             "image_url": {
                 "url": base64_image,
             }
         }
-    if "claude" == engine or "vertex-claude" == engine or "aws" == engine:
+    if image_format == "claude":
         # if not validate_image(base64_image.split(",")[1], image_type):
         #     raise ValueError(f"Invalid image format. Expected {image_type}")
         return {
@@ -804,17 +1105,29 @@ async def get_image_message(base64_image, engine = None):
             "source": {
                 "type": "base64",
                 "media_type": image_type,
-                "data": base64_image.split(",")[1],
+                "data": base64_image[base64_image.index(",") + 1:],
             }
         }
-    if "gemini" == engine or "vertex-gemini" == engine:
-        return {
-            "inlineData": {
-                "mimeType": image_type,
-                "data": base64_image.split(",")[1],
-            }
+    return {
+        "inlineData": {
+            "mimeType": image_type,
+            "data": base64_image[base64_image.index(",") + 1:],
         }
-    raise ValueError("Unknown engine")
+    }
+
+async def prepare_image_messages(messages, engine = None):
+    """并发准备一组消息中的所有图片片段，之后的 get_image_message 调用直接命中缓存。"""
+    if engine not in IMAGE_MESSAGE_FORMATS:
+        return
+    _request_remote_images.set({})
+    urls = []
+    for message in messages:
+        if isinstance(message.content, list):
+            for item in message.content:
+                if item.type == "image_url":
+                    urls.append(item.image_url.url)
+    if len(urls) > 1:
+        await asyncio.gather(*(get_image_message(url, engine) for url in dict.fromkeys(urls)), return_exceptions=True)
 
 async def get_text_message(message, engine = None):
     if "gpt" == engine or "claude" == engine or "openrouter" == engine or \
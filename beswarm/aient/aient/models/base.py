@@ -1,11 +1,34 @@
 import os
-import httpx
 import requests
 from pathlib import Path
 from collections import defaultdict
 
 from ..utils import prompt
 from ..core.utils import BaseAPI
+from ..core.connection import get_async_client
+
+class DiscardOutput(str):
+    """
+    重试前产出的标记：调用方应删除此前收到的最后 length 个字符，重试的输出随后产出。
+    它本身是空字符串，直接拼接输出的调用方不受影响。
+    """
+    def __new__(cls, length):
+        marker = super().__new__(cls, "")
+        marker.length = length
+        return marker
+
+def append_output(output: list, chunk: str):
+    """把流式输出的 chunk 追加到 output，遇到 DiscardOutput 时删除最后 length 个字符。"""
+    if not isinstance(chunk, DiscardOutput):
+        output.append(chunk)
+        return
+    remaining = chunk.length
+    while remaining and output:
+        last = output.pop()
+        if len(last) > remaining:
+            output.append(last[:len(last) - remaining])
+            break
+        remaining -= len(last)
 
 class BaseLLM:
     def __init__(
@@ -67,6 +90,8 @@ class BaseLLM:
             ],
         }
         self.tokens_usage = defaultdict(int)
+        # 命中服务端提示词缓存的输入 token 数
+        self.cached_tokens = defaultdict(int)
         self.current_tokens = defaultdict(int)
         self.function_calls_counter = {}
         self.function_call_max_loop = 10
@@ -75,7 +100,7 @@ class BaseLLM:
 
     def _get_aclient(self):
         """
-        Lazily initialize and return the httpx.AsyncClient.
+        Return the process-wide shared httpx.AsyncClient for this API's origin.
         This method ensures the client is always bound to a running event loop.
         """
         import asyncio
@@ -89,11 +114,7 @@ class BaseLLM:
             self._loop = loop
             proxy = self._proxy or os.environ.get("all_proxy") or os.environ.get("ALL_PROXY") or None
             proxies = proxy if proxy and "socks5h" not in proxy else None
-            self._aclient = httpx.AsyncClient(
-                follow_redirects=True,
-                proxy=proxies,
-                timeout=self._timeout,
-            )
+            self._aclient = get_async_client(self.api_url.base_url, proxy=proxies, timeout=self._timeout, loop=loop)
         return self._aclient
 
     @property
@@ -203,7 +224,7 @@ class BaseLLM:
         """
         Non-streaming ask
         """
-        response = ""
+        response = []
         async for chunk in self.ask_stream_async(
             prompt=prompt,
             role=role,
@@ -212,7 +233,7 @@ class BaseLLM:
             pass_history=pass_history,
             **kwargs,
         ):
-            response += chunk
+            append_output(response, chunk)
         full_response: str = "".join(response)
         return full_response
 
@@ -236,7 +257,10 @@ class BaseLLM:
             pass_history=pass_history,
             **kwargs,
         )
-        full_response: str = "".join(response)
+        output = []
+        for chunk in response:
+            append_output(output, chunk)
+        full_response: str = "".join(output)
         return full_response
 
     def rollback(self, n: int = 1, convo_id: str = "default") -> None:
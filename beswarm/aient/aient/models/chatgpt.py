@@ -1,20 +1,25 @@
 import os
 import re
 import json
-import copy
 import httpx
 import asyncio
 import logging
-import inspect
 from collections import defaultdict
 from typing import Union, Optional, Callable
 
-from .base import BaseLLM
+from .base import BaseLLM, DiscardOutput, append_output
 from ..plugins.registry import registry
-from ..plugins import PLUGINS, get_tools_result_async, function_call_list, update_tools_config
-from ..utils.scripts import safe_get, async_generator_to_sync, parse_function_xml, parse_continuous_json, convert_functions_to_xml, remove_xml_tags_and_content
+from ..plugins import get_tools_result_async, update_tools_config
+from ..plugins.executor import ToolExecutor, READ, SPECULATIVE_TOOLS, _tool_footprint, _conflicts
+from ..utils.scripts import safe_get, async_generator_to_sync, parse_function_xml, StreamingToolCallParser, parse_continuous_json, convert_functions_to_xml, remove_xml_tags_and_content, RepetitionDetector
 from ..core.request import prepare_request_payload
 from ..core.response import fetch_response_stream, fetch_response
+from ..core.utils import ChatDelta
+from ..core.retry import RetryPolicy, RetryBudget
+from ..core.ratelimit import get_rate_limiter, parse_rate_limit, request_api_key
+from ..core.tokenizer import get_tokenizer
+from .compaction import ContextCompactor, is_summary, default_compaction_model
+from ..utils.prompt import compaction_prompt
 from ..architext.architext import Messages, SystemMessage, UserMessage, AssistantMessage, ToolCalls, ToolResults, Texts, RoleMessage, Images, Files
 
 class ToolResult(Texts):
@@ -34,7 +39,9 @@ class ToolResult(Texts):
 
 class APITimeoutError(Exception):
     """Custom exception for API timeout errors."""
-    pass
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 class ValidationError(Exception):
     """Custom exception for response validation errors."""
@@ -52,7 +59,9 @@ class ModelNotFoundError(Exception):
 
 class RateLimitError(Exception):
     """Custom exception for rate limit (429) errors."""
-    pass
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 class BadRequestError(Exception):
     """Custom exception for bad request (400) errors."""
@@ -60,7 +69,10 @@ class BadRequestError(Exception):
 
 class HTTPError(Exception):
     """Custom exception for HTTP 500 errors."""
-    pass
+    def __init__(self, message, retry_after=None, status_code=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
 
 class InputTokenCountExceededError(Exception):
     """Custom exception for input token count exceeding the maximum."""
@@ -95,6 +107,8 @@ class AllToolsMissingParametersError(Exception):
         super().__init__(message)
         self.response_text = response_text
 
+_RETRY_AFTER_PATTERN = re.compile(r"'retry_after': ([0-9.]+)")
+_STATUS_CODE_PATTERN = re.compile(r"'status_code': ([0-9]+)")
 
 class chatgpt(BaseLLM):
     """
@@ -124,6 +138,13 @@ class chatgpt(BaseLLM):
         logger: logging.Logger = None,
         check_done: bool = False,
         retry_count: int = 999999,
+        retry_policy: Optional[RetryPolicy] = None,
+        tool_concurrency: int = 4,
+        speculative_tools: bool = True,
+        repetition_check: bool = True,
+        compaction: bool = True,
+        compaction_model: str = None,
+        rate_limit: str = None,
     ) -> None:
         """
         Initialize Chatbot with API key (from https://platform.openai.com/account/api-keys)
@@ -136,6 +157,15 @@ class chatgpt(BaseLLM):
         self.function_call_max_loop = function_call_max_loop
         self.check_done = check_done
         self.retry_count = retry_count
+        self.retry_policy = retry_policy or RetryPolicy(budget=RetryBudget(retry_count))
+        # 例如 "500/min, 200k tokens/min"。同一 base URL 的限流器在所有 agent 之间共享，
+        # 没有配置时只使用从响应头学到的限额
+        rate_limit = rate_limit or os.environ.get("RATE_LIMIT")
+        self.rate_limits = parse_rate_limit(rate_limit) if rate_limit else None
+        self.tool_executor = ToolExecutor(tool_concurrency)
+        self.speculative_tools = speculative_tools
+        # 流式输出中出现重复循环时立即中断并重试，不再为失控的生成消耗 token
+        self.repetition_check = repetition_check
         if logger:
             self.logger = logger
         else:
@@ -149,6 +179,10 @@ class chatgpt(BaseLLM):
                 self.logger.addHandler(handler)
                 self.logger.setLevel(logging.INFO if print_log else logging.WARNING)
 
+        # 对话接近 token 上限时，在后台用 compaction_model 总结最早的消息，默认使用同系列的便宜模型
+        self.compaction_model = compaction_model or os.environ.get("COMPACTION_MODEL") or default_compaction_model(engine)
+        self.compactor = ContextCompactor(self._summarise_history, get_tokenizer(engine), logger=self.logger) if compaction else None
+
         # 注册和处理传入的工具
         self._register_tools(tools)
 
@@ -156,9 +190,8 @@ class chatgpt(BaseLLM):
     def _register_tools(self, tools):
         """动态注册工具函数并更新配置"""
 
-        self.plugins = copy.deepcopy(PLUGINS)
-        self.function_call_list = copy.deepcopy(function_call_list)
-        # 如果有新工具，需要注册到registry并更新配置
+        # 如果有新工具，需要注册到registry并更新配置。
+        # self.plugins 是每个实例自己的开关字典；function_call_list 中的 schema 在实例之间共享，只读
         self.plugins, self.function_call_list, _ = update_tools_config()
 
         if isinstance(tools, list):
@@ -239,15 +272,24 @@ class chatgpt(BaseLLM):
         history = pass_history
         if pass_history < 2:
             history = 2
+        # 摘要消息不计入历史长度，也不会被移除
+        first = 2 if history_len > 1 and is_summary(self.conversation[convo_id][1]) else 1
+        history += first - 1
+        evicted = []
         while history_len > history:
-            mess_body = self.conversation[convo_id].pop(1)
+            mess_body = self.conversation[convo_id].pop(first)
+            evicted.append(mess_body)
             history_len = history_len - 1
             if mess_body.get("role") == "user":
-                assistant_body = self.conversation[convo_id].pop(1)
+                assistant_body = self.conversation[convo_id].pop(first)
+                evicted.append(assistant_body)
                 history_len = history_len - 1
                 if assistant_body.get("tool_calls"):
-                    self.conversation[convo_id].pop(1)
+                    evicted.append(self.conversation[convo_id].pop(first))
                     history_len = history_len - 1
+        if evicted and self.compactor:
+            self.compactor.evict(convo_id, evicted)
+            self.compactor.schedule(convo_id, self.conversation[convo_id])
 
         if total_tokens:
             self.current_tokens[convo_id] = total_tokens
@@ -257,18 +299,45 @@ class chatgpt(BaseLLM):
         """
         Truncate the conversation
         """
-        while True:
-            if (
-                self.current_tokens[convo_id] > self.truncate_limit
-                and len(self.conversation[convo_id]) > 1
-            ):
-                # Don't remove the first message
-                mess = self.conversation[convo_id].pop(1)
-                string_mess = json.dumps(mess, ensure_ascii=False)
-                self.current_tokens[convo_id] -= len(string_mess) / 4
-                self.logger.info(f"Truncate message: {mess}")
-            else:
-                break
+        tokenizer = get_tokenizer(self.engine)
+        conversation = self.conversation[convo_id]
+        # 每条消息的 token 数随消息缓存，只有内容变化过的部分需要重新计数
+        message_tokens = [
+            message.token_count(tokenizer) if hasattr(message, "token_count") else tokenizer.count(json.dumps(message, ensure_ascii=False))
+            for message in conversation
+        ]
+        self.current_tokens[convo_id] = sum(message_tokens)
+        evicted = []
+        while self.current_tokens[convo_id] > self.truncate_limit and len(conversation) > 1:
+            # Don't remove the first message, and keep the summary of earlier messages as long as possible
+            first = 2 if len(conversation) > 2 and is_summary(conversation[1]) else 1
+            mess = conversation.pop(first)
+            evicted.append(mess)
+            self.current_tokens[convo_id] -= message_tokens.pop(first)
+            self.logger.info(f"Truncate message: {mess}")
+
+        if self.compactor and isinstance(conversation, Messages):
+            if evicted:
+                # 进行中的压缩可能包含刚被移除的消息，重新开始一次
+                self.compactor.cancel(convo_id)
+                self.compactor.evict(convo_id, evicted)
+            self.compactor.schedule(convo_id, conversation, self.truncate_limit)
+
+    async def _summarise_history(self, text: str) -> str:
+        def summariser(engine):
+            return chatgpt(
+                api_key=self.api_key, api_url=self.api_url.chat_url, engine=engine,
+                system_prompt=compaction_prompt, use_plugins=False, compaction=False, retry_count=3, logger=self.logger,
+            )
+        try:
+            return await summariser(self.compaction_model).ask_async(text)
+        except (ModelNotFoundError, BadRequestError) as e:
+            if self.compaction_model == self.engine:
+                raise
+            # 服务端不提供这个压缩模型，之后都改用主模型
+            self.logger.warning(f"Compaction model {self.compaction_model} is unavailable ({e}), using {self.engine} instead.")
+            self.compaction_model = self.engine
+            return await summariser(self.engine).ask_async(text)
 
     async def get_post_body(
         self,
@@ -365,10 +434,67 @@ class chatgpt(BaseLLM):
         function_full_response = ""
         function_call_name = ""
         need_function_call = False
+        cached_tokens = 0
+
+        async def collect_tool_result(tool_name, tool_args):
+            return [chunk async for chunk in get_tools_result_async(
+                tool_name, tool_args, model or self.engine, chatgpt, kwargs.get('api_key', self.api_key),
+                kwargs.get('api_url', self.api_url.chat_url), use_plugins=False, model=model or self.engine,
+                add_message=self.add_to_conversation, convo_id=convo_id, language=language
+            )]
+
+        # 投机执行：流式输出过程中，SPECULATIVE_TOOLS 中的纯本地读取工具的调用标签一闭合就开始执行，
+        # 响应最终校验通过后直接复用结果，校验失败则取消。其他只读工具（搜索、下载等）有费用或副作用，等响应完成后再执行。
+        # 同一响应中一旦出现非只读的调用，后面的调用可能依赖它的结果，不再投机执行。
+        speculative_parser = None
+        speculative_tasks = {}
+        speculative_footprints = []
+        if is_async and self.use_plugins and self.speculative_tools:
+            speculative_parser = StreamingToolCallParser(self.plugins.keys())
+
+        def start_speculative_tools(content):
+            for tool_call in speculative_parser.feed(content):
+                tool_name = tool_call.get("function_name", "")
+                parameter = tool_call.get("parameter")
+                footprint = _tool_footprint(tool_name, parameter)
+                blocked = any(previous[0] != READ or _conflicts(previous, footprint) for previous in speculative_footprints)
+                speculative_footprints.append(footprint)
+                if blocked or footprint[0] != READ or tool_name not in SPECULATIVE_TOOLS or not isinstance(parameter, dict):
+                    continue
+                tool_args = json.dumps(parameter, ensure_ascii=False)
+                if (tool_name, tool_args) not in speculative_tasks:
+                    if self.print_log:
+                        self.logger.info(f"Speculatively calling: {tool_name}")
+                    speculative_tasks[(tool_name, tool_args)] = asyncio.ensure_future(collect_tool_result(tool_name, tool_args))
+
+        def discard_speculative_task(task):
+            if task.done():
+                if not task.cancelled():
+                    task.exception()
+            else:
+                task.cancel()
+
+        def cancel_speculative_tools():
+            for task in speculative_tasks.values():
+                discard_speculative_task(task)
+            speculative_tasks.clear()
+
+        # 正文和思考过程分别检测
+        repetition_detectors = {"content": RepetitionDetector(), "reasoning": RepetitionDetector()} if self.repetition_check else None
+
+        def check_repetition(kind, content):
+            repetition = repetition_detectors[kind].feed(content)
+            if repetition:
+                cancel_speculative_tools()
+                phrase, count = repetition
+                raise RepetitiveResponseError(f"Repetitive {kind} detected: {phrase[:100]!r} repeated {count} times", phrase, count)
 
         # 处理单行数据的公共逻辑
         def process_line(line):
-            nonlocal response_role, full_response, function_full_response, function_call_name, need_function_call, total_tokens, function_call_id
+            nonlocal response_role, full_response, function_full_response, function_call_name, need_function_call, total_tokens, function_call_id, cached_tokens
+
+            if isinstance(line, ChatDelta):
+                return process_delta(line)
 
             if not line or (isinstance(line, str) and line.startswith(':')):
                 return None
@@ -398,10 +524,16 @@ class chatgpt(BaseLLM):
                     return None
 
             resp = json.loads(line) if isinstance(line, str) else line
+            return process_chunk(resp)
+
+        def process_chunk(resp):
+            nonlocal response_role, full_response, function_full_response, function_call_name, need_function_call, total_tokens, function_call_id, cached_tokens
+
             if "error" in resp:
                 raise Exception(json.dumps({"type": "api_error", "details": resp}, ensure_ascii=False))
 
             total_tokens = total_tokens or safe_get(resp, "usage", "total_tokens", default=0)
+            cached_tokens = cached_tokens or safe_get(resp, "usage", "prompt_tokens_details", "cached_tokens", default=0)
             delta = safe_get(resp, "choices", 0, "delta")
             if not delta:
                 return None
@@ -411,6 +543,10 @@ class chatgpt(BaseLLM):
                 need_function_call = False
                 content = delta["content"]
                 full_response += content
+                if repetition_detectors:
+                    check_repetition("content", content)
+                if speculative_parser:
+                    start_speculative_tools(content)
                 return content
 
             if safe_get(delta, "tool_calls"):
@@ -420,120 +556,178 @@ class chatgpt(BaseLLM):
                 function_call_id = function_call_id or safe_get(delta, "tool_calls", 0, "id")
                 return None
 
+        # fetch_response_stream 产出的增量对象，直接读取字段，不经过 JSON
+        def process_delta(delta):
+            nonlocal response_role, full_response, function_full_response, function_call_name, need_function_call, total_tokens, function_call_id, cached_tokens
+
+            if delta.done:
+                return "DONE"
+            if delta.raw is not None:
+                return process_chunk(delta.raw)
+            if delta.keepalive:
+                return None
+
+            total_tokens = total_tokens or delta.total_tokens
+            cached_tokens = cached_tokens or delta.cached_tokens
+            if delta.total_tokens or delta.stop:
+                return None
+
+            if delta.role:
+                response_role = response_role or delta.role
+                return None
+            if delta.tools_id and delta.function_call_name:
+                need_function_call = True
+                function_call_name = function_call_name or delta.function_call_name
+                function_call_id = function_call_id or delta.tools_id
+                return None
+            if delta.function_call_content:
+                need_function_call = True
+                function_full_response += delta.function_call_content
+                return None
+            if delta.reasoning_content:
+                response_role = response_role or "assistant"
+                if repetition_detectors:
+                    check_repetition("reasoning", delta.reasoning_content)
+                return None
+            if delta.content:
+                response_role = response_role or "assistant"
+                need_function_call = False
+                content = delta.content
+                full_response += content
+                if repetition_detectors:
+                    check_repetition("content", content)
+                if speculative_parser:
+                    start_speculative_tools(content)
+                return content
+
         # 处理流式响应
         async def process_async():
             nonlocal response_role, full_response, function_full_response, function_call_name, need_function_call, total_tokens, function_call_id
 
-            async for line in response_gen:
-                line = line.strip() if isinstance(line, str) else line
-                result = process_line(line)
-                if result == "DONE":
-                    break
-                elif result:
-                    yield result
+            try:
+                async for line in response_gen:
+                    line = line.strip() if isinstance(line, str) else line
+                    result = process_line(line)
+                    if result == "DONE":
+                        break
+                    elif result:
+                        yield result
+            except RepetitiveResponseError:
+                # 立即关闭上游连接，服务端停止生成
+                if hasattr(response_gen, "aclose"):
+                    await response_gen.aclose()
+                raise
 
         def process_sync():
             nonlocal response_role, full_response, function_full_response, function_call_name, need_function_call, total_tokens, function_call_id
 
-            for line in response_gen:
-                line = line.decode("utf-8") if hasattr(line, "decode") else line
-                result = process_line(line)
-                if result == "DONE":
-                    break
-                elif result:
-                    yield result
-
-        # 使用同步或异步处理器处理响应
-        if is_async:
-            async for chunk in process_async():
-                yield chunk
-        else:
-            for chunk in process_sync():
-                yield chunk
+            try:
+                for line in response_gen:
+                    line = line.decode("utf-8") if hasattr(line, "decode") else line
+                    result = process_line(line)
+                    if result == "DONE":
+                        break
+                    elif result:
+                        yield result
+            except RepetitiveResponseError:
+                if hasattr(response_gen, "close"):
+                    response_gen.close()
+                raise
+
+        try:
+            # 使用同步或异步处理器处理响应
+            if is_async:
+                async for chunk in process_async():
+                    yield chunk
+            else:
+                for chunk in process_sync():
+                    yield chunk
 
-        if not full_response.strip() and not need_function_call:
-            raise EmptyResponseError("Response is empty")
+            if not full_response.strip() and not need_function_call:
+                raise EmptyResponseError("Response is empty")
 
-        if self.print_log:
-            self.logger.info(f"total_tokens: {total_tokens}")
+            if cached_tokens:
+                self.cached_tokens[convo_id] += cached_tokens
 
-        if response_role is None:
-            response_role = "assistant"
+            if self.print_log:
+                self.logger.info(f"total_tokens: {total_tokens}, cached_tokens: {cached_tokens}")
 
-        missing_required_params = []
+            if response_role is None:
+                response_role = "assistant"
 
-        if self.use_plugins == True:
-            if self.check_done:
-                # self.logger.info(f"worker Response: {full_response}")
-                if not full_response.strip().endswith('[done]'):
-                    raise ValidationError("Response is not ended with [done]", response_text=full_response)
-                else:
-                    full_response = full_response.strip().rstrip('[done]')
-            full_response = full_response.replace("<tool_code>", "").replace("</tool_code>", "")
-            function_parameter = parse_function_xml(full_response)
-            if function_parameter:
-                invalid_tools = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") not in self.plugins.keys()]
-                function_parameter = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") in self.plugins.keys()]
-
-                # Check for missing required parameters
-                valid_function_parameters = []
-                for tool_dict in function_parameter:
-                    tool_name = tool_dict.get("function_name")
-                    # tool_name must be in registry.tools, because it is in self.plugins which is from registry.tools
-                    func = registry.tools.get(tool_name)
-                    if not func:
-                        continue
-
-                    sig = inspect.signature(func)
-                    provided_params = tool_dict.get("parameter", {})
-                    # Ensure provided_params is a dictionary
-                    if not isinstance(provided_params, dict):
-                        self.logger.warning(f"Parameters for {tool_name} are not a dict: {provided_params}. Skipping.")
-                        continue
-
-                    missing_required_params = []
-                    for param in sig.parameters.values():
-                        # Check if the parameter has no default value and is not in the provided parameters
-                        if param.default is inspect.Parameter.empty and param.name not in provided_params:
-                            missing_required_params.append(param.name)
-
-                    if not missing_required_params:
-                        valid_function_parameters.append(tool_dict)
+            missing_required_params = []
+
+            if self.use_plugins == True:
+                if self.check_done:
+                    # self.logger.info(f"worker Response: {full_response}")
+                    if not full_response.strip().endswith('[done]'):
+                        raise ValidationError("Response is not ended with [done]", response_text=full_response)
                     else:
-                        if self.print_log:
-                            self.logger.warning(
-                                f"Skipping tool call for '{tool_name}' due to missing required parameters: {missing_required_params}"
-                            )
-                            missing_required_params.append(f"Error: {tool_name} missing required parameters: {missing_required_params}")
-                function_parameter = valid_function_parameters
-
-                if not function_parameter and missing_required_params:
-                    raise AllToolsMissingParametersError("\n\n".join(missing_required_params), response_text=full_response)
-
-                # 删除 task_complete 跟其他工具一起调用的情况，因为 task_complete 必须单独调用
-                if len(function_parameter) > 1:
-                    function_parameter = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") != "task_complete"]
-                    # 仅当存在其他工具时，才删除 get_task_result
-                    if any(tool.get("function_name") != "get_task_result" for tool in function_parameter):
-                        function_parameter = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") != "get_task_result"]
-                if len(function_parameter) == 1 and function_parameter[0].get("function_name", "") == "task_complete":
-                    raise TaskComplete(safe_get(function_parameter, 0, "parameter", "message", default="The task has been completed."))
-
-                if self.print_log and invalid_tools:
-                    self.logger.error(f"invalid_tools: {invalid_tools}")
-                    self.logger.error(f"function_parameter: {function_parameter}")
-                    self.logger.error(f"full_response: {full_response}")
+                        full_response = full_response.strip().rstrip('[done]')
+                full_response = full_response.replace("<tool_code>", "").replace("</tool_code>", "")
+                function_parameter = parse_function_xml(full_response)
                 if function_parameter:
-                    need_function_call = True
-                    if isinstance(self.conversation[convo_id][-1]["content"], str) and \
-                    "<tool_error>" in self.conversation[convo_id][-1]["content"]:
+                    invalid_tools = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") not in self.plugins.keys()]
+                    function_parameter = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") in self.plugins.keys()]
+
+                    # Check for missing required parameters
+                    valid_function_parameters = []
+                    for tool_dict in function_parameter:
+                        tool_name = tool_dict.get("function_name")
+                        # tool_name must be in registry.tools, because it is in self.plugins which is from registry.tools
+                        func = registry.tools.get(tool_name)
+                        if not func:
+                            continue
+
+                        provided_params = tool_dict.get("parameter", {})
+                        # Ensure provided_params is a dictionary
+                        if not isinstance(provided_params, dict):
+                            self.logger.warning(f"Parameters for {tool_name} are not a dict: {provided_params}. Skipping.")
+                            continue
+
+                        # 必填参数在注册时已经计算好，这里不再对函数做 inspect.signature
+                        missing_required_params = registry.binder(tool_name).missing(provided_params)
+
+                        if not missing_required_params:
+                            valid_function_parameters.append(tool_dict)
+                        else:
+                            if self.print_log:
+                                self.logger.warning(
+                                    f"Skipping tool call for '{tool_name}' due to missing required parameters: {missing_required_params}"
+                                )
+                                missing_required_params.append(f"Error: {tool_name} missing required parameters: {missing_required_params}")
+                    function_parameter = valid_function_parameters
+
+                    if not function_parameter and missing_required_params:
+                        raise AllToolsMissingParametersError("\n\n".join(missing_required_params), response_text=full_response)
+
+                    # 删除 task_complete 跟其他工具一起调用的情况，因为 task_complete 必须单独调用
+                    if len(function_parameter) > 1:
+                        function_parameter = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") != "task_complete"]
+                        # 仅当存在其他工具时，才删除 get_task_result
+                        if any(tool.get("function_name") != "get_task_result" for tool in function_parameter):
+                            function_parameter = [tool_dict for tool_dict in function_parameter if tool_dict.get("function_name", "") != "get_task_result"]
+                    if len(function_parameter) == 1 and function_parameter[0].get("function_name", "") == "task_complete":
+                        raise TaskComplete(safe_get(function_parameter, 0, "parameter", "message", default="The task has been completed."))
+
+                    if self.print_log and invalid_tools:
+                        self.logger.error(f"invalid_tools: {invalid_tools}")
+                        self.logger.error(f"function_parameter: {function_parameter}")
+                        self.logger.error(f"full_response: {full_response}")
+                    if function_parameter:
+                        need_function_call = True
+                        if isinstance(self.conversation[convo_id][-1]["content"], str) and \
+                        "<tool_error>" in self.conversation[convo_id][-1]["content"]:
+                            need_function_call = False
+                            full_response = remove_xml_tags_and_content(full_response) + "上面是我的分析，还没有实际行动。\n\n接下来我需要做什么？"
+                    else:
                         need_function_call = False
-                        full_response = remove_xml_tags_and_content(full_response) + "上面是我的分析，还没有实际行动。\n\n接下来我需要做什么？"
-                else:
-                    need_function_call = False
-                    if self.print_log:
-                        self.logger.error(f"Failed to parse function_parameter full_response: {full_response}")
-                    full_response = ""
+                        if self.print_log:
+                            self.logger.error(f"Failed to parse function_parameter full_response: {full_response}")
+                        full_response = ""
+        except BaseException:
+            cancel_speculative_tools()
+            raise
 
         # 处理函数调用
         if need_function_call and self.use_plugins == True:
@@ -560,7 +754,11 @@ class chatgpt(BaseLLM):
                         self.logger.info(f"Tool use, calling: {tool_name}")
 
                     # 处理函数调用结果
-                    if is_async:
+                    speculative_task = speculative_tasks.pop((tool_name, tool_args), None)
+                    if speculative_task is not None:
+                        for chunk in await speculative_task:
+                            yield chunk
+                    elif is_async:
                         async for chunk in get_tools_result_async(
                             tool_name, tool_args, model or self.engine, chatgpt, kwargs.get('api_key', self.api_key),
                             kwargs.get('api_url', self.api_url.chat_url), use_plugins=False, model=model or self.engine,
@@ -604,24 +802,49 @@ class chatgpt(BaseLLM):
             # 处理所有工具调用
             all_responses = UserMessage()
 
-            for tool_info in tool_calls:
+            def tool_call_arguments(tool_info):
                 tool_name = tool_info['function_name']
                 tool_args = json.dumps(tool_info['parameter'], ensure_ascii=False) if not isinstance(tool_info['parameter'], str) else tool_info['parameter']
                 tool_id = tool_info.get('function_call_id', tool_name + "_tool_call")
+                return tool_name, tool_args, tool_id
 
+            def split_tool_chunks(chunks):
                 tool_response = ""
-                if is_async:
-                    async for chunk in process_single_tool_call(tool_name, tool_args, tool_id):
-                        if isinstance(chunk, str) and "function_response:" in chunk:
-                            tool_response = chunk.replace("function_response:", "")
-                        else:
-                            yield chunk
-                else:
-                    for chunk in async_generator_to_sync(process_single_tool_call(tool_name, tool_args, tool_id)):
-                        if isinstance(chunk, str) and "function_response:" in chunk:
-                            tool_response = chunk.replace("function_response:", "")
-                        else:
-                            yield chunk
+                other_chunks = []
+                for chunk in chunks:
+                    if isinstance(chunk, str) and "function_response:" in chunk:
+                        tool_response = chunk.replace("function_response:", "")
+                    else:
+                        other_chunks.append(chunk)
+                return other_chunks, tool_response
+
+            async def collect_tool_call(tool_info):
+                return split_tool_chunks([chunk async for chunk in process_single_tool_call(*tool_call_arguments(tool_info))])
+
+            # 最终的调用计划中，与更早的调用冲突的调用必须按顺序重新执行，不能复用投机结果
+            if speculative_tasks:
+                for tool_info, dependencies in zip(tool_calls, self.tool_executor.plan(tool_calls)):
+                    if dependencies:
+                        task = speculative_tasks.pop(tool_call_arguments(tool_info)[:2], None)
+                        if task is not None:
+                            discard_speculative_task(task)
+
+            # 异步模式下互不依赖的工具并发执行，结果按原始顺序处理
+            if is_async:
+                tool_results = await self.tool_executor.run(tool_calls, collect_tool_call)
+            else:
+                tool_results = [
+                    split_tool_chunks(list(async_generator_to_sync(process_single_tool_call(*tool_call_arguments(tool_info)))))
+                    for tool_info in tool_calls
+                ]
+
+            # 未被最终工具调用采用的投机结果直接丢弃
+            cancel_speculative_tools()
+
+            for tool_info, (tool_chunks, tool_response) in zip(tool_calls, tool_results):
+                tool_name, tool_args, tool_id = tool_call_arguments(tool_info)
+                for chunk in tool_chunks:
+                    yield chunk
                 final_tool_response = tool_response
                 if "<tool_error>" not in tool_response:
                     if tool_name == "read_file":
@@ -679,6 +902,7 @@ class chatgpt(BaseLLM):
                 ):
                     yield chunk
         else:
+            cancel_speculative_tools()
             # 添加响应到对话历史
             self.add_to_conversation(full_response, response_role, convo_id=convo_id, total_tokens=total_tokens, pass_history=pass_history)
             self.function_calls_counter = {}
@@ -708,6 +932,10 @@ class chatgpt(BaseLLM):
             self.reset(convo_id=convo_id, system_prompt=self.system_prompt)
         self.add_to_conversation(prompt, role, convo_id=convo_id, function_name=function_name, total_tokens=total_tokens, function_arguments=function_arguments, pass_history=pass_history, function_call_id=function_call_id)
 
+        # 后台压缩已完成时，用摘要替换被压缩的早期消息
+        if self.compactor:
+            self.compactor.apply(convo_id, self.conversation[convo_id])
+
         # 获取请求体
         url, headers, json_post, engine_type = await self.get_post_body(prompt, role, convo_id, model, pass_history, stream=stream, **kwargs)
         self.truncate_conversation(convo_id=convo_id)
@@ -720,12 +948,43 @@ class chatgpt(BaseLLM):
 
         # 发送请求并处理响应
         retry_times = 0
+        backoff_attempt = 0
         error_to_raise = None
+        circuit_breaker = self.retry_policy.circuit_breaker(url)
+        # 服务商按 API key 和模型计算限额，与 check_response 中学习响应头时使用同一个限流器
+        rate_limiter = get_rate_limiter(url, self.rate_limits, api_key=request_api_key(headers, url), model=model or self.engine)
+
+        async def wait_before_retry(error, retry_after=None, server_fault=None):
+            # 消耗任务重试预算，并按指数退避等待。熔断器按 base URL 在进程内共享，只记录服务端故障：
+            # server_fault=True（连接中断、5xx、524）记录失败；False 表示服务端正常应答（429 交给限流器，其他 4xx），
+            # 按成功处理；None（空响应、重复输出、本地异常）与服务端健康无关，不影响熔断器。
+            nonlocal backoff_attempt
+            if server_fault:
+                circuit_breaker.record_failure()
+            elif server_fault is False:
+                circuit_breaker.record_success()
+            if not self.retry_policy.consume_budget():
+                raise RetryFailedError(f"Retry budget exhausted: {error}")
+            backoff_attempt += 1
+            delay = self.retry_policy.backoff(backoff_attempt, retry_after)
+            self.logger.warning(f"{error}, retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
+
         while retry_times < self.retry_count:
             retry_times += 1
-            tmp_post_json = copy.deepcopy(json_post)
-            if need_done_prompt:
-                tmp_post_json["messages"].extend(need_done_prompt)
+            # 本次请求已经产出的字符数，重试前通知调用方丢弃
+            attempt_length = 0
+            # 只在需要追加纠正提示时复制消息列表，其余字段与原请求共享
+            tmp_post_json = {**json_post, "messages": json_post["messages"] + need_done_prompt} if need_done_prompt else json_post
+            wait_time = circuit_breaker.acquire()
+            while wait_time > 0:
+                self.logger.warning(f"Circuit breaker open for {url}, waiting {wait_time:.2f}s...")
+                await asyncio.sleep(wait_time)
+                wait_time = circuit_breaker.acquire()
+            # 额度不足时等待，而不是发出注定被 429 拒绝的请求
+            waited = await rate_limiter.acquire(tokens=self.current_tokens.get(convo_id, 0))
+            if waited:
+                self.logger.info(f"Rate limit reached for {url}, waited {waited:.2f}s")
             if self.print_log:
                 replaced_text = json.loads(re.sub(r';base64,([A-Za-z0-9+/=]+)', ';base64,***', json.dumps(tmp_post_json)))
                 replaced_text_str = json.dumps(replaced_text, indent=4, ensure_ascii=False)
@@ -748,7 +1007,7 @@ class chatgpt(BaseLLM):
                         "system_fingerprint": "fp_d576307f90",
                     }
                     async def _mock_response_generator():
-                        yield f"data: {json.dumps(tmp_response)}\n\n"
+                        yield ChatDelta(raw=tmp_response)
                     generator = _mock_response_generator()
                 else:
                     if stream:
@@ -769,39 +1028,45 @@ class chatgpt(BaseLLM):
                     system_prompt=system_prompt, pass_history=pass_history, is_async=True, stream=stream, **kwargs
                 ):
                     if index == 0:
+                        if "HTTP Error', 'status_code': " in processed_chunk:
+                            retry_after_match = _RETRY_AFTER_PATTERN.search(processed_chunk)
+                            retry_after = float(retry_after_match.group(1)) if retry_after_match else None
                         if "HTTP Error', 'status_code': 524" in processed_chunk:
-                            raise APITimeoutError("Response timeout")
+                            raise APITimeoutError("Response timeout", retry_after=retry_after)
                         if "HTTP Error', 'status_code': 404" in processed_chunk:
                             raise ModelNotFoundError(f"Model: {model or self.engine} not found!")
                         if "HTTP Error', 'status_code': 429" in processed_chunk:
-                            raise RateLimitError(f"Rate limit exceeded for model: {model or self.engine}")
+                            raise RateLimitError(f"Rate limit exceeded for model: {model or self.engine}", retry_after=retry_after)
                         if "HTTP Error', 'status_code': 413" in processed_chunk:
                             raise InputTokenCountExceededError(processed_chunk)
                         if "HTTP Error', 'status_code': 400" in processed_chunk:
                             raise BadRequestError(f"Bad Request: {processed_chunk}")
                         if "HTTP Error', 'status_code': " in processed_chunk:
-                            raise HTTPError(f"HTTP Error: {processed_chunk}")
+                            status_match = _STATUS_CODE_PATTERN.search(processed_chunk)
+                            raise HTTPError(f"HTTP Error: {processed_chunk}", retry_after=retry_after, status_code=int(status_match.group(1)) if status_match else None)
+                        circuit_breaker.record_success()
                     yield processed_chunk
+                    attempt_length += -processed_chunk.length if isinstance(processed_chunk, DiscardOutput) else len(processed_chunk)
                     index += 1
 
                 # 成功处理，跳出重试循环
+                circuit_breaker.record_success()
                 break
             except (httpx.ConnectError, httpx.ReadTimeout, httpx.PoolTimeout):
+                circuit_breaker.record_failure()
                 self.logger.error("Connection or read timeout.")
                 return # Stop iteration
-            except httpx.RemoteProtocolError:
-                continue
-            except httpx.ReadError as e:
-                self.logger.warning(f"{e}, retrying...")
+            except (httpx.RemoteProtocolError, httpx.ReadError) as e:
+                await wait_before_retry(e, server_fault=True)
                 continue
-            except APITimeoutError:
-                self.logger.warning("API response timeout (524), retrying...")
+            except APITimeoutError as e:
+                await wait_before_retry("API response timeout (524)", e.retry_after, server_fault=True)
                 continue
             except HTTPError as e:
-                self.logger.warning(f"{e}, retrying...")
+                await wait_before_retry(e, e.retry_after, server_fault=e.status_code >= 500 if e.status_code is not None else None)
                 continue
             except RateLimitError as e:
-                self.logger.warning(f"{e}, retrying...")
+                await wait_before_retry(e, e.retry_after, server_fault=False)
                 continue
             except InputTokenCountExceededError as e:
                 self.logger.error(f"The request body is too long: {e}")
@@ -828,10 +1093,12 @@ class chatgpt(BaseLLM):
                 ]
                 continue
             except EmptyResponseError as e:
-                self.logger.warning(f"{e}, retrying...")
+                await wait_before_retry(e)
                 continue
             except RepetitiveResponseError as e:
-                self.logger.warning(f"{e}, retrying...")
+                if attempt_length:
+                    yield DiscardOutput(attempt_length)
+                await wait_before_retry(e)
                 continue
             except TaskComplete as e:
                 raise
@@ -847,6 +1114,7 @@ class chatgpt(BaseLLM):
                 # 最后一次重试失败，向上抛出异常
                 if retry_times == self.retry_count:
                     raise RetryFailedError(str(e))
+                await wait_before_retry(e)
 
         if error_to_raise:
             raise error_to_raise
@@ -869,6 +1137,9 @@ class chatgpt(BaseLLM):
     ):
         """
         Ask a question (同步流式响应)
+
+        正文立即流式产出。检测到重复循环而重试时，会先产出 DiscardOutput，表示撤回此前收到的最后 length 个字符，
+        调用方应使用 append_output 拼接输出。
         """
         try:
             loop = asyncio.get_event_loop()
@@ -904,6 +1175,9 @@ class chatgpt(BaseLLM):
     ):
         """
         Ask a question (异步流式响应)
+
+        正文立即流式产出。检测到重复循环而重试时，会先产出 DiscardOutput，表示撤回此前收到的最后 length 个字符，
+        调用方应使用 append_output 拼接输出。
         """
         async for chunk in self._ask_stream_handler(
             prompt, role, convo_id, model, pass_history, function_name, total_tokens,
@@ -932,8 +1206,10 @@ class chatgpt(BaseLLM):
             stream=True,
             **kwargs,
         )
-        full_response: str = "".join([r async for r in response])
-        return full_response
+        output = []
+        async for chunk in response:
+            append_output(output, chunk)
+        return "".join(output)
 
     def ask(
         self,
@@ -956,8 +1232,10 @@ class chatgpt(BaseLLM):
             stream=True,
             **kwargs,
         )
-        full_response: str = "".join([r for r in response])
-        return full_response
+        output = []
+        for chunk in response:
+            append_output(output, chunk)
+        return "".join(output)
 
     def rollback(self, n: int = 1, convo_id: str = "default") -> None:
         """
@@ -976,3 +1254,6 @@ class chatgpt(BaseLLM):
         )
         self.tokens_usage[convo_id] = 0
         self.current_tokens[convo_id] = 0
+        self.cached_tokens[convo_id] = 0
+        if self.compactor:
+            self.compactor.cancel(convo_id, keep_evicted=False)
@@ -0,0 +1,220 @@
+import re
+import json
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from ..architext.architext import Messages, Message, UserMessage, Texts
+
+"""
+后台上下文压缩。
+
+对话接近 token 上限时，把最早的一段消息交给便宜的模型总结，总结与主请求并行进行，
+完成后在下一次请求前用一条摘要消息替换这段消息。被后续消息引用的工具结果原样保留在摘要消息中。
+因为超过上限而被直接移除的消息也会被收集起来，并入下一次的摘要。
+任务目标一类必须一直可见的 provider 不参与总结，原样放在摘要消息的开头。
+"""
+
+SUMMARY_NAME = "conversation_summary"
+
+# 模型系列前缀 -> 用于压缩的便宜模型。按顺序匹配，没有命中时使用主模型。
+COMPACTION_MODELS = [
+    ("gpt-", "gpt-4o-mini"),
+    ("o1", "gpt-4o-mini"),
+    ("o3", "gpt-4o-mini"),
+    ("o4", "gpt-4o-mini"),
+    ("claude", "claude-3-5-haiku-latest"),
+    ("gemini", "gemini-2.0-flash"),
+]
+
+def default_compaction_model(engine: str) -> str:
+    """按主模型的系列选择压缩用的模型，保留 "openai/" 一类的服务商前缀。"""
+    head, family = re.match(r"(.*[/:])?(.*)", engine or "").groups()
+    for prefix, model in COMPACTION_MODELS:
+        if family.lower().startswith(prefix):
+            return (head or "") + model
+    return engine
+
+@dataclass
+class CompactionStats:
+    convo_id: str
+    messages: int
+    tokens_before: int
+    tokens_after: int
+    kept_tool_results: int
+    # 摘要请求的耗时，这段时间与主请求重叠，不会阻塞对话
+    duration: float
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+class _CompactionJob:
+    def __init__(self, replaced: List[Message], evicted: List[Message], pinned: list, kept: list, tokens_before: int, task: asyncio.Future):
+        self.replaced = replaced
+        self.evicted = evicted
+        self.pinned = pinned
+        self.kept = kept
+        self.tokens_before = tokens_before
+        self.task = task
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+def is_summary(message: Message) -> bool:
+    return isinstance(message, Message) and message.provider(SUMMARY_NAME) is not None
+
+def _message_text(message: Message) -> str:
+    rendered = message.to_dict() or {}
+    content = rendered.get("content")
+    if isinstance(content, list):
+        content = "\n".join(block.get("text", "[image]") for block in content)
+    if rendered.get("tool_calls"):
+        content = (content or "") + json.dumps(rendered["tool_calls"], ensure_ascii=False)
+    return f"<{message.role}>\n{content or ''}\n</{message.role}>"
+
+def _tool_result_references(provider) -> List[str]:
+    """工具结果的标识：参数中较短的字符串值，例如文件路径、查询词、节点 ID。"""
+    try:
+        arguments = json.loads(provider.tool_args) if isinstance(provider.tool_args, str) else provider.tool_args
+    except ValueError:
+        return []
+    if not isinstance(arguments, dict):
+        return []
+    return [value for value in arguments.values() if isinstance(value, str) and 4 <= len(value) <= 200]
+
+
+class ContextCompactor:
+    """
+    按会话管理压缩任务，每个会话同一时间最多一个任务。
+
+    summarise 接收待总结的对话文本，返回摘要。token 数超过 limit * threshold 时开始压缩，
+    压缩到 limit * target 以下，最近的 keep_recent 条消息不参与压缩。
+    pinned: 这些名字的 provider 不会被总结，压缩后移到摘要消息中。
+    """
+    def __init__(
+        self,
+        summarise: Callable[[str], Awaitable[str]],
+        tokenizer,
+        threshold: float = 0.8,
+        target: float = 0.5,
+        keep_recent: int = 4,
+        pinned: Sequence[str] = ("goal",),
+        logger: Optional[logging.Logger] = None,
+    ):
+        self.summarise = summarise
+        self.tokenizer = tokenizer
+        self.threshold = threshold
+        self.target = target
+        self.keep_recent = keep_recent
+        self.pinned = tuple(pinned)
+        self.logger = logger or logging.getLogger(__name__)
+        self.stats: List[CompactionStats] = []
+        self._jobs: Dict[str, _CompactionJob] = {}
+        self._evicted: Dict[str, List[Message]] = {}
+
+    def pending(self, convo_id: str) -> bool:
+        return convo_id in self._jobs
+
+    def evict(self, convo_id: str, messages: List[Message]):
+        """记录已经被移出对话的消息，它们会并入下一次摘要。"""
+        self._evicted.setdefault(convo_id, []).extend(message for message in messages if message)
+
+    def schedule(self, convo_id: str, conversation: Messages, limit: Optional[int] = None) -> bool:
+        """需要时在后台开始一次压缩。没有运行中的事件循环时不做任何事。"""
+        if convo_id in self._jobs:
+            return False
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        message_tokens = [message.token_count(self.tokenizer) for message in conversation]
+        start = 2 if len(conversation) > 1 and is_summary(conversation[1]) else 1
+        end = start
+        if limit and sum(message_tokens) > limit * self.threshold:
+            remaining = sum(message_tokens)
+            while end < len(conversation) - self.keep_recent and remaining > limit * self.target:
+                remaining -= message_tokens[end]
+                end += 1
+            # 不拆开工具调用和它的结果
+            while end < len(conversation) and conversation[end].role == "tool":
+                end += 1
+            if end - start < 2:
+                end = start
+
+        evicted = self._evicted.pop(convo_id, [])
+        if end == start and not evicted:
+            return False
+
+        replaced = [conversation[index] for index in range(1, end)]
+        later_text = "\n".join(_message_text(conversation[index]) for index in range(end, len(conversation)))
+        pinned = []
+        kept = []
+        transcript = []
+        for message in evicted + replaced:
+            for provider in message.provider():
+                if provider.name in self.pinned:
+                    pinned.append(provider)
+                elif hasattr(provider, "tool_name") and hasattr(provider, "tool_args") and \
+                        any(reference in later_text for reference in _tool_result_references(provider)):
+                    kept.append(provider)
+            transcript.append(_message_text(message))
+
+        tokens_before = sum(message.token_count(self.tokenizer) for message in evicted) + sum(message_tokens[1:end])
+        task = asyncio.ensure_future(self.summarise("<conversation>\n" + "\n".join(transcript) + "\n</conversation>"))
+        job = self._jobs[convo_id] = _CompactionJob(replaced, evicted, pinned, kept, tokens_before, task)
+
+        def finished(_):
+            job.finished = time.perf_counter()
+        task.add_done_callback(finished)
+        return True
+
+    def apply(self, convo_id: str, conversation: Messages) -> Optional[CompactionStats]:
+        """如果压缩任务已经完成，用摘要替换被压缩的消息。不会等待未完成的任务。"""
+        job = self._jobs.get(convo_id)
+        if job is None or not job.task.done():
+            return None
+        del self._jobs[convo_id]
+        if job.task.cancelled():
+            return None
+        if job.task.exception() is not None:
+            self.logger.warning(f"Context compaction failed: {job.task.exception()}")
+            self.evict(convo_id, job.evicted)
+            return None
+
+        end = 1 + len(job.replaced)
+        if end > len(conversation) or any(conversation[index] is not message for index, message in zip(range(1, end), job.replaced)):
+            # 对话在总结期间被修改过，放弃这次结果
+            self.logger.warning("Conversation changed during compaction, discarding summary.")
+            self.evict(convo_id, job.evicted)
+            return None
+
+        summary = UserMessage(*job.pinned, Texts(f"<{SUMMARY_NAME}>\n{job.task.result().strip()}\n</{SUMMARY_NAME}>", name=SUMMARY_NAME), *job.kept)
+        conversation[1:end] = Messages(summary)
+        stats = CompactionStats(
+            convo_id=convo_id,
+            messages=len(job.replaced) + len(job.evicted),
+            tokens_before=job.tokens_before,
+            tokens_after=summary.token_count(self.tokenizer),
+            kept_tool_results=len(job.kept),
+            duration=(job.finished or time.perf_counter()) - job.started,
+        )
+        self.stats.append(stats)
+        self.logger.info(
+            f"Compacted {stats.messages} messages: {stats.tokens_before} -> {stats.tokens_after} tokens "
+            f"(saved {stats.tokens_saved}), summary took {stats.duration:.2f}s in the background, "
+            f"kept {stats.kept_tool_results} referenced tool results"
+        )
+        return stats
+
+    def cancel(self, convo_id: str, keep_evicted: bool = True):
+        """取消进行中的压缩。默认把已经移出对话的消息放回缓冲区，留给下一次压缩。"""
+        job = self._jobs.pop(convo_id, None)
+        if job is not None:
+            job.task.cancel()
+            if keep_evicted:
+                self._evicted.setdefault(convo_id, [])[:0] = job.evicted
+        if not keep_evicted:
+            self._evicted.pop(convo_id, None)
@@ -4,8 +4,10 @@ import importlib
 import os
 import pkgutil
 import sys
+import types
 
 from .registry import registry, register_agent, register_tool
+from .manifest import load_plugin_index
 
 # Export config helpers that `chatgpt` expects early to avoid circular imports.
 from .config import *  # noqa: F403,E402
@@ -25,13 +27,15 @@ def _minimal_mode() -> bool:
     return False
 
 
-excluded_modules = ["config", "registry", "__init__"]
+excluded_modules = ["config", "registry", "executor", "manifest", "command_runner", "__init__"]
 current_dir = os.path.dirname(__file__)
 
 if not _minimal_mode():
-    for _, module_name, _ in pkgutil.iter_modules([current_dir]):
-        if module_name not in excluded_modules:
-            importlib.import_module(f".{module_name}", package=__name__)
+    wanted = [
+        module_name
+        for _, module_name, _ in pkgutil.iter_modules([current_dir])
+        if module_name not in excluded_modules
+    ]
 else:
     module_list = os.environ.get("OCEANS_PLUGIN_MODULES", "").strip()
     if module_list:
@@ -42,18 +46,55 @@ else:
             "read_image",
             "list_directory",
             "excute_command",
+            "command_session",
             "websearch",
             "arXiv",
             "readonly",
         ]
-    for module_name in wanted:
-        try:
-            importlib.import_module(f".{module_name}", package=__name__)
-        except Exception:
-            pass
+
+# 插件模块在工具第一次被调用时才导入，启动时只读取缓存的插件清单。
+# OCEANS_EAGER_PLUGINS=1 恢复启动时导入全部插件；没有源码的打包环境也会直接导入。
+if _truthy(os.environ.get("OCEANS_EAGER_PLUGINS")) or getattr(sys, "frozen", False):
+    plugin_index = {}
+else:
+    plugin_index = load_plugin_index(current_dir, wanted)
+
+for module_name in wanted:
+    entries = plugin_index.get(module_name)
+    if entries is not None:
+        for entry in entries:
+            registry.register_lazy(f"{__name__}.{module_name}", entry)
+        continue
+    try:
+        importlib.import_module(f".{module_name}", package=__name__)
+    except Exception:
+        if not _minimal_mode():
+            raise
 
 for tool_name, tool_func in registry.tools.items():
-    globals()[tool_name] = tool_func
+    if not registry.is_lazy(tool_name):
+        globals()[tool_name] = tool_func
+
+
+def __getattr__(name: str):
+    # from aient.plugins import get_time 时才导入 get_time 所在的模块
+    if name in registry.tools:
+        func = registry.resolve(name)
+        globals()[name] = func
+        return func
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class _PluginPackage(types.ModuleType):
+    def __setattr__(self, name, value):
+        # 部分子模块与工具同名（例如 excute_command），延迟导入子模块时，
+        # 导入机制会把子模块设置为包的属性，这里保留包上导出的工具函数
+        if isinstance(value, types.ModuleType) and name in registry.tools:
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _PluginPackage
 
 __all__ = [
     "PLUGINS",
@@ -1,3 +1,6 @@
+import os
+import asyncio
+import tempfile
 import requests
 
 from ..utils.scripts import Document_extract
@@ -8,8 +11,8 @@ async def download_read_arxiv_pdf(arxiv_id: str) -> str:
     """
     下载指定arXiv ID的论文PDF并提取其内容。
 
-    此函数会下载arXiv上的论文PDF文件，保存到指定路径，
-    然后使用文档提取工具读取其内容。
+    此函数会下载arXiv上的论文PDF文件，保存到临时文件，
+    然后使用文档提取工具读取其内容。每次调用使用各自的临时文件，同一轮中的并发调用不会互相覆盖。
 
     Args:
         arxiv_id: arXiv论文的ID，例如'2305.12345'
@@ -20,17 +23,21 @@ async def download_read_arxiv_pdf(arxiv_id: str) -> str:
     # 构造下载PDF的URL
     url = f'https://arxiv.org/pdf/{arxiv_id}.pdf'
 
-    # 发送HTTP GET请求
-    response = requests.get(url)
+    # 在线程中发送HTTP GET请求，下载期间不阻塞事件循环
+    response = await asyncio.to_thread(requests.get, url, timeout=60)
 
     # 检查是否成功获取内容
     if response.status_code == 200:
-        # 将PDF内容写入文件
-        save_path = "paper.pdf"
-        with open(save_path, 'wb') as file:
+        # 将PDF内容写入临时文件，提取完成后删除
+        fd, save_path = tempfile.mkstemp(prefix="arxiv-", suffix=".pdf")
+        with os.fdopen(fd, 'wb') as file:
             file.write(response.content)
         print(f'PDF下载成功，保存路径: {save_path}')
-        return await Document_extract(None, save_path)
+        try:
+            return await Document_extract(None, save_path)
+        finally:
+            if os.path.exists(save_path):
+                os.remove(save_path)
     else:
         print(f'下载失败，状态码: {response.status_code}')
         return "文件下载失败"
@@ -0,0 +1,439 @@
+import os
+import re
+import time
+import codecs
+import signal
+import asyncio
+import logging
+import threading
+import contextvars
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+
+from ..utils.scripts import sandbox
+
+"""
+异步命令执行器，供 excute_command 等需要运行 shell 命令的工具使用。
+
+- 输出边读边处理：按行切分后只保留开头 head_lines 行和最后 tail_lines 行（环形缓冲），
+  中间的行只计数，命令输出再多内存占用也是固定的；
+- 读取大小在 4KB 到 64KB 之间自适应：读满就翻倍，读到的数据很少时减半；
+- 支持总运行时间上限和无输出时间上限，超时后先向整个进程组发送 SIGTERM，
+  等待 kill_grace 秒后仍未退出则发送 SIGKILL，shell 启动的子进程也会一起结束；
+- 运行过程中按 progress_interval 向当前上下文登记的监听器发送进度事件，
+  beswarm 的智能体把它们转发到消息总线。
+
+Unix 上通过 pty 读取输出，tqdm 等库会按终端方式输出进度条；其它系统回退到管道。
+"""
+
+logger = logging.getLogger(__name__)
+
+IS_UNIX = hasattr(os, "fork")
+
+if IS_UNIX:
+    import pty
+
+MIN_READ_SIZE = 4096
+MAX_READ_SIZE = 65536
+# 一次可读回调中最多读取的字节数，避免输出很快的命令长时间占住事件循环
+READ_BUDGET = 512 * 1024
+DEFAULT_HEAD_LINES = 250
+DEFAULT_TAIL_LINES = 250
+# 没有换行的超长输出按这个长度切成多行
+MAX_LINE_CHARS = 8192
+PROGRESS_LINES = 20
+
+# 含有非空白字符的行；\r 和 \n 都算作换行
+_NON_EMPTY_LINE = re.compile(r"[^\S\r\n]*\S[^\r\n]*")
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[a-zA-Z]|\\u001b\[[0-9;]*[a-zA-Z]")
+
+_GIT_CLONE_PROGRESS = ("Counting objects", "Resolving deltas", "Receiving objects", "Compressing objects")
+
+def _env_seconds(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+def default_timeouts() -> tuple:
+    """
+    返回 (总运行时间上限, 无输出时间上限)，单位秒，0 表示不限制。
+    由环境变量 OCEANS_COMMAND_TIMEOUT（默认 3600）和 OCEANS_COMMAND_IDLE_TIMEOUT（默认 600）配置。
+    """
+    return _env_seconds("OCEANS_COMMAND_TIMEOUT", 3600), _env_seconds("OCEANS_COMMAND_IDLE_TIMEOUT", 600)
+
+def noise_filter(command: str) -> Optional[Callable[[str], bool]]:
+    """pip 的进度条和 git clone 的进度行对模型没有用处，返回判断某一行是否保留的函数。"""
+    pip = "pip install" in command
+    git = "git clone" in command
+    if not pip and not git:
+        return None
+
+    def keep(line: str) -> bool:
+        if pip and "━━" in line:
+            return False
+        if git and any(marker in line for marker in _GIT_CLONE_PROGRESS):
+            return False
+        return True
+    return keep
+
+def normalize_lines(text: str) -> List[str]:
+    """
+    把一段输出切成行：\\r 和 \\n 都视为换行（tqdm 每次刷新进度条都会得到一行），
+    字面量形式的 "\\\\r"、"\\\\n" 也按换行处理，去掉 ANSI 转义序列和空行。
+    整块做替换和切分，不逐行执行 Python 代码。
+    """
+    text = text.replace("\\r", "\r").replace("\\\\", "").replace("\\n", "\n")
+    text = _ANSI_ESCAPE.sub("", text)
+    return _NON_EMPTY_LINE.findall(text)
+
+class OutputBuffer:
+    """
+    按行保存命令输出的开头和结尾，切分规则见 normalize_lines。
+    超过 head_lines + tail_lines 的中间部分只记录行数。
+    """
+    def __init__(self, head_lines: int = DEFAULT_HEAD_LINES, tail_lines: int = DEFAULT_TAIL_LINES,
+                 line_filter: Optional[Callable[[str], bool]] = None, max_line_chars: int = MAX_LINE_CHARS):
+        self.head_lines = head_lines
+        self.head: List[str] = []
+        self.tail: Deque[str] = deque(maxlen=tail_lines)
+        self.line_filter = line_filter
+        self.max_line_chars = max_line_chars
+        self.total_lines = 0
+        self.dropped = 0
+        self._partial = ""
+
+    def _add(self, text: str) -> List[str]:
+        """text 由若干完整的行组成。"""
+        added = normalize_lines(text)
+        if self.line_filter is not None:
+            added = [line for line in added if self.line_filter(line)]
+        self.total_lines += len(added)
+        rest = added
+        room = self.head_lines - len(self.head)
+        if room > 0:
+            self.head.extend(added[:room])
+            rest = added[room:]
+        if rest:
+            before = len(self.tail)
+            self.tail.extend(rest)
+            self.dropped += before + len(rest) - len(self.tail)
+        return added
+
+    def feed(self, text: str) -> List[str]:
+        """写入一段文本，返回其中新增的完整行。"""
+        text = self._partial + text
+        cut = max(text.rfind("\n"), text.rfind("\r"))
+        added = []
+        if cut >= 0:
+            added = self._add(text[:cut])
+            text = text[cut + 1:]
+        while len(text) > self.max_line_chars:
+            added += self._add(text[:self.max_line_chars])
+            text = text[self.max_line_chars:]
+        self._partial = text
+        return added
+
+    def close(self) -> List[str]:
+        text, self._partial = self._partial, ""
+        return self._add(text) if text else []
+
+    def lines(self) -> List[str]:
+        if not self.dropped:
+            return self.head + list(self.tail)
+        return self.head + [f"... (省略 {self.dropped} 行输出) ..."] + list(self.tail)
+
+    def render(self) -> str:
+        return "\n".join(self.lines()).strip()
+
+@dataclass
+class CommandResult:
+    command: str
+    returncode: Optional[int]
+    output: str
+    pid: Optional[int] = None
+    # None: 正常结束；"timeout": 超过总运行时间；"idle": 长时间没有输出
+    timed_out: Optional[str] = None
+    duration: float = 0.0
+    total_lines: int = 0
+    dropped_lines: int = 0
+    bytes_read: int = 0
+
+# 当前上下文中的进度监听器，接收 dict 形式的事件
+_progress_listener: contextvars.ContextVar[Optional[Callable[[Dict], None]]] = contextvars.ContextVar("command_progress_listener", default=None)
+
+@contextmanager
+def progress_listener(listener: Optional[Callable[[Dict], None]]) -> Iterator[None]:
+    """在 with 块（以及其中创建的任务）内运行的命令把进度事件发送给 listener。"""
+    token = _progress_listener.set(listener)
+    try:
+        yield
+    finally:
+        _progress_listener.reset(token)
+
+def _emit(listener: Optional[Callable[[Dict], None]], event: Dict):
+    if listener is None:
+        return
+    try:
+        listener(event)
+    except Exception:
+        logger.exception("Command progress listener failed")
+
+def kill_process_group(process: subprocess.Popen, sig: int = signal.SIGTERM):
+    """向命令所在的进程组发送信号；进程组不存在时忽略。"""
+    try:
+        if IS_UNIX:
+            os.killpg(process.pid, sig)
+        elif sig == signal.SIGTERM:
+            process.terminate()
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+async def terminate(process: subprocess.Popen, kill_grace: float = 2.0):
+    """先 SIGTERM，kill_grace 秒内没有退出再 SIGKILL，最后回收子进程。"""
+    kill_process_group(process, signal.SIGTERM)
+    deadline = time.monotonic() + kill_grace
+    while process.poll() is None and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    if process.poll() is None:
+        kill_process_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+        await asyncio.to_thread(process.wait)
+    elif IS_UNIX:
+        # 进程组中可能还有忽略了 SIGTERM 的子进程
+        kill_process_group(process, signal.SIGKILL)
+
+def spawn(command: str, cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None):
+    """
+    在新的进程组中启动命令，返回 (process, 读取输出的文件描述符或文件对象)。
+    Unix 上 stdout 和 stderr 都连接到 pty，其它系统连接到同一个管道。
+    """
+    if IS_UNIX:
+        master_fd, slave_fd = pty.openpty()
+        try:
+            process = sandbox.Popen(
+                command,
+                shell=True,
+                stdin=subprocess.PIPE,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                close_fds=True,
+                start_new_session=True,
+                cwd=cwd,
+                env=env,
+            )
+        except BaseException:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        os.set_blocking(master_fd, False)
+        return process, master_fd
+    process = sandbox.Popen(
+        command,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        creationflags=getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0),
+        cwd=cwd,
+        env=env,
+    )
+    return process, process.stdout
+
+class _Reader:
+    """把命令输出送入 handler，直到 EOF。Unix 上使用事件循环的可读回调，其它系统使用后台线程。"""
+    def __init__(self, loop: asyncio.AbstractEventLoop, source, handler: Callable[[bytes], None]):
+        self.loop = loop
+        self.source = source
+        self.handler = handler
+        self.read_size = MIN_READ_SIZE
+        self.eof = asyncio.Event()
+        if isinstance(source, int):
+            loop.add_reader(source, self._on_readable)
+        else:
+            threading.Thread(target=self._pump, name="command-output", daemon=True).start()
+
+    def _adapt(self, size: int):
+        if size >= self.read_size and self.read_size < MAX_READ_SIZE:
+            self.read_size *= 2
+        elif size < self.read_size // 4 and self.read_size > MIN_READ_SIZE:
+            self.read_size //= 2
+
+    def _finish(self):
+        if isinstance(self.source, int) and not self.eof.is_set():
+            self.loop.remove_reader(self.source)
+        self.eof.set()
+
+    def drain(self):
+        """读出当前已经可读的全部数据。"""
+        budget = READ_BUDGET
+        while budget > 0 and not self.eof.is_set():
+            try:
+                data = os.read(self.source, self.read_size)
+            except BlockingIOError:
+                return
+            except OSError:
+                # pty 的写端全部关闭后读取得到 EIO
+                data = b""
+            if not data:
+                self._finish()
+                return
+            budget -= len(data)
+            self._adapt(len(data))
+            self.handler(data)
+
+    def _on_readable(self):
+        self.drain()
+
+    def _pump(self):
+        try:
+            while True:
+                data = self.source.read1(self.read_size)
+                if not data:
+                    break
+                self._adapt(len(data))
+                self.loop.call_soon_threadsafe(self.handler, data)
+        except (OSError, ValueError):
+            pass
+        self.loop.call_soon_threadsafe(self.eof.set)
+
+    def close(self):
+        if isinstance(self.source, int):
+            if not self.eof.is_set():
+                self.loop.remove_reader(self.source)
+            os.close(self.source)
+        else:
+            self.source.close()
+
+async def run_command(
+    command: str,
+    timeout: Optional[float] = None,
+    idle_timeout: Optional[float] = None,
+    head_lines: int = DEFAULT_HEAD_LINES,
+    tail_lines: int = DEFAULT_TAIL_LINES,
+    line_filter: Optional[Callable[[str], bool]] = None,
+    on_output: Optional[Callable[[bytes], None]] = None,
+    on_start: Optional[Callable[[subprocess.Popen], None]] = None,
+    echo: bool = False,
+    progress_interval: float = 1.0,
+    kill_grace: float = 2.0,
+    cwd: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> CommandResult:
+    """
+    运行 shell 命令直到结束或超时，返回截断后的输出。
+
+    timeout / idle_timeout 为 None 时使用 default_timeouts()，0 表示不限制。
+    on_output 收到每一段原始输出；on_start 在进程启动后收到 Popen 对象；
+    echo 为 True 时同时把输出打印到标准输出。
+    任务被取消时同样会结束整个进程组。
+    """
+    default_timeout, default_idle = default_timeouts()
+    timeout = default_timeout if timeout is None else timeout
+    idle_timeout = default_idle if idle_timeout is None else idle_timeout
+
+    loop = asyncio.get_running_loop()
+    listener = _progress_listener.get()
+    buffer = OutputBuffer(head_lines, tail_lines, line_filter)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    recent: Deque[str] = deque(maxlen=PROGRESS_LINES)
+    started = time.monotonic()
+    state = {"last_output": started, "bytes": 0, "pending": False}
+
+    def handle(data: bytes):
+        state["last_output"] = time.monotonic()
+        state["bytes"] += len(data)
+        if on_output is not None:
+            on_output(data)
+        text = decoder.decode(data)
+        if echo:
+            print(text, end="", flush=True)
+        added = buffer.feed(text)
+        if added:
+            recent.extend(added)
+            state["pending"] = True
+
+    def progress(event: str, **extra) -> Dict:
+        return {
+            "event": event,
+            "command": command,
+            "pid": process.pid,
+            "elapsed": round(time.monotonic() - started, 3),
+            "lines": buffer.total_lines,
+            "bytes": state["bytes"],
+            **extra,
+        }
+
+    process, source = spawn(command, cwd=cwd, env=env)
+    reader = _Reader(loop, source, handle)
+    if on_start is not None:
+        on_start(process)
+    _emit(listener, progress("started"))
+    deadline = started + timeout if timeout else None
+    next_progress = started + progress_interval
+    timed_out = None
+    try:
+        while True:
+            if process.poll() is not None:
+                if IS_UNIX and not reader.eof.is_set():
+                    # 命令已经退出；pty 可能被它留在后台的子进程继续持有，读完已有的输出就结束
+                    reader.drain()
+                elif not IS_UNIX:
+                    try:
+                        await asyncio.wait_for(reader.eof.wait(), 1.0)
+                    except asyncio.TimeoutError:
+                        pass
+                break
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                timed_out = "timeout"
+                break
+            if idle_timeout and now - state["last_output"] >= idle_timeout:
+                timed_out = "idle"
+                break
+            if state["pending"] and now >= next_progress:
+                _emit(listener, progress("output", recent=list(recent)))
+                recent.clear()
+                state["pending"] = False
+                next_progress = now + progress_interval
+            if reader.eof.is_set():
+                # 输出已经结束，等待进程退出
+                await asyncio.sleep(0.02)
+                continue
+            try:
+                await asyncio.wait_for(reader.eof.wait(), 0.1)
+            except asyncio.TimeoutError:
+                pass
+        if timed_out is not None:
+            await terminate(process, kill_grace)
+    except BaseException:
+        # 任务被取消或处理输出时出错，不留下继续运行的命令
+        kill_process_group(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+        reader.close()
+        raise
+
+    if process.stdin:
+        process.stdin.close()
+    reader.close()
+    text = decoder.decode(b"", final=True)
+    if text:
+        buffer.feed(text)
+    buffer.close()
+    result = CommandResult(
+        command=command,
+        returncode=process.returncode,
+        output=buffer.render(),
+        pid=process.pid,
+        timed_out=timed_out,
+        duration=time.monotonic() - started,
+        total_lines=buffer.total_lines,
+        dropped_lines=buffer.dropped,
+        bytes_read=state["bytes"],
+    )
+    _emit(listener, progress("finished", recent=list(recent), returncode=result.returncode, timed_out=timed_out))
+    return result
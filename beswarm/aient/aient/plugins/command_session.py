@@ -0,0 +1,461 @@
+import os
+import time
+import atexit
+import shutil
+import signal
+import asyncio
+import itertools
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .registry import register_tool
+from .command_runner import run_command, terminate, kill_process_group, normalize_lines, CommandResult, IS_UNIX
+from .excute_command import get_python_executable
+from ..utils.scripts import unescape_html
+
+"""
+后台命令会话：start_command 启动命令后立即返回，智能体可以在训练脚本之类的长任务运行期间
+继续写代码，再用 poll_command / read_command_output 查看进度，kill_command 提前结束。
+
+- 每个命令运行在自己的进程组中（见 command_runner.run_command），结束或被终止时整个进程组一起处理；
+- 输出写入一个有上限的 spool 文件，超过 spool_limit 时丢弃最早的一半，偏移量始终按命令的全部输出计算；
+- 每隔 sample_interval 秒从 /proc 采样一次会话内全部进程的 CPU 时间和常驻内存（仅 Linux）。
+
+会话运行在启动它的事件循环上，事件循环关闭时仍在运行的命令会被终止。在 session_owner 块内启动的会话属于该所有者
+（例如一个 WorkerAgent），所有者结束时用 CommandSessionManager.release 终止并删除它的会话；
+进程退出时仍在运行的命令被强制终止，spool 目录被删除。
+"""
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+# 当前上下文中启动的后台命令归属的所有者
+_session_owner: contextvars.ContextVar[Optional[object]] = contextvars.ContextVar("command_session_owner", default=None)
+
+@contextmanager
+def session_owner(owner: object) -> Iterator[None]:
+    """在 with 块（以及其中创建的任务）内启动的后台命令归属于 owner。"""
+    token = _session_owner.set(owner)
+    try:
+        yield
+    finally:
+        _session_owner.reset(token)
+
+def session_usage(session_id: int) -> Optional[Tuple[float, int, int]]:
+    """
+    返回会话 session_id 中仍在运行的进程的 (CPU 秒数, 常驻内存字节数, 进程数)。
+    CPU 时间包括这些进程已回收的子进程。无法读取 /proc 时返回 None。
+    """
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return None
+    cpu_ticks = 0
+    rss_pages = 0
+    count = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名可能包含空格和括号，从最后一个 ')' 之后开始解析
+        fields = stat[stat.rfind(b")") + 2:].split()
+        if len(fields) < 22 or int(fields[3]) != session_id:
+            continue
+        cpu_ticks += int(fields[11]) + int(fields[12]) + int(fields[13]) + int(fields[14])
+        rss_pages += int(fields[21])
+        count += 1
+    return cpu_ticks / _CLOCK_TICKS, rss_pages * _PAGE_SIZE, count
+
+class SpoolFile:
+    """
+    只保留最近输出的磁盘文件。start 和 total 是按命令全部输出计算的偏移量，
+    文件中保存的是 [start, total) 这一段；超过 limit 字节时丢弃较早的一半。
+    """
+    def __init__(self, path: str, limit: int):
+        self.path = path
+        self.limit = limit
+        self.start = 0
+        self.total = 0
+        self._file = open(path, "w+b")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        self.total += len(data)
+        if self.total - self.start > self.limit:
+            self._compact()
+
+    def _compact(self):
+        keep = self.limit // 2
+        self._file.flush()
+        self._file.seek(self.total - self.start - keep)
+        tail = self._file.read(keep)
+        self._file.seek(0)
+        self._file.write(tail)
+        self._file.truncate()
+        self.start = self.total - len(tail)
+
+    def read(self, offset: int, size: int) -> Tuple[int, bytes]:
+        """读取从 offset 开始的至多 size 字节，offset 早于 start 时从 start 开始。返回实际的起始偏移和数据。"""
+        offset = min(max(offset, self.start), self.total)
+        self._file.flush()
+        self._file.seek(offset - self.start)
+        data = self._file.read(size)
+        self._file.seek(0, os.SEEK_END)
+        return offset, data
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+class CommandSession:
+    def __init__(self, session_id: str, command: str, spool: SpoolFile, cwd: str, owner: Optional[object] = None):
+        self.id = session_id
+        self.command = command
+        self.spool = spool
+        self.cwd = cwd
+        self.owner = owner
+        self.process = None
+        self.task: Optional[asyncio.Task] = None
+        self.result: Optional[CommandResult] = None
+        self.error: Optional[BaseException] = None
+        self.killed = False
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self.cpu_time = 0.0
+        self.rss = 0
+        self.peak_rss = 0
+        self.processes = 0
+
+    @property
+    def running(self) -> bool:
+        return self.ended is None
+
+    @property
+    def status(self) -> str:
+        if self.running:
+            return "running"
+        if self.killed:
+            return "killed"
+        if self.error is not None:
+            return "failed"
+        if self.result.timed_out is not None:
+            return "timeout"
+        return "exited"
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended or time.monotonic()) - self.started
+
+    def sample(self):
+        if not self.running or self.process is None or not IS_UNIX:
+            return
+        usage = session_usage(self.process.pid)
+        if usage is None:
+            return
+        cpu_time, rss, count = usage
+        # 进程退出后它的 CPU 时间不再计入，保留见过的最大值
+        self.cpu_time = max(self.cpu_time, cpu_time)
+        self.rss = rss
+        self.peak_rss = max(self.peak_rss, rss)
+        self.processes = count
+
+    def tail(self, size: int = 4096, lines: int = 10) -> List[str]:
+        _, data = self.spool.read(self.spool.total - size, size)
+        return normalize_lines(data.decode(errors="replace"))[-lines:]
+
+    def summary(self, tail_lines: int = 10) -> str:
+        self.sample()
+        parts = [f"会话 {self.id}: {self.status}"]
+        if self.result is not None and self.result.returncode is not None:
+            parts.append(f"退出码 {self.result.returncode}")
+        parts.append(f"已运行 {self.elapsed:.1f} 秒")
+        if self.process is not None:
+            parts.append(f"pid {self.process.pid}")
+        text = "，".join(parts) + "\n"
+        text += f"命令: {self.command}\n"
+        if IS_UNIX:
+            text += f"CPU 时间 {self.cpu_time:.1f} 秒，常驻内存 {self.rss / 2 ** 20:.1f}MB（峰值 {self.peak_rss / 2 ** 20:.1f}MB），进程数 {self.processes}\n"
+        text += f"输出共 {self.spool.total} 字节"
+        if self.spool.start:
+            text += f"（前 {self.spool.start} 字节已丢弃）"
+        if self.error is not None:
+            text += f"\n错误: {self.error}"
+        if self.result is not None and self.result.timed_out == "timeout":
+            text += "\n命令超过了后台命令的运行时间上限，已被终止。"
+        lines = self.tail(lines=tail_lines)
+        if lines:
+            text += "\n最近的输出:\n" + "\n".join(lines)
+        return text
+
+class CommandSessionManager:
+    """
+    管理后台命令会话。
+
+    max_running: 同时运行的会话上限；max_sessions: 保留的会话总数，超出时删除最早结束的会话和它的 spool 文件；
+    spool_limit: 每个会话 spool 文件的字节上限；timeout: 每个命令的总运行时间上限，0 表示不限制。
+    """
+    def __init__(self, max_running: int = 8, max_sessions: int = 32, spool_limit: int = 16 * 2 ** 20,
+                 timeout: float = 0, sample_interval: float = 2.0, spool_dir: Optional[str] = None):
+        self.max_running = max_running
+        self.max_sessions = max_sessions
+        self.spool_limit = spool_limit
+        self.timeout = timeout
+        self.sample_interval = sample_interval
+        self.sessions: Dict[str, CommandSession] = {}
+        self._spool_dir = spool_dir
+        self._ids = itertools.count(1)
+
+    @property
+    def spool_dir(self) -> str:
+        if self._spool_dir is None:
+            self._spool_dir = tempfile.mkdtemp(prefix="aient-commands-")
+            atexit.register(self._cleanup_at_exit)
+        return self._spool_dir
+
+    def get(self, session_id: str) -> CommandSession:
+        session = self.sessions.get(str(session_id).strip())
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def running(self) -> List[CommandSession]:
+        return [session for session in self.sessions.values() if session.running]
+
+    async def start(self, command: str, cwd: Optional[str] = None) -> CommandSession:
+        if len(self.running()) >= self.max_running:
+            raise RuntimeError(f"同时运行的后台命令已达到上限 {self.max_running}")
+        self._evict()
+        session_id = f"cmd-{next(self._ids)}"
+        spool = SpoolFile(os.path.join(self.spool_dir, f"{session_id}.log"), self.spool_limit)
+        session = CommandSession(session_id, command, spool, cwd or os.getcwd(), owner=_session_owner.get())
+        started = asyncio.Event()
+
+        def on_start(process):
+            session.process = process
+            started.set()
+
+        session.task = asyncio.create_task(self._run(session, on_start))
+        waiter = asyncio.ensure_future(started.wait())
+        await asyncio.wait({session.task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if session.process is None:
+            # 启动失败（例如工作目录不存在）
+            spool.close()
+            os.remove(spool.path)
+            await session.task
+            raise session.error or RuntimeError(f"命令没有启动: {command}")
+        self.sessions[session_id] = session
+        return session
+
+    async def _run(self, session: CommandSession, on_start):
+        sampler = asyncio.create_task(self._sample(session))
+        try:
+            session.result = await run_command(
+                session.command,
+                timeout=self.timeout,
+                idle_timeout=0,
+                head_lines=0,
+                tail_lines=0,
+                on_output=session.spool.write,
+                on_start=on_start,
+                cwd=session.cwd,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            session.error = e
+        finally:
+            sampler.cancel()
+            session.ended = time.monotonic()
+
+    async def _sample(self, session: CommandSession):
+        # 开始时采样得密一些，运行时间很短的命令也能留下资源占用
+        interval = min(0.25, self.sample_interval)
+        while True:
+            await asyncio.sleep(interval)
+            session.sample()
+            interval = min(interval * 2, self.sample_interval)
+
+    async def wait(self, session: CommandSession, timeout: float) -> bool:
+        """等待会话结束，至多 timeout 秒。返回会话是否已经结束。"""
+        if session.running and timeout > 0:
+            await asyncio.wait({session.task}, timeout=timeout)
+        return not session.running
+
+    async def kill(self, session: CommandSession, kill_grace: float = 2.0):
+        if not session.running:
+            return
+        session.sample()
+        session.killed = True
+        await terminate(session.process, kill_grace)
+        await asyncio.wait({session.task}, timeout=kill_grace + 1)
+
+    def _evict(self):
+        finished = sorted((session for session in self.sessions.values() if not session.running), key=lambda session: session.ended)
+        while len(self.sessions) >= self.max_sessions and finished:
+            self._remove(finished.pop(0))
+
+    def _remove(self, session: CommandSession):
+        self.sessions.pop(session.id, None)
+        session.spool.close()
+        try:
+            os.remove(session.spool.path)
+        except OSError:
+            pass
+
+    async def release(self, owner: object):
+        """终止 owner 启动的全部命令，删除这些会话和它们的 spool 文件。"""
+        for session in [session for session in self.sessions.values() if session.owner is owner]:
+            await self.kill(session)
+            self._remove(session)
+
+    async def shutdown(self):
+        """终止全部仍在运行的命令并删除 spool 文件。"""
+        for session in self.running():
+            await self.kill(session)
+        for session in self.sessions.values():
+            session.spool.close()
+        self.sessions.clear()
+        if self._spool_dir is not None:
+            atexit.unregister(self._cleanup_at_exit)
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+            self._spool_dir = None
+
+    def _cleanup_at_exit(self):
+        # 进程退出时事件循环已经不可用，直接结束仍在运行的进程组
+        for session in self.running():
+            if session.process is not None:
+                kill_process_group(session.process, signal.SIGKILL if IS_UNIX else signal.SIGTERM)
+        for session in self.sessions.values():
+            session.spool.close()
+        if self._spool_dir is not None:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+            self._spool_dir = None
+
+_session_manager: Optional[CommandSessionManager] = None
+_session_manager_lock = threading.Lock()
+
+def get_session_manager() -> CommandSessionManager:
+    """
+    返回进程内共享的后台命令会话管理器。
+
+    环境变量：OCEANS_MAX_COMMAND_SESSIONS 同时运行的后台命令上限（默认 8）；
+    OCEANS_COMMAND_SPOOL_MB 每个会话保留的输出大小（默认 16MB）；
+    OCEANS_BACKGROUND_COMMAND_TIMEOUT 后台命令的运行时间上限（秒，默认 86400，0 表示不限制）。
+    """
+    global _session_manager
+    with _session_manager_lock:
+        if _session_manager is None:
+            _session_manager = CommandSessionManager(
+                max_running=max(1, int(_env_number("OCEANS_MAX_COMMAND_SESSIONS", 8))),
+                spool_limit=max(2 ** 16, int(_env_number("OCEANS_COMMAND_SPOOL_MB", 16) * 2 ** 20)),
+                timeout=_env_number("OCEANS_BACKGROUND_COMMAND_TIMEOUT", 86400),
+            )
+        return _session_manager
+
+def _unknown_session(session_id) -> str:
+    known = ", ".join(get_session_manager().sessions) or "无"
+    return f"<tool_error>没有找到会话 {session_id}。现有会话: {known}</tool_error>"
+
+@register_tool()
+async def start_command(command):
+    """
+在后台启动一个长时间运行的命令（例如训练或实验脚本），立即返回会话 ID，不等待命令结束。
+
+命令运行期间可以继续执行其它操作（例如编写下一步的代码），之后用 `poll_command` 查看状态和资源占用，
+用 `read_command_output` 读取输出，用 `kill_command` 提前终止。运行时间短的命令请直接使用 `excute_command`。
+
+参数:
+    command: 要在后台执行的命令。
+
+返回:
+    会话 ID 和进程信息。
+    """
+    try:
+        command = get_python_executable(unescape_html(command))
+        session = await get_session_manager().start(command)
+    except FileNotFoundError:
+        return f"<tool_error>启动命令失败: 命令或程序未找到 ({command})</tool_error>"
+    except Exception as e:
+        return f"<tool_error>启动命令失败: {e}</tool_error>"
+    return f"已在后台启动命令，会话 ID: {session.id}，pid {session.process.pid}。使用 poll_command 查看状态，read_command_output 读取输出。"
+
+@register_tool()
+async def poll_command(session_id, wait: int = 0):
+    """
+查看后台命令会话的状态：是否仍在运行、退出码、运行时间、CPU 时间、内存占用和最近的输出。
+
+参数:
+    session_id: start_command 返回的会话 ID。
+    wait: 可选，最多等待多少秒让命令结束（最长 600 秒），默认不等待。没有其它事情可做时用它代替反复查询。
+
+返回:
+    会话状态摘要。
+    """
+    manager = get_session_manager()
+    try:
+        session = manager.get(session_id)
+    except KeyError:
+        return _unknown_session(session_id)
+    await manager.wait(session, min(max(wait, 0), 600))
+    return session.summary()
+
+@register_tool()
+async def read_command_output(session_id, offset: int = -1, max_chars: int = 8000):
+    """
+读取后台命令会话的输出。
+
+参数:
+    session_id: start_command 返回的会话 ID。
+    offset: 可选，从第几个字节开始读取；默认 -1 表示读取最新的 max_chars 字节。
+        返回结果中会给出下一次继续读取时使用的 offset。
+    max_chars: 可选，最多读取的字节数，默认 8000，最大 65536。
+
+返回:
+    这一段输出（已去掉 ANSI 转义序列和空行）以及它在全部输出中的位置。
+    """
+    try:
+        session = get_session_manager().get(session_id)
+    except KeyError:
+        return _unknown_session(session_id)
+    size = min(max(max_chars, 1), 65536)
+    spool = session.spool
+    start = spool.total - size if offset < 0 else offset
+    start, data = spool.read(start, size)
+    end = start + len(data)
+    header = f"会话 {session.id} ({session.status}) 输出 [{start}, {end})，共 {spool.total} 字节"
+    if start > offset >= 0:
+        header += f"；偏移 {offset} 之前的 {start - offset} 字节已被丢弃"
+    if end < spool.total:
+        header += f"；继续读取请使用 offset={end}"
+    return header + "\n" + "\n".join(normalize_lines(data.decode(errors="replace")))
+
+@register_tool()
+async def kill_command(session_id):
+    """
+终止后台命令会话及其启动的全部子进程（先发送 SIGTERM，几秒内没有退出再发送 SIGKILL）。
+
+参数:
+    session_id: start_command 返回的会话 ID。
+
+返回:
+    会话终止后的状态摘要。
+    """
+    manager = get_session_manager()
+    try:
+        session = manager.get(session_id)
+    except KeyError:
+        return _unknown_session(session_id)
+    await manager.kill(session)
+    return session.summary()
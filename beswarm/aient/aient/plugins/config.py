@@ -3,6 +3,7 @@ import json
 import inspect
 
 from .registry import registry
+from .executor import get_tool_runner
 from ..utils.prompt import search_key_word_prompt
 
 async def get_tools_result_async(function_call_name, function_full_response, engine, robot, api_key, api_url, use_plugins, model, add_message, convo_id, language):
@@ -11,19 +12,20 @@ async def get_tools_result_async(function_call_name, function_full_response, eng
     call_args = json.loads(function_full_response)
     if function_call_name in registry.tools:
         function_to_call = registry.tools[function_call_name]
-        call_args_name_list = call_args.keys()
-        required_args = registry.tools_info[function_call_name].args
-        invalid_args = [arg_name for arg_name in call_args_name_list if arg_name not in required_args]
+        # 参数名、必填参数和类型转换在注册时已经计算好
+        binder = registry.binder(function_call_name)
+        invalid_args = binder.invalid(call_args)
         if invalid_args:
             function_response = (
                 "function_response: "
                 "<tool_error>"
                 f"无效的参数: {invalid_args} "
-                f"{function_call_name} 只允许使用以下参数: {required_args}"
+                f"{function_call_name} 只允许使用以下参数: {registry.tools_info[function_call_name].args}"
                 "</tool_error>"
             )
             yield function_response
             return
+        call_args = binder.bind(call_args)
 
     if function_call_name == "get_search_results":
         prompt = call_args["query"]
@@ -53,10 +55,8 @@ async def get_tools_result_async(function_call_name, function_full_response, eng
             function_response = "无法找到相关信息，停止使用 tools"
 
     elif function_to_call:
-        if inspect.iscoroutinefunction(function_to_call):
-            function_response = await function_to_call(**call_args)
-        else:
-            function_response = function_to_call(**call_args)
+        # 同步工具放进线程池或进程池执行，不阻塞事件循环上的其它智能体和流
+        function_response = await get_tool_runner().call(function_call_name, function_to_call, call_args)
 
     function_response = (
         f"function_response:{function_response}"
@@ -156,9 +156,21 @@ def get_function_call_list(tools_list=None):
         filtered_tools = [tool.__name__ if callable(tool) else str(tool) for tool in tools_list]
     for tool_name, tool_func in registry.tools.items():
         if tool_name in filtered_tools:
-            function_list[tool_name] = function_to_json(tool_func)
+            function_list[tool_name] = tool_schema(tool_name)
     return function_list
 
+def tool_schema(tool_name):
+    """
+    返回工具的 JSON schema。延迟加载的工具直接使用插件清单中预先计算的 schema，不需要导入模块。
+    schema 在所有智能体之间共享，不要修改；需要修改时先 copy.deepcopy。
+    """
+    info = registry.tools_info.get(tool_name)
+    if info is None:
+        return function_to_json(registry.tools[tool_name])
+    if info.schema is None:
+        info.schema = function_to_json(registry.tools[tool_name])
+    return info.schema
+
 def get_claude_tools_list():
     function_list = get_function_call_list()
     return {f"{key}": gpt2claude_tools_json(function_list[key]) for key in function_list.keys()}
@@ -168,10 +180,18 @@ PLUGINS = get_plugins()
 function_call_list = get_function_call_list()
 claude_tools_list = get_claude_tools_list()
 
+_tools_config_version = registry.version
+
 # 动态更新工具函数配置
 def update_tools_config():
-    global PLUGINS, function_call_list, claude_tools_list
+    """
+    注册表变化后重新生成工具列表，否则直接返回已有的列表。
+    function_call_list 和 claude_tools_list 在智能体之间共享，不要修改；PLUGINS 每次都是新的字典。
+    """
+    global PLUGINS, function_call_list, claude_tools_list, _tools_config_version
     PLUGINS = get_plugins()
-    function_call_list = get_function_call_list()
-    claude_tools_list = get_claude_tools_list()
+    if _tools_config_version != registry.version:
+        function_call_list = get_function_call_list()
+        claude_tools_list = get_claude_tools_list()
+        _tools_config_version = registry.version
     return PLUGINS, function_call_list, claude_tools_list
\ No newline at end of file
@@ -1,16 +1,9 @@
-import subprocess
 from .registry import register_tool
-from ..utils.scripts import sandbox, unescape_html
+from .command_runner import run_command, noise_filter, CommandResult
+from ..utils.scripts import unescape_html
 
 import re
-import os
-import select
-
-# 检查是否在 Unix-like 系统上 (pty 模块主要用于 Unix)
-IS_UNIX = hasattr(os, 'fork')
-
-if IS_UNIX:
-    import pty
+import asyncio
 
 import difflib
 
@@ -64,9 +57,21 @@ def get_python_executable(command: str) -> str:
                     command = f"{executable} -u" # 如果没有其他参数，也添加 -u
     return command
 
+def format_command_result(result: CommandResult) -> str:
+    """把命令执行结果整理成返回给模型的文本。"""
+    if result.timed_out == "timeout":
+        return f"<tool_error>执行命令超时: 运行 {result.duration:.0f} 秒后仍未结束，已终止该命令及其子进程。\n输出/错误:\n{result.output}</tool_error>"
+    if result.timed_out == "idle":
+        return f"<tool_error>执行命令超时: 命令长时间没有任何输出，运行 {result.duration:.0f} 秒后已终止该命令及其子进程。\n输出/错误:\n{result.output}</tool_error>"
+    if result.returncode == 0:
+        if result.output == "":
+            return f"执行命令成功"
+        return f"执行命令成功:\n{result.output}"
+    return f"<tool_error>执行命令失败 (退出码 {result.returncode}):\n输出/错误:\n{result.output}</tool_error>"
+
 # 执行命令
 @register_tool()
-def excute_command(command):
+async def excute_command(command):
     """
 执行命令并返回输出结果 (标准输出会实时打印到控制台)。
 
@@ -76,6 +81,7 @@ def excute_command(command):
   - **错误用法**: `git clone https://github.com/user/repo_name.git .`
 - **禁止**: 禁止用于查看pdf，禁止使用 `pdftotext` 命令。
 - **检查子任务状态**: 禁止使用 `ls`, `cat` 等文件系统命令轮询检查子任务的完成状态或其输出。请改用 `get_task_result`, `get_all_tasks_status` 等工具来获取子任务的状态和结果。
+- **超时**: 命令的总运行时间和无输出时间都有上限，超时后命令及其子进程会被终止，返回已收集到的输出。输出过长时只保留开头和结尾各 250 行。
 
 参数:
     command: 要执行的命令，例如克隆仓库、安装依赖、运行代码等。
@@ -86,117 +92,9 @@ def excute_command(command):
     try:
         command = unescape_html(command)
         command = get_python_executable(command)
-
-        output_lines = []
-
-        if IS_UNIX:
-            # 在 Unix-like 系统上使用 pty 以支持 tqdm 等库的 ANSI 转义序列
-            master_fd, slave_fd = pty.openpty()
-
-            process = sandbox.Popen(
-                command,
-                shell=True,
-                stdin=subprocess.PIPE,
-                stdout=slave_fd,
-                stderr=slave_fd,
-                close_fds=True,
-            )
-            os.close(slave_fd)
-
-            # print(f"--- 开始执行命令 (PTY): {command} ---")
-            while True:
-                try:
-                    # 使用 select 进行非阻塞读取
-                    r, _, _ = select.select([master_fd], [], [], 0.1) # 0.1 秒超时
-                    if r:
-                        data_bytes = os.read(master_fd, 1024)
-                        if not data_bytes: # EOF
-                            break
-                        # 尝试解码，如果失败则使用 repr 显示原始字节
-                        try:
-                            data_str = data_bytes.decode(errors='replace')
-                        except UnicodeDecodeError:
-                            data_str = repr(data_bytes) + " (decode error)\n"
-
-                        print(data_str, end='', flush=True)
-                        if "pip install" in command and '━━' in data_str:
-                            continue
-                        if "git clone" in command and ('Counting objects' in data_str or 'Resolving deltas' in data_str or 'Receiving objects' in data_str or 'Compressing objects' in data_str):
-                            continue
-                        output_lines.append(data_str)
-                    # 检查进程是否已结束，避免在进程已退出后 select 仍然阻塞
-                    if process.poll() is not None and not r:
-                        break
-                except OSError: # 当 PTY 关闭时可能会发生
-                    break
-            # print(f"\n--- 命令实时输出结束 (PTY) ---")
-            os.close(master_fd)
-        else:
-            # 在非 Unix 系统上，回退到原始的 subprocess.PIPE 行为
-            # tqdm 进度条可能不会像在终端中那样动态更新
-            process = sandbox.Popen(
-                command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                encoding='utf-8',
-                errors='replace',
-                universal_newlines=True
-            )
-            # print(f"--- 开始执行命令 (PIPE): {command} ---")
-            if process.stdout:
-                for line in iter(process.stdout.readline, ''):
-                    print(line, end='', flush=True)
-                    if "pip install" in command and '━━' in line:
-                        continue
-                    if "git clone" in command and ('Counting objects' in line or 'Resolving deltas' in line or 'Receiving objects' in line or 'Compressing objects' in line):
-                        continue
-                    output_lines.append(line)
-                process.stdout.close()
-            # print(f"\n--- 命令实时输出结束 (PIPE) ---")
-
-        process.wait() # 等待命令完成
-
-        # 在非 PTY 模式下，stderr 需要单独读取
-        stderr_output = ""
-        if not IS_UNIX and process.stderr:
-            stderr_output = process.stderr.read()
-            process.stderr.close()
-
-        new_output_lines = []
-        output_lines = "".join(output_lines).strip().replace("\\r", "\r").replace("\\\\", "").replace("\\n", "\n").replace("\r", "+++").replace("\n", "+++")
-        output_lines = re.sub(r'\\u001b\[[0-9;]*[a-zA-Z]', '', output_lines)
-        for line in output_lines.split("+++"):
-            if line.strip() == "":
-                continue
-            # aaa = last_line.strip()
-            # is_same = compare_line(repr(line.strip()))
-            # if not is_same:
-            #     # print(f"{repr(aaa)}", flush=True)
-            #     # print(f"{repr(line.strip())}", flush=True)
-            #     # print(f"is_same: {is_same}", flush=True)
-            #     # print(f"\n\n\n", flush=True)
-            new_output_lines.append(line)
-        # 限制输出行数
-        if len(new_output_lines) > 500:
-            new_output_lines = new_output_lines[:250] + new_output_lines[-250:]
-        final_output_log = "\n".join(new_output_lines)
-        # print(f"output_lines: {len(new_output_lines)}")
-
-        if process.returncode == 0:
-            if final_output_log.strip() == "":
-                return f"执行命令成功"
-            else:
-                return f"执行命令成功:\n{final_output_log.strip()}"
-        else:
-            # 如果是 PTY 模式，stderr 已经包含在 final_output_log 中
-            if IS_UNIX:
-                return f"<tool_error>执行命令失败 (退出码 {process.returncode}):\n输出/错误:\n{final_output_log}</tool_error>"
-            else:
-                return f"<tool_error>执行命令失败 (退出码 {process.returncode}):\n错误: {stderr_output}\n输出: {final_output_log}</tool_error>"
-
+        # 输出实时打印到控制台，只保留开头和结尾各 250 行返回给模型
+        result = await run_command(command, line_filter=noise_filter(command), echo=True)
+        return format_command_result(result)
     except FileNotFoundError:
         return f"<tool_error>执行命令失败: 命令或程序未找到 ({command})</tool_error>"
     except Exception as e:
@@ -239,7 +137,7 @@ for i in content.split("\\n"):
     processed_tqdm_script = tqdm_script.replace('"', '\\"')
     tqdm_command = f"python -c \"{processed_tqdm_script}\""
     # print(f"执行: {tqdm_command}")
-    print(excute_command(tqdm_command))
+    print(asyncio.run(excute_command(tqdm_command)))
 
 #     tqdm_script = """
 # import time
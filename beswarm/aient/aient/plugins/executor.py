@@ -0,0 +1,366 @@
+import os
+import time
+import asyncio
+import logging
+import inspect
+import threading
+import contextvars
+from weakref import WeakKeyDictionary
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+"""
+依赖感知的工具执行器。
+
+同一轮回复中的多个工具调用会按照访问的资源建立依赖：只读工具之间可以并发执行，
+写入同一路径的工具按原始顺序串行，未登记的工具视为独占，与前后所有调用保持顺序。
+
+登记为 I/O 密集的同步工具放进有并发上限的线程池执行，不阻塞事件循环。CPU 密集的解析（pdfminer、tree-sitter、difflib）
+由工具自己提交到共享的进程池（core.process_pool）。其余同步工具（例如操作 asyncio.Queue 的任务管理工具、修改共享知识图谱的工具）
+按 INLINE 在循环上直接调用，它们不一定是线程安全的。另有一个事件循环延迟监视器，记录循环被阻塞的时长。
+"""
+
+logger = logging.getLogger(__name__)
+
+READ = "read"
+WRITE = "write"
+EXCLUSIVE = "exclusive"
+
+# 表示工具可能访问任意路径，例如执行 shell 命令。
+ALL_PATHS = None
+
+# 工具名 -> (访问模式, 路径参数名列表)。路径参数名为 ALL_PATHS 表示可能访问任意路径。
+TOOL_ACCESS: Dict[str, Tuple[str, Optional[List[str]]]] = {
+    "read_file": (READ, ["file_path"]),
+    "read_image": (READ, ["image_path"]),
+    "list_directory": (READ, ["path"]),
+    "get_code_repo_map": (READ, ["dir_path"]),
+    "search_web": (READ, []),
+    "search_arxiv": (READ, []),
+    "get_url_content": (READ, []),
+    "get_search_results": (READ, []),
+    "download_read_arxiv_pdf": (READ, []),
+    "get_time": (READ, []),
+    "get_knowledge_graph_tree": (READ, []),
+    "get_node_details": (READ, []),
+    "write_to_file": (WRITE, ["path"]),
+    "edit_file": (WRITE, ["file_path"]),
+    "append_row_to_csv": (WRITE, ["file_path"]),
+    "excute_command": (WRITE, ALL_PATHS),
+    "start_command": (WRITE, ALL_PATHS),
+    "kill_command": (WRITE, ALL_PATHS),
+    # 会话 id 不是路径，按可能访问任意路径处理，保证排在同一响应中更早的 start_command / kill_command 之后
+    "poll_command": (READ, ALL_PATHS),
+    "read_command_output": (READ, ALL_PATHS),
+}
+
+# 可以在流式输出过程中投机执行的工具：只读取本地状态、没有副作用也不花钱。
+# 投机执行的结果可能因为响应被截断或判定为重复而丢弃，调用外部服务（搜索、LLM）或写文件的只读工具不在其中。
+SPECULATIVE_TOOLS = {
+    "read_file",
+    "read_image",
+    "list_directory",
+    "get_time",
+    "get_knowledge_graph_tree",
+    "get_node_details",
+}
+
+def register_tool_access(tool_name: str, mode: str, path_args: Optional[List[str]] = (), speculative: bool = False):
+    """
+    登记工具的访问模式，使其可以参与并发调度。
+    speculative=True 表示工具是纯粹的本地读取，可以投机执行，只允许用于 READ。
+    """
+    if mode not in (READ, WRITE, EXCLUSIVE):
+        raise ValueError(f"Unknown access mode: {mode}")
+    if speculative and mode != READ:
+        raise ValueError(f"Only read-only tools can run speculatively: {tool_name}")
+    TOOL_ACCESS[tool_name] = (mode, list(path_args) if path_args is not ALL_PATHS else ALL_PATHS)
+    if speculative:
+        SPECULATIVE_TOOLS.add(tool_name)
+    else:
+        SPECULATIVE_TOOLS.discard(tool_name)
+
+def _tool_footprint(tool_name: str, parameter: Any) -> Tuple[str, Optional[List[str]]]:
+    mode, path_args = TOOL_ACCESS.get(tool_name, (EXCLUSIVE, ALL_PATHS))
+    if path_args is ALL_PATHS:
+        return mode, ALL_PATHS
+    paths = []
+    if isinstance(parameter, dict):
+        for arg in path_args:
+            value = parameter.get(arg)
+            if isinstance(value, str) and value:
+                paths.append(os.path.normpath(os.path.abspath(os.path.expanduser(value))))
+    elif path_args:
+        # 参数无法解析时无法确定访问的路径，只能保守处理。
+        return mode, ALL_PATHS
+    return mode, paths
+
+def _paths_overlap(left: Optional[List[str]], right: Optional[List[str]]) -> bool:
+    # 不访问文件系统的工具（例如网页搜索）与任何路径都不冲突。
+    if left == [] or right == []:
+        return False
+    if left is ALL_PATHS or right is ALL_PATHS:
+        return True
+    for a in left:
+        for b in right:
+            if a == b or a.startswith(b.rstrip(os.sep) + os.sep) or b.startswith(a.rstrip(os.sep) + os.sep):
+                return True
+    return False
+
+def _conflicts(left: Tuple[str, Optional[List[str]]], right: Tuple[str, Optional[List[str]]]) -> bool:
+    if EXCLUSIVE in (left[0], right[0]):
+        return True
+    if left[0] == READ and right[0] == READ:
+        return False
+    return _paths_overlap(left[1], right[1])
+
+
+class ToolExecutor:
+    """
+    按依赖关系并发执行一组工具调用，结果按原始顺序返回。
+
+    每个调用只等待与它冲突的更早调用，并发数量受 max_concurrency 限制。
+    """
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max_concurrency
+
+    def plan(self, tool_calls: List[Dict[str, Any]]) -> List[List[int]]:
+        """返回每个调用必须等待的更早调用的下标。"""
+        footprints = [_tool_footprint(call.get("function_name", ""), call.get("parameter")) for call in tool_calls]
+        return [
+            [j for j in range(i) if _conflicts(footprints[j], footprints[i])]
+            for i in range(len(tool_calls))
+        ]
+
+    async def run(self, tool_calls: List[Dict[str, Any]], runner: Callable[[Dict[str, Any]], Awaitable[Any]]) -> List[Any]:
+        dependencies = self.plan(tool_calls)
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        tasks: List[asyncio.Task] = []
+
+        async def run_one(index: int):
+            for dependency in dependencies[index]:
+                await asyncio.shield(tasks[dependency])
+            async with semaphore:
+                return await runner(tool_calls[index])
+
+        for index in range(len(tool_calls)):
+            tasks.append(asyncio.ensure_future(run_one(index)))
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+
+# 工具的执行方式
+ASYNC = "async"    # 协程，直接在事件循环上 await
+INLINE = "inline"  # 同步且依赖事件循环状态，或耗时可以忽略，直接调用
+IO = "io"          # 同步 I/O（网络请求、子进程、文件），放进线程池
+
+# 未登记的同步工具按 INLINE 处理：只有确认可以在其他线程中运行的工具才登记为 IO。
+TOOL_KINDS: Dict[str, str] = {
+    "get_time": INLINE,
+    "task_complete": INLINE,
+    "create_task": INLINE,
+    "resume_task": INLINE,
+    "get_all_tasks_status": INLINE,
+    "create_tasks_from_csv": INLINE,
+    # 知识图谱工具读写进程内共享的 networkx 图并保存 graphml，没有加锁，必须在循环上串行执行
+    "add_knowledge_node": INLINE,
+    "add_tags_to_knowledge_node": INLINE,
+    "remove_tags_from_knowledge_node": INLINE,
+    "delete_knowledge_node": INLINE,
+    "rename_knowledge_node": INLINE,
+    "move_knowledge_node": INLINE,
+    "get_knowledge_graph_tree": INLINE,
+    "get_node_details": INLINE,
+    "read_file": IO,
+    "write_to_file": IO,
+    "edit_file": IO,
+    "list_directory": IO,
+    "append_row_to_csv": IO,
+    "read_image": IO,
+    "get_url_content": IO,
+    "generate_image": IO,
+    "search_arxiv": IO,
+    "get_code_repo_map": IO,
+    "save_screenshot_to_file": IO,
+    "request_admin_input": IO,
+}
+
+def register_tool_kind(tool_name: str, kind: str):
+    """登记同步工具的执行方式。"""
+    if kind not in (ASYNC, INLINE, IO):
+        raise ValueError(f"Unknown tool kind: {kind}")
+    TOOL_KINDS[tool_name] = kind
+
+def tool_kind(tool_name: str, func: Callable) -> str:
+    if inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func):
+        return ASYNC
+    kind = TOOL_KINDS.get(tool_name, INLINE)
+    return INLINE if kind == ASYNC else kind
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
+
+
+class LoopLagMonitor:
+    """
+    测量事件循环的调度延迟。
+
+    用 call_later 每隔 interval 秒安排一次回调，回调实际执行的时间与预定时间之差就是这段时间内
+    循环被阻塞的时长。不创建 Task，循环关闭时不会留下未完成的任务。
+    """
+    def __init__(self, interval: float = 0.25, threshold: float = 0.2, alpha: float = 0.2):
+        self.interval = interval
+        self.threshold = threshold
+        self.alpha = alpha
+        self.samples = 0
+        self.stalls = 0
+        self.max_lag = 0.0
+        self.ewma_lag = 0.0
+        self.last_lag = 0.0
+        self._handle = None
+        self._loop = None
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        if self._handle is not None:
+            return
+        self._loop = loop or asyncio.get_running_loop()
+        self._schedule()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_later(self.interval, self._tick, expected)
+
+    def _tick(self, expected: float):
+        lag = max(0.0, self._loop.time() - expected)
+        self.samples += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.ewma_lag += self.alpha * (lag - self.ewma_lag)
+        if lag >= self.threshold:
+            self.stalls += 1
+            logger.warning(f"Event loop was blocked for {lag * 1000:.0f}ms")
+        if self._loop.is_closed():
+            self._handle = None
+            return
+        self._schedule()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "stalls": self.stalls,
+            "max_lag": self.max_lag,
+            "ewma_lag": self.ewma_lag,
+            "last_lag": self.last_lag,
+        }
+
+
+class BlockingToolRunner:
+    """
+    按工具类型选择执行位置，并限制线程池中同时执行的数量。线程池在第一次使用时创建。
+    """
+    def __init__(self, io_workers: int = None, monitor_loop_lag: bool = True):
+        self.limits = {
+            IO: io_workers or _env_int("OCEANS_TOOL_IO_WORKERS", 16),
+        }
+        self.monitor_loop_lag = monitor_loop_lag
+        self._thread_pool = None
+        self._lock = threading.Lock()
+        # asyncio.Semaphore 绑定在第一次使用它的事件循环上，每个循环各用一组
+        self._semaphores: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = WeakKeyDictionary()
+        self._monitors: "WeakKeyDictionary[asyncio.AbstractEventLoop, LoopLagMonitor]" = WeakKeyDictionary()
+        self.counters = {kind: {"calls": 0, "running": 0, "queued": 0, "max_queue_wait": 0.0} for kind in (ASYNC, INLINE, IO)}
+
+    def thread_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.limits[IO], thread_name_prefix="aient-tool")
+            return self._thread_pool
+
+    def lag_monitor(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> LoopLagMonitor:
+        loop = loop or asyncio.get_running_loop()
+        monitor = self._monitors.get(loop)
+        if monitor is None:
+            monitor = self._monitors[loop] = LoopLagMonitor()
+            monitor.start(loop)
+        return monitor
+
+    def _semaphore(self, loop: asyncio.AbstractEventLoop, kind: str) -> asyncio.Semaphore:
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = self._semaphores[loop] = {k: asyncio.Semaphore(limit) for k, limit in self.limits.items()}
+        return semaphores[kind]
+
+    async def call(self, tool_name: str, func: Callable, kwargs: Dict[str, Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        if self.monitor_loop_lag:
+            self.lag_monitor(loop)
+        kind = tool_kind(tool_name, func)
+        counters = self.counters[kind]
+        counters["calls"] += 1
+        if kind == ASYNC:
+            return await func(**kwargs)
+        if kind == INLINE:
+            return func(**kwargs)
+
+        queued_at = time.monotonic()
+        counters["queued"] += 1
+        waiting = True
+        try:
+            async with self._semaphore(loop, kind):
+                waiting = False
+                counters["queued"] -= 1
+                counters["max_queue_wait"] = max(counters["max_queue_wait"], time.monotonic() - queued_at)
+                counters["running"] += 1
+                try:
+                    return await self._run_in_thread(loop, func, kwargs)
+                finally:
+                    counters["running"] -= 1
+        finally:
+            if waiting:
+                counters["queued"] -= 1
+
+    async def _run_in_thread(self, loop, func: Callable, kwargs: Dict[str, Any]) -> Any:
+        # 与 asyncio.to_thread 一样把当前上下文变量带进线程
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.thread_pool(), lambda: context.run(func, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {kind: dict(counters) for kind, counters in self.counters.items()}
+        stats["limits"] = dict(self.limits)
+        try:
+            monitor = self._monitors.get(asyncio.get_running_loop())
+        except RuntimeError:
+            monitor = None
+        if monitor is not None:
+            stats["loop_lag"] = monitor.stats()
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._thread_pool = self._thread_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+_tool_runner: Optional[BlockingToolRunner] = None
+_tool_runner_lock = threading.Lock()
+
+def get_tool_runner() -> BlockingToolRunner:
+    """返回进程内共享的工具执行器。"""
+    global _tool_runner
+    with _tool_runner_lock:
+        if _tool_runner is None:
+            _tool_runner = BlockingToolRunner()
+        return _tool_runner
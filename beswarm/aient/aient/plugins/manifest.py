@@ -0,0 +1,216 @@
+import os
+import ast
+import json
+import tempfile
+from typing import Dict, List, Optional
+
+"""
+插件清单：不导入插件模块，直接从源码的语法树中读出 @register_tool / @register_agent 注册的
+工具名、参数和 JSON schema。
+
+结果缓存在一个 JSON 索引文件里，以每个源文件的 mtime 和大小判断是否失效，
+启动时只需要读这个文件；插件模块在工具第一次被调用时才导入。
+无法静态分析的模块（没有源码、装饰器参数不是字面量、以其它方式调用 register_tool 等）
+返回 None，由调用方照常导入。
+
+索引文件默认位于 ~/.cache/aient/plugin_index.json，可以用 OCEANS_PLUGIN_INDEX 指定其它路径。
+"""
+
+INDEX_VERSION = 1
+
+_REGISTER_DECORATORS = {"register_tool": "tool", "register_agent": "agent"}
+
+# 与 config.function_to_json 的类型映射保持一致。它按注解对象查表，
+# 所以 "-> None" 之类的注解（值是 None 而不是 NoneType）和字符串注解都得到 "string"
+_TYPE_NAMES = {
+    "str": "string",
+    "int": "integer",
+    "float": "number",
+    "bool": "boolean",
+}
+_BUILTIN_TYPES = {"str", "int", "float", "bool", "bytes", "list", "dict", "tuple", "set", "object"}
+
+def default_index_path() -> str:
+    path = os.environ.get("OCEANS_PLUGIN_INDEX", "").strip()
+    if path:
+        return path
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "aient", "plugin_index.json")
+
+def _decorator_registration(decorator) -> Optional[tuple]:
+    """返回 (类型, 注册名)；不是注册装饰器时返回 ("", None)，无法静态确定时返回 None。"""
+    if not isinstance(decorator, ast.Call):
+        target = decorator
+        if isinstance(target, ast.Name) and target.id in _REGISTER_DECORATORS:
+            # @register_tool 没有加括号，行为依赖运行时，交给导入处理
+            return None
+        return ("", None)
+    func = decorator.func
+    name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+    if name not in _REGISTER_DECORATORS:
+        return ("", None)
+    values = list(decorator.args) + [keyword.value for keyword in decorator.keywords if keyword.arg == "name"]
+    if any(keyword.arg not in ("name",) for keyword in decorator.keywords) or len(values) > 1:
+        return None
+    if not values:
+        return (_REGISTER_DECORATORS[name], None)
+    value = values[0]
+    if isinstance(value, ast.Constant) and (value.value is None or isinstance(value.value, str)):
+        return (_REGISTER_DECORATORS[name], value.value)
+    return None
+
+def _has_yield(node) -> bool:
+    """函数体内（不含嵌套函数）是否有 yield。"""
+    stack = list(node.body)
+    while stack:
+        child = stack.pop()
+        if isinstance(child, (ast.Yield, ast.YieldFrom)):
+            return True
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        stack.extend(ast.iter_child_nodes(child))
+    return False
+
+def _annotation(node) -> Optional[str]:
+    return ast.unparse(node) if node is not None else None
+
+def _parameters(arguments: ast.arguments) -> List[dict]:
+    params = []
+    positional = arguments.posonlyargs + arguments.args
+    defaults = [None] * (len(positional) - len(arguments.defaults)) + list(arguments.defaults)
+    for index, (arg, default) in enumerate(zip(positional, defaults)):
+        kind = "POSITIONAL_ONLY" if index < len(arguments.posonlyargs) else "POSITIONAL_OR_KEYWORD"
+        params.append({"name": arg.arg, "kind": kind, "annotation": _annotation(arg.annotation), "default": _annotation(default)})
+    if arguments.vararg:
+        params.append({"name": arguments.vararg.arg, "kind": "VAR_POSITIONAL", "annotation": _annotation(arguments.vararg.annotation), "default": None})
+    for arg, default in zip(arguments.kwonlyargs, arguments.kw_defaults):
+        params.append({"name": arg.arg, "kind": "KEYWORD_ONLY", "annotation": _annotation(arg.annotation), "default": _annotation(default)})
+    if arguments.kwarg:
+        params.append({"name": arguments.kwarg.arg, "kind": "VAR_KEYWORD", "annotation": _annotation(arguments.kwarg.annotation), "default": None})
+    return params
+
+def _schema(function_name: str, docstring: Optional[str], params: List[dict], string_annotations: bool) -> dict:
+    """与 config.function_to_json 对同一个函数的输出相同。"""
+    type_names = {} if string_annotations else _TYPE_NAMES
+    properties = {param["name"]: {"type": type_names.get(param["annotation"], "string")} for param in params}
+    required = [param["name"] for param in params if param["default"] is None]
+    return {
+        "name": function_name,
+        "description": docstring or "",
+        "parameters": {
+            "type": "object",
+            "properties": properties,
+            "required": required,
+        },
+    }
+
+def scan_source(source: str, filename: str = "<plugin>") -> Optional[List[dict]]:
+    """从源码中找出注册的工具。无法静态确定注册结果时返回 None。"""
+    try:
+        tree = ast.parse(source, filename)
+    except SyntaxError:
+        return None
+
+    # from __future__ import annotations 之后注解都是字符串
+    string_annotations = any(
+        isinstance(node, ast.ImportFrom) and node.module == "__future__" and any(alias.name == "annotations" for alias in node.names)
+        for node in tree.body
+    )
+    entries = []
+    decorator_nodes = set()
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for decorator in node.decorator_list:
+            registration = _decorator_registration(decorator)
+            if registration is None:
+                return None
+            registry_type, name = registration
+            if not registry_type:
+                continue
+            decorator_nodes.add(id(decorator.func))
+            if len(node.decorator_list) > 1:
+                # 其它装饰器可能改变函数签名，交给导入处理
+                return None
+            params = _parameters(node.args)
+            raw_docstring = ast.get_docstring(node, clean=False)
+            if isinstance(node, ast.AsyncFunctionDef):
+                kind = "async_generator" if _has_yield(node) else "coroutine"
+            else:
+                kind = "generator" if _has_yield(node) else "function"
+            returns = _annotation(node.returns)
+            # 与 str(signature.return_annotation) 一致
+            return_type = f"<class '{returns}'>" if returns in _BUILTIN_TYPES else returns
+            entries.append({
+                "type": registry_type,
+                "name": name or node.name,
+                "function": node.name,
+                "kind": kind,
+                "parameters": params,
+                "returns": returns,
+                "docstring": ast.get_docstring(node),
+                "return_type": return_type,
+                "schema": _schema(node.name, raw_docstring, params, string_annotations),
+            })
+
+    # 除了装饰器和导入以外还引用了 register_tool（例如 register_tool()(func)），静态结果不完整
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in _REGISTER_DECORATORS and id(node) not in decorator_nodes:
+            return None
+        if isinstance(node, ast.Attribute) and node.attr in _REGISTER_DECORATORS and id(node) not in decorator_nodes:
+            return None
+    return entries
+
+def _load_cache(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+        return {}
+    return data.get("modules", {})
+
+def _save_cache(path: str, modules: dict):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".plugin_index.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "modules": modules}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        # 缓存只是加速手段，只读文件系统上每次重新分析即可
+        pass
+
+def load_plugin_index(directory: str, module_names: List[str], index_path: Optional[str] = None) -> Dict[str, Optional[List[dict]]]:
+    """
+    返回 {模块名: 注册的工具列表}。模块无法静态分析时对应的值为 None。
+    只有 mtime 或大小变化的源文件会被重新分析。
+    """
+    index_path = index_path or default_index_path()
+    cached = _load_cache(index_path)
+    updated = dict(cached)
+    changed = False
+    result = {}
+    for module_name in module_names:
+        path = os.path.abspath(os.path.join(directory, f"{module_name}.py"))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            result[module_name] = None
+            continue
+        entry = cached.get(path)
+        if entry and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+            result[module_name] = entry.get("entries")
+            continue
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = scan_source(f.read(), path)
+        except (OSError, UnicodeDecodeError):
+            entries = None
+        updated[path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "entries": entries}
+        changed = True
+        result[module_name] = entries
+    if changed:
+        _save_cache(index_path, updated)
+    return result
@@ -1,6 +1,84 @@
-from typing import Callable, Dict, Literal, List, Optional
-from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, Literal, List, Optional, Tuple
+from dataclasses import dataclass, asdict, field
+import importlib
 import inspect
+import threading
+
+def _to_bool(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in ("true", "1", "yes", "y", "on"):
+        return True
+    if lowered in ("false", "0", "no", "n", "off", "none", ""):
+        return False
+    raise ValueError(value)
+
+# 模型给出的参数大多是字符串，按注解把它们转换成 int / float / bool。
+# 注解可能是类型对象，也可能是字符串（from __future__ import annotations 或插件清单）
+_COERCERS = {
+    int: int, "int": int,
+    float: float, "float": float,
+    bool: _to_bool, "bool": _to_bool,
+}
+
+class ToolBinder:
+    """
+    工具调用参数的绑定器，注册时由函数签名生成一次，之后每次调用只做字典查找。
+
+    names: 全部具名参数；required: 没有默认值的参数；coercers: 参数名 -> 字符串转换函数；
+    var_keyword: 是否接受 **kwargs（此时不检查未知参数）。
+    """
+    __slots__ = ("names", "required", "coercers", "var_keyword", "_name_set")
+
+    def __init__(self, names: Tuple[str, ...], required: Tuple[str, ...], coercers: Dict[str, Callable], var_keyword: bool):
+        self.names = names
+        self.required = required
+        self.coercers = coercers
+        self.var_keyword = var_keyword
+        self._name_set = frozenset(names)
+
+    @classmethod
+    def from_signature(cls, signature: inspect.Signature) -> "ToolBinder":
+        names, required, coercers = [], [], {}
+        var_keyword = False
+        for param in signature.parameters.values():
+            if param.kind is inspect.Parameter.VAR_KEYWORD:
+                var_keyword = True
+                continue
+            if param.kind is inspect.Parameter.VAR_POSITIONAL:
+                continue
+            names.append(param.name)
+            if param.default is inspect.Parameter.empty:
+                required.append(param.name)
+            try:
+                coercer = _COERCERS.get(param.annotation)
+            except TypeError:
+                # 不可哈希的注解
+                coercer = None
+            if coercer is not None:
+                coercers[param.name] = coercer
+        return cls(tuple(names), tuple(required), coercers, var_keyword)
+
+    def missing(self, arguments: Dict[str, Any]) -> List[str]:
+        return [name for name in self.required if name not in arguments]
+
+    def invalid(self, arguments: Dict[str, Any]) -> List[str]:
+        if self.var_keyword:
+            return []
+        return [name for name in arguments if name not in self._name_set]
+
+    def bind(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """按注解转换字符串参数，无法转换的值保持原样交给工具自己处理。"""
+        if not self.coercers:
+            return arguments
+        bound = dict(arguments)
+        for name, coercer in self.coercers.items():
+            value = bound.get(name)
+            if isinstance(value, str):
+                try:
+                    bound[name] = coercer(value)
+                except ValueError:
+                    pass
+        return bound
 
 @dataclass
 class FunctionInfo:
@@ -8,20 +86,73 @@ class FunctionInfo:
     func: Callable
     args: List[str]
     docstring: Optional[str]
-    body: str
     return_type: Optional[str]
+    # 延迟加载的工具所在的模块，导入后为 None
+    module: Optional[str] = None
+    # 预先计算好的 JSON schema（来自插件清单），为 None 时按需由 function_to_json 生成
+    schema: Optional[dict] = None
+    _body: Optional[str] = field(default=None, repr=False, compare=False)
+    # 注册时生成的参数绑定器
+    binder: Optional[ToolBinder] = field(default=None, repr=False, compare=False)
+
+    @property
+    def body(self) -> str:
+        # 函数体只在需要时读取源码，注册时不调用 inspect.getsource
+        if self._body is None:
+            self._body = _function_body(self.func)
+        return self._body
+
     def to_dict(self) -> dict:
         # using asdict, but exclude func field because it cannot be serialized
         d = asdict(self)
         d.pop('func')  # remove func field
+        d.pop('_body')
+        d.pop('binder')
+        d['body'] = self.body
         return d
 
     @classmethod
     def from_dict(cls, data: dict) -> 'FunctionInfo':
         # if you need to create an object from a dictionary
+        data = dict(data)
         if 'func' not in data:
             data['func'] = None  # or other default value
-        return cls(**data)
+        body = data.pop('body', None)
+        info = cls(**data)
+        info._body = body
+        return info
+
+def _function_body(func: Callable) -> str:
+    try:
+        source_lines = inspect.getsource(func)
+    except (OSError, TypeError):
+        # In frozen apps (PyInstaller) the original .py source file is usually not available.
+        # The function body is optional metadata; fall back to empty to avoid crashing.
+        return ""
+    # 移除装饰器和函数定义行
+    body_lines = source_lines.split('\n')[1:]  # 跳过装饰器行
+    while body_lines and (body_lines[0].strip().startswith('@') or 'def ' in body_lines[0]):
+        body_lines = body_lines[1:]
+    return '\n'.join(body_lines)
+
+class _LazyDefault:
+    """清单中记录的参数默认值，只用于展示签名。"""
+    def __init__(self, text: str):
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+def _lazy_signature(parameters: List[dict], returns: Optional[str]) -> inspect.Signature:
+    return inspect.Signature([
+        inspect.Parameter(
+            param["name"],
+            getattr(inspect.Parameter, param["kind"]),
+            default=inspect.Parameter.empty if param["default"] is None else _LazyDefault(param["default"]),
+            annotation=inspect.Parameter.empty if param["annotation"] is None else param["annotation"],
+        )
+        for param in parameters
+    ], return_annotation=inspect.Signature.empty if returns is None else returns)
 
 class Registry:
     _instance = None
@@ -33,6 +164,9 @@ class Registry:
         "tools": {},
         "agents": {}
     }
+    _import_lock = threading.RLock()
+    # 每次注册或替换工具时加一，用于判断缓存的工具配置是否过期
+    version = 0
 
     def __new__(cls):
         if cls._instance is None:
@@ -60,40 +194,102 @@ class Registry:
             args = list(signature.parameters.keys())
             docstring = inspect.getdoc(func)
 
-            # 获取函数体
-            try:
-                source_lines = inspect.getsource(func)
-            except (OSError, TypeError):
-                # In frozen apps (PyInstaller) the original .py source file is usually not available.
-                # The function body is optional metadata; fall back to empty to avoid crashing.
-                source_lines = ""
-            # 移除装饰器和函数定义行
-            body_lines = source_lines.split('\n')[1:]  # 跳过装饰器行
-            while body_lines and (body_lines[0].strip().startswith('@') or 'def ' in body_lines[0]):
-                body_lines = body_lines[1:]
-            body = '\n'.join(body_lines)
-
             # 获取返回类型提示
             return_type = None
             if signature.return_annotation != inspect.Signature.empty:
                 return_type = str(signature.return_annotation)
 
+            registry_type = f"{type}s"
+            # 延迟加载的占位函数被真正的函数替换时，沿用插件清单中与 function_to_json 相同的 schema
+            previous = self._registry_info[registry_type].get(name)
+            schema = previous.schema if previous is not None and previous.module is not None else None
+
             # 创建函数信息对象
             func_info = FunctionInfo(
                 name=name,
                 func=func,
                 args=args,
                 docstring=docstring,
-                body=body,
-                return_type=return_type
+                return_type=return_type,
+                schema=schema,
+                binder=ToolBinder.from_signature(signature),
             )
 
-            registry_type = f"{type}s"
             self._registry[registry_type][name] = func
             self._registry_info[registry_type][name] = func_info
+            Registry.version += 1
             return func
         return decorator
 
+    def register_lazy(self, module: str, entry: dict):
+        """
+        按插件清单登记一个尚未导入的工具。登记的是一个同名的占位函数，
+        第一次调用时导入 module，之后模块中的 @register_tool 会用真正的函数替换它。
+        """
+        registry_type = f"{entry['type']}s"
+        name = entry["name"]
+        if name in self._registry[registry_type]:
+            return
+
+        def resolve():
+            return self.resolve(name, registry_type)
+
+        kind = entry["kind"]
+        if kind == "coroutine":
+            async def lazy(*args, **kwargs):
+                return await resolve()(*args, **kwargs)
+        elif kind == "async_generator":
+            async def lazy(*args, **kwargs):
+                async for item in resolve()(*args, **kwargs):
+                    yield item
+        elif kind == "generator":
+            def lazy(*args, **kwargs):
+                yield from resolve()(*args, **kwargs)
+        else:
+            def lazy(*args, **kwargs):
+                return resolve()(*args, **kwargs)
+        lazy.__name__ = lazy.__qualname__ = entry["function"]
+        lazy.__module__ = module
+        lazy.__doc__ = entry["schema"]["description"] or None
+        lazy.__signature__ = signature = _lazy_signature(entry["parameters"], entry.get("returns"))
+        lazy.__lazy_module__ = module
+
+        self._registry[registry_type][name] = lazy
+        self._registry_info[registry_type][name] = FunctionInfo(
+            name=name,
+            func=lazy,
+            args=[param["name"] for param in entry["parameters"]],
+            docstring=entry["docstring"],
+            return_type=entry["return_type"],
+            module=module,
+            schema=entry["schema"],
+            binder=ToolBinder.from_signature(signature),
+        )
+        Registry.version += 1
+
+    def binder(self, name: str, registry_type: str = "tools") -> ToolBinder:
+        """返回工具的参数绑定器。"""
+        info = self._registry_info[registry_type][name]
+        if info.binder is None:
+            info.binder = ToolBinder.from_signature(inspect.signature(info.func))
+        return info.binder
+
+    def is_lazy(self, name: str, registry_type: str = "tools") -> bool:
+        return hasattr(self._registry[registry_type].get(name), "__lazy_module__")
+
+    def resolve(self, name: str, registry_type: str = "tools") -> Callable:
+        """返回工具的真正函数，必要时导入它所在的模块。"""
+        func = self._registry[registry_type][name]
+        module = getattr(func, "__lazy_module__", None)
+        if module is None:
+            return func
+        with self._import_lock:
+            importlib.import_module(module)
+            func = self._registry[registry_type][name]
+            if getattr(func, "__lazy_module__", None) is not None:
+                raise ImportError(f"{module} did not register {name}")
+        return func
+
     @property
     def tools(self) -> Dict[str, Callable]:
         return self._registry["tools"]
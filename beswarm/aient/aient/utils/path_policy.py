@@ -0,0 +1,69 @@
+import os
+import re
+import fnmatch
+from functools import lru_cache
+
+"""
+沙箱的路径规则匹配器。
+
+规则有两种：包含 * ? [ 的按 glob 匹配（与 fnmatch 相同，* 可以跨越目录分隔符），
+其余按精确路径或目录前缀匹配。原来每次 open() 都要逐条规则调用 fnmatch，
+这里把全部规则编译成一个正则表达式，一次 match 得到结果，并按路径缓存最近的判断。
+
+这个文件的源码会被原样嵌入 scripts.INJECTION_CODE，在注入沙箱的 Python 子进程中执行，
+所以只能依赖标准库，也不能使用相对导入。
+"""
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+def is_glob(pattern: str) -> bool:
+    return _GLOB_CHARS.search(pattern) is not None
+
+def compile_patterns(patterns):
+    """把规则编译成一个正则表达式，没有规则时返回 None。规则应当已经是绝对路径。"""
+    prefixes, globs = [], []
+    for pattern in patterns:
+        pattern = os.path.normcase(pattern)
+        if is_glob(pattern):
+            globs.append(fnmatch.translate(pattern))
+        else:
+            prefixes.append(re.escape(pattern))
+    parts = []
+    if prefixes:
+        # 路径等于规则，或者位于规则表示的目录下
+        parts.append("(?:%s)(?:%s|\\Z)" % ("|".join(prefixes), re.escape(os.sep)))
+    parts.extend(globs)
+    return re.compile("|".join(parts)) if parts else None
+
+class PathPolicy:
+    """
+    一组路径规则。matches(path) 判断 path 是否命中任一规则，相对路径按当前工作目录解析。
+    cache_size: 缓存最近多少个绝对路径的判断结果。
+    """
+    def __init__(self, patterns=(), cache_size: int = 4096):
+        self.patterns = [os.path.abspath(p) for p in patterns]
+        self._regex = compile_patterns(self.patterns)
+        self._match_absolute = lru_cache(maxsize=cache_size)(self._match)
+
+    def __bool__(self):
+        return self._regex is not None
+
+    def _match(self, path: str) -> bool:
+        return self._regex.match(os.path.normcase(os.path.normpath(path))) is not None
+
+    def matches(self, target) -> bool:
+        if self._regex is None:
+            return False
+        try:
+            path = os.fspath(target)
+        except TypeError:
+            # open() 也接受文件描述符，它不是路径
+            return False
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        if not os.path.isabs(path):
+            path = os.path.join(os.getcwd(), path)
+        return self._match_absolute(path)
+
+    def cache_info(self):
+        return self._match_absolute.cache_info()
@@ -86,6 +86,12 @@ system_prompt = (
     # "Search results is provided inside <Search_results></Search_results> XML tags. Your task is to think about my question step by step and then answer my question based on the Search results provided. Please response with a style that is logical, in-depth, and detailed. Note: In order to make the answer appear highly professional, you should be an expert in textual analysis, aiming to make the answer precise and comprehensive. Directly response markdown format, without using markdown code blocks."
 )
 
+compaction_prompt = (
+    "你负责压缩一个 AI 智能体的对话历史。下面 <conversation> 标签中是即将被移出上下文的早期对话，"
+    "可能包含之前的摘要。请用简洁的要点总结：任务目标与约束、已经完成的步骤及其结论、读取或修改过的文件路径、"
+    "关键的数值和报错信息、尚未完成的事项。不要编造对话中没有的信息，不要复述完整的文件内容，直接输出摘要。"
+)
+
 chatgpt_system_prompt = (
     "You are ChatGPT, a large language model trained by OpenAI. Use simple characters to represent mathematical symbols. Do not use LaTeX commands. Respond conversationally"
 )
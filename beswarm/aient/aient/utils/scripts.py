@@ -5,8 +5,10 @@ import fnmatch
 import requests
 import collections
 import urllib.parse
+from typing import Dict, List, Optional, Tuple
 
 from ..core.utils import get_image_message
+from ..core.process_pool import get_process_pool
 
 def find_most_frequent_phrase(s, min_len=4, max_phrase_len=20):
     """
@@ -62,6 +64,84 @@ def find_most_frequent_phrase(s, min_len=4, max_phrase_len=20):
     else:
         return "", 0
 
+# ASCII 单词作为一个 token，其余每个非空白字符（包括每个汉字）单独作为一个 token
+_REPETITION_TOKEN = re.compile(r"[0-9A-Za-z_]+|\S")
+_TRAILING_WORD = re.compile(r"[0-9A-Za-z_]+\Z")
+
+class RepetitionDetector:
+    """
+    在流式输出过程中检测响应结尾的重复循环，每次 feed 只处理新增的片段。
+
+    文本切分为 token 后，检查每个新 token 是否与 period 个 token 之前的 token 相同：
+    相同则重复区域延长，不同则以该 token 上一次出现的位置重新确定周期。每个 token 只做常数次字典和数组操作，
+    不需要像 find_most_frequent_phrase 那样在整个响应上统计所有短语。
+
+    结尾同一段内容连续出现至少 min_repeats 次、且重复区域不少于 min_chars 个字符时，
+    feed 返回 (重复的内容, 次数)，否则返回 None。max_period: 能识别的最长重复单元（token 数）。
+    """
+    def __init__(self, min_repeats: int = 4, min_chars: int = 2000, max_period: int = 512):
+        self.min_repeats = max(2, min_repeats)
+        self.min_chars = min_chars
+        self.window = max_period + 1
+        # 最近 window 个 token 及其起始位置，按 token 序号取模存放
+        self._tokens: List[Optional[str]] = [None] * self.window
+        self._starts = [0] * self.window
+        self._last_seen: Dict[str, int] = {}
+        self._pending = ""
+        self.count = 0
+        self.offset = 0
+        self.period = 0
+        self.run = 0
+        self.region_start = 0
+        self.result: Optional[Tuple[str, int]] = None
+
+    def feed(self, chunk: str) -> Optional[Tuple[str, int]]:
+        if self.result is not None or not chunk:
+            return self.result
+        text = self._pending + chunk
+        # 结尾的单词可能在下一个片段中继续，留到下次处理
+        trailing = _TRAILING_WORD.search(text)
+        end = trailing.start() if trailing else len(text)
+        base = self.offset
+        for match in _REPETITION_TOKEN.finditer(text, 0, end):
+            if self._push(match.group(), base + match.start(), base + match.end()):
+                break
+        self._pending = text[end:]
+        self.offset = base + end
+        return self.result
+
+    def _push(self, token: str, start: int, end: int) -> bool:
+        n, window = self.count, self.window
+        period = self.period
+        if period and self._tokens[(n - period) % window] == token:
+            self.run += 1
+        else:
+            previous = self._last_seen.get(token)
+            if previous is not None and n - previous < window:
+                self.period = period = n - previous
+                self.run = 1
+                self.region_start = self._starts[previous % window]
+            else:
+                self.period = period = 0
+                self.run = 0
+        self._tokens[n % window] = token
+        self._starts[n % window] = start
+        self._last_seen[token] = n
+        self.count = n + 1
+        if len(self._last_seen) > 4 * window:
+            # 只保留窗口内出现过的 token
+            self._last_seen = {t: i for t, i in self._last_seen.items() if n - i < window}
+
+        if period and self.run >= period * (self.min_repeats - 1) and end - self.region_start >= self.min_chars:
+            unit = [self._tokens[i % window] for i in range(n - period + 1, n + 1)]
+            phrase = "".join(
+                (" " + t if i and t[0].isascii() and t[0].isalnum() and unit[i - 1][-1].isascii() and unit[i - 1][-1].isalnum() else t)
+                for i, t in enumerate(unit)
+            )
+            self.result = (phrase, (self.run + period) // period)
+            return True
+        return False
+
 def get_doc_from_url(url):
     filename = urllib.parse.unquote(url.split("/")[-1])
     response = requests.get(url, stream=True)
@@ -95,7 +175,8 @@ async def Document_extract(docurl, docpath=None, engine_type = None):
         docpath = os.getcwd() + "/" + filename
     if filename and filename[-3:] == "pdf":
         from pdfminer.high_level import extract_text
-        text = extract_text(docpath)
+        # 进程池的子进程保留启动时的工作目录，相对路径要在这里解析
+        text = await get_process_pool().run_async(extract_text, os.path.abspath(docpath))
     if filename and (filename[-3:] == "txt" or filename[-3:] == ".md" or filename[-3:] == ".py" or filename[-3:] == "yml"):
         with open(docpath, 'r') as f:
             text = f.read()
@@ -283,8 +364,11 @@ def unescape_html(input_string: str) -> str:
 import sys
 import shlex
 import builtins
+import inspect
 import subprocess
-import fnmatch
+
+from . import path_policy
+from .path_policy import PathPolicy
 
 # --- 沙箱配置 ---
 # 从环境变量 'SANDBOX_READONLY_PATHS' 读取只读路径列表（可以是文件或目录）。
@@ -297,61 +381,41 @@ no_read_paths_str = os.getenv('SANDBOX_NO_READ_PATHS', '')
 NO_READ_PATHS = [p for p in no_read_paths_str.split(':') if p]
 
 # --- 子进程注入代码 (更智能的版本) ---
-INJECTION_CODE = """
+# 子进程与父进程使用同一个路径规则匹配器：path_policy 的源码直接拼接在注入代码前面，
+# 子进程不需要能导入 aient。拿不到源码时（例如打包后的应用）退回到导入它
+try:
+    _PATH_POLICY_SOURCE = inspect.getsource(path_policy)
+except (OSError, TypeError):
+    _PATH_POLICY_SOURCE = f"from {path_policy.__name__} import PathPolicy\n"
+
+INJECTION_CODE = _PATH_POLICY_SOURCE + """
 import builtins
 import os
 import sys
 import runpy
-import fnmatch
 
 # 1. 从环境变量中获取沙箱规则并设置补丁
 # 子进程从和父进程完全相同的环境变量中读取配置
 readonly_paths_str = os.getenv('SANDBOX_READONLY_PATHS', '')
-readonly_paths = [os.path.abspath(p) for p in readonly_paths_str.split(':') if p]
+readonly_paths = [p for p in readonly_paths_str.split(':') if p]
 
 # 优先使用执行命令专用的禁止读取路径
 no_read_paths_str = os.getenv('SANDBOX_EXEC_NO_READ_PATHS', '/**/*beswarm*/**')
+no_read_paths = [p for p in no_read_paths_str.split(':') if p]
 
-no_read_paths = [os.path.abspath(p) for p in no_read_paths_str.split(':') if p]
+readonly_policy = PathPolicy(readonly_paths)
+no_read_policy = PathPolicy(no_read_paths)
 original_open = builtins.open
 
-def _is_path_protected(target_path):
-    abs_target_path = os.path.abspath(target_path)
-    for protected_pattern in readonly_paths:
-        # 检查是否是 glob 模式
-        is_glob = '*' in protected_pattern or '?' in protected_pattern or '[' in protected_pattern
-        if is_glob:
-            if fnmatch.fnmatch(abs_target_path, protected_pattern):
-                return True
-        else:
-            # 兼容旧的精确/目录匹配
-            if abs_target_path == protected_pattern or abs_target_path.startswith(protected_pattern + os.sep):
-                return True
-    return False
-
-def _is_path_no_read(target_path):
-    abs_target_path = os.path.abspath(target_path)
-    for no_read_pattern in no_read_paths:
-        # 检查是否是 glob 模式
-        is_glob = '*' in no_read_pattern or '?' in no_read_pattern or '[' in no_read_pattern
-        if is_glob:
-            if fnmatch.fnmatch(abs_target_path, no_read_pattern):
-                return True
-        else:
-            # 兼容旧的精确/目录匹配
-            if abs_target_path == no_read_pattern or abs_target_path.startswith(no_read_pattern + os.sep):
-                return True
-    return False
-
 def _sandboxed_open(file, mode='r', *args, **kwargs):
     # 检查写保护
     is_write_mode = 'w' in mode or 'a' in mode or 'x' in mode or '+' in mode
-    if is_write_mode and _is_path_protected(file):
+    if is_write_mode and readonly_policy.matches(file):
         raise PermissionError(f"路径 '{file}' 被禁止写入。")
 
     # 检查读保护 (默认模式是 'r')
     is_read_mode = 'r' in mode or '+' in mode
-    if is_read_mode and _is_path_no_read(file):
+    if is_read_mode and no_read_policy.matches(file):
         raise PermissionError(f"路径 '{file}' 被禁止读取。")
 
     return original_open(file, mode, *args, **kwargs)
@@ -408,36 +472,19 @@ class Sandbox:
     def __init__(self, readonly_paths, no_read_paths):
         self._readonly_paths = [os.path.abspath(p) for p in readonly_paths]
         self._no_read_paths = [os.path.abspath(p) for p in no_read_paths]
+        # 规则编译成 PathPolicy，增加规则时重新编译
+        self._readonly_policy = PathPolicy(self._readonly_paths)
+        self._no_read_policy = PathPolicy(self._no_read_paths)
         self._original_open = builtins.open
         self.is_active = bool(self._readonly_paths or self._no_read_paths) # 如果有任一规则，则沙箱激活
 
     def _is_path_protected(self, target_path):
         """检查给定路径是否位于或就是只读路径之一（支持 glob 模式）。"""
-        abs_target_path = os.path.abspath(target_path)
-        for protected_pattern in self._readonly_paths:
-            is_glob = '*' in protected_pattern or '?' in protected_pattern or '[' in protected_pattern
-            if is_glob:
-                if fnmatch.fnmatch(abs_target_path, protected_pattern):
-                    return True
-            else:
-                # 兼容旧的精确/目录匹配
-                if abs_target_path == protected_pattern or abs_target_path.startswith(protected_pattern + os.sep):
-                    return True
-        return False
+        return self._readonly_policy.matches(target_path)
 
     def _is_path_no_read(self, target_path):
         """检查给定路径是否位于或就是禁止读取的路径之一（支持 glob 模式）。"""
-        abs_target_path = os.path.abspath(target_path)
-        for no_read_pattern in self._no_read_paths:
-            is_glob = '*' in no_read_pattern or '?' in no_read_pattern or '[' in no_read_pattern
-            if is_glob:
-                if fnmatch.fnmatch(abs_target_path, no_read_pattern):
-                    return True
-            else:
-                # 兼容旧的精确/目录匹配
-                if abs_target_path == no_read_pattern or abs_target_path.startswith(no_read_pattern + os.sep):
-                    return True
-        return False
+        return self._no_read_policy.matches(target_path)
 
     def _sandboxed_open(self, file, mode='r', *args, **kwargs):
         """我们自己编写的、带安全检查的 open 函数代理"""
@@ -479,6 +526,7 @@ class Sandbox:
         abs_path = os.path.abspath(path)
         if abs_path not in self._readonly_paths:
             self._readonly_paths.append(abs_path)
+            self._readonly_policy = PathPolicy(self._readonly_paths)
             self._update_env_var('SANDBOX_READONLY_PATHS', self._readonly_paths)
             self.is_active = True # 确保沙箱被激活
 
@@ -497,6 +545,7 @@ class Sandbox:
         abs_path = os.path.abspath(path)
         if abs_path not in self._no_read_paths:
             self._no_read_paths.append(abs_path)
+            self._no_read_policy = PathPolicy(self._no_read_paths)
             self._update_env_var('SANDBOX_NO_READ_PATHS', self._no_read_paths)
             self.is_active = True
 
@@ -573,6 +622,8 @@ class XmlMatcher(Generic[R]):
 
         self.index: int = 0
         self.chunks: List[XmlMatcherResult] = []
+        # 等待合并到 chunks[-1] 的文本，_pop 时一次拼接，避免反复复制越来越长的 data
+        self.tail: List[str] = []
         self.cached: List[str] = []
         self.matched: bool = False
         self.state: str = "TEXT"  # "TEXT", "TAG_OPEN", "TAG_CLOSE"
@@ -591,16 +642,23 @@ class XmlMatcher(Generic[R]):
         current_matched_state = self.matched if self.state == "TEXT" else (self.depth > 0) # 在标签解析过程中，匹配状态取决于深度
 
         if last and last.matched == current_matched_state:
-            last.data += data
+            self.tail.append(data)
         else:
             # 只有当 data 不为空时才添加新的 chunk
             if data:
+                 self._flush_tail()
                  self.chunks.append(XmlMatcherResult(data=data, matched=current_matched_state))
 
         self.cached = []
 
+    def _flush_tail(self):
+        if self.tail:
+            self.chunks[-1].data += "".join(self.tail)
+            self.tail = []
+
     def _pop(self) -> List[Union[XmlMatcherResult, R]]:
         """返回处理过的 chunks 并清空列表"""
+        self._flush_tail()
         chunks_to_return = self.chunks
         self.chunks = []
         if not self.transform:
@@ -610,142 +668,112 @@ class XmlMatcher(Generic[R]):
         # 应用 transform 函数
         return [self.transform(chunk) for chunk in chunks_to_return]
 
+    def _next_tag(self, chunk: str, start: int, base: int) -> int:
+        """返回 chunk 中从 start 开始、可以开始一个标签的 '<' 的下标。position 之前的 '<' 在未匹配时视为普通文本。"""
+        if not self.matched and base + start < self.position:
+            start = self.position - base
+            if start >= len(chunk):
+                return -1
+        return chunk.find("<", start)
+
     def _update(self, chunk: str):
-        """处理输入字符串块的核心逻辑"""
-        for char in chunk:
-            current_char_processed = False # 标记当前字符是否已被状态机逻辑处理
+        """
+        处理输入字符串块的核心逻辑。
 
+        普通文本按片段整体跳过，直接定位到下一个 '<'；标签名已匹配、等待 '>' 时也直接跳到 '>'。
+        只有标签开头的几个字符逐个经过状态机，整体与输入长度成线性关系。
+        """
+        base = self.pointer
+        length = len(chunk)
+        tag_name_len = len(self.tag_name)
+        i = 0
+        while i < length:
             if self.state == "TEXT":
-                if char == "<" and (self.pointer >= self.position or self.matched):
-                    self._collect()
-                    self.state = "TAG_OPEN"
-                    self.cached.append(char)
-                    self.index = 0 # 重置 index 以开始匹配标签名或跳过空格
-                    current_char_processed = True
-                # else: 保持在 TEXT 状态，字符将在循环末尾添加到 cached
-
-            elif self.state == "TAG_OPEN":
-                self.cached.append(char)
-                current_char_processed = True
-
-                tag_name_len = len(self.tag_name)
-
-                # 状态: 刚进入 < 之后
-                if self.index == 0:
-                    if char == "/":
-                        self.state = "TAG_CLOSE"
-                        # index 保持 0，准备匹配闭合标签名或跳过空格
-                    elif char.isspace():
-                        # 跳过 < 后的空格
-                        pass # index 保持 0
-                    elif char == self.tag_name[0]:
-                        # 开始匹配标签名
-                        self.index = 1
-                    else:
-                        # 无效标签开头 (不是 /，不是空格，不是 tag_name[0])
-                        self.state = "TEXT"
-                        current_char_processed = True
-                # 状态: 正在匹配标签名
-                elif self.index < tag_name_len:
-                    if self.tag_name[self.index] == char:
-                        self.index += 1
-                    # 允许在标签名匹配过程中遇到空格，视为属性或无效字符处理
-                    elif char.isspace():
-                         # 遇到空格，表示标签名已结束，进入属性/结束符处理
-                         # 将 index 设置为 tag_name_len 以便后续逻辑处理
-                         # 但前提是当前 index 确实匹配到了 tag_name
-                         # 如果是 <t hink> 这种情况，这里会失败
-                         # 为了简化，我们不允许标签名内部有空格，如果需要，逻辑会更复杂
-                         # 因此，如果这里遇到空格但 index < tag_name_len，视为无效
-                         self.state = "TEXT"
-                         current_char_processed = True
-                    else:
-                        # 字符不匹配标签名
-                        self.state = "TEXT"
-                        current_char_processed = True
-                # 状态: 标签名已完全匹配 (self.index == tag_name_len)
-                else: # self.index >= tag_name_len (实际是 ==)
-                    if char == ">":
-                        # 找到了开始标签的结束符
-                        self.state = "TEXT"
-                        self.depth += 1
-                        self.matched = True
-                        self.cached = [] # 清空缓存，丢弃 <tag ...>
-                    elif char.isspace():
-                        # 忽略标签名后的空格
-                        pass # 保持在 TAG_OPEN 状态，等待 > 或属性
-                    else:
-                        # 字符是属性的一部分，忽略它，继续等待 '>'
-                        pass # 保持在 TAG_OPEN 状态
-
-            elif self.state == "TAG_CLOSE":
-                self.cached.append(char)
-                current_char_processed = True # 默认设为 True
-
-                tag_name_len = len(self.tag_name)
-
-                # 状态: 刚进入 </ 之后
-                if self.index == 0:
-                    if char.isspace():
-                        # 跳过 </ 后的空格
-                        pass # index 保持 0
-                    elif char == self.tag_name[0]:
-                        # 开始匹配标签名
-                        self.index = 1
-                    else:
-                        # 无效闭合标签 (不是空格，不是 tag_name[0])
-                        self.state = "TEXT"
-                        current_char_processed = True
-                # 状态: 正在匹配标签名
-                elif self.index < tag_name_len:
-                    if self.tag_name[self.index] == char:
-                        self.index += 1
-                    else:
-                        # 字符不匹配标签名
-                        self.state = "TEXT"
-                        current_char_processed = True
-                # 状态: 标签名已完全匹配 (self.index == tag_name_len)
-                else: # self.index == tag_name_len
-                    if char == ">":
-                        # 找到了 '>'
-                        was_inside_tag = self.depth > 0
-                        self.state = "TEXT" # 无论如何都回到 TEXT 状态
-
-                        if was_inside_tag:
-                            # 确实在标签内部，正常处理闭合标签
-                            self.depth -= 1
-                            self.matched = self.depth > 0
-                            self.cached = [] # 清空缓存，丢弃 </tag>
-                            # current_char_processed 保持 True
-                        else:
-                            # 不在标签内部，这是一个无效/意外的闭合标签
-                            # 将其视为普通文本，但阻止最后的 > 被添加到缓存
-                            # 保留 cached 中已有的 '</tag' 部分，它们将在下次 collect 时作为文本处理
-                            current_char_processed = True # 标记 '>' 已处理，防止循环末尾再次添加
-
-                    elif char.isspace():
-                        # 允许 </tag >, 继续等待 '>'
-                        pass # 保持在 TAG_CLOSE 状态, current_char_processed 保持 True
-                    else:
-                        # 闭合标签名后出现非空格、非 > 的字符
-                        self.state = "TEXT"
-                        current_char_processed = True
-
-            # 如果当前字符未被状态机逻辑处理（即应视为普通文本）
-            if not current_char_processed:
-                # 确保状态是 TEXT
-                if self.state != "TEXT":
-                     # 如果之前在尝试匹配标签但失败了，缓存的内容应视为文本
-                     self.state = "TEXT"
-
-                self.cached.append(char)
-
-            self.pointer += 1
+                tag_start = self._next_tag(chunk, i, base)
+                if tag_start == -1:
+                    self.cached.append(chunk[i:])
+                    break
+                if tag_start > i:
+                    self.cached.append(chunk[i:tag_start])
+                self._collect()
+                self.state = "TAG_OPEN"
+                self.cached.append("<")
+                self.index = 0 # 重置 index 以开始匹配标签名或跳过空格
+                i = tag_start + 1
+            elif self.state == "TAG_OPEN" and self.index >= tag_name_len:
+                # 标签名已完全匹配，之后的空格和属性都被忽略，直到 '>'
+                tag_end = chunk.find(">", i)
+                if tag_end == -1:
+                    self.cached.append(chunk[i:])
+                    break
+                self.state = "TEXT"
+                self.depth += 1
+                self.matched = True
+                self.cached = [] # 清空缓存，丢弃 <tag ...>
+                i = tag_end + 1
+            else:
+                self._step(chunk[i])
+                i += 1
+        self.pointer = base + length
 
         # 在处理完整个 chunk 后，如果状态是 TEXT，收集剩余缓存
         if self.state == "TEXT":
              self._collect()
 
+    def _step(self, char: str):
+        """在 TAG_OPEN / TAG_CLOSE 状态下处理一个字符，字符总是先进入缓存；匹配失败时回到 TEXT，已缓存的部分作为文本。"""
+        self.cached.append(char)
+        tag_name_len = len(self.tag_name)
+
+        if self.state == "TAG_OPEN":
+            # 状态: 刚进入 < 之后
+            if self.index == 0:
+                if char == "/":
+                    self.state = "TAG_CLOSE"
+                elif char.isspace():
+                    # 跳过 < 后的空格
+                    pass
+                elif char == self.tag_name[0]:
+                    self.index = 1
+                else:
+                    # 无效标签开头 (不是 /，不是空格，不是 tag_name[0])
+                    self.state = "TEXT"
+            # 状态: 正在匹配标签名，不允许标签名内部有空格
+            elif self.tag_name[self.index] == char:
+                self.index += 1
+            else:
+                self.state = "TEXT"
+
+        elif self.state == "TAG_CLOSE":
+            # 状态: 刚进入 </ 之后
+            if self.index == 0:
+                if char.isspace():
+                    pass
+                elif char == self.tag_name[0]:
+                    self.index = 1
+                else:
+                    self.state = "TEXT"
+            # 状态: 正在匹配标签名
+            elif self.index < tag_name_len:
+                if self.tag_name[self.index] == char:
+                    self.index += 1
+                else:
+                    self.state = "TEXT"
+            # 状态: 标签名已完全匹配
+            elif char == ">":
+                self.state = "TEXT" # 无论如何都回到 TEXT 状态
+                if self.depth > 0:
+                    # 确实在标签内部，正常处理闭合标签
+                    self.depth -= 1
+                    self.matched = self.depth > 0
+                    self.cached = [] # 清空缓存，丢弃 </tag>
+                # 不在标签内部时是一个意外的闭合标签，'</tag>' 保留在缓存中作为文本
+            elif char.isspace():
+                # 允许 </tag >, 继续等待 '>'
+                pass
+            else:
+                # 闭合标签名后出现非空格、非 > 的字符
+                self.state = "TEXT"
 
     def final(self, chunk: Optional[str] = None) -> List[Union[XmlMatcherResult, R]]:
         """处理最后一块数据并返回所有结果"""
@@ -761,148 +789,264 @@ class XmlMatcher(Generic[R]):
         self._update(chunk)
         return self._pop()
 
-def parse_function_xml(xml_content: str, check_line_start: bool = True) -> List[Dict[str, Any]]:
+# 行首（前面只有空白）的 '<'
+_LINE_START_TAG = re.compile(r"^[^\S\n]*(<)", re.MULTILINE)
+# 包裹函数调用的辅助标签，在其内部寻找函数调用
+_WRAPPER_TAGS = ("tool_call", "function_call", "tool", "function", "tools")
+
+class _CloseTagFinder:
     """
-    解析XML格式的函数调用信息，转换为字典数组格式
-    只解析倒数两层XML标签，忽略更高层级的XML标签
-    当 check_line_start 为 True 时，只解析行首的XML标签。
+    在 [start, end) 范围内查找闭合标签，记住每个标签名最近一次的查找结果。
+    未闭合的标签（例如正文中的 <br>）第一次查找失败后不再重复扫描到文本末尾。
+    """
+    __slots__ = ("text", "end", "found")
+
+    def __init__(self, text: str, end: int):
+        self.text = text
+        self.end = end
+        # 闭合标签 -> (查找起点, 结果)
+        self.found: Dict[str, Tuple[int, int]] = {}
+
+    def find(self, close_tag: str, start: int) -> int:
+        cached = self.found.get(close_tag)
+        if cached is not None and start >= cached[0] and (cached[1] == -1 or cached[1] >= start):
+            return cached[1]
+        pos = self.text.find(close_tag, start, self.end)
+        self.found[close_tag] = (start, pos)
+        return pos
+
+def _tag_name(text: str, start: int, end: int) -> str:
+    tag_content = text[start:end].strip()
+    # 处理可能有属性的情况
+    return tag_content.split()[0] if " " in tag_content else tag_content
+
+def _parse_parameters(text: str, start: int, end: int) -> Dict[str, str]:
+    """解析 text[start:end] 中的参数标签，不复制函数体。"""
+    parameters = {}
+    finder = _CloseTagFinder(text, end)
+    position = start
+    while position < end:
+        tag_start = text.find("<", position, end)
+        if tag_start == -1:
+            break
 
-    参数:
-        xml_content: 包含一个或多个函数调用的XML字符串
-        check_line_start: 布尔值，指示是否只解析行首的XML标签
+        # 跳过闭合标签
+        if tag_start + 1 < end and text[tag_start + 1] == '/':
+            position = tag_start + 1
+            continue
 
-    返回:
-        包含所有函数调用信息的字典数组，每个字典包含函数名和参数
-    """
-    result_functions = []
+        tag_end = text.find(">", tag_start, end)
+        if tag_end == -1:
+            break
 
-    # 第一步：识别XML中的顶层标签（可能是函数调用）
-    position = 0
-    while position < len(xml_content):
-        # 寻找下一个开始标签
-        tag_start = xml_content.find("<", position)
-        if tag_start == -1:
-            break  # 没有找到更多的标签
+        param_name = text[tag_start + 1:tag_end].strip()
+        if " " in param_name:  # 处理有属性的情况
+            param_name = param_name.split()[0]
+        if not param_name:
+            position = tag_end + 1
+            continue
+
+        param_end_tag = f"</{param_name}>"
+        param_end_pos = finder.find(param_end_tag, tag_end)
+        if param_end_pos == -1:
+            # 参数标签未闭合
+            position = tag_end + 1
+            continue
 
-        # 新增：如果 check_line_start 为 True，检查标签是否在行首
-        # 如果 '<' 不在行首 (即 tag_start > 0 且其前一个字符不是换行符)，
-        # 则将其视为普通文本的一部分，移动 position 并继续搜索
+        parameters[param_name] = text[tag_end + 1:param_end_pos].strip()
+        position = param_end_pos + len(param_end_tag)
+    return parameters
+
+def _parse_function_xml(text: str, start: int, end: int, check_line_start: bool, result_functions: List[Dict[str, Any]]):
+    finder = _CloseTagFinder(text, end)
+    position = start
+    while position < end:
+        # 寻找下一个开始标签；check_line_start 时只考虑行首的标签，其余的 '<' 是普通文本
         if check_line_start:
-            # 检查标签是否在行首，或者行首到标签之间只有空格
-            is_start_of_line_or_only_spaces_before = True
-            if tag_start > 0:
-                # 从 tag_start - 1 向前检查，直到行首或遇到非空格字符
-                check_pos = tag_start - 1
-                while check_pos >= 0 and xml_content[check_pos] != '\n':
-                    if not xml_content[check_pos].isspace():
-                        is_start_of_line_or_only_spaces_before = False
-                        break
-                    check_pos -= 1
-
-            if not is_start_of_line_or_only_spaces_before:
-                position = tag_start + 1  # 从 '<' 之后继续搜索
-                continue
+            match = _LINE_START_TAG.search(text, position, end)
+            if match is None:
+                break
+            tag_start = match.start(1)
+        else:
+            tag_start = text.find("<", position, end)
+            if tag_start == -1:
+                break
 
         # 检查是否是XML标签的开始（不是闭合标签）
-        if tag_start + 1 < len(xml_content) and xml_content[tag_start + 1] == '/':
-            # 这是一个结束标签，跳过
+        if tag_start + 1 < end and text[tag_start + 1] == '/':
             position = tag_start + 1
             continue
 
-        # 找到标签的结束位置
-        tag_end = xml_content.find(">", tag_start)
+        tag_end = text.find(">", tag_start, end)
         if tag_end == -1:
             break  # 标签未正确关闭
 
-        # 提取标签名
-        tag_content = xml_content[tag_start+1:tag_end].strip()
-        # 处理可能有属性的情况
-        tag_name = tag_content.split()[0] if " " in tag_content else tag_content
-
+        tag_name = _tag_name(text, tag_start + 1, tag_end)
         if not tag_name:
             position = tag_end + 1
             continue  # 空标签名，跳过
 
-        # 查找整个标签的起止范围
+        # 标签名前有空白时（如 "< name>"）开始标签不在 tag_start，向后查找
         full_start_tag = f"<{tag_name}"
-        full_end_tag = f"</{tag_name}>"
-
-        # 从当前位置找到开始标签
-        start_pos = xml_content.find(full_start_tag, position)
+        start_pos = tag_start if text.startswith(full_start_tag, tag_start) else text.find(full_start_tag, tag_start + 1, end)
         if start_pos == -1:
             position = tag_end + 1
             continue
 
         # 找到对应的结束标签
-        end_pos = xml_content.find(full_end_tag, start_pos)
+        full_end_tag = f"</{tag_name}>"
+        end_pos = finder.find(full_end_tag, start_pos)
         if end_pos == -1:
             # 没有找到结束标签，可能是未闭合标签
             position = tag_end + 1
             continue
 
-        # 标签的内容（不包括开始和结束标签）
-        tag_inner_content = xml_content[tag_end+1:end_pos]
-
-        # 如果是普通辅助标签（如tool_call），则在其内部寻找函数调用
-        if tag_name in ["tool_call", "function_call", "tool", "function", "tools"]:
+        if tag_name in _WRAPPER_TAGS:
             # 递归处理内部内容，此时不再检查行首条件
-            nested_functions = parse_function_xml(tag_inner_content, check_line_start=False)
-            result_functions.extend(nested_functions)
+            _parse_function_xml(text, tag_end + 1, end_pos, False, result_functions)
         else:
             # 将当前标签作为函数名，解析其内部标签作为参数
-            parameters = {}
-
-            # 解析内部标签作为参数
-            param_position = 0
-            while param_position < len(tag_inner_content):
-                param_tag_start = tag_inner_content.find("<", param_position)
-                if param_tag_start == -1:
-                    break
-
-                # 跳过闭合标签
-                if param_tag_start + 1 < len(tag_inner_content) and tag_inner_content[param_tag_start + 1] == '/':
-                    param_position = param_tag_start + 1
-                    continue
+            result_functions.append({
+                'function_name': tag_name,
+                'parameter': _parse_parameters(text, tag_end + 1, end_pos)
+            })
 
-                param_tag_end = tag_inner_content.find(">", param_tag_start)
-                if param_tag_end == -1:
-                    break
+        position = end_pos + len(full_end_tag)
 
-                # 提取参数名
-                param_name = tag_inner_content[param_tag_start+1:param_tag_end].strip()
-                if " " in param_name:  # 处理有属性的情况
-                    param_name = param_name.split()[0]
+def parse_function_xml(xml_content: str, check_line_start: bool = True) -> List[Dict[str, Any]]:
+    """
+    解析XML格式的函数调用信息，转换为字典数组格式
+    只解析倒数两层XML标签，忽略更高层级的XML标签
+    当 check_line_start 为 True 时，只解析行首的XML标签。
 
-                if not param_name:
-                    param_position = param_tag_end + 1
-                    continue
+    整个响应只扫描一遍：嵌套的辅助标签和参数按下标范围解析，不复制子串；
+    每个闭合标签的查找结果会被记住，大量未闭合的标签不会让解析退化为平方复杂度。
 
-                # 查找参数标签的结束位置
-                param_end_tag = f"</{param_name}>"
-                param_end_pos = tag_inner_content.find(param_end_tag, param_tag_end)
+    参数:
+        xml_content: 包含一个或多个函数调用的XML字符串
+        check_line_start: 布尔值，指示是否只解析行首的XML标签
 
-                if param_end_pos == -1:
-                    # 参数标签未闭合
-                    param_position = param_tag_end + 1
-                    continue
+    返回:
+        包含所有函数调用信息的字典数组，每个字典包含函数名和参数
+    """
+    result_functions = []
+    _parse_function_xml(xml_content, 0, len(xml_content), check_line_start, result_functions)
+    return result_functions
 
-                # 提取参数值
-                param_value = tag_inner_content[param_tag_end+1:param_end_pos].strip()
-                parameters[param_name] = param_value
+class StreamingToolCallParser:
+    """
+    增量解析流式响应中的 XML 工具调用。
 
-                # 更新位置到当前参数标签之后
-                param_position = param_end_pos + len(param_end_tag)
+    每次 feed 一个响应片段，返回在该片段中刚刚闭合的工具调用，格式与 parse_function_xml 相同。
+    只识别位于行首、且标签名属于 tool_names 的顶层标签，闭合检测复用 XmlMatcher 的深度跟踪。
 
-            # 添加解析结果
-            result_functions.append({
-                'function_name': tag_name,
-                'parameter': parameters
-            })
+    工具调用之外只保留当前行的文本；工具调用内部的片段先放进列表，闭合时拼接一次再解析，
+    大段的 write_to_file 内容不会被反复复制。
+    """
+    def __init__(self, tool_names):
+        self.tool_names = set(tool_names)
+        self.max_name_len = max(map(len, self.tool_names), default=0)
+        # 尚未进入工具调用的文本，从当前行开始保留
+        self.buffer = ""
+        self.scan_pos = 0
+        # buffer 开头之前、同一行上是否已有非空白字符
+        self.line_dirty = False
+        self.matcher: Optional[XmlMatcher] = None
+        self.matcher_opened = False
+        self.call_parts: List[str] = []
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        completed = []
+        while chunk:
+            if self.matcher is None:
+                self.buffer += chunk
+                chunk = ""
+                if not self._find_call_start():
+                    self._trim()
+                    break
+                # 工具调用从 call_start 开始，之前的文本不再需要
+                chunk = self.buffer[self.call_start:]
+                self.buffer = ""
+                self.scan_pos = 0
+            chunk, tool_calls = self._advance_matcher(chunk)
+            if tool_calls is not None:
+                completed.extend(tool_calls)
+        return completed
+
+    def _at_line_start(self, tag_start: int) -> bool:
+        line_start = self.buffer.rfind("\n", 0, tag_start)
+        if line_start == -1 and self.line_dirty:
+            return False
+        return self.buffer[line_start + 1:tag_start].strip() == ""
+
+    def _cannot_be_tool(self, tag_start: int) -> bool:
+        """'>' 还没有到达时，根据已到达的标签名判断它是否已经不可能是工具标签。"""
+        partial = self.buffer[tag_start + 1:tag_start + 2 + self.max_name_len].lstrip()
+        if not partial:
+            return False
+        name = partial.split()[0]
+        if name != partial.rstrip() or partial[-1].isspace():
+            # 标签名已经完整
+            return name not in self.tool_names
+        return len(name) > self.max_name_len or not any(tool.startswith(name) for tool in self.tool_names)
+
+    def _find_call_start(self) -> bool:
+        """从 scan_pos 开始寻找下一个位于行首的工具标签，找到后创建对应的 XmlMatcher。"""
+        while True:
+            tag_start = self.buffer.find("<", self.scan_pos)
+            if tag_start == -1:
+                self.scan_pos = len(self.buffer)
+                return False
+            tag_end = self.buffer.find(">", tag_start)
+            if tag_end == -1:
+                if self._at_line_start(tag_start) and not self._cannot_be_tool(tag_start):
+                    # 标签名还没有完整到达，等待下一个片段
+                    self.scan_pos = tag_start
+                    return False
+                self.scan_pos = tag_start + 1
+                continue
+            tag_content = self.buffer[tag_start + 1:tag_end].strip()
+            tag_name = tag_content.split()[0] if tag_content else ""
+            if tag_name in self.tool_names and self._at_line_start(tag_start):
+                self.call_start = tag_start
+                self.matcher = XmlMatcher(tag_name)
+                self.matcher_opened = False
+                return True
+            self.scan_pos = tag_start + 1
 
-        # 更新位置到当前标签之后
-        position = end_pos + len(full_end_tag)
+    def _trim(self):
+        """丢弃 scan_pos 之前已经检查过的文本，只记住当前行上是否出现过非空白字符。"""
+        if not self.scan_pos:
+            return
+        newline = self.buffer.rfind("\n", 0, self.scan_pos)
+        dirty = self.line_dirty if newline == -1 else False
+        self.line_dirty = dirty or self.buffer[newline + 1:self.scan_pos].strip() != ""
+        self.buffer = self.buffer[self.scan_pos:]
+        self.scan_pos = 0
 
-    return result_functions
+    def _advance_matcher(self, text: str):
+        """
+        继续向 XmlMatcher 输入数据。标签只可能在 '>' 处闭合，因此按 '>' 分段输入。
+        返回 (闭合之后剩余的文本, 解析出的工具调用)，尚未闭合时工具调用为 None。
+        """
+        pos = 0
+        while pos < len(text):
+            piece_end = text.find(">", pos)
+            piece_end = len(text) if piece_end == -1 else piece_end + 1
+            self.matcher.update(text[pos:piece_end])
+            pos = piece_end
+            if self.matcher.depth > 0:
+                self.matcher_opened = True
+            elif self.matcher_opened:
+                self.call_parts.append(text[:piece_end])
+                segment = "".join(self.call_parts)
+                self.call_parts = []
+                self.matcher = None
+                # 剩余文本所在的行以闭合标签开头
+                self.line_dirty = True
+                return text[piece_end:], parse_function_xml(segment)
+        self.call_parts.append(text)
+        return "", None
 
 def parse_continuous_json(json_str: str, function_name: str = "") -> List[Dict[str, Any]]:
     """
@@ -932,47 +1076,37 @@ def parse_continuous_json(json_str: str, function_name: str = "") -> List[Dict[s
         # 如果不是单个JSON，尝试解析为连续JSON
         pass
 
+    # 依次从每个 '{' 开始用 raw_decode 解码一个完整的对象；解码失败时按括号配对跳过这一段
+    decoder = json.JSONDecoder()
     result = []
-    idx = 0
-    length = len(json_str)
-
-    while idx < length:
-        # 找到JSON对象的开始
-        if json_str[idx] != '{':
-            idx += 1
-            continue
+    idx = json_str.find('{')
+    while idx != -1:
+        try:
+            json_obj, idx = decoder.raw_decode(json_str, idx)
+        except json.JSONDecodeError:
+            idx = _skip_braces(json_str, idx)
+        else:
+            # 构造函数调用信息
+            tool_id = function_name + "_" + str(len(result)) if function_name else "tool_" + str(len(result))
+            result.append({
+                'function_name': function_name or "default_function",
+                'parameter': json_obj,
+                'function_call_id': tool_id
+            })
+        idx = json_str.find('{', idx)
 
-        # 跟踪括号的平衡
-        balance = 1
-        start = idx
-        idx += 1
+    return result
 
-        # 寻找匹配的右括号
-        while idx < length and balance > 0:
-            if json_str[idx] == '{':
-                balance += 1
-            elif json_str[idx] == '}':
-                balance -= 1
-            idx += 1
+_BRACES = re.compile(r"[{}]")
 
+def _skip_braces(text: str, start: int) -> int:
+    """返回从 start 处的 '{' 开始、括号配平之后的位置；无法配平时返回文本长度。"""
+    balance = 0
+    for match in _BRACES.finditer(text, start):
+        balance += 1 if match.group() == '{' else -1
         if balance == 0:
-            # 提取出一个完整的JSON对象
-            json_obj_str = json_str[start:idx]
-            try:
-                # 解析JSON对象
-                json_obj = json.loads(json_obj_str)
-                # 构造函数调用信息
-                tool_id = function_name + "_" + str(len(result)) if function_name else "tool_" + str(len(result))
-                result.append({
-                    'function_name': function_name or "default_function",
-                    'parameter': json_obj,
-                    'function_call_id': tool_id
-                })
-            except json.JSONDecodeError:
-                # 忽略解析错误
-                pass
-
-    return result
+            return match.end()
+    return len(text)
 
 def convert_functions_to_xml(functions_list):
     """
@@ -4,7 +4,7 @@ from datetime import datetime
 from typing import Optional, Union, Callable
 
 from .aient.aient.architext.architext import (
-   Messages, SystemMessage, UserMessage, AssistantMessage, ToolCalls, ToolResults, Texts, RoleMessage, Images, Files, Tools
+   Messages, SystemMessage, UserMessage, AssistantMessage, ToolCalls, ToolResults, Texts, RoleMessage, Images, Files, Tools, CacheBreakpoint
 )
 from .core import kgm, render_system_prompt_extensions
 
@@ -63,14 +63,6 @@ When making code changes, NEVER output code to the USER, unless requested. Inste
 2. If an external API requires an API Key, be sure to point this out to the USER. Adhere to best security practices (e.g. DO NOT hardcode an API key in a place where it can be exposed)
 </calling_external_apis>
 
-<user_info>
-The user's OS version is {Texts(lambda: platform.platform())}. The absolute path of the user's workspace is {Texts(name="workspace_path")} which is also the project root directory. The user's shell is {Texts(lambda: os.getenv('SHELL', 'Unknown'))}.
-请在指令中使用绝对路径。所有操作必须基于工作目录。禁止在工作目录之外进行任何操作。你当前运行目录不一定就是工作目录。禁止默认你当前就在工作目录。
-
-当前时间：{Texts(lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))}
-当前目录：{Texts(lambda: os.getcwd())}
-</user_info>
-
 <instructions for tool use>
 Answer the user's request using the relevant tool(s), if they are available. Check that all the required parameters for each tool call are provided or can reasonably be inferred from context. If the user provides a specific value for a parameter (for example provided in quotes), make sure to use that value EXACTLY. DO NOT make up values for or ask about optional parameters. Carefully analyze descriptive terms in the request as they may indicate required parameter values that should be included even if not explicitly quoted. 如果你不清楚工具的参数，请直接问user。请勿自己编造参数。
 
@@ -124,6 +116,14 @@ Always adhere to this format for all tool uses to ensure proper parsing and exec
 You can use tools as follows:
 
 {Tools()}
+{CacheBreakpoint()}
+<user_info>
+The user's OS version is {Texts(lambda: platform.platform())}. The absolute path of the user's workspace is {Texts(name="workspace_path")} which is also the project root directory. The user's shell is {Texts(lambda: os.getenv('SHELL', 'Unknown'))}.
+请在指令中使用绝对路径。所有操作必须基于工作目录。禁止在工作目录之外进行任何操作。你当前运行目录不一定就是工作目录。禁止默认你当前就在工作目录。
+
+当前时间：{Texts(lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))}
+当前目录：{Texts(lambda: os.getcwd())}
+</user_info>
 
 {Files()}
 
@@ -145,9 +145,6 @@ instruction_system_prompt = SystemMessage(f"""
 你的工作目录为：{Texts(name="workspace_path")}，请在指令中使用绝对路径。所有操作必须基于工作目录。
 除了任务目标里面明确提到的目录，禁止在工作目录之外进行任何操作。你当前运行目录不一定就是工作目录。禁止默认你当前就在工作目录。
 
-当前时间：{Texts(lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))}
-当前目录：{Texts(lambda: os.getcwd())}
-
 你的输出必须符合以下步骤，以生成最终指令：
 
 1. **回顾与分析 (Review & Analyze):**
@@ -249,6 +246,9 @@ git clone https://github.com/username/project-name.git
 
 工作智能体仅可以使用如下工具：
 {Tools()}
+{CacheBreakpoint(relocate=False)}
+当前时间：{Texts(lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))}
+当前目录：{Texts(lambda: os.getcwd())}
 
 {KnowledgeGraph(name="knowledge_graph", text=lambda: kgm.render_tree(), visible=False)}
 
@@ -61,6 +61,10 @@ else:
         read_image,
         register_tool,
         excute_command,
+        start_command,
+        poll_command,
+        read_command_output,
+        kill_command,
         generate_image,
         list_directory,
         get_url_content,
@@ -88,6 +92,10 @@ else:
         "register_tool",
         "task_complete",
         "excute_command",
+        "start_command",
+        "poll_command",
+        "read_command_output",
+        "kill_command",
         "generate_image",
         "list_directory",
         "get_task_result",
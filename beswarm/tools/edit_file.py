@@ -2,8 +2,76 @@ import os
 import re
 import difflib
 from ..aient.aient.plugins import register_tool
+from ..aient.aient.core.process_pool import get_process_pool
 from ..aient.aient.utils.scripts import unescape_html
 
+# 逐行 difflib 比较的次数超过该值时，把候选位置分块交给进程池计算
+FUZZY_MATCH_POOL_THRESHOLD = 20000
+
+def _score_positions(search_lines, content_lines, start, stop, match_precision, offset=0):
+    """在 [start, stop) 中寻找与搜索块最相似的起始行，返回 (下标 + offset, 分数)。"""
+    best_match_index = -1
+    best_match_score = 0
+
+    for i in range(start, stop):
+        # 计算当前位置的匹配分数
+        match_score = 0
+        lines_compared = 0
+
+        for j in range(len(search_lines)):
+            search_line = search_lines[j]
+            content_line = content_lines[i + j]
+
+            # 使用 difflib 计算行相似度，该算法对插入和删除更具鲁棒性
+            line_match = difflib.SequenceMatcher(None, search_line, content_line).ratio()
+            match_score += line_match
+            lines_compared += 1
+
+        # 计算整体匹配分数
+        match_score = match_score / lines_compared
+
+        # 如果使用高精度匹配 (>0.95)，我们需要更严格地检查匹配结果
+        if match_precision > 0.95:
+            # 字符串长度差异也要考虑
+            search_text = '\n'.join(search_lines)
+            potential_match_text = '\n'.join(content_lines[i:i + len(search_lines)])
+            length_diff_ratio = abs(len(search_text) - len(potential_match_text)) / max(len(search_text), 1)
+
+            # 如果长度差异太大，降低匹配分数
+            if length_diff_ratio > 0.1:  # 允许10%的长度差异
+                match_score *= (1 - length_diff_ratio)
+
+        if match_score > best_match_score:
+            best_match_score = match_score
+            best_match_index = i
+
+    return (best_match_index + offset if best_match_index >= 0 else -1), best_match_score
+
+def find_best_match(search_lines, content_lines, match_precision):
+    """
+    模糊匹配搜索块。difflib 是纯 Python 计算，大文件时按候选位置分块在进程池中并行执行，
+    分数相同时取最靠前的位置，结果与顺序扫描一致。
+    """
+    positions = max(0, len(content_lines) - len(search_lines) + 1)
+    pool = get_process_pool()
+    if positions * len(search_lines) < FUZZY_MATCH_POOL_THRESHOLD or not pool.available:
+        return _score_positions(search_lines, content_lines, 0, positions, match_precision)
+
+    step = -(-positions // (pool.max_workers * 2))
+    futures = []
+    for start in range(0, positions, step):
+        stop = min(positions, start + step)
+        # 只发送这一块需要的行
+        window = content_lines[start:stop + len(search_lines) - 1]
+        futures.append(pool.submit(_score_positions, search_lines, window, 0, stop - start, match_precision, start))
+
+    best_match_index, best_match_score = -1, 0
+    for future in futures:
+        index, score = future.result()
+        if score > best_match_score:
+            best_match_index, best_match_score = index, score
+    return best_match_index, best_match_score
+
 @register_tool()
 def edit_file(file_path, diff_content, match_precision=0.9):
     """
@@ -91,40 +159,7 @@ def edit_file(file_path, diff_content, match_precision=0.9):
                     return f"<tool_error>搜索块不能为空</tool_error>"
 
                 # 尝试找到最佳匹配位置
-                best_match_index = -1
-                best_match_score = 0
-
-                for i in range(len(content_lines) - len(search_lines) + 1):
-                    # 计算当前位置的匹配分数
-                    match_score = 0
-                    lines_compared = 0
-
-                    for j in range(len(search_lines)):
-                        search_line = search_lines[j]
-                        content_line = content_lines[i + j]
-
-                        # 使用 difflib 计算行相似度，该算法对插入和删除更具鲁棒性
-                        line_match = difflib.SequenceMatcher(None, search_line, content_line).ratio()
-                        match_score += line_match
-                        lines_compared += 1
-
-                    # 计算整体匹配分数
-                    match_score = match_score / lines_compared
-
-                    # 如果使用高精度匹配 (>0.95)，我们需要更严格地检查匹配结果
-                    if match_precision > 0.95:
-                        # 字符串长度差异也要考虑
-                        search_text = '\n'.join(search_lines)
-                        potential_match_text = '\n'.join(content_lines[i:i + len(search_lines)])
-                        length_diff_ratio = abs(len(search_text) - len(potential_match_text)) / max(len(search_text), 1)
-
-                        # 如果长度差异太大，降低匹配分数
-                        if length_diff_ratio > 0.1:  # 允许10%的长度差异
-                            match_score *= (1 - length_diff_ratio)
-
-                    if match_score > best_match_score:
-                        best_match_score = match_score
-                        best_match_index = i
+                best_match_index, best_match_score = find_best_match(search_lines, content_lines, match_precision)
 
                 # 使用匹配精度作为阈值
                 if best_match_score >= match_precision and best_match_index >= 0:
@@ -3,6 +3,7 @@ import json
 import chardet
 from pdfminer.high_level import extract_text
 from ..aient.aient.plugins import register_tool
+from ..aient.aient.core.process_pool import get_process_pool
 from ..core import current_work_dir
 
 
@@ -73,8 +74,8 @@ Examples:
 
         # 检查文件扩展名
         if file_path.lower().endswith('.pdf'):
-            # 提取PDF文本
-            text_content = extract_text(file_path)
+            # 提取PDF文本。pdfminer 是纯 Python 解析，放到进程池中执行，不占用主进程的 GIL
+            text_content = get_process_pool().run(extract_text, file_path)
 
             # 如果提取结果为空
             if not text_content:
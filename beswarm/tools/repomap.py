@@ -11,6 +11,8 @@ from pathlib import Path
 from collections import Counter, defaultdict, namedtuple
 
 from ..aient.aient.plugins import register_tool
+from ..aient.aient.core.tokenizer import get_tokenizer
+from ..aient.aient.core.process_pool import get_process_pool
 
 from tqdm import tqdm
 from diskcache import Cache
@@ -400,6 +402,17 @@ from grep_ast.tsl import USING_TSL_PACK, get_language, get_parser  # noqa: E402
 
 Tag = namedtuple("Tag", "rel_fname fname line name kind".split())
 
+# 未命中缓存的文件达到这个数量时，tree-sitter 解析分发到进程池并行执行
+TAGS_PREFETCH_MIN_FILES = 8
+
+def _get_tags_raw(root, fname, rel_fname):
+    """进程池中执行的 RepoMap.get_tags_raw，不加载标签缓存和分词器。"""
+    rm = RepoMap.__new__(RepoMap)
+    rm.root = root
+    rm.io = InputOutput()
+    rm.verbose = False
+    return list(rm.get_tags_raw(fname, rel_fname))
+
 
 SQLITE_ERRORS = (sqlite3.OperationalError, sqlite3.DatabaseError, OSError)
 
@@ -444,6 +457,7 @@ class RepoMap:
         self.repo_content_prefix = repo_content_prefix
 
         self.main_model = main_model
+        self.tokenizer = get_tokenizer(os.environ.get("MODEL", ""))
 
         self.tree_cache = {}
         self.tree_context_cache = {}
@@ -458,16 +472,16 @@ class RepoMap:
 
     def token_count(self, text):
         len_text = len(text)
-        return len_text / 4
+        count = self.main_model.token_count if self.main_model else self.tokenizer.count
         if len_text < 200:
-            return self.main_model.token_count(text)
+            return count(text)
 
         lines = text.splitlines(keepends=True)
         num_lines = len(lines)
         step = num_lines // 100 or 1
         lines = lines[::step]
         sample_text = "".join(lines)
-        sample_tokens = self.main_model.token_count(sample_text)
+        sample_tokens = count(sample_text)
         est_tokens = sample_tokens / len(sample_text) * len_text
         return est_tokens
 
@@ -634,6 +648,52 @@ class RepoMap:
 
         return data
 
+    def prefetch_tags(self, fnames):
+        """
+        并行解析缓存中缺失或已过期的文件，结果写入 TAGS_CACHE，之后的 get_tags 直接命中缓存。
+        单个文件解析失败时跳过，由 get_tags 在当前进程中重试。
+        """
+        pool = get_process_pool()
+        if not pool.available:
+            return 0
+        misses = []
+        for fname in fnames:
+            try:
+                if not (self.root / Path(fname)).is_file():
+                    continue
+            except OSError:
+                continue
+            file_mtime = self.get_mtime(fname)
+            if file_mtime is None:
+                continue
+            try:
+                val = self.TAGS_CACHE.get(fname)
+            except SQLITE_ERRORS as e:
+                self.tags_cache_error(e)
+                val = self.TAGS_CACHE.get(fname)
+            if val is None or val.get("mtime") != file_mtime:
+                misses.append((fname, file_mtime))
+        if len(misses) < TAGS_PREFETCH_MIN_FILES:
+            return 0
+
+        futures = [
+            (fname, file_mtime, pool.submit(_get_tags_raw, self.root, fname, self.get_rel_fname(self.root / Path(fname))))
+            for fname, file_mtime in misses
+        ]
+        prefetched = 0
+        for fname, file_mtime, future in futures:
+            try:
+                data = future.result()
+            except Exception:
+                continue
+            try:
+                self.TAGS_CACHE[fname] = {"mtime": file_mtime, "data": data}
+            except SQLITE_ERRORS as e:
+                self.tags_cache_error(e)
+                self.TAGS_CACHE[fname] = {"mtime": file_mtime, "data": data}
+            prefetched += 1
+        return prefetched
+
     def get_tags_raw(self, fname, rel_fname):
         # 检查是否为 .ipynb 文件，如果是则转换为 Python 代码再处理
         if fname.endswith('.ipynb'):
@@ -765,6 +825,8 @@ class RepoMap:
             self.tags_cache_error(e)
             cache_size = len(self.TAGS_CACHE)
 
+        self.prefetch_tags(fnames)
+
         if len(fnames) - cache_size > 100:
             # self.io.tool_output(
             #     "Initial repo scan can be slow in larger repos, but only happens once."
@@ -9,6 +9,7 @@ import urllib.parse
 from pathlib import Path
 
 from ..aient.aient.plugins import register_tool, get_url_content # Assuming a similar plugin structure
+from ..aient.aient.core.connection import get_async_client
 from ..core import current_work_dir
 
 class ThreadWithReturnValue(threading.Thread):
@@ -80,12 +81,13 @@ async def search_web(query: str):
         search_url = v1_root.rstrip("/") + "/search"
 
         try:
-            async with httpx.AsyncClient(timeout=20) as client:
-                response = await client.get(
-                    search_url,
-                    headers={"Authorization": f"Bearer {api_key}"},
-                    params={"q": query},
-                )
+            client = get_async_client(search_url)
+            response = await client.get(
+                search_url,
+                headers={"Authorization": f"Bearer {api_key}"},
+                params={"q": query},
+                timeout=20,
+            )
             if response.status_code >= 400:
                 return {"error": f"搜索接口返回错误: {response.status_code} - {response.text}", "code": 400}
             payload = response.json()
@@ -115,16 +117,16 @@ async def search_web(query: str):
         results = []
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(api_url, headers=headers, data=payload)
-                response.raise_for_status()  # 如果状态码是 4xx 或 5xx，则引发 HTTPStatusError
-                # The API can return either a JSON object or a string containing JSON.
-                # This handles both cases to avoid a TypeError.
-                decoded_response = response.json()
-                if isinstance(decoded_response, str):
-                    results = json.loads(decoded_response)
-                else:
-                    results = decoded_response
+            client = get_async_client(api_url)
+            response = await client.post(api_url, headers=headers, data=payload, timeout=httpx.Timeout(5.0))
+            response.raise_for_status()  # 如果状态码是 4xx 或 5xx，则引发 HTTPStatusError
+            # The API can return either a JSON object or a string containing JSON.
+            # This handles both cases to avoid a TypeError.
+            decoded_response = response.json()
+            if isinstance(decoded_response, str):
+                results = json.loads(decoded_response)
+            else:
+                results = decoded_response
         except httpx.HTTPStatusError as e:
             return {
                 "error": f"HTTP error occurred: {e.response.status_code} - {e.response.text}",
@@ -5,6 +5,7 @@ from ..core import mcp_manager, broker, kgm, get_task_manager, current_task_mana
 from ..agents.planact import BrokerWorker
 from ..agents.chatgroup import ChatGroupWorker
 from ..aient.aient.plugins import register_tool
+from ..aient.aient.core.retry import RetryBudget, current_retry_budget
 
 
 @register_tool()
@@ -12,6 +13,7 @@ async def worker(goal: str, tools: List[Union[str, Dict]], work_dir: str, cache_
     start_time = datetime.now()
     task_manager = get_task_manager()
     current_task_manager.set(task_manager)
+    current_retry_budget.set(RetryBudget())
     current_work_dir.set(work_dir)
     worker_instance = BrokerWorker(goal, tools, work_dir, cache_messages, broker, mcp_manager, task_manager, kgm)
     result = await worker_instance.run()
@@ -26,6 +28,7 @@ async def worker_gen(goal: str, tools: List[Union[str, Dict]], work_dir: str, ca
     start_time = datetime.now()
     task_manager = get_task_manager()
     current_task_manager.set(task_manager)
+    current_retry_budget.set(RetryBudget())
     current_work_dir.set(work_dir)
     worker_instance = BrokerWorker(goal, tools, work_dir, cache_messages, broker, mcp_manager, task_manager, kgm)
     async for result in worker_instance.stream_run():
@@ -40,6 +43,7 @@ async def chatgroup(tools: List[Union[str, Dict]], work_dir: str, cache_messages
     start_time = datetime.now()
     task_manager = get_task_manager()
     current_task_manager.set(task_manager)
+    current_retry_budget.set(RetryBudget())
     worker_instance = ChatGroupWorker(tools, work_dir, cache_messages, broker, mcp_manager, task_manager, kgm)
     result = await worker_instance.run()
     end_time = datetime.now()